@@ -31,6 +31,7 @@ function Knowledge() {
   const [showUrlModal, setShowUrlModal] = useState(false)
   const [urlInput, setUrlInput] = useState('')
   const [importingUrl, setImportingUrl] = useState(false)
+  const [jobStatus, setJobStatus] = useState(null)
   const [selectedItems, setSelectedItems] = useState(new Set())
   const [selectMode, setSelectMode] = useState(false)
   const [exporting, setExporting] = useState(false)
@@ -269,6 +270,35 @@ function Knowledge() {
     return value || 'Ingen kategori'
   }
 
+  // Uploads and URL imports run as background jobs - poll until the job is done
+  const waitForJob = async (jobId) => {
+    while (true) {
+      await new Promise(resolve => setTimeout(resolve, 1500))
+      const response = await authFetch(`${API_BASE}/jobs/${jobId}`)
+      const job = await response.json()
+      if (!response.ok) throw new Error(job.detail || 'Kunde inte hämta jobbstatus')
+      if (['succeeded', 'failed', 'cancelled'].includes(job.status)) return job
+      setJobStatus(job.stage ? `${job.stage} (${job.progress}%)` : null)
+    }
+  }
+
+  const showJobResult = (job, fallbackMessage) => {
+    if (job.status === 'succeeded') {
+      setUploadResult({
+        success: true,
+        message: job.result.message,
+        count: job.result.imported
+      })
+      fetchKnowledge()
+      return true
+    }
+    setUploadResult({
+      success: false,
+      message: job.status === 'cancelled' ? 'Importen avbröts' : (job.error || fallbackMessage)
+    })
+    return false
+  }
+
   const handleUrlImport = async (e) => {
     e.preventDefault()
     if (!urlInput.trim()) return
@@ -284,15 +314,12 @@ function Knowledge() {
 
       const result = await response.json()
 
-      if (response.ok && result.success) {
-        setUploadResult({
-          success: true,
-          message: result.message,
-          count: result.items_added
-        })
-        fetchKnowledge()
-        setShowUrlModal(false)
-        setUrlInput('')
+      if (response.ok) {
+        const job = await waitForJob(result.job_id)
+        if (showJobResult(job, 'Import misslyckades')) {
+          setShowUrlModal(false)
+          setUrlInput('')
+        }
       } else {
         setUploadResult({
           success: false,
@@ -306,6 +333,7 @@ function Knowledge() {
       })
     } finally {
       setImportingUrl(false)
+      setJobStatus(null)
     }
   }
 
@@ -506,12 +534,7 @@ function Knowledge() {
       const result = await response.json()
 
       if (response.ok) {
-        setUploadResult({
-          success: true,
-          message: result.message,
-          count: result.items_added
-        })
-        fetchKnowledge()
+        showJobResult(await waitForJob(result.job_id), 'Uppladdning misslyckades')
       } else {
         setUploadResult({
           success: false,
@@ -525,6 +548,7 @@ function Knowledge() {
       })
     } finally {
       setUploading(false)
+      setJobStatus(null)
       e.target.value = '' // Reset file input
     }
   }
@@ -668,7 +692,7 @@ function Knowledge() {
                     <line x1="12" y1="3" x2="12" y2="15" />
                   </svg>
                 )}
-                {uploading ? 'Laddar upp...' : 'Ladda upp fil'}
+                {uploading ? (jobStatus || 'Laddar upp...') : 'Ladda upp fil'}
               </label>
               <button onClick={handleAdd} className="btn btn-primary">
                 <svg width="20" height="20" viewBox="0 0 24 24" fill="none" stroke="currentColor" strokeWidth="2" strokeLinecap="round" strokeLinejoin="round">
@@ -1119,7 +1143,7 @@ function Knowledge() {
                   {importingUrl ? (
                     <>
                       <span className="animate-spin mr-2">⏳</span>
-                      Importerar...
+                      {jobStatus || 'Importerar...'}
                     </>
                   ) : (
                     <>
@@ -553,7 +553,34 @@ function WidgetPage({ widgetType }) {
     }
   }
 
-  // Import functions
+  // Import functions - uploads and URL imports run as background jobs, poll until done
+  const waitForJob = async (jobId) => {
+    while (true) {
+      await new Promise(resolve => setTimeout(resolve, 1500))
+      const response = await authFetch(`${API_BASE}/jobs/${jobId}`)
+      const job = await response.json()
+      if (!response.ok) throw new Error(job.detail || 'Kunde inte hämta jobbstatus')
+      if (['succeeded', 'failed', 'cancelled'].includes(job.status)) return job
+      if (job.stage) setUploadProgress(`${job.stage} (${job.progress}%)`)
+    }
+  }
+
+  const handleImportJob = async (jobId, emptyMessage) => {
+    const job = await waitForJob(jobId)
+    if (job.status === 'succeeded' && job.result.imported > 0) {
+      setSuccess(`Importerade ${job.result.imported} poster!`)
+      fetchKnowledge(widget.id)
+      setShowImportModal(false)
+      return true
+    }
+    if (job.status === 'succeeded') {
+      setError(job.result.message || emptyMessage)
+    } else {
+      setError(job.status === 'cancelled' ? 'Importen avbröts' : (job.error || 'Import misslyckades'))
+    }
+    return false
+  }
+
   const handleFileUpload = async (e) => {
     const file = e.target.files?.[0]
     if (!file || !widget) return
@@ -573,12 +600,8 @@ function WidgetPage({ widgetType }) {
 
       const data = await response.json()
 
-      if (response.ok && data.success !== false && data.imported > 0) {
-        setSuccess(`Importerade ${data.imported} poster!`)
-        fetchKnowledge(widget.id)
-        setShowImportModal(false)
-      } else if (response.ok && data.imported === 0) {
-        setError(data.message || 'Kunde inte hitta några frågor/svar i filen. Kontrollera formatet.')
+      if (response.ok) {
+        await handleImportJob(data.job_id, 'Kunde inte hitta några frågor/svar i filen. Kontrollera formatet.')
       } else {
         setError(data.detail || data.message || 'Import misslyckades')
       }
@@ -605,13 +628,10 @@ function WidgetPage({ widgetType }) {
 
       const data = await response.json()
 
-      if (response.ok && data.success !== false && data.imported > 0) {
-        setSuccess(`Importerade ${data.imported} poster!`)
-        fetchKnowledge(widget.id)
-        setShowImportModal(false)
-        setImportUrl('')
-      } else if (response.ok && data.imported === 0) {
-        setError(data.message || 'Kunde inte hitta några frågor/svar på sidan. Försök med en annan URL.')
+      if (response.ok) {
+        if (await handleImportJob(data.job_id, 'Kunde inte hitta några frågor/svar på sidan. Försök med en annan URL.')) {
+          setImportUrl('')
+        }
       } else {
         setError(data.detail || data.message || 'Import misslyckades')
       }
@@ -0,0 +1,292 @@
+"""
+Bobot Analytics Rollups
+Per-company, per-day counters behind /analytics and /stats
+
+New conversations, chat turns, category changes and feedback add deltas to
+analytics_rollups rows (company, date, metric) through the write-behind
+queue, in the same transaction as the chat messages. The dashboards read
+one row per day and metric instead of scanning conversations and messages.
+
+Metrics:
+    conversations, messages, answered, unanswered
+    response_ms_count, response_ms_sum, response_ms:le_<ms>   (histogram)
+    language:<code>, category:<name>, hour:<0-23>               (conversation start)
+    feedback:helpful, feedback:not_helpful
+
+Like DailyStatistics, rollups are kept when conversations are deleted by
+the GDPR cleanup. Rebuild them from existing data with
+
+    python analytics_rollup.py backfill [--company demo]
+"""
+
+import argparse
+import json
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, insert, update
+from sqlalchemy.orm import Session
+
+from database import AnalyticsRollup, Conversation, DailyStatistics, Message
+
+
+# =============================================================================
+# Metrics
+# =============================================================================
+
+CONVERSATIONS = "conversations"
+MESSAGES = "messages"
+ANSWERED = "answered"
+UNANSWERED = "unanswered"
+RESPONSE_COUNT = "response_ms_count"
+RESPONSE_SUM = "response_ms_sum"
+HELPFUL = "feedback:helpful"
+NOT_HELPFUL = "feedback:not_helpful"
+
+RESPONSE_BUCKETS_MS = (250, 500, 1000, 2000, 5000, 10000, 30000)
+
+# Metrics of the 30-day breakdown on the dashboard
+DAILY_METRICS = (CONVERSATIONS, MESSAGES, ANSWERED, UNANSWERED)
+
+Deltas = Dict[str, int]
+RollupKey = Tuple[str, date, str]  # (company_id, date, metric)
+
+
+def response_bucket(response_time_ms: int) -> str:
+    for bound in RESPONSE_BUCKETS_MS:
+        if response_time_ms <= bound:
+            return f"response_ms:le_{bound}"
+    return "response_ms:le_inf"
+
+
+def conversation_started(started_at: datetime, language: Optional[str], category: Optional[str]) -> Deltas:
+    """A new conversation, counted on the day and hour it started"""
+    return {
+        CONVERSATIONS: 1,
+        f"language:{language or 'sv'}": 1,
+        f"category:{category or 'allmant'}": 1,
+        f"hour:{started_at.hour}": 1,
+    }
+
+
+def chat_turn(had_answer: bool, response_time_ms: Optional[int], messages: int = 2) -> Deltas:
+    """A question and its answer, counted on the day they were written"""
+    deltas = {MESSAGES: messages, ANSWERED if had_answer else UNANSWERED: 1}
+    if response_time_ms is not None:
+        deltas[RESPONSE_COUNT] = 1
+        deltas[RESPONSE_SUM] = response_time_ms
+        deltas[response_bucket(response_time_ms)] = 1
+    return deltas
+
+
+def category_changed(old: Optional[str], new: str) -> Deltas:
+    """A conversation moved from one category to another (on its start day)"""
+    return {f"category:{old or 'allmant'}": -1, f"category:{new}": 1}
+
+
+def feedback_changed(previous: Optional[bool], helpful: bool) -> Deltas:
+    """Feedback given or changed on a conversation (on its start day)"""
+    deltas: Deltas = defaultdict(int)
+    if previous is True:
+        deltas[HELPFUL] -= 1
+    elif previous is False:
+        deltas[NOT_HELPFUL] -= 1
+    deltas[HELPFUL if helpful else NOT_HELPFUL] += 1
+    return {metric: value for metric, value in deltas.items() if value}
+
+
+# =============================================================================
+# Writing
+# =============================================================================
+
+def rows_for(company_id: str, day: date, deltas: Deltas) -> List[dict]:
+    return [{"company_id": company_id, "date": day, "metric": metric, "value": value}
+            for metric, value in deltas.items()]
+
+
+def apply(db: Session, rows: Iterable[dict]):
+    """Add rows of deltas to the rollups (caller commits)
+
+    One upsert per batch on SQLite and PostgreSQL; rows for the same key
+    are summed first, as ON CONFLICT may only touch a row once.
+    """
+    merged: Dict[RollupKey, int] = defaultdict(int)
+    for row in rows:
+        merged[(row["company_id"], row["date"], row["metric"])] += row["value"]
+    values = [{"company_id": c, "date": d, "metric": m, "value": v} for (c, d, m), v in merged.items() if v]
+    if not values:
+        return
+
+    table = AnalyticsRollup.__table__
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as upsert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as upsert
+        statement = upsert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.company_id, table.c.date, table.c.metric],
+            set_={"value": table.c.value + statement.excluded.value}
+        )
+        db.execute(statement, values)
+        return
+
+    # Other databases: update, and insert what did not exist yet
+    for row in values:
+        result = db.execute(
+            update(table).where(
+                table.c.company_id == row["company_id"], table.c.date == row["date"], table.c.metric == row["metric"]
+            ).values(value=table.c.value + row["value"])
+        )
+        if result.rowcount == 0:
+            db.execute(insert(table), row)
+
+
+# =============================================================================
+# Reading
+# =============================================================================
+
+def totals(db: Session, company_id: str, since: Optional[date] = None) -> Dict[str, int]:
+    """Sum of every metric, optionally from a date on"""
+    query = db.query(AnalyticsRollup.metric, func.sum(AnalyticsRollup.value)).filter(
+        AnalyticsRollup.company_id == company_id
+    )
+    if since is not None:
+        query = query.filter(AnalyticsRollup.date >= since)
+    return {metric: int(value or 0) for metric, value in query.group_by(AnalyticsRollup.metric)}
+
+
+def daily(db: Session, company_id: str, since: date, metrics: Iterable[str] = DAILY_METRICS) -> Dict[date, Dict[str, int]]:
+    """Metric values per day from a date on"""
+    rows = db.query(AnalyticsRollup.date, AnalyticsRollup.metric, AnalyticsRollup.value).filter(
+        AnalyticsRollup.company_id == company_id,
+        AnalyticsRollup.date >= since,
+        AnalyticsRollup.metric.in_(list(metrics))
+    )
+    result: Dict[date, Dict[str, int]] = defaultdict(dict)
+    for day, metric, value in rows:
+        result[day][metric] = value
+    return result
+
+
+def breakdown(values: Dict[str, int], prefix: str) -> Dict[str, int]:
+    """{"sv": 10, "en": 2} from {"language:sv": 10, "language:en": 2, ...}"""
+    return {metric[len(prefix) + 1:]: value for metric, value in values.items()
+            if metric.startswith(prefix + ":") and value}
+
+
+def average_response_ms(values: Dict[str, int]) -> float:
+    count = values.get(RESPONSE_COUNT, 0)
+    return values.get(RESPONSE_SUM, 0) / count if count else 0
+
+
+# =============================================================================
+# Backfill
+# =============================================================================
+
+def _add_json_counts(counts: Dict[RollupKey, int], company_id: str, day: date, prefix: str, raw: Optional[str]):
+    try:
+        values = json.loads(raw or "{}")
+    except (json.JSONDecodeError, TypeError, ValueError):
+        return
+    for key, value in values.items():
+        counts[(company_id, day, f"{prefix}:{key}")] += int(value or 0)
+
+
+def rebuild(db: Session, company_id: Optional[str] = None) -> int:
+    """Recompute the rollups from DailyStatistics and the live tables
+
+    DailyStatistics holds conversations already deleted by the GDPR
+    cleanup (no response-time histogram, and their average response time
+    counts as one sample per answered or unanswered question); live
+    conversations and messages are counted as the chat path does. Returns
+    the number of rollup rows written. Run it while no chats are written,
+    e.g. right after deploying.
+    """
+    counts: Dict[RollupKey, int] = defaultdict(int)
+
+    history = db.query(DailyStatistics)
+    if company_id:
+        history = history.filter(DailyStatistics.company_id == company_id)
+    for s in history.yield_per(1000):
+        key = (s.company_id, s.date)
+        counts[key + (CONVERSATIONS,)] += s.total_conversations or 0
+        counts[key + (MESSAGES,)] += s.total_messages or 0
+        counts[key + (ANSWERED,)] += s.questions_answered or 0
+        counts[key + (UNANSWERED,)] += s.questions_unanswered or 0
+        counts[key + (HELPFUL,)] += s.helpful_count or 0
+        counts[key + (NOT_HELPFUL,)] += s.not_helpful_count or 0
+        samples = (s.questions_answered or 0) + (s.questions_unanswered or 0)
+        if s.avg_response_time_ms and samples:
+            counts[key + (RESPONSE_COUNT,)] += samples
+            counts[key + (RESPONSE_SUM,)] += round(s.avg_response_time_ms * samples)
+        _add_json_counts(counts, s.company_id, s.date, "category", s.category_counts)
+        _add_json_counts(counts, s.company_id, s.date, "language", s.language_counts)
+        _add_json_counts(counts, s.company_id, s.date, "hour", s.hourly_counts)
+
+    conversations = db.query(
+        Conversation.company_id, Conversation.started_at, Conversation.language,
+        Conversation.category, Conversation.was_helpful
+    )
+    if company_id:
+        conversations = conversations.filter(Conversation.company_id == company_id)
+    for cid, started_at, language, category, was_helpful in conversations.yield_per(1000):
+        day = started_at.date()
+        deltas = conversation_started(started_at, language, category)
+        if was_helpful is not None:
+            deltas.update(feedback_changed(None, was_helpful))
+        for metric, value in deltas.items():
+            counts[(cid, day, metric)] += value
+
+    messages = db.query(
+        Conversation.company_id, Conversation.started_at, Message.created_at,
+        Message.role, Message.had_answer, Message.response_time_ms
+    ).join(Message, Message.conversation_id == Conversation.id)
+    if company_id:
+        messages = messages.filter(Conversation.company_id == company_id)
+    for cid, started_at, created_at, role, had_answer, response_time_ms in messages.yield_per(1000):
+        day = (created_at or started_at).date()
+        counts[(cid, day, MESSAGES)] += 1
+        if role == "bot":
+            counts[(cid, day, ANSWERED if had_answer else UNANSWERED)] += 1
+        if response_time_ms is not None:
+            counts[(cid, day, RESPONSE_COUNT)] += 1
+            counts[(cid, day, RESPONSE_SUM)] += response_time_ms
+            counts[(cid, day, response_bucket(response_time_ms))] += 1
+
+    existing = db.query(AnalyticsRollup)
+    if company_id:
+        existing = existing.filter(AnalyticsRollup.company_id == company_id)
+    existing.delete(synchronize_session=False)
+
+    rows = [{"company_id": c, "date": d, "metric": m, "value": v} for (c, d, m), v in counts.items() if v]
+    apply(db, rows)
+    db.commit()
+    return len(rows)
+
+
+def backfill_if_empty(db: Session) -> Optional[int]:
+    """Build the rollups on first start after an upgrade (None if not needed)"""
+    if db.query(AnalyticsRollup.id).first() is not None:
+        return None
+    if db.query(Conversation.id).first() is None and db.query(DailyStatistics.id).first() is None:
+        return None
+    return rebuild(db)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild analytics rollups from existing data")
+    parser.add_argument("command", choices=["backfill"])
+    parser.add_argument("--company", help="Only this company (default: all)")
+    args = parser.parse_args()
+
+    from database import SessionLocal, create_tables
+    create_tables()
+    session = SessionLocal()
+    try:
+        written = rebuild(session, args.company)
+        print(f"Analytics rollups rebuilt: {written} rows")
+    finally:
+        session.close()
@@ -0,0 +1,433 @@
+"""
+Bobot Background Jobs
+Persistent job table and an in-process worker pool for long-running work
+
+    job_id = job_engine.submit(db, "knowledge_upload", company_id, {"filename": name}, payload=content)
+    job_engine.wake()
+    ...
+    GET /jobs/{job_id}   ->  status, progress, stage, (partial) result, error
+
+Knowledge imports call Ollama for minutes; run inside the HTTP request they
+held a connection open and hit the proxy timeout. Endpoints now store the
+work as a BackgroundJob row and return its id; JOB_WORKERS worker tasks
+claim queued jobs and run the handler registered for the job's kind:
+
+    @job_engine.handler("knowledge_upload")
+    async def knowledge_upload_job(job: JobContext) -> dict:
+        await job.update(10, "Läser filen...", {"found": 0})
+        ...
+        return {"imported": 12}       # stored as the job's result
+
+A handler raises JobFailed with a message for the user; any other error
+fails the job with a generic one. Jobs survive restarts: a running job whose
+heartbeat is older than JOB_STALE_SECONDS (its process died) is queued
+again, up to JOB_MAX_ATTEMPTS runs. Jobs are claimed with a conditional
+UPDATE, so several processes can share the table.
+
+Cancelling a queued job ends it at once. A running job in this process is
+cancelled directly; one running in another process stops at its next
+heartbeat or update().
+
+A handler whose last step writes to the database (an import's INSERT)
+completes the job in that same transaction with job.complete(db, result),
+so a job interrupted after the commit is not queued and run again.
+Finishing an already finished job changes nothing.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from database import BackgroundJob
+from db_executor import run_db
+
+logger = logging.getLogger(__name__)
+
+
+# =============================================================================
+# Configuration
+# =============================================================================
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))  # Jobs run at once per process
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "2"))  # Seconds between checks for new jobs
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "120"))  # Running without heartbeat = worker died
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETENTION_DAYS = int(os.getenv("JOB_RETENTION_DAYS", "7"))  # Finished jobs are deleted after this
+
+FINISHED = ("succeeded", "failed", "cancelled")
+
+
+class JobFailed(Exception):
+    """Raised by a handler to fail its job with a message shown to the user"""
+
+
+class JobCancelled(Exception):
+    """The job was cancelled while running"""
+
+
+class JobContext:
+    """The job a handler runs: its input, and a way to report progress"""
+
+    def __init__(self, engine: "JobEngine", row: BackgroundJob):
+        self.engine = engine
+        self.id = row.id
+        self.kind = row.kind
+        self.company_id = row.company_id
+        self.params = json.loads(row.params or "{}")
+        self.payload = row.payload
+        self.attempt = row.attempts
+
+    async def update(self, progress: Optional[int] = None, stage: Optional[str] = None,
+                     result: Optional[dict] = None):
+        """Record progress (0-100), the current step and a partial result
+
+        Raises JobCancelled if the job was cancelled from another process.
+        """
+        if await run_db(self.engine.record_progress, self.id, progress, stage, result):
+            raise JobCancelled()
+
+    def complete(self, db: Session, result: Optional[dict] = None):
+        """Mark the job succeeded in db's transaction (the caller commits with its own writes)
+
+        Raises JobCancelled if the job is no longer running.
+        """
+        job = db.get(BackgroundJob, self.id)
+        if job is None or job.status != "running" or job.cancel_requested:
+            raise JobCancelled()
+        self.engine._finish(job, "succeeded", result)
+
+
+Handler = Callable[[JobContext], Awaitable[Optional[dict]]]
+
+
+class JobEngine:
+    """Runs BackgroundJob rows with the handlers registered for their kind"""
+
+    def __init__(self, session_factory: Callable[[], Session], workers: int = JOB_WORKERS,
+                 poll_interval: float = JOB_POLL_INTERVAL, stale_seconds: float = JOB_STALE_SECONDS,
+                 max_attempts: int = JOB_MAX_ATTEMPTS):
+        self.session_factory = session_factory
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.stale_seconds = stale_seconds
+        self.max_attempts = max_attempts
+        self.handlers: Dict[str, Handler] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._running: Dict[str, asyncio.Task] = {}  # job id -> handler task
+        self._cancelling: Set[str] = set()
+        # Metrics
+        self.succeeded = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.requeued = 0
+
+    def handler(self, kind: str):
+        """Decorator registering the handler for a job kind"""
+        def register(fn: Handler) -> Handler:
+            self.handlers[kind] = fn
+            return fn
+        return register
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    # -------------------------------------------------------------------------
+    # Lifecycle
+    # -------------------------------------------------------------------------
+
+    def start(self):
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker(n)) for n in range(self.workers)]
+
+    async def stop(self):
+        """Stop the workers; jobs they were running are queued again"""
+        interrupted = list(self._running)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if interrupted:
+            await run_db(self.requeue, interrupted)
+
+    def wake(self):
+        """Look for new jobs now instead of at the next poll"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    # -------------------------------------------------------------------------
+    # Submitting and cancelling
+    # -------------------------------------------------------------------------
+
+    def submit(self, db: Session, kind: str, company_id: Optional[str] = None, params: Optional[dict] = None,
+               payload: Optional[bytes] = None) -> str:
+        """Store a queued job (committed) and return its id"""
+        if kind not in self.handlers:
+            raise ValueError(f"No handler for job kind '{kind}'")
+        job_id = uuid.uuid4().hex
+        job = BackgroundJob(
+            id=job_id, company_id=company_id, kind=kind,
+            params=json.dumps(params or {}), payload=payload,
+            status="queued", progress=0, stage="I kö", created_at=datetime.utcnow()
+        )
+        db.add(job)
+        db.commit()
+        return job_id
+
+    async def cancel(self, job_id: str) -> Optional[str]:
+        """Cancel a job; returns its status afterwards (None if it does not exist)"""
+        status = await run_db(self.request_cancel, job_id)
+        task = self._running.get(job_id)
+        if status == "running" and task is not None:
+            self._cancelling.add(job_id)
+            task.cancel()
+        return status
+
+    def request_cancel(self, job_id: str) -> Optional[str]:
+        db = self.session_factory()
+        try:
+            job = db.get(BackgroundJob, job_id)
+            if job is None:
+                return None
+            if job.status == "queued":
+                self._finish(job, "cancelled")
+            elif job.status == "running":
+                job.cancel_requested = True
+            db.commit()
+            return job.status
+        finally:
+            db.close()
+
+    # -------------------------------------------------------------------------
+    # Workers
+    # -------------------------------------------------------------------------
+
+    async def _worker(self, number: int):
+        last_recovery = 0.0
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                # One worker looks for jobs left behind by dead processes
+                if number == 0 and loop.time() - last_recovery >= self.stale_seconds / 2:
+                    last_recovery = loop.time()
+                    await run_db(self.recover)
+
+                job = await run_db(self.claim)
+                if job is not None:
+                    await self._run(job)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[Jobs] Worker error: {e}", exc_info=True)
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run(self, job: JobContext):
+        handler = self.handlers.get(job.kind)
+        if handler is None:
+            await run_db(self.finish, job.id, "failed", error=f"Okänd jobbtyp: {job.kind}")
+            return
+
+        task = asyncio.create_task(handler(job))
+        self._running[job.id] = task
+        heartbeat = asyncio.create_task(self._heartbeat(job.id, task))
+        try:
+            result = await task
+        except asyncio.CancelledError:
+            if job.id not in self._cancelling:
+                raise  # Shutdown: stop() queues the job again
+            await run_db(self.finish, job.id, "cancelled")
+        except JobCancelled:
+            await run_db(self.finish, job.id, "cancelled")
+        except JobFailed as e:
+            await run_db(self.finish, job.id, "failed", error=str(e))
+        except Exception as e:
+            logger.error(f"[Jobs] {job.kind} {job.id} failed: {e}", exc_info=True)
+            await run_db(self.finish, job.id, "failed", error="Ett oväntat fel uppstod. Försök igen.")
+        else:
+            await run_db(self.finish, job.id, "succeeded", result=result)
+        finally:
+            heartbeat.cancel()
+            self._running.pop(job.id, None)
+            self._cancelling.discard(job.id)
+
+    async def _heartbeat(self, job_id: str, task: asyncio.Task):
+        """Keep the job's heartbeat fresh; cancel it if another process asked to"""
+        while True:
+            await asyncio.sleep(max(0.5, self.stale_seconds / 4))
+            if await run_db(self.record_progress, job_id):
+                self._cancelling.add(job_id)
+                task.cancel()
+                return
+
+    # -------------------------------------------------------------------------
+    # Job rows (sync, run on the DB thread pool)
+    # -------------------------------------------------------------------------
+
+    def claim(self) -> Optional[JobContext]:
+        """Mark the oldest queued job running (if no other worker got it first)"""
+        db = self.session_factory()
+        try:
+            candidates = db.query(BackgroundJob.id).filter(
+                BackgroundJob.status == "queued"
+            ).order_by(BackgroundJob.created_at).limit(5).all()
+            now = datetime.utcnow()
+            for (job_id,) in candidates:
+                claimed = db.query(BackgroundJob).filter(
+                    BackgroundJob.id == job_id, BackgroundJob.status == "queued"
+                ).update({
+                    "status": "running", "started_at": now, "heartbeat_at": now,
+                    "attempts": BackgroundJob.attempts + 1, "stage": "Startar...",
+                }, synchronize_session=False)
+                db.commit()
+                if claimed:
+                    return JobContext(self, db.get(BackgroundJob, job_id))
+            return None
+        finally:
+            db.close()
+
+    def record_progress(self, job_id: str, progress: Optional[int] = None, stage: Optional[str] = None,
+                        result: Optional[dict] = None) -> bool:
+        """Update a running job (and its heartbeat); returns True if it should stop
+
+        A job its handler already completed (JobContext.complete) is left
+        alone and not stopped: the handler still has in-memory work to do
+        after the commit.
+        """
+        db = self.session_factory()
+        try:
+            job = db.get(BackgroundJob, job_id)
+            if job is None:
+                return True
+            if job.status == "succeeded":
+                return False
+            job.heartbeat_at = datetime.utcnow()
+            if progress is not None:
+                job.progress = max(0, min(100, int(progress)))
+            if stage is not None:
+                job.stage = stage
+            if result is not None:
+                job.result = json.dumps(result)
+            db.commit()
+            return bool(job.cancel_requested) or job.status != "running"
+        finally:
+            db.close()
+
+    def finish(self, job_id: str, status: str, result: Optional[dict] = None, error: Optional[str] = None):
+        db = self.session_factory()
+        try:
+            job = db.get(BackgroundJob, job_id)
+            if job is not None and job.status not in FINISHED:  # e.g. completed by the handler itself
+                self._finish(job, status, result, error)
+                db.commit()
+        finally:
+            db.close()
+
+    def _finish(self, job: BackgroundJob, status: str, result: Optional[dict] = None, error: Optional[str] = None):
+        job.status = status
+        job.finished_at = datetime.utcnow()
+        job.payload = None  # Uploaded files are not kept
+        job.error = error
+        if result is not None:
+            job.result = json.dumps(result)
+        if status == "succeeded":
+            job.progress = 100
+            job.stage = "Klar"
+            self.succeeded += 1
+        elif status == "failed":
+            job.stage = "Misslyckades"
+            self.failed += 1
+        else:
+            job.stage = "Avbruten"
+            self.cancelled += 1
+
+    def requeue(self, job_ids: List[str]):
+        """Put running jobs back in the queue (this process is shutting down)"""
+        db = self.session_factory()
+        try:
+            requeued = db.query(BackgroundJob).filter(
+                BackgroundJob.id.in_(job_ids), BackgroundJob.status == "running"
+            ).update({"status": "queued", "stage": "Återupptas"}, synchronize_session=False)
+            db.commit()
+            self.requeued += requeued
+        finally:
+            db.close()
+
+    def recover(self) -> int:
+        """Queue running jobs whose process died again (or fail them after max_attempts)"""
+        db = self.session_factory()
+        try:
+            stale = datetime.utcnow() - timedelta(seconds=self.stale_seconds)
+            jobs = db.query(BackgroundJob).filter(
+                BackgroundJob.status == "running",
+                or_(BackgroundJob.heartbeat_at < stale, BackgroundJob.heartbeat_at.is_(None))
+            ).all()
+            for job in jobs:
+                if job.cancel_requested:
+                    self._finish(job, "cancelled")
+                elif (job.attempts or 0) >= self.max_attempts:
+                    self._finish(job, "failed", error="Jobbet avbröts för många gånger och har stoppats.")
+                else:
+                    job.status = "queued"
+                    job.stage = "Återupptas"
+                    self.requeued += 1
+            db.commit()
+            if jobs:
+                logger.warning(f"[Jobs] Recovered {len(jobs)} interrupted jobs")
+            return len(jobs)
+        finally:
+            db.close()
+
+    def delete_finished(self, days: int = JOB_RETENTION_DAYS) -> int:
+        """Delete jobs that ended more than days ago"""
+        db = self.session_factory()
+        try:
+            deleted = db.query(BackgroundJob).filter(
+                BackgroundJob.status.in_(FINISHED),
+                BackgroundJob.finished_at < datetime.utcnow() - timedelta(days=days)
+            ).delete(synchronize_session=False)
+            db.commit()
+            return deleted
+        finally:
+            db.close()
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self._tasks),
+            "running": len(self._running),
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "requeued": self.requeued,
+        }
+
+
+def job_response(job: BackgroundJob) -> dict:
+    """A job as returned by GET /jobs/{id}"""
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "progress": job.progress or 0,
+        "stage": job.stage or "",
+        "result": json.loads(job.result) if job.result else None,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
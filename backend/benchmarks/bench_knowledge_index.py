@@ -0,0 +1,79 @@
+"""
+Benchmark: find_relevant_context full scan vs in-memory inverted index
+
+Usage (from backend/):
+    python benchmarks/bench_knowledge_index.py [--queries 200]
+
+Generates a synthetic Swedish-like knowledge base at 100, 1k and 10k items,
+checks that both implementations return the same items for every query and
+prints the average time per query.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from knowledge_index import KnowledgeIndex, IndexedItem, scan_score_items
+
+SYLLABLES = ["hy", "ra", "fel", "an", "mäl", "tvätt", "stu", "ga", "par", "ke", "ring",
+             "kon", "trakt", "nyck", "el", "lä", "gen", "het", "bo", "kning", "vär", "me",
+             "sop", "rum", "för", "råd", "bal", "kong", "port", "kod", "ut", "flytt"]
+CATEGORIES = ["hyra", "felanmalan", "tvattstuga", "parkering", "kontrakt", "allmant"]
+
+
+def make_vocabulary(size: int, rng: random.Random) -> list:
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choices(SYLLABLES, k=rng.randint(1, 4))))
+    return sorted(words)
+
+
+def make_items(count: int, vocabulary: list, rng: random.Random) -> list:
+    items = []
+    for item_id in range(1, count + 1):
+        question = " ".join(rng.choices(vocabulary, k=rng.randint(4, 10))) + "?"
+        answer = " ".join(rng.choices(vocabulary, k=rng.randint(15, 60))) + "."
+        items.append(IndexedItem(item_id, "bench", None, question, answer, rng.choice(CATEGORIES)))
+    return items
+
+
+def run(sizes, query_count: int):
+    rng = random.Random(42)
+    vocabulary = make_vocabulary(3000, rng)
+    questions = [" ".join(rng.choices(vocabulary, k=rng.randint(2, 8))) for _ in range(query_count)]
+
+    print(f"{'items':>7} | {'scan ms/query':>14} | {'index ms/query':>15} | {'speedup':>8} | {'build ms':>9}")
+    print("-" * 66)
+    for size in sizes:
+        items = make_items(size, vocabulary, rng)
+
+        index = KnowledgeIndex()
+        start = time.perf_counter()
+        index.build_company("bench", items)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        expected = [scan_score_items(q, items) for q in questions]
+        scan_ms = (time.perf_counter() - start) * 1000 / query_count
+
+        start = time.perf_counter()
+        actual = [index.search(None, "bench", q) for q in questions]
+        index_ms = (time.perf_counter() - start) * 1000 / query_count
+
+        for q, exp, act in zip(questions, expected, actual):
+            if [i.id for i in exp] != [i.id for i in act]:
+                raise SystemExit(f"Result mismatch for query {q!r}")
+
+        print(f"{size:>7} | {scan_ms:>14.3f} | {index_ms:>15.3f} | {scan_ms / index_ms:>7.1f}x | {build_ms:>9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    args = parser.parse_args()
+    run(args.sizes, args.queries)
@@ -0,0 +1,85 @@
+"""
+Benchmark: new httpx.AsyncClient per Ollama call vs the shared pooled client
+
+Usage (from backend/):
+    python benchmarks/bench_ollama_client.py [--requests 500] [--concurrency 1]
+
+Runs an in-process stub Ollama server and sends /api/generate requests the
+old way (one client, one TCP connection per call) and through
+ollama_client.get_http_client(). Reports wall latency and process CPU time
+per request, plus how many TCP connections the stub accepted.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from ollama_client import get_http_client, close_http_client, CHAT_TIMEOUT
+from ollama_stub import OllamaStub
+
+PAYLOAD = {"model": "stub", "prompt": "Question: När ska hyran betalas?", "stream": False}
+
+
+async def per_call_client(base_url: str):
+    async with httpx.AsyncClient(timeout=60.0) as client:
+        response = await client.post(f"{base_url}/api/generate", json=PAYLOAD)
+        response.raise_for_status()
+        return response.json()["response"]
+
+
+async def shared_client(base_url: str):
+    response = await get_http_client().post(f"{base_url}/api/generate", json=PAYLOAD, timeout=CHAT_TIMEOUT)
+    response.raise_for_status()
+    return response.json()["response"]
+
+
+async def measure(name: str, call, stub: OllamaStub, requests: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await call(stub.base_url)
+            latencies.append(time.perf_counter() - start)
+
+    connections_before = stub.connections
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+    print(f"{name:<16} | {p50:>8.3f} | {p99:>8.3f} | {cpu / requests * 1000:>11.3f} | "
+          f"{requests / wall:>8.0f} | {stub.connections - connections_before:>11}")
+
+
+async def main(requests: int, concurrency: int):
+    async with OllamaStub() as stub:
+        # Warm up both paths
+        await per_call_client(stub.base_url)
+        await shared_client(stub.base_url)
+
+        print(f"{requests} requests, concurrency {concurrency}")
+        print(f"{'client':<16} | {'p50 ms':>8} | {'p99 ms':>8} | {'CPU ms/req':>11} | {'req/s':>8} | {'connections':>11}")
+        print("-" * 78)
+        await measure("per-call", per_call_client, stub, requests, concurrency)
+        await measure("shared pooled", shared_client, stub, requests, concurrency)
+    await close_http_client()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency))
@@ -0,0 +1,121 @@
+"""
+Benchmark: chat latency while PDFs are parsed on the event loop vs in the parser pool
+
+Usage (from backend/):
+    python benchmarks/bench_parse_offload.py [--uploads 2] [--pages 150] [--chatters 4]
+
+Runs an in-process stub Ollama server and keeps --chatters clients sending
+/api/generate requests while --uploads PDFs of --pages pages are parsed at
+the same time. "inline" parses with pypdf on the event loop, as
+parse_pdf_file used to; "process pool" is the current parse_pdf_file.
+Reports chat latency (p50/p99/max) during the uploads and upload wall time.
+"""
+
+import argparse
+import asyncio
+import io
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("ENVIRONMENT", "development")
+
+from document_parser import pdf_text, get_parse_pool, close_parse_pool
+from main import parse_pdf_file
+from ollama_client import get_http_client, close_http_client, CHAT_TIMEOUT
+from ollama_stub import OllamaStub
+
+PAYLOAD = {"model": "stub", "prompt": "Question: När ska hyran betalas?", "stream": False}
+LINES_PER_PAGE = 45
+
+
+def make_pdf(pages: int) -> bytes:
+    """A text-heavy PDF (LINES_PER_PAGE lines per page)"""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for n in range(1, pages + 1):
+        lines = " ".join(f"(Sida {n} rad {i}: hyran betalas senast den sista vardagen i manaden.) Tj T*"
+                         for i in range(LINES_PER_PAGE))
+        stream = f"BT /F1 10 Tf 12 TL 50 760 Td {lines} ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {pages} >>"
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n{body}\nendobj\n".encode())
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    return out.getvalue()
+
+
+async def inline(content: bytes) -> str:
+    """The old parse_pdf_file: pypdf on the event loop"""
+    parts, _ = pdf_text(content)
+    return "\n\n".join(parts)
+
+
+async def measure(name: str, parse, content: bytes, stub: OllamaStub, args):
+    latencies = []
+    uploading = True
+
+    async def chatter():
+        while uploading:
+            start = time.perf_counter()
+            response = await get_http_client().post(f"{stub.base_url}/api/generate", json=PAYLOAD,
+                                                    timeout=CHAT_TIMEOUT)
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+    chatters = [asyncio.create_task(chatter()) for _ in range(args.chatters)]
+    await asyncio.sleep(0.2)  # Chat traffic is flowing before the uploads start
+
+    start = time.perf_counter()
+    texts = await asyncio.gather(*(parse(content) for _ in range(args.uploads)))
+    upload_wall = time.perf_counter() - start
+    uploading = False
+    await asyncio.gather(*chatters)
+
+    assert all(text.count("Sida") == args.pages * LINES_PER_PAGE for text in texts)
+    latencies.sort()
+    print(f"{name:<14} | {len(latencies):>6} | {latencies[len(latencies) // 2] * 1000:>8.1f} | "
+          f"{latencies[int(len(latencies) * 0.99) - 1] * 1000:>8.1f} | {latencies[-1] * 1000:>8.1f} | "
+          f"{upload_wall * 1000:>10.0f}")
+
+
+async def main(args):
+    logging.disable(logging.INFO)
+    content = make_pdf(args.pages)
+    print(f"{args.uploads} concurrent uploads of a {args.pages}-page PDF ({len(content) // 1024} KB), "
+          f"{args.chatters} chat clients, stub delay {args.delay * 1000:.0f} ms")
+    print(f"{'parsing':<14} | {'chats':>6} | {'p50 ms':>8} | {'p99 ms':>8} | {'max ms':>8} | {'upload ms':>10}")
+    print("-" * 70)
+
+    # Start the workers up front, so the comparison does not include process startup
+    await asyncio.gather(*(asyncio.wrap_future(get_parse_pool().submit(len, b"")) for _ in range(4)))
+
+    async with OllamaStub(delay=args.delay) as stub:
+        await measure("inline", inline, content, stub, args)
+        await measure("process pool", parse_pdf_file, content, stub, args)
+    await close_http_client()
+    close_parse_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--uploads", type=int, default=2)
+    parser.add_argument("--pages", type=int, default=150)
+    parser.add_argument("--chatters", type=int, default=4)
+    parser.add_argument("--delay", type=float, default=0.02, help="Stub generation time in seconds")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,156 @@
+"""
+Benchmark: Ollama prompt evaluation with the old interleaved prompt vs the static-prefix layout
+
+Usage (from backend/):
+    python benchmarks/bench_prompt_prefix.py [--requests 300] [--widgets 3] [--slots 4] [--eval-us 200]
+
+Sends chat prompts for a few widgets to a stub Ollama that simulates its
+prompt cache: each of --slots slots keeps the last prompt it evaluated, and
+only the tokens after the longest prefix shared with a cached prompt are
+evaluated (--eval-us microseconds per token). "interleaved" puts the facts
+between the persona and the rules, as build_prompt used to; "static prefix"
+is the current build_prompt. Reports evaluated prompt tokens, prompt-eval
+time and wall time per request.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("ENVIRONMENT", "development")
+
+from main import build_prompt
+from ollama_client import get_http_client, close_http_client, CHAT_TIMEOUT
+from ollama_stub import OllamaStub
+from tenant_config import Snapshot
+
+CHARS_PER_TOKEN = 4
+TONES = [None, "casual", "collegial"]
+
+
+class PrefixCachingStub(OllamaStub):
+    """Ollama stub whose prompt-eval time only counts tokens missing from its slot caches"""
+
+    def __init__(self, slots: int = 4, eval_us: float = 200, **kwargs):
+        super().__init__(**kwargs)
+        self.slots = slots
+        self.eval_us = eval_us
+        self.cached = []  # Prompts in the slots, least recently used first
+        self.prompt_tokens = 0
+        self.evaluated_tokens = 0
+        self.eval_seconds = 0.0
+
+    async def generate(self, payload, writer):
+        prompt = payload.get("prompt", "")
+        reused = max((len(os.path.commonprefix([prompt, cached])) for cached in self.cached), default=0)
+        tokens = len(prompt) // CHARS_PER_TOKEN
+        evaluated = tokens - reused // CHARS_PER_TOKEN
+        seconds = evaluated * self.eval_us / 1e6
+
+        # The prompt takes the slot holding its longest shared prefix (or the least recently used one)
+        best = max(self.cached, key=lambda cached: len(os.path.commonprefix([prompt, cached])), default=None)
+        if best is not None and (reused or len(self.cached) >= self.slots):
+            self.cached.remove(best)
+        self.cached.append(prompt)
+        self.cached = self.cached[-self.slots:]
+
+        self.prompt_tokens += tokens
+        self.evaluated_tokens += evaluated
+        self.eval_seconds += seconds
+        await asyncio.sleep(seconds)
+        payload["_prompt_eval"] = (evaluated, int(seconds * 1e9))
+        await super().generate(payload, writer)
+
+    def final_chunk(self, payload, started):
+        chunk = super().final_chunk(payload, started)
+        chunk["prompt_eval_count"], chunk["prompt_eval_duration"] = payload.get("_prompt_eval", (0, 0))
+        return chunk
+
+
+def make_widgets(count: int, rng: random.Random) -> list:
+    widgets = []
+    for n in range(count):
+        settings = Snapshot({
+            "company_id": f"company-{n}", "company_name": f"Bostadsbolag {n}",
+            "contact_email": f"info@bolag{n}.se", "contact_phone": f"08-{rng.randint(100000, 999999)}",
+            "data_controller_name": "Dataskyddsombud", "data_controller_email": f"dpo@bolag{n}.se",
+            "privacy_policy_url": f"https://bolag{n}.se/integritet",
+        })
+        widget = Snapshot({"id": n, "display_name": None, "contact_email": None, "contact_phone": None,
+                           "tone": TONES[n % len(TONES)]})
+        widgets.append((settings, widget))
+    return widgets
+
+
+def make_question(rng: random.Random):
+    topic = rng.choice(["hyran", "tvättstugan", "parkeringen", "sophämtningen", "nycklarna", "felanmälan"])
+    facts = [SimpleNamespace(question=f"Hur fungerar {topic} {i}?",
+                             answer=f"Om {topic}: " + " ".join(rng.choice(["du", "kan", "boka", "via", "portalen",
+                                                                          "senast", "den", "sista", "vardagen"])
+                                                               for _ in range(40)))
+             for i in range(3)]
+    return f"Vad gäller för {topic} nummer {rng.randint(1, 1000)}?", facts
+
+
+def interleaved(question, facts, settings, widget) -> str:
+    """The old layout: facts between the persona and the rules, so nothing after them is shared"""
+    prompt = build_prompt(question, facts, settings, "sv", widget=widget)
+    rules = prompt.index("HOW TO RESPOND:")
+    facts_at = prompt.index("FACTS")
+    return prompt[:rules] + prompt[facts_at:prompt.rindex("Question:")] + "\n" + prompt[rules:facts_at] + \
+        prompt[prompt.rindex("Question:"):]
+
+
+def static_prefix(question, facts, settings, widget) -> str:
+    return build_prompt(question, facts, settings, "sv", widget=widget)
+
+
+async def measure(name: str, layout, args):
+    rng = random.Random(42)
+    widgets = make_widgets(args.widgets, rng)
+    async with PrefixCachingStub(slots=args.slots, eval_us=args.eval_us) as stub:
+        latencies = []
+        for _ in range(args.requests):
+            settings, widget = rng.choice(widgets)
+            question, facts = make_question(rng)
+            start = time.perf_counter()
+            response = await get_http_client().post(
+                f"{stub.base_url}/api/generate",
+                json={"model": "stub", "prompt": layout(question, facts, settings, widget), "stream": False},
+                timeout=CHAT_TIMEOUT
+            )
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+        latencies.sort()
+        print(f"{name:<14} | {stub.prompt_tokens / args.requests:>13.0f} | "
+              f"{stub.evaluated_tokens / args.requests:>15.0f} | {stub.eval_seconds / args.requests * 1000:>12.1f} | "
+              f"{sum(latencies) / len(latencies) * 1000:>8.1f} | {latencies[int(len(latencies) * 0.99) - 1] * 1000:>8.1f}")
+
+
+async def main(args):
+    logging.disable(logging.INFO)
+    print(f"{args.requests} requests over {args.widgets} widgets, {args.slots} cache slots, "
+          f"{args.eval_us:.0f}us per prompt token")
+    print(f"{'layout':<14} | {'prompt tok/req':>13} | {'evaluated tok/req':>15} | {'eval ms/req':>12} | "
+          f"{'mean ms':>8} | {'p99 ms':>8}")
+    print("-" * 86)
+    await measure("interleaved", interleaved, args)
+    await measure("static prefix", static_prefix, args)
+    await close_http_client()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--widgets", type=int, default=3)
+    parser.add_argument("--slots", type=int, default=4, help="Prompt cache slots (OLLAMA_NUM_PARALLEL)")
+    parser.add_argument("--eval-us", type=float, default=200, help="Microseconds to evaluate one prompt token")
+    asyncio.run(main(parser.parse_args()))
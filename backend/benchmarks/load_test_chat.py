@@ -0,0 +1,115 @@
+"""
+Load test: concurrent widget chats with DB work on the event loop vs the DB thread pool
+
+Usage (from backend/):
+    python benchmarks/load_test_chat.py [--chats 400] [--concurrency 50] [--db-latency-ms 2]
+
+Runs the app in-process (httpx ASGITransport) against a temporary SQLite
+database and an Ollama stub, and sends widget chat turns from many
+concurrent sessions. Every SQL statement is delayed by --db-latency-ms to
+stand in for a network round-trip to PostgreSQL (or a busy SQLite lock).
+
+"event loop" runs each run_db() call inline, i.e. how every endpoint used
+to call SessionLocal; "DB thread pool" is the current code. Reports p50/p99
+latency and throughput of both.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_db_dir = tempfile.mkdtemp(prefix="bobot-load-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_dir}/load.db"
+os.environ.setdefault("ENVIRONMENT", "development")
+
+import httpx
+from sqlalchemy import event
+
+import main
+from database import engine
+from ollama_stub import OllamaStub
+
+
+async def inline_db(fn, *args, release=None, **kwargs):
+    """The old behaviour: DB work runs on (and blocks) the event loop"""
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        if release is not None:
+            release.close()
+
+
+async def measure(name: str, client: httpx.AsyncClient, chats: int, concurrency: int, turns: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def chat(n: int):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post("/chat/widget/demo-ext-001", json={
+                # Unique question text so the response cache never answers
+                "question": f"Hur betalar jag hyran? ({name} {n})",
+                "session_id": f"{name}-{n // turns}",
+            })
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors += 1
+
+    wall_start = time.perf_counter()
+    await asyncio.gather(*(chat(n) for n in range(chats)))
+    wall = time.perf_counter() - wall_start
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[max(0, int(len(latencies) * 0.99) - 1)] * 1000
+    print(f"{name:<16} | {p50:>8.1f} | {p99:>8.1f} | {chats / wall:>8.1f} | {errors:>6}")
+
+
+async def run(chats: int, concurrency: int, db_latency: float, model_delay: float, turns: int):
+    @event.listens_for(engine, "before_cursor_execute")
+    def simulated_round_trip(conn, cursor, statement, parameters, context, executemany):
+        time.sleep(db_latency)
+
+    # No rate limiting in a load test
+    main.check_rate_limit = lambda session_id, ip, company_id=None: (True, 1, 60)
+
+    async with OllamaStub(delay=model_delay) as stub:
+        main.OLLAMA_BASE_URL = stub.base_url
+        async with main.lifespan(main.app):
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+                # Warm up caches and the knowledge index
+                await client.post("/chat/widget/demo-ext-001", json={"question": "Hur betalar jag hyran?"})
+
+                print(f"{chats} chats, concurrency {concurrency}, {turns} turns per session, "
+                      f"{db_latency * 1000:.1f} ms per statement, {model_delay * 1000:.0f} ms model time")
+                print(f"{'DB calls on':<16} | {'p50 ms':>8} | {'p99 ms':>8} | {'chats/s':>8} | {'errors':>6}")
+                print("-" * 58)
+
+                run_db = main.run_db
+                main.run_db = inline_db
+                try:
+                    await measure("event loop", client, chats, concurrency, turns)
+                finally:
+                    main.run_db = run_db
+                await measure("DB thread pool", client, chats, concurrency, turns)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--chats", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=4, help="Chat turns per session")
+    parser.add_argument("--db-latency-ms", type=float, default=2.0)
+    parser.add_argument("--model-delay-ms", type=float, default=50.0)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    asyncio.run(run(args.chats, args.concurrency, args.db_latency_ms / 1000, args.model_delay_ms / 1000, args.turns))
@@ -0,0 +1,142 @@
+"""
+Bobot Chat Streaming
+Server-Sent Events (SSE) transport for chat turns
+"""
+
+import asyncio
+import json
+import logging
+from typing import Awaitable, Callable, Optional
+
+from fastapi import HTTPException, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+def format_sse(event: str, data: dict) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class ChatStream:
+    """Event channel between a running chat turn and its SSE response
+
+    The chat turn calls open() once its sources are known and token() for
+    every generated token. Events are queued until the response reads them.
+    Turns that finish without opening (cache hits, greetings, fallbacks) are
+    streamed from their final ChatResponse instead.
+    """
+
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.opened = asyncio.Event()
+
+    def open(self, session_id: str, context: list, confidence: int, had_answer: bool = True):
+        """Send the opening metadata event (sources and confidence)"""
+        self.queue.put_nowait(("meta", {
+            "session_id": session_id,
+            "sources": [item.question for item in context],
+            "sources_detail": [
+                {"question": item.question, "answer": item.answer, "category": item.category}
+                for item in context
+            ],
+            "confidence": confidence,
+            "had_answer": had_answer,
+        }))
+        self.opened.set()
+
+    def token(self, text: str):
+        self.queue.put_nowait(("token", {"text": text}))
+
+    def close(self):
+        self.queue.put_nowait(None)
+
+
+async def stream_chat_turn(turn: Callable[[ChatStream, Response, Session], Awaitable],
+                           on_finish: Optional[Callable[[int], None]] = None) -> StreamingResponse:
+    """Run a chat turn and stream it as SSE
+
+    turn(stream, response, db) is the same coroutine that serves the JSON
+    endpoint and returns a ChatResponse. Errors raised before the stream
+    opens (rate limits, inactive widget, maintenance) become normal HTTP
+    error responses; errors after that are sent as an `error` event.
+
+    The turn gets its own database session because it keeps running after
+    the endpoint has returned; message persistence happens when generation
+    is complete, just before the final `done` event.
+
+    on_finish(status) is called once the stream ends: 200 after `done`, the
+    error's status after an `error` event, 499 if the client went away.
+    """
+    stream = ChatStream()
+    header_response = Response()
+    db = SessionLocal()
+
+    task = asyncio.create_task(turn(stream, header_response, db))
+    task.add_done_callback(lambda _: stream.close())
+    task.add_done_callback(lambda _: db.close())
+
+    opened = asyncio.create_task(stream.opened.wait())
+    await asyncio.wait({task, opened}, return_when=asyncio.FIRST_COMPLETED)
+    if not opened.done():
+        opened.cancel()
+        # Finished (or failed) before any token - raise errors as plain HTTP errors
+        task.result()
+
+    async def events():
+        status = 499  # Client went away before the end
+        try:
+            while True:
+                event = await stream.queue.get()
+                if event is None:
+                    break
+                yield format_sse(*event)
+
+            try:
+                result = task.result()
+            except HTTPException as e:
+                status = e.status_code
+                yield format_sse("error", {"status": e.status_code, "detail": e.detail})
+                return
+            except Exception as e:
+                logger.error(f"Chat stream error: {e}", exc_info=True)
+                status = 500
+                yield format_sse("error", {"status": 500, "detail": "Internt fel"})
+                return
+
+            if not stream.opened.is_set():
+                yield format_sse("meta", {
+                    "session_id": result.session_id,
+                    "sources": result.sources,
+                    "sources_detail": [s if isinstance(s, dict) else s.model_dump() for s in result.sources_detail],
+                    "confidence": result.confidence,
+                    "had_answer": result.had_answer,
+                })
+                yield format_sse("token", {"text": result.answer})
+
+            # The final answer may differ from the streamed tokens if the
+            # hallucination check replaced it with the fallback message
+            status = 200
+            yield format_sse("done", {
+                "conversation_id": result.conversation_id,
+                "session_id": result.session_id,
+                "answer": result.answer,
+                "had_answer": result.had_answer,
+                "confidence": result.confidence,
+            })
+        finally:
+            # Client went away mid-stream: stop generating
+            if not task.done():
+                task.cancel()
+            if on_finish is not None:
+                on_finish(status)
+
+    headers = dict(header_response.headers)
+    headers.pop("content-length", None)
+    headers["Cache-Control"] = "no-cache"
+    headers["X-Accel-Buffering"] = "no"  # Let nginx pass tokens through unbuffered
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
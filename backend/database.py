@@ -3,7 +3,7 @@ Bobot Database - SQLite/PostgreSQL med SQLAlchemy
 GDPR-compliant med anonymiserad statistik
 """
 
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Boolean, ForeignKey, Float, Date, Index, JSON
+from sqlalchemy import create_engine, Column, Integer, BigInteger, String, Text, DateTime, Boolean, ForeignKey, Float, Date, Index, JSON, LargeBinary, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from sqlalchemy.pool import QueuePool
@@ -86,6 +86,7 @@ class Company(Base):
     settings = relationship("CompanySettings", back_populates="company", uselist=False, cascade="all, delete-orphan")
     conversations = relationship("Conversation", back_populates="company", cascade="all, delete-orphan")
     statistics = relationship("DailyStatistics", back_populates="company", cascade="all, delete-orphan")
+    analytics_rollups = relationship("AnalyticsRollup", back_populates="company", cascade="all, delete-orphan")
     widgets = relationship("Widget", back_populates="company", cascade="all, delete-orphan")
     categories = relationship("Category", back_populates="company", cascade="all, delete-orphan")
 
@@ -221,6 +222,9 @@ class KnowledgeItem(Base):
     question = Column(Text, nullable=False)
     answer = Column(Text, nullable=False)
     category = Column(String, default="", index=True)  # Kategori för filtrering
+    embedding = Column(LargeBinary, nullable=True)  # float32 vector for hybrid retrieval (embeddings.py)
+    embedding_model = Column(String, nullable=True)  # Model that produced the embedding
+    minhash = Column(LargeBinary, nullable=True)  # Question's MinHash signature (near_duplicates.py)
     created_at = Column(DateTime, default=datetime.utcnow, index=True)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -368,6 +372,27 @@ class DailyStatistics(Base):
     )
 
 
+class AnalyticsRollup(Base):
+    """Statistikräknare per företag, dag och mätvärde (se analytics_rollup.py)
+
+    Uppdateras löpande när chattar skrivs och raderas inte med konversationerna.
+    """
+    __tablename__ = "analytics_rollups"
+
+    id = Column(Integer, primary_key=True, index=True)
+    company_id = Column(String, ForeignKey("companies.id"), nullable=False)
+    date = Column(Date, nullable=False)
+    metric = Column(String, nullable=False)  # "answered", "language:sv", "hour:14", "response_ms:le_1000"
+    value = Column(BigInteger, default=0, nullable=False)
+
+    # Relations
+    company = relationship("Company", back_populates="analytics_rollups")
+
+    __table_args__ = (
+        UniqueConstraint('company_id', 'date', 'metric', name='uq_analytics_rollup'),
+    )
+
+
 class SuperAdmin(Base):
     """Super admin för att hantera alla företag"""
     __tablename__ = "super_admins"
@@ -643,6 +668,37 @@ class EmailNotificationQueue(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
 
+class BackgroundJob(Base):
+    """Long-running work (knowledge imports, exports, large deletes) run by background_jobs.py"""
+    __tablename__ = "background_jobs"
+
+    id = Column(String, primary_key=True)  # uuid4 hex
+    company_id = Column(String, ForeignKey("companies.id"), nullable=True, index=True)
+    kind = Column(String, nullable=False)  # knowledge_upload, knowledge_import_url, ...
+
+    # Input
+    params = Column(Text, default="{}")  # JSON
+    payload = Column(LargeBinary, nullable=True)  # Uploaded file, cleared when the job ends
+
+    # State
+    status = Column(String, default="queued", index=True)  # queued, running, succeeded, failed, cancelled
+    progress = Column(Integer, default=0)  # 0-100
+    stage = Column(String, default="")  # Human-readable step ("Analyserar med AI...")
+    result = Column(Text, nullable=True)  # JSON, partial while running
+    error = Column(Text, nullable=True)
+    cancel_requested = Column(Boolean, default=False)
+    attempts = Column(Integer, default=0)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)  # Updated while running; stale = worker died
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index('ix_background_job_status_created', 'status', 'created_at'),
+    )
+
+
 class PageView(Base):
     """Page view tracking for landing pages and external sites"""
     __tablename__ = "page_views"
@@ -891,6 +947,26 @@ def run_migrations():
 
             conn.commit()
 
+        # Migrate knowledge_items table (embedding columns for hybrid retrieval, MinHash signature)
+        if 'knowledge_items' in inspector.get_table_names():
+            knowledge_columns = [col['name'] for col in inspector.get_columns('knowledge_items')]
+
+            if 'embedding' not in knowledge_columns:
+                blob_type = "BYTEA" if engine.dialect.name == "postgresql" else "BLOB"
+                conn.execute(text(f"ALTER TABLE knowledge_items ADD COLUMN embedding {blob_type}"))
+                print("[Migration] Added 'embedding' column to knowledge_items table")
+
+            if 'embedding_model' not in knowledge_columns:
+                conn.execute(text("ALTER TABLE knowledge_items ADD COLUMN embedding_model VARCHAR"))
+                print("[Migration] Added 'embedding_model' column to knowledge_items table")
+
+            if 'minhash' not in knowledge_columns:
+                blob_type = "BYTEA" if engine.dialect.name == "postgresql" else "BLOB"
+                conn.execute(text(f"ALTER TABLE knowledge_items ADD COLUMN minhash {blob_type}"))
+                print("[Migration] Added 'minhash' column to knowledge_items table")
+
+            conn.commit()
+
         # Fix orphaned knowledge items (widget_id is NULL) by assigning to external widget
         # This prevents knowledge from being "shared" across widgets unintentionally
         if 'knowledge_items' in inspector.get_table_names() and 'widgets' in inspector.get_table_names():
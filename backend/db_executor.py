@@ -0,0 +1,67 @@
+"""
+Bobot DB Executor
+Runs synchronous SQLAlchemy work off the asyncio event loop
+
+    conversation = await run_db(find_conversation, db, session_id)
+
+The database layer is synchronous (SessionLocal). Calling it directly from
+an async endpoint blocks the event loop, and with it every Ollama stream
+and every other tenant's chat, for the length of the round-trip. run_db()
+runs the call on a dedicated thread pool sized to the connection pool, so
+DB work waits for a connection instead of for the loop.
+
+A request session must not keep its connection checked out between two
+run_db() calls: the next call needs a pool thread, and with every thread
+waiting for a connection the request could never give its own back. Pass
+release=db to end the session's transaction in the same thread; objects
+already loaded stay readable (detached) and the session can be used again.
+
+Endpoints that only do DB work are plain `def` instead; FastAPI runs
+those in its own threadpool.
+"""
+
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, TypeVar
+
+from sqlalchemy.orm import Session
+
+T = TypeVar("T")
+
+# One thread per pooled connection (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+DB_THREADS = int(os.getenv(
+    "DB_THREADS",
+    str(int(os.getenv("DB_POOL_SIZE", "5")) + int(os.getenv("DB_MAX_OVERFLOW", "10")))
+))
+
+_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix="bobot-db")
+
+
+def _call_and_release(fn: Callable[..., T], release: Optional[Session], *args, **kwargs) -> T:
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        if release is not None:
+            release.close()  # Returns the connection to the pool
+
+
+async def run_db(fn: Callable[..., T], *args, release: Optional[Session] = None, **kwargs) -> T:
+    """Run fn(*args, **kwargs) on the DB thread pool and await the result
+
+    Context variables (e.g. the per-request query counter) are carried
+    over. A session passed in must not be used by the caller until this
+    returns; if the caller is cancelled, the cancellation waits for the
+    thread to finish so request cleanup never closes a session in use.
+    With release=db the session is closed afterwards in the same thread.
+    """
+    loop = asyncio.get_running_loop()
+    call = functools.partial(contextvars.copy_context().run, _call_and_release, fn, release, *args, **kwargs)
+    future = loop.run_in_executor(_executor, call)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        await asyncio.wait([future])
+        raise
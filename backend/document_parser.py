@@ -0,0 +1,255 @@
+"""
+Bobot Document Parser
+Parses uploaded PDF, Word and Excel files in a pool of worker processes
+
+    text = await parse_in_pool(word_text, content)
+
+pypdf, python-docx and openpyxl are pure Python and CPU-bound: run on the
+event loop (or a thread, holding the GIL) a large upload stalls every
+tenant's chat while it parses. The parsers run in a bounded
+ProcessPoolExecutor instead. Each task has a time limit and each worker a
+memory limit (RLIMIT_AS); a task that overruns either gets a ParseError.
+A task only starts its clock once a worker is free for it. A pool with a
+stuck worker takes no new tasks (they go to a fresh pool) and is killed
+once the tasks still running on it have finished, so one tenant's
+oversized file never fails another tenant's parse. Large PDFs are split
+into page ranges that parse in parallel.
+
+Functions submitted to the pool must be module-level (picklable) and import
+their parser library themselves, so a missing library surfaces as an
+ImportError from the task.
+"""
+
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, List, Optional, Set, Tuple, TypeVar
+
+logger = logging.getLogger("bobot")
+
+T = TypeVar("T")
+
+
+# =============================================================================
+# Configuration
+# =============================================================================
+
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(min(2, os.cpu_count() or 1))))
+PARSE_TIMEOUT = float(os.getenv("PARSE_TIMEOUT", "60"))  # Seconds per task
+PARSE_MEMORY_MB = int(os.getenv("PARSE_MEMORY_MB", "1024"))  # Address space per worker (0 = no limit)
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "10"))
+
+
+class ParseError(Exception):
+    """The document could not be parsed within the time or memory limits"""
+
+
+# =============================================================================
+# Pool Lifecycle
+# =============================================================================
+
+_pool: Optional[ProcessPoolExecutor] = None
+_retired: Set[ProcessPoolExecutor] = set()  # Pools with a stuck worker, killed when their other tasks finish
+_in_flight: Dict[ProcessPoolExecutor, int] = {}  # Awaited tasks per pool
+_slots: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Semaphore]] = None
+
+
+def _limit_memory(memory_mb: int):
+    """Worker initializer: cap the process's address space"""
+    if memory_mb <= 0:
+        return
+    try:
+        import resource
+    except ImportError:  # Not available on Windows
+        return
+    limit = memory_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def get_parse_pool() -> ProcessPoolExecutor:
+    """Return the parser pool, starting it on first use
+
+    Workers are spawned rather than forked: the server process has DB and
+    HTTP threads whose locks a forked child could inherit mid-use.
+    """
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=PARSE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_limit_memory,
+            initargs=(PARSE_MEMORY_MB,),
+        )
+    return _pool
+
+
+def _shutdown(pool: ProcessPoolExecutor, kill: bool):
+    if kill:
+        for process in list((pool._processes or {}).values()):
+            process.kill()
+    pool.shutdown(wait=not kill, cancel_futures=True)
+
+
+def _retire(pool: ProcessPoolExecutor):
+    """Send new tasks to a fresh pool; this one is killed once no awaited task is left on it"""
+    global _pool
+    if pool is _pool:
+        _pool = None
+    if _in_flight.get(pool):
+        _retired.add(pool)
+    else:
+        _shutdown(pool, kill=True)
+
+
+def close_parse_pool(kill: bool = False):
+    """Shut the pool down (kill=True terminates busy workers); the next task starts a new one"""
+    global _pool
+    pools = [_pool] if _pool is not None else []
+    if kill:
+        pools.extend(_retired)
+        _retired.clear()
+    _pool = None
+    for pool in pools:
+        _shutdown(pool, kill)
+
+
+def _worker_slots() -> asyncio.Semaphore:
+    """One slot per worker, so a submitted task never queues inside the pool"""
+    global _slots
+    loop = asyncio.get_running_loop()
+    if _slots is None or _slots[0] is not loop:
+        _slots = (loop, asyncio.Semaphore(PARSE_WORKERS))
+    return _slots[1]
+
+
+async def parse_in_pool(fn: Callable[..., T], *args, timeout: float = None) -> T:
+    """Run fn(*args) in a worker process and await the result
+
+    Waits for a free worker first; the time limit starts when the task does.
+
+    Raises:
+        ParseError: On timeout, out of memory, or a crashed worker
+    """
+    timeout = PARSE_TIMEOUT if timeout is None else timeout
+    async with _worker_slots():
+        pool = get_parse_pool()
+        task = pool.submit(fn, *args)
+        _in_flight[pool] = _in_flight.get(pool, 0) + 1
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(task), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"[Parser] {fn.__name__} exceeded {timeout:.0f}s, replacing the parser pool")
+            _retire(pool)
+            raise ParseError("Filen tog för lång tid att läsa. Försök med en mindre fil.")
+        except asyncio.CancelledError:
+            if task.running():  # Still busy in a worker that no longer holds a slot
+                _retire(pool)
+            raise
+        except MemoryError:
+            logger.warning(f"[Parser] {fn.__name__} ran out of memory")
+            raise ParseError("Filen är för stor eller komplex för att läsas.")
+        except BrokenProcessPool:
+            logger.error(f"[Parser] Worker died during {fn.__name__}")
+            _retire(pool)
+            raise ParseError("Filen kunde inte läsas.")
+        finally:
+            _in_flight[pool] -= 1
+            if not _in_flight[pool]:
+                del _in_flight[pool]
+                if pool in _retired:
+                    _retired.discard(pool)
+                    _shutdown(pool, kill=True)
+
+
+# =============================================================================
+# Parsers (run in the worker processes)
+# =============================================================================
+
+def excel_items(content: bytes) -> List[dict]:
+    """Q&A pairs from the active sheet, streamed in read-only mode
+
+    The first row holds the headers (fråga/question, svar/answer,
+    kategori/category); without them the first two columns are used.
+    """
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        headers = [str(val).lower() if val else "" for val in next(rows, ())]
+
+        # Map columns to Q&A
+        q_col = None
+        a_col = None
+        cat_col = None
+
+        # Category before answer: "kategori" and "category" contain an "a"
+        for i, h in enumerate(headers):
+            if any(x in h for x in ['fråga', 'question', 'q']):
+                q_col = i
+            elif any(x in h for x in ['kategori', 'category', 'cat']):
+                cat_col = i
+            elif any(x in h for x in ['svar', 'answer', 'a']):
+                a_col = i
+
+        # If no headers found, assume first two columns
+        if q_col is None:
+            q_col = 0
+        if a_col is None:
+            a_col = 1
+
+        def cell(row: tuple, col: Optional[int]):
+            return row[col] if col is not None and col < len(row) else None
+
+        items = []
+        for row in rows:
+            q, a, cat = cell(row, q_col), cell(row, a_col), cell(row, cat_col)
+            if q and a:
+                items.append({
+                    "question": str(q).strip(),
+                    "answer": str(a).strip(),
+                    "category": str(cat).strip() if cat else None
+                })
+        return items
+    finally:
+        workbook.close()
+
+
+def word_text(content: bytes) -> str:
+    """Non-empty paragraphs of a .docx file"""
+    from docx import Document
+
+    doc = Document(io.BytesIO(content))
+    return "\n\n".join(para.text.strip() for para in doc.paragraphs if para.text.strip())
+
+
+def pdf_text(content: bytes, start: int = 0, end: Optional[int] = None) -> Tuple[List[str], int]:
+    """Text of pages [start, end) and the document's page count"""
+    from pypdf import PdfReader
+
+    reader = PdfReader(io.BytesIO(content))
+    pages = len(reader.pages)
+    parts = []
+    for page_num in range(start, min(pages, end if end is not None else pages)):
+        page_text = reader.pages[page_num].extract_text()
+        if page_text and page_text.strip():
+            parts.append(page_text.strip())
+    return parts, pages
+
+
+async def parse_pdf_pages(content: bytes, pages_per_task: int = None) -> str:
+    """Text of all pages; beyond the first pages_per_task pages, ranges parse in parallel"""
+    pages_per_task = pages_per_task or PDF_PAGES_PER_TASK
+    parts, pages = await parse_in_pool(pdf_text, content, 0, pages_per_task)
+    if pages > pages_per_task:
+        rest = await asyncio.gather(*(
+            parse_in_pool(pdf_text, content, start, start + pages_per_task)
+            for start in range(pages_per_task, pages, pages_per_task)
+        ))
+        for range_parts, _ in rest:
+            parts.extend(range_parts)
+    return "\n\n".join(parts)
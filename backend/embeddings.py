@@ -0,0 +1,261 @@
+"""
+Bobot Embeddings
+Vector embeddings for hybrid (keyword + semantic) knowledge retrieval
+
+RETRIEVAL_MODE=keyword keeps the plain keyword search. RETRIEVAL_MODE=hybrid
+adds a cosine similarity bonus from knowledge item embeddings, which are
+computed in the background by EmbeddingWorker and stored on each item.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+import numpy as np
+from sqlalchemy import bindparam, or_, update
+from sqlalchemy.orm import Session
+
+from database import KnowledgeItem
+from db_executor import run_db
+from knowledge_index import STOPWORDS, normalize_text, encode_vector
+from ollama_client import OLLAMA_BASE_URL, EXTRACT_TIMEOUT, get_http_client
+import query_counter
+
+logger = logging.getLogger(__name__)
+
+
+# =============================================================================
+# Configuration
+# =============================================================================
+
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "keyword")  # keyword | hybrid
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "hash")  # hash | ollama
+OLLAMA_EMBED_MODEL = os.getenv("OLLAMA_EMBED_MODEL", "nomic-embed-text")
+HASH_EMBEDDING_DIM = int(os.getenv("HASH_EMBEDDING_DIM", "384"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+
+# Blended score = keyword score + SEMANTIC_WEIGHT * cosine similarity, where
+# similarities below SEMANTIC_MIN_SIMILARITY count as 0. With the defaults a
+# close paraphrase alone clears the anti-hallucination min_score of 3.
+SEMANTIC_WEIGHT = float(os.getenv("SEMANTIC_WEIGHT", "6"))
+SEMANTIC_MIN_SIMILARITY = float(os.getenv(
+    "SEMANTIC_MIN_SIMILARITY", "0.75" if EMBEDDING_PROVIDER == "ollama" else "0.55"
+))
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalize each row so dot products are cosine similarities"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def item_text(question: str, answer: str) -> str:
+    """Text that is embedded for a knowledge item"""
+    return f"{question}\n{answer}"
+
+
+# =============================================================================
+# Embedders
+# =============================================================================
+
+class HashingEmbedder:
+    """Deterministic local embedder (no model, works offline)
+
+    Words (minus stopwords) and character trigrams are hashed into a fixed
+    number of signed buckets. Trigrams let Swedish compound words such as
+    "betalningsdag" land near "betalning". It does not understand meaning
+    across languages; use the Ollama embedder for that.
+    """
+
+    def __init__(self, dim: int = HASH_EMBEDDING_DIM):
+        self.dim = dim
+        self.model_id = f"hash:{dim}"
+
+    def _features(self, text: str):
+        for word in normalize_text(text).split():
+            if word in STOPWORDS:
+                continue
+            yield word, 1.0
+            padded = f" {word} "
+            for i in range(len(padded) - 2):
+                yield padded[i:i + 3], 0.5
+
+    def embed_one(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature, weight in self._features(text):
+            h = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+            vector[h % self.dim] += weight if h >> 63 else -weight
+        return vector
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        return normalize_rows(np.stack([self.embed_one(t) for t in texts]))
+
+
+class OllamaEmbedder:
+    """Embeddings from Ollama's /api/embed endpoint"""
+
+    def __init__(self, model: str = OLLAMA_EMBED_MODEL, base_url: Optional[str] = None):
+        self.model = model
+        self.model_id = f"ollama:{model}"
+        self.base_url = base_url
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        with query_counter.waiting("ollama"):
+            response = await get_http_client().post(
+                f"{self.base_url or OLLAMA_BASE_URL}/api/embed",
+                json={"model": self.model, "input": texts},
+                timeout=EXTRACT_TIMEOUT
+            )
+        response.raise_for_status()
+        return normalize_rows(response.json()["embeddings"])
+
+
+def create_embedder(provider: str = EMBEDDING_PROVIDER):
+    if provider == "ollama":
+        return OllamaEmbedder()
+    if provider == "hash":
+        return HashingEmbedder()
+    raise ValueError(f"Unknown EMBEDDING_PROVIDER: {provider}")
+
+
+# =============================================================================
+# Background Worker
+# =============================================================================
+
+class EmbeddingWorker:
+    """Computes missing item embeddings off the chat path
+
+    Knowledge endpoints call schedule(company_id) after adding or editing
+    items (edits clear the stored embedding). The worker embeds that
+    company's items without a current embedding in batches, stores the
+    vectors, and hands them to the knowledge index. schedule() is a no-op
+    until start() is called, i.e. in keyword mode.
+    """
+
+    def __init__(self, embedder, session_factory: Callable[[], Session], index,
+                 batch_size: int = EMBEDDING_BATCH_SIZE):
+        self.embedder = embedder
+        self.session_factory = session_factory
+        self.index = index
+        self.batch_size = batch_size
+        self._pending: Set[str] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._busy = False
+        self.embedded = 0  # Items embedded since start
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, company_ids: Iterable[str] = ()):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        for company_id in company_ids:
+            self.schedule(company_id)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def schedule(self, company_id: str):
+        if not self.running:
+            return
+        self._pending.add(company_id)
+        self._wakeup.set()
+
+    async def wait_idle(self):
+        """Wait until every scheduled company is embedded (for tests and scripts)"""
+        while self._pending or self._busy or self._wakeup.is_set():
+            await asyncio.sleep(0.01)
+
+    def pending_companies(self, db: Session) -> List[str]:
+        """Companies with items that lack a current embedding"""
+        rows = db.query(KnowledgeItem.company_id).filter(self._missing()).distinct().all()
+        return [row.company_id for row in rows]
+
+    def _missing(self):
+        return or_(KnowledgeItem.embedding.is_(None), KnowledgeItem.embedding_model != self.embedder.model_id)
+
+    def _missing_batch(self, company_id: str, last_id: int) -> list:
+        db = self.session_factory()
+        try:
+            return db.query(KnowledgeItem.id, KnowledgeItem.question, KnowledgeItem.answer).filter(
+                KnowledgeItem.company_id == company_id,
+                KnowledgeItem.id > last_id,
+                self._missing()
+            ).order_by(KnowledgeItem.id).limit(self.batch_size).all()
+        finally:
+            db.close()
+
+    def _store(self, rows: list, vectors: List[np.ndarray]) -> Dict[int, np.ndarray]:
+        """Write a batch of embeddings in one executemany UPDATE; returns the ones stored
+
+        Items edited while we were embedding are skipped (the question and
+        answer must still match); the edit reschedules them.
+        """
+        db = self.session_factory()
+        try:
+            current = {
+                item.id: (item.question, item.answer) for item in
+                db.query(KnowledgeItem.id, KnowledgeItem.question, KnowledgeItem.answer).filter(
+                    KnowledgeItem.id.in_([row.id for row in rows])
+                )
+            }
+            stored = {row.id: vector for row, vector in zip(rows, vectors)
+                      if current.get(row.id) == (row.question, row.answer)}
+            if stored:
+                db.execute(
+                    update(KnowledgeItem).where(
+                        KnowledgeItem.question == bindparam("old_question"),
+                        KnowledgeItem.answer == bindparam("old_answer"),
+                    ).execution_options(synchronize_session=None),
+                    [{"id": row.id, "old_question": row.question, "old_answer": row.answer,
+                      "embedding": encode_vector(stored[row.id]), "embedding_model": self.embedder.model_id}
+                     for row in rows if row.id in stored]
+                )
+                db.commit()
+            return stored
+        finally:
+            db.close()
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            self._busy = True
+            try:
+                while self._pending:
+                    company_id = self._pending.pop()
+                    try:
+                        await self.embed_company(company_id)
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        # Keyword search keeps working; the next edit retries
+                        logger.warning(f"Embedding failed for {company_id}: {e}")
+            finally:
+                self._busy = False
+
+    async def embed_company(self, company_id: str):
+        last_id = 0
+        while True:
+            rows = await run_db(self._missing_batch, company_id, last_id)
+            if not rows:
+                return
+            last_id = rows[-1].id
+
+            vectors = await self.embedder.embed([item_text(r.question, r.answer) for r in rows])
+            stored = await run_db(self._store, rows, vectors)
+
+            self.index.set_vectors(company_id, stored)
+            self.embedded += len(stored)
@@ -0,0 +1,138 @@
+"""
+Bobot Exports
+Streaming CSV, JSON and NDJSON exports read with keyset pagination
+
+    pages = keyset_pages(SessionLocal, lambda db: db.query(KnowledgeItem)..., [KnowledgeItem.id])
+    return export_response(rows_of(pages), "ndjson", KNOWLEDGE_COLUMNS, "knowledge_base")
+
+Rows are read EXPORT_PAGE_SIZE at a time (WHERE key > last key ORDER BY
+key LIMIT n), turned into dicts and encoded to one bytes chunk per page,
+so memory stays flat however much a tenant has stored. The generators
+are synchronous: Starlette iterates them in its threadpool, off the event
+loop. Each export opens its own session (the request's session may be
+closed before the body is sent) and returns the connection to the pool
+between pages.
+"""
+
+import csv
+import io
+import json
+import os
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Query, Session
+
+
+# =============================================================================
+# Configuration
+# =============================================================================
+
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "500"))  # Rows per query and per chunk
+
+FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "json": ("application/json", "json"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+}
+
+Columns = Sequence[Tuple[str, str]]  # (dict key / JSON field, CSV header)
+
+
+# =============================================================================
+# Reading
+# =============================================================================
+
+def keyset_pages(session_factory: Callable[[], Session], build_query: Callable[[Session], Query],
+                 key: Sequence, descending: bool = False, page_size: Optional[int] = None,
+                 transform: Optional[Callable[[Session, list], List[dict]]] = None) -> Iterator[List[dict]]:
+    """Yield pages of rows, paginated on the (unique) key columns
+
+    build_query(db) returns the filtered query; key is e.g. [Model.id] or
+    [Model.date, Model.id]. transform(db, rows) turns a page into dicts and
+    may run one extra query per page (e.g. first messages); without it the
+    rows must already be dicts.
+    """
+    page_size = page_size or EXPORT_PAGE_SIZE
+    db = session_factory()
+    last = None
+    try:
+        while True:
+            query = build_query(db)
+            if last is not None:
+                position = tuple_(*key) if len(key) > 1 else key[0]
+                value = last if len(key) > 1 else last[0]
+                query = query.filter(position < value if descending else position > value)
+            order = [column.desc() if descending else column for column in key]
+            rows = query.order_by(*order).limit(page_size).all()
+            if not rows:
+                return
+            last = tuple(getattr(rows[-1], column.key) for column in key)
+            page = transform(db, rows) if transform else rows
+            db.close()  # Return the connection while the page is sent
+            yield page
+            if len(rows) < page_size:
+                return
+    finally:
+        db.close()
+
+
+# =============================================================================
+# Encoding
+# =============================================================================
+
+def _csv_chunk(rows: Iterable[list]) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue().encode("utf-8")
+
+
+def encode(pages: Iterable[List[dict]], format: str, columns: Columns) -> Iterator[bytes]:
+    """One bytes chunk per page in csv, json (one array) or ndjson"""
+    keys = [key for key, _ in columns]
+    if format == "csv":
+        yield _csv_chunk([[header for _, header in columns]])
+        for page in pages:
+            yield _csv_chunk([row.get(key, "") for key in keys] for row in page)
+    elif format == "json":
+        first = True
+        yield b"["
+        for page in pages:
+            chunk = ",".join(json.dumps({key: row.get(key) for key in keys}, ensure_ascii=False) for row in page)
+            if chunk:
+                yield (chunk if first else "," + chunk).encode("utf-8")
+                first = False
+        yield b"]"
+    else:
+        for page in pages:
+            yield "".join(
+                json.dumps({key: row.get(key) for key in keys}, ensure_ascii=False) + "\n" for row in page
+            ).encode("utf-8")
+
+
+def encode_document(head: dict, field: str, pages: Iterable[List[dict]], columns: Columns,
+                    tail: Callable[[], dict]) -> Iterator[bytes]:
+    """One JSON object: the head's fields, field as a streamed array, then tail()'s fields
+
+    tail is called after the last page, so it can run its own (aggregate) query.
+    """
+    opening = json.dumps(head, ensure_ascii=False)[:-1]
+    yield f'{opening}{", " if head else ""}{json.dumps(field)}: '.encode("utf-8")
+    yield from encode(pages, "json", columns)
+    closing = json.dumps(tail(), ensure_ascii=False)[1:]
+    yield (", " + closing if closing != "}" else closing).encode("utf-8")
+
+
+def export_response(pages: Iterable[List[dict]], format: str, columns: Columns, filename: str) -> StreamingResponse:
+    """StreamingResponse with a download filename for csv, json or ndjson"""
+    format = (format or "csv").lower()
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"Okänt format: {format} (csv, json eller ndjson)")
+    media_type, extension = FORMATS[format]
+    return StreamingResponse(
+        encode(pages, format, columns),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}.{extension}"}
+    )
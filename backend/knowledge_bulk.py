@@ -0,0 +1,116 @@
+"""
+Bobot Knowledge Bulk Operations
+Inserts and deletes knowledge items in batches of one statement each
+
+    inserted, duplicates = bulk_insert_knowledge(db, company_id, widget_id, items)
+    db.commit()
+    knowledge_index.add_items(inserted)
+
+Imports used to add one KnowledgeItem at a time and flush to get its id
+(one round-trip per row), and bulk delete ran a SELECT and a DELETE per id.
+Here the new rows go in one INSERT ... RETURNING (executemany on drivers
+without multi-row RETURNING), and deletes are one DELETE ... WHERE id IN
+(...) RETURNING per BULK_BATCH_SIZE ids. Neither commits: the caller
+commits, then updates the retrieval index and response cache once for
+the whole batch.
+
+Near-duplicates of existing questions are found through the knowledge
+index's LSH buckets, and those within the batch through a batch-local
+LSHIndex, so deduplication does not compare every pair.
+"""
+
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, insert
+from sqlalchemy.orm import Session
+
+from database import KnowledgeItem
+from knowledge_index import IndexedItem, knowledge_index
+from near_duplicates import (
+    LSHIndex, NEAR_DUPLICATE_SIMILARITY, decode_signature, encode_signature, minhash, question_words
+)
+
+BULK_BATCH_SIZE = 500  # Ids per IN (...) list, below every driver's parameter limit
+
+
+def bulk_insert_knowledge(
+    db: Session,
+    company_id: str,
+    widget_id: Optional[int],
+    items: Iterable[dict],
+    skip_existing: bool = True,
+    min_similarity: float = NEAR_DUPLICATE_SIMILARITY
+) -> Tuple[List[IndexedItem], List[dict]]:
+    """Insert items (dicts with question, answer, category) in one statement
+
+    Questions whose words overlap an existing question (with skip_existing;
+    of the widget, if given) or an earlier item of the batch by
+    min_similarity or more are skipped. Returns the inserted items, in input
+    order and with their ids, and the skipped ones as dicts with question,
+    duplicate_of, duplicate_of_id (None within the batch) and similarity.
+    """
+    batch = LSHIndex()
+    exact = {}  # Normalized question -> question; also catches questions without words, which have no signature
+    rows = []
+    duplicates = []
+    for item in items:
+        words = question_words(item["question"])
+        signature = minhash(words)
+        match = None
+        normalized = item["question"].lower().strip()
+        if normalized in exact:
+            match = (1.0, None, exact[normalized])
+        if match is None:
+            similar = batch.similar(words, min_similarity, signature)
+            if similar:
+                match = (similar[0][0], None, rows[similar[0][1]]["question"])
+        if match is None and skip_existing:
+            similar = knowledge_index.similar_questions(db, company_id, item["question"], min_similarity,
+                                                        limit=1, widget_id=widget_id)
+            if similar:
+                match = (similar[0][0], similar[0][1].id, similar[0][1].question)
+        if match is not None:
+            similarity, duplicate_of_id, duplicate_of = match
+            duplicates.append({"question": item["question"], "duplicate_of": duplicate_of,
+                               "duplicate_of_id": duplicate_of_id, "similarity": round(similarity, 2)})
+            continue
+
+        batch.add(len(rows), words, signature)
+        exact[normalized] = item["question"]
+        rows.append({
+            "company_id": company_id,
+            "widget_id": widget_id,
+            "question": item["question"],
+            "answer": item["answer"],
+            "category": item.get("category") or "",
+            "minhash": encode_signature(signature),
+        })
+
+    if not rows:
+        return [], duplicates
+
+    # RETURNING order is not guaranteed (and asking for it makes SQLite insert row by row),
+    # so ids are matched back by question, which is unique within the batch
+    result = db.execute(insert(KnowledgeItem).returning(KnowledgeItem.id, KnowledgeItem.question), rows)
+    ids = {question: item_id for item_id, question in result}
+    inserted = [
+        IndexedItem(ids[row["question"]], company_id, widget_id, row["question"], row["answer"], row["category"],
+                    signature=decode_signature(row["minhash"]))
+        for row in rows
+    ]
+    return inserted, duplicates
+
+
+def bulk_delete_knowledge(db: Session, company_id: str, item_ids: Iterable[int]) -> List[Tuple[int, Optional[int]]]:
+    """Delete the company's items among item_ids; returns (id, widget_id) of each deleted item"""
+    item_ids = list(dict.fromkeys(item_ids))
+    deleted = []
+    for start in range(0, len(item_ids), BULK_BATCH_SIZE):
+        result = db.execute(
+            delete(KnowledgeItem)
+            .where(KnowledgeItem.company_id == company_id, KnowledgeItem.id.in_(item_ids[start:start + BULK_BATCH_SIZE]))
+            .returning(KnowledgeItem.id, KnowledgeItem.widget_id)
+            .execution_options(synchronize_session=False)
+        )
+        deleted.extend((item_id, widget_id) for item_id, widget_id in result)
+    return deleted
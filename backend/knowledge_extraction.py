@@ -0,0 +1,179 @@
+"""
+Bobot Knowledge Extraction
+Splits long documents into overlapping chunks for AI extraction, caches the
+Q&A pairs per chunk by content hash and merges near-duplicates
+
+Chunk boundaries are content-defined: a chunk ends after a paragraph whose
+hash marks a boundary (once the chunk is half full), or when the next
+paragraph would not fit. An edit therefore only changes the chunks around
+it, and a re-uploaded document reuses the cached results for the rest.
+"""
+
+import hashlib
+import os
+import re
+import zlib
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+from near_duplicates import LSHIndex, minhash, question_words
+
+
+# =============================================================================
+# Configuration
+# =============================================================================
+
+EXTRACT_CHUNK_CHARS = int(os.getenv("EXTRACT_CHUNK_CHARS", "4000"))
+EXTRACT_CHUNK_OVERLAP = int(os.getenv("EXTRACT_CHUNK_OVERLAP", "400"))
+EXTRACT_CONCURRENCY = int(os.getenv("EXTRACT_CONCURRENCY", "3"))  # Chunks in flight per document
+EXTRACT_MAX_CHUNKS = int(os.getenv("EXTRACT_MAX_CHUNKS", "60"))  # ~240k characters
+EXTRACT_CACHE_SIZE = int(os.getenv("EXTRACT_CACHE_SIZE", "2048"))  # Chunks
+
+DUPLICATE_SIMILARITY = 0.8  # Word overlap at which two questions count as the same
+BOUNDARY_MODULUS = 4  # About one paragraph in four may end a chunk
+
+
+# =============================================================================
+# Chunking
+# =============================================================================
+
+def split_pieces(text: str, size: int) -> List[str]:
+    """Paragraphs of the text; paragraphs longer than size are split at sentences (or hard)"""
+    pieces = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= size:
+            pieces.append(paragraph)
+            continue
+
+        current = ""
+        for sentence in re.split(r"(?<=[.!?])\s+", paragraph):
+            while len(sentence) > size:
+                if current:
+                    pieces.append(current)
+                    current = ""
+                pieces.append(sentence[:size])
+                sentence = sentence[size:]
+            if current and len(current) + 1 + len(sentence) > size:
+                pieces.append(current)
+                current = ""
+            current = f"{current} {sentence}" if current else sentence
+        if current:
+            pieces.append(current)
+    return pieces
+
+
+def is_boundary(piece: str) -> bool:
+    return zlib.crc32(piece.encode()) % BOUNDARY_MODULUS == 0
+
+
+def chunk_text(text: str, size: int = EXTRACT_CHUNK_CHARS, overlap: int = EXTRACT_CHUNK_OVERLAP) -> List[str]:
+    """Split text into paragraph-aligned chunks of at most size characters
+
+    Each chunk after the first starts with the last paragraphs (up to overlap
+    characters) of the previous one, so Q&A that spans a boundary is seen whole.
+    """
+    chunks = []
+    current: List[str] = []
+    length = 0
+    carried = 0  # Leading pieces of current that repeat the previous chunk
+
+    def close():
+        nonlocal current, length, carried
+        chunks.append("\n\n".join(current))
+        tail = []
+        for piece in reversed(current):
+            if sum(len(p) + 2 for p in tail) + len(piece) > overlap:
+                break
+            tail.insert(0, piece)
+        current, carried = tail, len(tail)
+        length = sum(len(p) + 2 for p in tail)
+
+    for piece in split_pieces(text, size):
+        if len(current) > carried and length + len(piece) > size:
+            close()
+        if length + len(piece) > size:
+            # The carried overlap and the piece do not both fit
+            current, carried, length = [], 0, 0
+        current.append(piece)
+        length += len(piece) + 2
+        if length >= size // 2 and is_boundary(piece):
+            close()
+
+    if len(current) > carried:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+# =============================================================================
+# Per-chunk cache
+# =============================================================================
+
+def chunk_key(model: str, chunk: str) -> str:
+    return hashlib.sha256(f"{model}\0{chunk}".encode()).hexdigest()
+
+
+class ExtractionCache:
+    """LRU cache of extracted Q&A pairs keyed by chunk content hash"""
+
+    def __init__(self, max_entries: int = EXTRACT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, List[dict]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[List[dict]]:
+        items = self.entries.get(key)
+        if items is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return [dict(item) for item in items]
+
+    def put(self, key: str, items: List[dict]):
+        self.entries[key] = [dict(item) for item in items]
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = self.misses = 0
+
+    def stats(self) -> Dict:
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+extraction_cache = ExtractionCache()
+
+
+# =============================================================================
+# Merging
+# =============================================================================
+
+def merge_pairs(results: Iterable[List[dict]], threshold: float = DUPLICATE_SIMILARITY) -> List[dict]:
+    """Concatenate per-chunk results, dropping questions that repeat an earlier one
+
+    Of two near-duplicates the one with the longer answer is kept, in the
+    position of the first. Earlier questions are looked up through LSH
+    buckets, not compared one by one.
+    """
+    merged: List[dict] = []
+    kept = LSHIndex()
+    for items in results:
+        for item in items:
+            words = question_words(item["question"])
+            signature = minhash(words)
+            similar = kept.similar(words, threshold, signature)
+            if similar:
+                n = min(item_id for _, item_id in similar)  # The earliest, as when scanning in order
+                if len(item["answer"]) > len(merged[n]["answer"]):
+                    merged[n] = item
+                    kept.add(n, words, signature)
+            else:
+                kept.add(len(merged), words, signature)
+                merged.append(item)
+    return merged
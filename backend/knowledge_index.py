@@ -0,0 +1,547 @@
+"""
+Bobot Knowledge Index
+In-memory inverted index for knowledge base retrieval (per company and widget),
+optionally blended with embedding similarity (see embeddings.py), and an LSH
+index of the questions for near-duplicate lookups (see near_duplicates.py)
+"""
+
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Set
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from database import KnowledgeItem
+from near_duplicates import LSHIndex, decode_signature, question_words
+from state_backend import StateBackend, state_backend
+
+# State backend namespace with a change counter per company
+VERSION_NAMESPACE = "knowledge_version"
+
+
+# =============================================================================
+# Text Normalization
+# =============================================================================
+
+# Common stopwords to ignore (Swedish and English)
+STOPWORDS = {'jag', 'vill', 'kan', 'hur', 'vad', 'är', 'har', 'en', 'ett', 'att', 'och',
+             'för', 'med', 'om', 'på', 'av', 'i', 'det', 'den', 'de', 'du', 'vi', 'ni',
+             'göra', 'gör', 'ska', 'skulle', 'a', 'the', 'is', 'are', 'to', 'how', 'what',
+             'min', 'mitt', 'mina', 'din', 'ditt', 'dina', 'sin', 'sitt', 'sina',
+             'this', 'that', 'these', 'those', 'my', 'your', 'our', 'their'}
+
+# Words shorter than this are never used for partial (compound word) matching
+PARTIAL_MIN_LENGTH = 4
+
+_PUNCTUATION_RE = re.compile(r'[^\w\s]')
+
+
+def normalize_text(text: str) -> str:
+    """Remove punctuation and normalize text for matching"""
+    # Remove punctuation, keep letters and numbers
+    return _PUNCTUATION_RE.sub('', text.lower())
+
+
+def tokenize_item(question: str, answer: str) -> Set[str]:
+    """Unique normalized words of a Q&A pair (question + answer)"""
+    return set(normalize_text(question).split()) | set(normalize_text(answer).split())
+
+
+def partial_match_points(q_word: str, i_word: str) -> int:
+    """Points for a partial match between a question word and an item word
+
+    Important for Swedish compound words, e.g. "felanmäler" should match
+    "felanmälan" or "anmäler". Both words must have 4+ chars.
+    """
+    # Check if one contains the other
+    if q_word in i_word or i_word in q_word:
+        # Give more points for longer substring matches
+        if min(len(q_word), len(i_word)) >= 6:
+            return 3  # Strong match (e.g., "anmaler" in "felanmaler")
+        return 2
+    # Check root similarity (first 4 chars match)
+    if q_word[:4] == i_word[:4]:
+        return 1
+    return 0
+
+
+def encode_vector(vector: np.ndarray) -> bytes:
+    """float32 little-endian bytes, as stored in KnowledgeItem.embedding"""
+    return np.asarray(vector, dtype="<f4").tobytes()
+
+
+def decode_vector(blob: bytes) -> np.ndarray:
+    return np.frombuffer(blob, dtype="<f4")
+
+
+def scan_score_items(question: str, items: Iterable, top_k: int = 3, min_score: int = 3) -> list:
+    """Reference implementation: score every item with a full scan
+
+    This is the original find_relevant_context algorithm. It is kept to
+    verify and benchmark KnowledgeIndex, which must return the same items.
+    """
+    question_normalized = normalize_text(question)
+    meaningful_words = set(question_normalized.split()) - STOPWORDS
+    if not meaningful_words:
+        return []
+
+    scored_items = []
+    for item in items:
+        item_words = tokenize_item(item.question, item.answer)
+
+        # Exact word matches (high score)
+        score = len(meaningful_words & item_words) * 3
+
+        # Partial/substring matches
+        for q_word in meaningful_words:
+            if len(q_word) >= PARTIAL_MIN_LENGTH:
+                for i_word in item_words:
+                    if len(i_word) >= PARTIAL_MIN_LENGTH:
+                        score += partial_match_points(q_word, i_word)
+
+        # Category match bonus (only if meaningful words also matched)
+        if item.category and score > 0:
+            if item.category.lower() in question_normalized:
+                score += 2
+
+        if score >= min_score:
+            scored_items.append((score, item))
+
+    scored_items.sort(key=lambda x: x[0], reverse=True)
+    return [item for _, item in scored_items[:top_k]]
+
+
+# =============================================================================
+# Index Structures
+# =============================================================================
+
+class IndexedItem:
+    """Read-only snapshot of a KnowledgeItem as stored in the index
+
+    Exposes the same attributes as the ORM model that the chat path reads
+    (question, answer, category), so it can be passed to build_prompt.
+    vector is the item's normalized embedding in hybrid retrieval mode;
+    signature is the question's stored MinHash signature (computed if None).
+    """
+    __slots__ = ("id", "company_id", "widget_id", "question", "answer", "category", "words", "vector",
+                 "signature")
+
+    def __init__(self, id: int, company_id: str, widget_id: Optional[int],
+                 question: str, answer: str, category: Optional[str],
+                 vector: Optional[np.ndarray] = None, signature: Optional[np.ndarray] = None):
+        self.id = id
+        self.company_id = company_id
+        self.widget_id = widget_id
+        self.question = question
+        self.answer = answer
+        self.category = category
+        self.words = tokenize_item(question, answer)
+        self.vector = vector
+        self.signature = signature
+
+    @classmethod
+    def from_model(cls, item: KnowledgeItem) -> "IndexedItem":
+        return cls(item.id, item.company_id, item.widget_id, item.question, item.answer, item.category,
+                   signature=decode_signature(item.minhash))
+
+    def __repr__(self):
+        return f"<IndexedItem {self.id} widget={self.widget_id}>"
+
+
+class _Partition:
+    """Postings for the items of one widget (or the shared items, widget_id None)"""
+
+    def __init__(self):
+        self.items: Dict[int, IndexedItem] = {}
+        self.postings: Dict[str, Set[int]] = {}  # word -> item ids
+        self.grams: Dict[str, Set[str]] = {}  # 4-gram -> vocabulary words with 4+ chars
+        self.max_word_length = 0
+        self._vectors = None  # (item ids, float32 matrix), rebuilt after changes
+
+    def add(self, item: IndexedItem):
+        self._vectors = None
+        self.items[item.id] = item
+        for word in item.words:
+            posting = self.postings.get(word)
+            if posting is None:
+                posting = self.postings[word] = set()
+                if len(word) >= PARTIAL_MIN_LENGTH:
+                    self._add_grams(word)
+            posting.add(item.id)
+
+    def remove(self, item_id: int) -> Optional[IndexedItem]:
+        item = self.items.pop(item_id, None)
+        if item is None:
+            return None
+        self._vectors = None
+        for word in item.words:
+            posting = self.postings.get(word)
+            if posting is None:
+                continue
+            posting.discard(item_id)
+            if not posting:
+                del self.postings[word]
+                if len(word) >= PARTIAL_MIN_LENGTH:
+                    self._remove_grams(word)
+        return item
+
+    def _add_grams(self, word: str):
+        self.max_word_length = max(self.max_word_length, len(word))
+        for i in range(len(word) - PARTIAL_MIN_LENGTH + 1):
+            self.grams.setdefault(word[i:i + PARTIAL_MIN_LENGTH], set()).add(word)
+
+    def _remove_grams(self, word: str):
+        for i in range(len(word) - PARTIAL_MIN_LENGTH + 1):
+            gram = word[i:i + PARTIAL_MIN_LENGTH]
+            words = self.grams.get(gram)
+            if words is not None:
+                words.discard(word)
+                if not words:
+                    del self.grams[gram]
+
+    def partial_candidates(self, q_word: str) -> Set[str]:
+        """Vocabulary words that can score a partial match against q_word
+
+        Every word that contains q_word, or shares its first 4 chars, contains
+        the 4-gram q_word[:4]. Words contained in q_word are found by looking
+        up q_word's own substrings (bounded by the longest indexed word).
+        """
+        candidates = set(self.grams.get(q_word[:PARTIAL_MIN_LENGTH], ()))
+        longest = min(len(q_word), self.max_word_length)
+        for length in range(PARTIAL_MIN_LENGTH, longest + 1):
+            for start in range(len(q_word) - length + 1):
+                sub = q_word[start:start + length]
+                if sub in self.postings:
+                    candidates.add(sub)
+        return candidates
+
+    def set_vector(self, item_id: int, vector: np.ndarray):
+        self.items[item_id].vector = vector
+        self._vectors = None
+
+    def vectors(self):
+        """Item ids and a contiguous float32 matrix of their embeddings"""
+        if self._vectors is None:
+            with_vectors = [item for item in self.items.values() if item.vector is not None]
+            if with_vectors:
+                ids = np.array([item.id for item in with_vectors], dtype=np.int64)
+                matrix = np.stack([item.vector for item in with_vectors]).astype(np.float32, copy=False)
+            else:
+                ids, matrix = np.empty(0, dtype=np.int64), None
+            self._vectors = (ids, matrix)
+        return self._vectors
+
+    def similarities(self, query_vector: np.ndarray, min_similarity: float, limit: int) -> Dict[int, float]:
+        """Top `limit` cosine similarities >= min_similarity, by item id"""
+        ids, matrix = self.vectors()
+        if matrix is None or matrix.shape[1] != query_vector.shape[0]:
+            return {}
+        sims = matrix @ query_vector
+        candidates = np.flatnonzero(sims >= min_similarity)
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(-sims[candidates], limit)[:limit]]
+        return {int(ids[i]): float(sims[i]) for i in candidates}
+
+    def score(self, meaningful_words: Set[str], scores: Dict[int, int]):
+        """Accumulate keyword scores for this partition's items into scores"""
+        postings = self.postings
+
+        # Exact word matches (high score)
+        for q_word in meaningful_words:
+            for item_id in postings.get(q_word, ()):
+                scores[item_id] = scores.get(item_id, 0) + 3
+
+        # Partial/substring matches - important for Swedish compound words
+        for q_word in meaningful_words:
+            if len(q_word) < PARTIAL_MIN_LENGTH:
+                continue
+            for i_word in self.partial_candidates(q_word):
+                points = partial_match_points(q_word, i_word)
+                if points:
+                    for item_id in postings[i_word]:
+                        scores[item_id] = scores.get(item_id, 0) + points
+
+
+class _CompanyIndex:
+    """All partitions of one company, keyed by widget_id (None = shared items)"""
+
+    def __init__(self):
+        self.partitions: Dict[Optional[int], _Partition] = {}
+        self.item_widgets: Dict[int, Optional[int]] = {}  # item id -> widget_id
+        self.questions = LSHIndex()  # All items, for near-duplicate lookups
+
+    def add(self, item: IndexedItem):
+        if item.vector is None and item.id in self.item_widgets:
+            # Keep the embedding when an edit did not change the text
+            previous = self.partitions[self.item_widgets[item.id]].items[item.id]
+            if previous.question == item.question and previous.answer == item.answer:
+                item.vector = previous.vector
+        self.remove(item.id)
+        partition = self.partitions.get(item.widget_id)
+        if partition is None:
+            partition = self.partitions[item.widget_id] = _Partition()
+        partition.add(item)
+        self.item_widgets[item.id] = item.widget_id
+        self.questions.add(item.id, question_words(item.question), item.signature)
+
+    def remove(self, item_id: int):
+        if item_id not in self.item_widgets:
+            return
+        self.questions.remove(item_id)
+        widget_id = self.item_widgets.pop(item_id)
+        partition = self.partitions.get(widget_id)
+        if partition is not None:
+            partition.remove(item_id)
+            if not partition.items:
+                del self.partitions[widget_id]
+
+    def visible_partitions(self, widget_id: Optional[int]) -> List[_Partition]:
+        if widget_id:
+            # Widget sees: its own items + shared items (widget_id is NULL)
+            keys = [widget_id, None]
+        else:
+            keys = list(self.partitions.keys())
+        return [self.partitions[k] for k in keys if k in self.partitions]
+
+
+class KnowledgeIndex:
+    """Process-wide inverted index over all companies' knowledge bases
+
+    Companies are loaded lazily on first search. Endpoints that change
+    knowledge items keep the index current with add_items/remove_items,
+    or call invalidate() when a bulk SQL update makes that impractical.
+
+    With a shared state backend (several uvicorn workers), every change also
+    bumps a per-company version there. A worker whose loaded copy is older
+    than the shared version reloads that company on its next search.
+    """
+
+    def __init__(self, versions: Optional[StateBackend] = None):
+        self.vector_model: Optional[str] = None  # Embedding model id when vectors are enabled
+        self._companies: Dict[str, _CompanyIndex] = {}
+        self._loaded_versions: Dict[str, int] = {}  # company_id -> shared version of the loaded copy
+        self._versions = versions
+        self._changes: Dict[str, int] = {}  # company_id -> local changes, see _get_company
+        self._epoch = 0  # Bumped when all companies are dropped
+        self._lock = threading.RLock()
+
+    def enable_vectors(self, model_id: str):
+        """Load and search embeddings made by model_id (hybrid retrieval)"""
+        with self._lock:
+            self.vector_model = model_id
+            self._companies.clear()
+            self._epoch += 1
+
+    def build_company(self, company_id: str, items: Iterable[IndexedItem]):
+        """Replace a company's index with the given items"""
+        company_index = _CompanyIndex()
+        for item in items:
+            company_index.add(item)
+        with self._lock:
+            self._companies[company_id] = company_index
+            self._changed(company_id)
+
+    def _loaded(self, company_id: str) -> Optional[_CompanyIndex]:
+        """The company's loaded index, or None if it is missing or outdated (call under the lock)"""
+        company_index = self._companies.get(company_id)
+        if company_index is not None and self._versions is not None:
+            # Another worker changed this company's knowledge since we loaded it
+            if self._versions.get(VERSION_NAMESPACE, company_id, 0) != self._loaded_versions.get(company_id):
+                company_index = None
+        return company_index
+
+    def _get_company(self, db: Session, company_id: str) -> _CompanyIndex:
+        """The company's index, loading it from the database if needed
+
+        Call without holding the lock: the rows are read outside it, so one
+        company's first search does not stall every other tenant's. Changes
+        made while the rows were read (add_items, remove_items, ...) may be
+        missing from them; the result is then used for this call only and
+        not published.
+        """
+        with self._lock:
+            company_index = self._loaded(company_id)
+            if company_index is not None:
+                return company_index
+            version = self._versions.get(VERSION_NAMESPACE, company_id, 0) if self._versions is not None else 0
+            vector_model = self.vector_model
+            changes = (self._epoch, self._changes.get(company_id, 0))
+
+        columns = [KnowledgeItem.id, KnowledgeItem.widget_id, KnowledgeItem.question,
+                   KnowledgeItem.answer, KnowledgeItem.category, KnowledgeItem.minhash]
+        if vector_model:
+            columns += [KnowledgeItem.embedding, KnowledgeItem.embedding_model]
+        rows = db.query(*columns).filter(KnowledgeItem.company_id == company_id).all()
+        company_index = _CompanyIndex()
+        for row in rows:
+            company_index.add(IndexedItem(row.id, company_id, row.widget_id, row.question, row.answer,
+                                          row.category, self._row_vector(row, vector_model),
+                                          decode_signature(row.minhash)))
+
+        with self._lock:
+            loaded = self._loaded(company_id)
+            if loaded is not None:
+                return loaded  # Another thread loaded it meanwhile
+            if (self._epoch, self._changes.get(company_id, 0)) == changes and self.vector_model == vector_model:
+                self._companies[company_id] = company_index
+                self._loaded_versions[company_id] = version
+        return company_index
+
+    def _changed(self, company_id: str):
+        """Note a local change, so a load that read its rows before it is not published"""
+        self._changes[company_id] = self._changes.get(company_id, 0) + 1
+
+    def _row_vector(self, row, vector_model: Optional[str]) -> Optional[np.ndarray]:
+        if vector_model and row.embedding is not None and row.embedding_model == vector_model:
+            return decode_vector(row.embedding)
+        return None
+
+    def _publish_change(self, company_id: str, applied: bool):
+        """Bump the shared version of a company after changing its knowledge
+
+        applied: whether this worker's loaded copy already has the change, in
+        which case it stays current unless another worker changed it too.
+        """
+        if self._versions is None:
+            return
+        previous, current = self._versions.update(
+            VERSION_NAMESPACE, company_id, lambda v: ((v or 0) + 1, ((v or 0), (v or 0) + 1))
+        )
+        if applied and self._loaded_versions.get(company_id) == previous:
+            self._loaded_versions[company_id] = current
+
+    def search(self, db: Session, company_id: str, question: str, top_k: int = 3,
+               min_score: int = 3, widget_id: Optional[int] = None,
+               query_vector: Optional[np.ndarray] = None, semantic_weight: float = 0.0,
+               min_similarity: float = 1.0) -> List[IndexedItem]:
+        """Keyword search with the same scoring rules as the original table scan
+
+        With a query_vector (hybrid mode), items whose cosine similarity is
+        at least min_similarity get semantic_weight * similarity added to
+        their keyword score before the min_score cut, so paraphrases without
+        shared words can still match. Items are ranked by score
+        (descending), ties broken by item id.
+        """
+        company_index = self._get_company(db, company_id)
+        with self._lock:
+            partitions = company_index.visible_partitions(widget_id)
+            if not partitions:
+                return []  # No knowledge base items at all
+
+            question_normalized = normalize_text(question)
+            meaningful_words = set(question_normalized.split()) - STOPWORDS
+
+            # ANTI-HALLUCINATION: If no meaningful words after removing stopwords, return empty
+            if not meaningful_words:
+                return []
+
+            scored_items = []
+            for partition in partitions:
+                scores: Dict[int, int] = {}
+                partition.score(meaningful_words, scores)
+                similarities = {}
+                if query_vector is not None and semantic_weight:
+                    similarities = partition.similarities(query_vector, min_similarity, top_k * 10)
+                for item_id in scores.keys() | similarities.keys():
+                    item = partition.items[item_id]
+                    score = scores.get(item_id, 0)
+                    # Category match bonus (only if meaningful words also matched)
+                    if item.category and score > 0:
+                        if item.category.lower() in question_normalized:
+                            score += 2
+                    score += semantic_weight * similarities.get(item_id, 0.0)
+                    if score >= min_score:
+                        scored_items.append((score, item))
+
+        scored_items.sort(key=lambda x: (-x[0], x[1].id))
+        return [item for _, item in scored_items[:top_k]]
+
+    def similar_questions(self, db: Session, company_id: str, question: str, min_similarity: float,
+                          limit: Optional[int] = None, widget_id: Optional[int] = None) -> List[tuple]:
+        """(similarity, item) for items whose question overlaps question by min_similarity or more
+
+        Looks up LSH candidates instead of comparing with every item (see
+        near_duplicates.py). With a widget_id only that widget's own items
+        are considered. Most similar first.
+        """
+        words = question_words(question)
+        company_index = self._get_company(db, company_id)
+        with self._lock:
+            matches = []
+            for similarity, item_id in company_index.questions.similar(words, min_similarity):
+                item_widget = company_index.item_widgets[item_id]
+                if widget_id and item_widget != widget_id:
+                    continue
+                matches.append((similarity, company_index.partitions[item_widget].items[item_id]))
+                if limit and len(matches) >= limit:
+                    break
+        return matches
+
+    def add_items(self, items: Iterable[IndexedItem]):
+        """Add or replace items; companies that are not loaded yet are skipped
+
+        Take the IndexedItem snapshots before db.commit() so that committing
+        (which expires ORM attributes) does not cost one reload per item.
+        """
+        with self._lock:
+            changed = set()
+            for item in items:
+                company_index = self._companies.get(item.company_id)
+                if company_index is not None:
+                    company_index.add(item)
+                changed.add(item.company_id)
+            for company_id in changed:
+                self._changed(company_id)
+                self._publish_change(company_id, applied=True)
+
+    def set_vectors(self, company_id: str, vectors: Dict[int, np.ndarray]):
+        """Attach freshly computed embeddings to loaded items"""
+        if not vectors:
+            return
+        with self._lock:
+            company_index = self._companies.get(company_id)
+            if company_index is not None:
+                for item_id, vector in vectors.items():
+                    widget_id = company_index.item_widgets.get(item_id, False)
+                    if widget_id is not False:
+                        company_index.partitions[widget_id].set_vector(item_id, vector)
+            self._changed(company_id)
+            self._publish_change(company_id, applied=True)
+
+    def remove_items(self, company_id: str, item_ids: Iterable[int]):
+        """Remove items by id from a company's index"""
+        with self._lock:
+            company_index = self._companies.get(company_id)
+            if company_index is not None:
+                for item_id in item_ids:
+                    company_index.remove(item_id)
+            self._changed(company_id)
+            self._publish_change(company_id, applied=True)
+
+    def invalidate(self, company_id: Optional[str] = None):
+        """Drop a company's index (or all) so it is rebuilt on next search"""
+        with self._lock:
+            if company_id is None:
+                self._companies.clear()
+                self._epoch += 1
+            else:
+                self._companies.pop(company_id, None)
+                self._changed(company_id)
+                self._publish_change(company_id, applied=False)
+
+    def stats(self) -> dict:
+        """Size of the loaded indexes, for monitoring"""
+        with self._lock:
+            return {
+                "companies": len(self._companies),
+                "items": sum(len(c.item_widgets) for c in self._companies.values()),
+                "terms": sum(len(p.postings) for c in self._companies.values() for p in c.partitions.values()),
+                "vectors": sum(
+                    1 for c in self._companies.values() for p in c.partitions.values()
+                    for item in p.items.values() if item.vector is not None
+                ),
+            }
+
+
+knowledge_index = KnowledgeIndex(state_backend if state_backend.shared else None)
@@ -5,12 +5,13 @@ En GDPR-säker AI-chatbot för fastighetsbolag
 
 from fastapi import FastAPI, HTTPException, Depends, Request, BackgroundTasks, UploadFile, File, Response, Query, Form
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from starlette.middleware.base import BaseHTTPMiddleware
 from pydantic import BaseModel, Field, field_validator
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Iterable, Tuple
 from datetime import datetime, timedelta, date
-from sqlalchemy.orm import Session
-from sqlalchemy import func, and_, text
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy import func, and_, case, text, select
 import httpx
 import os
 import json
@@ -18,6 +19,7 @@ import asyncio
 import uuid
 import time
 import logging
+import secrets
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -25,70 +27,65 @@ logger = logging.getLogger(__name__)
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
+# Before the local imports: several modules read their settings from the environment when imported
+load_dotenv()
+
 from database import (
     create_tables, run_migrations, get_db, Company, KnowledgeItem, ChatLog, SuperAdmin,
     CompanySettings, Conversation, Message, DailyStatistics, GDPRAuditLog,
     AdminAuditLog, GlobalSettings, CompanyActivityLog, Subscription, Invoice,
     CompanyNote, CompanyDocument, WidgetPerformance, EmailNotificationQueue,
     RoadmapItem, PricingTier, Widget, PageView, DailyPageStats, Category,
-    Announcement, AnnouncementRead
+    Announcement, AnnouncementRead, BackgroundJob, SessionLocal, engine
 )
 from auth import (
     hash_password, verify_password, create_token, create_2fa_pending_token,
     get_current_company, get_super_admin, get_2fa_pending_admin,
     needs_rehash, is_bcrypt_hash
 )
-
-load_dotenv()
+from knowledge_index import knowledge_index, IndexedItem
+from embeddings import RETRIEVAL_MODE, SEMANTIC_WEIGHT, SEMANTIC_MIN_SIMILARITY, EmbeddingWorker, create_embedder
+from response_cache import response_cache, make_cache_key, CACHE_FLUSH_INTERVAL
+from single_flight import SingleFlight
+from ollama_scheduler import ollama_scheduler, SchedulerBusy
+from ollama_router import OllamaRouter, OLLAMA_NODES
+from rate_limiter import SlidingWindowLimiter
+from tenant_config import config_cache, snapshot
+from exports import encode_document, export_response, keyset_pages
+from write_behind import WriteBehindQueue
+from retention_cleanup import RetentionCleanup
+from background_jobs import JobEngine, JobContext, JobFailed, job_response
+from document_parser import (
+    ParseError, parse_in_pool, parse_pdf_pages, excel_items, word_text, close_parse_pool
+)
+from knowledge_bulk import bulk_insert_knowledge, bulk_delete_knowledge
+from near_duplicates import question_signature, backfill_signatures
+from knowledge_extraction import (
+    chunk_text, chunk_key, merge_pairs, extraction_cache, EXTRACT_CONCURRENCY, EXTRACT_MAX_CHUNKS
+)
+from db_executor import run_db
+import query_counter
+import metrics
+import analytics_rollup
+from ollama_client import (
+    OLLAMA_BASE_URL, OLLAMA_MODEL, CHAT_TIMEOUT, EXTRACT_TIMEOUT, HEALTH_TIMEOUT, FETCH_TIMEOUT,
+    get_http_client, close_http_client
+)
+from chat_stream import ChatStream, stream_chat_turn
 
 
 # =============================================================================
 # Lifespan & Scheduled Tasks
 # =============================================================================
 
-async def cleanup_old_conversations():
-    """Rensa gamla konversationer baserat på retention-inställningar (GDPR)"""
-    from database import SessionLocal
-    db = SessionLocal()
-    try:
-        # Hämta alla företag med deras retention-inställningar
-        companies = db.query(Company).all()
-
-        for company in companies:
-            settings = db.query(CompanySettings).filter(
-                CompanySettings.company_id == company.id
-            ).first()
-
-            retention_days = settings.data_retention_days if settings else 30
-            cutoff_date = datetime.utcnow() - timedelta(days=retention_days)
-
-            # Hitta gamla konversationer
-            old_conversations = db.query(Conversation).filter(
-                and_(
-                    Conversation.company_id == company.id,
-                    Conversation.started_at < cutoff_date
-                )
-            ).all()
-
-            for conv in old_conversations:
-                # Spara statistik innan radering
-                await save_conversation_stats(db, conv)
+# Expired conversations are deleted in batches (retention_cleanup.py)
+retention_cleanup = RetentionCleanup(SessionLocal)
 
-                # Radera konversation och meddelanden (cascade)
-                db.delete(conv)
+# Knowledge imports (and other long work) run as persistent background jobs
+job_engine = JobEngine(SessionLocal)
 
-            if old_conversations:
-                db.commit()
-                print(f"[GDPR Cleanup] Raderade {len(old_conversations)} gamla konversationer för {company.id}")
-
-    except Exception as e:
-        print(f"[GDPR Cleanup Error] {e}")
-        db.rollback()
-    finally:
-        db.close()
 
-
-async def cleanup_old_activity_logs():
+def cleanup_old_activity_logs():
     """Clean up activity logs older than 12 months"""
     from database import SessionLocal
     db = SessionLocal()
@@ -120,8 +117,41 @@ async def scheduled_cleanup_task():
     """Kör cleanup varje timme"""
     while True:
         await asyncio.sleep(3600)  # Vänta 1 timme
-        await cleanup_old_conversations()
-        await cleanup_old_activity_logs()
+        await retention_cleanup.run()
+        await run_db(cleanup_old_activity_logs)
+        await run_db(job_engine.delete_finished)
+
+
+def flush_widget_performance(before: Optional[datetime] = None) -> int:
+    """Write hourly chat metrics to WidgetPerformance (finished hours, or all)"""
+    db = SessionLocal()
+    try:
+        return metrics.performance.flush(db, before)
+    finally:
+        db.close()
+
+
+async def widget_performance_task():
+    """Write each finished hour of chat metrics to WidgetPerformance"""
+    while True:
+        hour = metrics.next_hour()
+        await asyncio.sleep(max(0.0, (hour - datetime.utcnow()).total_seconds()) + 5)
+        try:
+            written = await run_db(flush_widget_performance, hour)
+            if written:
+                print(f"[Metrics] {written} timmar skrivna till WidgetPerformance")
+        except Exception as e:
+            logger.error(f"[Metrics] WidgetPerformance flush failed: {e}")
+
+
+async def response_cache_flush_task():
+    """Write the response cache's buffered hit/miss counts and LRU times (shared state backend)"""
+    while True:
+        await asyncio.sleep(CACHE_FLUSH_INTERVAL)
+        try:
+            await asyncio.to_thread(response_cache.flush)
+        except Exception as e:
+            logger.error(f"[Cache] Response cache flush failed: {e}")
 
 
 async def email_queue_task():
@@ -162,6 +192,20 @@ async def lifespan(app: FastAPI):
     run_migrations()  # Add new columns to existing tables
     init_demo_data()
 
+    # Build the analytics rollups on the first start after upgrading
+    db = SessionLocal()
+    try:
+        rebuilt = analytics_rollup.backfill_if_empty(db)
+    finally:
+        db.close()
+    if rebuilt is not None:
+        print(f"[Startup] Analytics rollups byggda från befintlig data ({rebuilt} rader)")
+
+    # MinHash signatures for knowledge items saved before near-duplicate detection
+    filled = backfill_signatures(SessionLocal)
+    if filled:
+        print(f"[Startup] MinHash-signaturer sparade för {filled} kunskapsposter")
+
     # Start background tasks
     cleanup_task = asyncio.create_task(scheduled_cleanup_task())
     print("[Startup] GDPR cleanup-task startad (körs varje timme)")
@@ -169,16 +213,45 @@ async def lifespan(app: FastAPI):
     email_task = asyncio.create_task(email_queue_task())
     print("[Startup] Email queue task started (runs every 5 minutes)")
 
+    performance_task = asyncio.create_task(widget_performance_task())
+
+    cache_flush_task = asyncio.create_task(response_cache_flush_task())
+
+    # Ejected Ollama nodes are re-probed and return when they answer
+    probe_task = asyncio.create_task(ollama_router.run_probes())
+
+    # Shared keep-alive connection pool for Ollama and URL imports
+    get_http_client()
+
+    # Batched writes of chat messages and counters
+    write_queue.start()
+
+    # Background jobs (knowledge imports); jobs left running by a previous process are resumed
+    job_engine.start()
+
+    # Hybrid retrieval: embed items that have no current embedding (e.g. after a model change)
+    if RETRIEVAL_MODE == "hybrid":
+        db = SessionLocal()
+        try:
+            embedding_worker.start(embedding_worker.pending_companies(db))
+        finally:
+            db.close()
+        print(f"[Startup] Hybrid retrieval enabled ({embedder.model_id})")
+
     yield
 
-    # Shutdown
-    cleanup_task.cancel()
-    email_task.cancel()
-    try:
-        await cleanup_task
-        await email_task
-    except asyncio.CancelledError:
-        pass
+    # Shutdown: wait for every periodic task, so no flush is still running in a DB thread
+    periodic_tasks = [cleanup_task, email_task, performance_task, cache_flush_task, probe_task]
+    for task in periodic_tasks:
+        task.cancel()
+    await asyncio.gather(*periodic_tasks, return_exceptions=True)
+    await job_engine.stop()  # Running jobs go back to the queue
+    await embedding_worker.stop()
+    await write_queue.stop()  # Flush queued chat writes
+    await run_db(flush_widget_performance)  # Including the current hour (merged on the next flush)
+    response_cache.flush()
+    await close_http_client()
+    close_parse_pool()
 
 
 app = FastAPI(
@@ -289,6 +362,9 @@ app.add_middleware(SecurityHeadersMiddleware)
 # Request ID & Logging Middleware
 # =============================================================================
 
+request_logger = logging.getLogger("bobot.requests")
+
+
 class RequestIDMiddleware(BaseHTTPMiddleware):
     """Add request ID to all requests for tracing"""
 
@@ -298,21 +374,47 @@ class RequestIDMiddleware(BaseHTTPMiddleware):
         request.state.request_id = request_id
 
         # Time the request
-        start_time = time.time()
-
-        response = await call_next(request)
+        start_time = time.perf_counter()
+        request.state.started_at = start_time
+
+        # Count and time SQL statements and Ollama waits (streamed bodies are still running when the headers are sent)
+        with query_counter.count_queries(request_id=request_id) as queries:
+            response = await call_next(request)
+        duration_ms = (time.perf_counter() - start_time) * 1000
+
+        # Prometheus metrics per route template (chat turns set request.state.company_id).
+        # Streamed chat turns are still generating here; they record themselves when the stream ends
+        route = request.scope.get("route")
+        streamed = response.headers.get("content-type", "").startswith("text/event-stream")
+        metrics.record_request(
+            request.method, route.path if route else "unmatched", response.status_code, duration_ms,
+            queries.count, queries.db_ms, None if streamed else getattr(request.state, "company_id", None)
+        )
 
-        # Add request ID to response
+        # Add request ID and timings to response
         response.headers["X-Request-ID"] = request_id
-
-        # Log request (skip health checks)
-        if request.url.path not in ["/health", "/", "/docs", "/openapi.json"]:
-            duration_ms = (time.time() - start_time) * 1000
-            print(f"[{request_id}] {request.method} {request.url.path} - {response.status_code} ({duration_ms:.0f}ms)")
+        response.headers["Server-Timing"] = queries.server_timing(duration_ms)
+        if os.getenv("ENVIRONMENT", "development") != "production":
+            response.headers["X-DB-Queries"] = str(queries.count)
+
+        # Log request as one structured line (skip health checks)
+        if request.url.path not in ["/health", "/", "/docs", "/openapi.json", "/metrics"]:
+            request_logger.info(json.dumps({
+                "request_id": request_id,
+                "method": request.method,
+                "path": request.url.path,
+                "status": response.status_code,
+                "duration_ms": round(duration_ms, 1),
+                "db_queries": queries.count,
+                "db_ms": round(queries.db_ms, 1),
+                "ollama_ms": round(queries.waits.get("ollama", 0.0), 1),
+                "slowest_queries": queries.slowest,
+            }, ensure_ascii=False))
 
         return response
 
 
+query_counter.install(engine)
 app.add_middleware(RequestIDMiddleware)
 
 
@@ -320,10 +422,11 @@ app.add_middleware(RequestIDMiddleware)
 # Login Attempt Tracking (Brute Force Protection)
 # =============================================================================
 
-login_attempts: Dict[str, list] = {}  # {identifier: [timestamp, timestamp, ...]}
 LOGIN_ATTEMPT_WINDOW = 900  # 15 minutes
 LOGIN_MAX_ATTEMPTS = 5  # Max failed attempts before lockout
-LOGIN_LOCKOUT_DURATION = 900  # 15 minutes lockout
+
+# Failed attempts per identifier; locked out while 5+ failures fall within the window
+login_limiter = SlidingWindowLimiter("login_attempts", LOGIN_MAX_ATTEMPTS, LOGIN_ATTEMPT_WINDOW)
 
 
 def check_login_attempts(identifier: str) -> tuple:
@@ -331,51 +434,20 @@ def check_login_attempts(identifier: str) -> tuple:
     Check if login is allowed for identifier (username or IP).
     Returns (allowed: bool, remaining_attempts: int, lockout_seconds: int)
     """
-    now = time.time()
-
-    if identifier not in login_attempts:
-        return True, LOGIN_MAX_ATTEMPTS, 0
-
-    # Clean old attempts outside window
-    login_attempts[identifier] = [
-        ts for ts in login_attempts[identifier]
-        if now - ts < LOGIN_ATTEMPT_WINDOW
-    ]
-
-    attempts = len(login_attempts[identifier])
-
-    if attempts >= LOGIN_MAX_ATTEMPTS:
-        # Check if still in lockout
-        oldest_attempt = min(login_attempts[identifier]) if login_attempts[identifier] else now
-        lockout_remaining = LOGIN_LOCKOUT_DURATION - (now - oldest_attempt)
-
-        if lockout_remaining > 0:
-            return False, 0, int(lockout_remaining)
-        else:
-            # Lockout expired, clear attempts
-            login_attempts[identifier] = []
-            return True, LOGIN_MAX_ATTEMPTS, 0
-
-    return True, LOGIN_MAX_ATTEMPTS - attempts, 0
+    decision = login_limiter.peek(identifier)
+    if not decision.allowed:
+        return False, 0, decision.reset
+    return True, decision.remaining, 0
 
 
 def record_failed_login(identifier: str):
     """Record a failed login attempt"""
-    now = time.time()
-    if identifier not in login_attempts:
-        login_attempts[identifier] = []
-    login_attempts[identifier].append(now)
+    login_limiter.add(identifier)
 
 
 def clear_login_attempts(identifier: str):
     """Clear login attempts on successful login"""
-    if identifier in login_attempts:
-        del login_attempts[identifier]
-
-
-# Ollama-konfiguration
-OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
-OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "qwen2.5:7b-instruct")
+    login_limiter.reset(identifier)
 
 
 # =============================================================================
@@ -423,128 +495,76 @@ class ChatResponse(BaseModel):
     confidence: int = 100  # Confidence score 0-100
 
 
-# Simple in-memory cache for responses
-response_cache = {}
-CACHE_TTL = 300  # 5 minutes
+# Identical questions answered at the same time share one generation
+chat_flights = SingleFlight()
 
 
 def get_cached_response(company_id: str, question: str, language: str = "sv", widget_key: str = None):
     """Get cached response if available and not expired"""
-    # Include widget_key in cache key to prevent cross-widget cache contamination
-    widget_part = widget_key or "default"
-    cache_key = f"{company_id}:{widget_part}:{language}:{question.lower().strip()}"
-    if cache_key in response_cache:
-        cached, timestamp = response_cache[cache_key]
-        if datetime.utcnow().timestamp() - timestamp < CACHE_TTL:
-            return cached
-        else:
-            del response_cache[cache_key]
-    return None
+    return response_cache.get(make_cache_key(company_id, question, language, widget_key))
 
 
 def set_cached_response(company_id: str, question: str, response: dict, language: str = "sv", widget_key: str = None):
     """Cache a response"""
-    # Include widget_key in cache key to prevent cross-widget cache contamination
-    widget_part = widget_key or "default"
-    cache_key = f"{company_id}:{widget_part}:{language}:{question.lower().strip()}"
-    response_cache[cache_key] = (response, datetime.utcnow().timestamp())
-    # Clean old entries if cache gets too large
-    if len(response_cache) > 1000:
-        oldest_keys = sorted(response_cache.keys(), key=lambda k: response_cache[k][1])[:100]
-        for k in oldest_keys:
-            del response_cache[k]
+    response_cache.set(make_cache_key(company_id, question, language, widget_key), response,
+                       company_id, widget_key=widget_key)
+
+
+def invalidate_response_cache(db: Session, company_id: str, widget_ids: Iterable[Optional[int]] = (None,)):
+    """Drop cached answers that a knowledge change can affect
+
+    Shared items (widget_id None) are visible to every widget, so they clear
+    the whole company. Widget items clear that widget's answers and answers
+    cached without a widget key (which search all of the company's items).
+    """
+    widget_ids = set(widget_ids)
+    if not widget_ids:
+        return
+    if None in widget_ids:
+        response_cache.invalidate(company_id)
+        return
+    widget_keys = [row.widget_key for row in db.query(Widget.widget_key).filter(
+        Widget.company_id == company_id,
+        Widget.id.in_(widget_ids)
+    )]
+    response_cache.invalidate(company_id, widget_keys + [None])
 
 
 # Rate limiting for chat endpoint
-rate_limit_store = {}  # {session_id: [timestamps]}
 RATE_LIMIT_WINDOW = 60  # 1 minute window
 RATE_LIMIT_MAX_REQUESTS = 15  # Max 15 messages per minute
 
+chat_rate_limiter = SlidingWindowLimiter("chat_rate_limit", RATE_LIMIT_MAX_REQUESTS, RATE_LIMIT_WINDOW)
+
 
-def check_rate_limit(session_id: str, ip_address: str) -> tuple:
+def check_rate_limit(session_id: str, ip_address: str, company_id: str = None) -> tuple:
     """
     Check if session/IP is rate limited.
     Returns (allowed: bool, current_count: int, reset_time: int)
     """
     # Use combination of session and IP for rate limiting
     rate_key = f"{session_id}:{ip_address}" if session_id else ip_address
-    now = datetime.utcnow().timestamp()
-    window_start = now - RATE_LIMIT_WINDOW
-
-    if rate_key not in rate_limit_store:
-        rate_limit_store[rate_key] = []
-
-    # Remove old timestamps outside window
-    rate_limit_store[rate_key] = [ts for ts in rate_limit_store[rate_key] if ts > window_start]
-
-    current_count = len(rate_limit_store[rate_key])
-
-    # Calculate reset time (when the oldest request in window expires)
-    if rate_limit_store[rate_key]:
-        reset_time = int(min(rate_limit_store[rate_key]) + RATE_LIMIT_WINDOW - now)
-    else:
-        reset_time = RATE_LIMIT_WINDOW
-
-    # Check if under limit
-    if current_count >= RATE_LIMIT_MAX_REQUESTS:
-        return False, current_count, reset_time
-
-    # Add current request
-    rate_limit_store[rate_key].append(now)
-
-    # Cleanup old entries periodically (every 100 requests)
-    if len(rate_limit_store) > 10000:
-        rate_limit_store.clear()  # Simple cleanup - clear all
-
-    return True, current_count + 1, reset_time
+    decision = chat_rate_limiter.hit(rate_key, label=company_id)
+    return decision.allowed, decision.count, decision.reset
 
 
 # =============================================================================
 # Admin Rate Limiting (stricter limits for administrative operations)
 # =============================================================================
 
-admin_rate_limit_store = {}  # {admin_username: [timestamps]}
 ADMIN_RATE_LIMIT_WINDOW = 60  # 1 minute window
 ADMIN_RATE_LIMIT_MAX_REQUESTS = 30  # Max 30 admin requests per minute
 
+admin_rate_limiter = SlidingWindowLimiter("admin_rate_limit", ADMIN_RATE_LIMIT_MAX_REQUESTS, ADMIN_RATE_LIMIT_WINDOW)
+
 
 def check_admin_rate_limit(admin_username: str) -> tuple:
     """
     Check if admin is rate limited.
     Returns (allowed: bool, remaining: int, reset_time: int)
     """
-    now = datetime.utcnow().timestamp()
-    window_start = now - ADMIN_RATE_LIMIT_WINDOW
-
-    if admin_username not in admin_rate_limit_store:
-        admin_rate_limit_store[admin_username] = []
-
-    # Remove old timestamps outside window
-    admin_rate_limit_store[admin_username] = [
-        ts for ts in admin_rate_limit_store[admin_username]
-        if ts > window_start
-    ]
-
-    current_count = len(admin_rate_limit_store[admin_username])
-
-    # Calculate reset time
-    if admin_rate_limit_store[admin_username]:
-        reset_time = int(min(admin_rate_limit_store[admin_username]) + ADMIN_RATE_LIMIT_WINDOW - now)
-    else:
-        reset_time = ADMIN_RATE_LIMIT_WINDOW
-
-    # Check if under limit
-    if current_count >= ADMIN_RATE_LIMIT_MAX_REQUESTS:
-        return False, 0, reset_time
-
-    # Add current request
-    admin_rate_limit_store[admin_username].append(now)
-
-    # Cleanup old entries periodically
-    if len(admin_rate_limit_store) > 1000:
-        admin_rate_limit_store.clear()
-
-    return True, ADMIN_RATE_LIMIT_MAX_REQUESTS - current_count - 1, reset_time
+    decision = admin_rate_limiter.hit(admin_username)
+    return decision.allowed, decision.remaining, decision.reset
 
 
 def require_admin_rate_limit(admin: dict):
@@ -1516,15 +1536,15 @@ def init_demo_data():
 # Helper Functions
 # =============================================================================
 
-def normalize_text(text: str) -> str:
-    """Remove punctuation and normalize text for matching"""
-    import re
-    # Remove punctuation, keep letters and numbers
-    text = re.sub(r'[^\w\s]', '', text.lower())
-    return text
+# Hybrid retrieval (RETRIEVAL_MODE=hybrid): item embeddings are computed in the
+# background by embedding_worker; only the question is embedded on the chat path
+embedder = create_embedder()
+embedding_worker = EmbeddingWorker(embedder, SessionLocal, knowledge_index)
+if RETRIEVAL_MODE == "hybrid":
+    knowledge_index.enable_vectors(embedder.model_id)
 
 
-def find_relevant_context(question: str, company_id: str, db: Session, top_k: int = 3, min_score: int = 3, widget_id: Optional[int] = None, widget_type: str = "external") -> List[KnowledgeItem]:
+async def find_relevant_context(question: str, company_id: str, db: Session, top_k: int = 3, min_score: int = 3, widget_id: Optional[int] = None, widget_type: str = "external") -> List[IndexedItem]:
     """Hitta relevanta frågor/svar från kunskapsbasen - fuzzy matching
 
     ANTI-HALLUCINATION: Only returns items with score >= min_score to prevent
@@ -1534,77 +1554,54 @@ def find_relevant_context(question: str, company_id: str, db: Session, top_k: in
     If widget_id is provided:
     - Returns items belonging to that specific widget
     - ALSO returns shared items (widget_id is NULL) which are visible to all widgets
+
+    Scoring runs against the in-memory inverted index (knowledge_index.py),
+    which is built once per company and kept current by the knowledge endpoints.
+    In hybrid mode, embedding similarity is added to the keyword score so
+    paraphrases can match (embeddings.py).
     """
-    # Filter by company and widget
-    query = db.query(KnowledgeItem).filter(KnowledgeItem.company_id == company_id)
-    if widget_id:
-        from sqlalchemy import or_
-        # Widget sees: its own items + shared items (widget_id is NULL)
-        query = query.filter(or_(KnowledgeItem.widget_id == widget_id, KnowledgeItem.widget_id.is_(None)))
-    items = query.all()
+    query_vector = None
+    if knowledge_index.vector_model:
+        try:
+            query_vector = (await embedder.embed([question]))[0]
+        except Exception as e:
+            # Fall back to keyword-only retrieval
+            logger.warning(f"Question embedding failed: {e}")
+
+    # Loads the company's items on the first search (or after a change elsewhere)
+    return await run_db(
+        knowledge_index.search,
+        db, company_id, question, top_k=top_k, min_score=min_score, widget_id=widget_id,
+        query_vector=query_vector, semantic_weight=SEMANTIC_WEIGHT, min_similarity=SEMANTIC_MIN_SIMILARITY,
+        release=db
+    )
 
-    if not items:
-        return []  # No knowledge base items at all
 
-    question_normalized = normalize_text(question)
-    question_words = set(question_normalized.split())
+def ollama_options(temperature: float) -> dict:
+    """Sampling options shared by all chat generations"""
+    return {
+        "temperature": temperature,  # 0.7 for natural but grounded responses
+        "top_p": 0.9,  # Nucleus sampling for quality
+        "repeat_penalty": 1.1,  # Slight penalty to avoid repetitive text
+    }
 
-    # Common stopwords to ignore (Swedish and English)
-    stopwords = {'jag', 'vill', 'kan', 'hur', 'vad', 'är', 'har', 'en', 'ett', 'att', 'och',
-                 'för', 'med', 'om', 'på', 'av', 'i', 'det', 'den', 'de', 'du', 'vi', 'ni',
-                 'göra', 'gör', 'ska', 'skulle', 'a', 'the', 'is', 'are', 'to', 'how', 'what',
-                 'min', 'mitt', 'mina', 'din', 'ditt', 'dina', 'sin', 'sitt', 'sina',
-                 'this', 'that', 'these', 'those', 'my', 'your', 'our', 'their'}
 
-    # Get meaningful words (not stopwords)
-    meaningful_words = question_words - stopwords
+def ollama_http_exception(e: Exception) -> HTTPException:
+    """Map an Ollama client error to the 503 shown to chat users"""
+    if isinstance(e, httpx.ConnectError):
+        return HTTPException(status_code=503, detail="AI-tjänsten är inte tillgänglig. Kontrollera att Ollama körs på rätt adress.")
+    if isinstance(e, httpx.HTTPStatusError):
+        if e.response.status_code == 404:
+            return HTTPException(status_code=503, detail=f"AI-modellen '{OLLAMA_MODEL}' hittades inte. Kör: ollama pull {OLLAMA_MODEL}")
+        return HTTPException(status_code=503, detail=f"AI-tjänstfel: {e.response.status_code}")
+    if isinstance(e, httpx.TimeoutException):
+        return HTTPException(status_code=503, detail="AI-tjänsten svarar inte. Försök igen om en stund.")
+    logger.error(f"Ollama query error: {e}", exc_info=True)
+    return HTTPException(status_code=503, detail="AI-tjänsten är inte tillgänglig just nu.")
 
-    # ANTI-HALLUCINATION: If no meaningful words after removing stopwords, return empty
-    if not meaningful_words:
-        return []
 
-    scored_items = []
-    for item in items:
-        item_question_normalized = normalize_text(item.question)
-        item_answer_normalized = normalize_text(item.answer)
-        item_words = set(item_question_normalized.split()) | set(item_answer_normalized.split())
-
-        score = 0
-
-        # Exact word matches (high score)
-        common_words = meaningful_words & item_words
-        score += len(common_words) * 3
-
-        # Partial/substring matches - important for Swedish compound words
-        # e.g., "felanmäler" should match "felanmälan" or "anmäler"
-        for q_word in meaningful_words:
-            if len(q_word) >= 4:  # Only check words with 4+ chars
-                for i_word in item_words:
-                    if len(i_word) >= 4:
-                        # Check if one contains the other
-                        if q_word in i_word or i_word in q_word:
-                            # Give more points for longer substring matches
-                            match_len = min(len(q_word), len(i_word))
-                            if match_len >= 6:
-                                score += 3  # Strong match (e.g., "anmaler" in "felanmaler")
-                            else:
-                                score += 2
-                        # Check root similarity (first 4 chars match)
-                        elif q_word[:4] == i_word[:4]:
-                            score += 1
-
-        # Category match bonus (only if meaningful words also matched)
-        if item.category and score > 0:
-            if item.category.lower() in question_normalized:
-                score += 2
-
-        # ANTI-HALLUCINATION: Only include items with score >= min_score
-        # This prevents weak/coincidental matches from being used as context
-        if score >= min_score:
-            scored_items.append((score, item))
-
-    scored_items.sort(key=lambda x: x[0], reverse=True)
-    return [item for _, item in scored_items[:top_k]]
+# Ollama nodes (OLLAMA_NODES, or the single OLLAMA_BASE_URL), read on every call
+ollama_router = OllamaRouter(lambda: OLLAMA_NODES or [OLLAMA_BASE_URL], get_http_client, probe_timeout=HEALTH_TIMEOUT)
 
 
 async def query_ollama(prompt: str, temperature: float = 0.7) -> str:
@@ -1615,34 +1612,106 @@ async def query_ollama(prompt: str, temperature: float = 0.7) -> str:
         temperature: Controls randomness (0.0 = deterministic, 1.0 = creative)
                     Default 0.7 for natural but consistent responses
     """
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        try:
-            response = await client.post(
-                f"{OLLAMA_BASE_URL}/api/generate",
-                json={
+    try:
+        with query_counter.waiting("ollama"):
+            response = await ollama_router.post(
+                "/api/generate",
+                {
                     "model": OLLAMA_MODEL,
                     "prompt": prompt,
                     "stream": False,
-                    "options": {
-                        "temperature": temperature,  # 0.7 for natural but grounded responses
-                        "top_p": 0.9,  # Nucleus sampling for quality
-                        "repeat_penalty": 1.1,  # Slight penalty to avoid repetitive text
-                    }
-                }
+                    "options": ollama_options(temperature)
+                },
+                timeout=CHAT_TIMEOUT
+            )
+        response.raise_for_status()
+        return response.json().get("response", "Kunde inte generera svar.")
+    except Exception as e:
+        raise ollama_http_exception(e)
+
+
+async def stream_ollama(prompt: str, temperature: float = 0.7):
+    """Streama svar från Ollama - yields text tokens as they are generated
+
+    Ollama sends one JSON object per line (NDJSON) until "done" is true.
+    """
+    client = get_http_client()
+    try:
+        # The wait includes the moment each token takes to reach the caller
+        with query_counter.waiting("ollama"):
+            async with ollama_router.node(OLLAMA_MODEL) as node, client.stream(
+                "POST",
+                f"{node.url}/api/generate",
+                json={
+                    "model": OLLAMA_MODEL,
+                    "prompt": prompt,
+                    "stream": True,
+                    "options": ollama_options(temperature)
+                },
+                timeout=CHAT_TIMEOUT
+            ) as response:
+                if response.status_code >= 400:
+                    await response.aread()
+                    response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line.strip():
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get("response"):
+                        yield chunk["response"]
+                    if chunk.get("done"):
+                        break
+    except Exception as e:
+        raise ollama_http_exception(e)
+
+
+async def generate_answer(prompt: str, stream: Optional[ChatStream] = None, key: Optional[str] = None,
+                          company_id: str = "-", tier: Optional[str] = None) -> str:
+    """Generate an answer, forwarding tokens to the SSE stream if there is one
+
+    With a key (the response-cache key of the question), identical
+    questions generated at the same time share one Ollama call. The call
+    waits for a slot in the Ollama scheduler, queued fairly per company
+    and weighted by pricing tier; when the queue is overloaded the answer
+    is a 503 with Retry-After.
+    """
+    async def generate(emit) -> str:
+        try:
+            async with ollama_scheduler.slot(company_id, tier):
+                if stream is None:
+                    return await query_ollama(prompt)
+
+                parts = []
+                async for token in stream_ollama(prompt):
+                    parts.append(token)
+                    emit(token)
+                return "".join(parts) or "Kunde inte generera svar."
+        except SchedulerBusy as e:
+            raise HTTPException(
+                status_code=503,
+                detail="AI-tjänsten har många frågor just nu. Försök igen om en stund.",
+                headers={"Retry-After": str(e.retry_after)}
             )
-            response.raise_for_status()
-            return response.json().get("response", "Kunde inte generera svar.")
-        except httpx.ConnectError:
-            raise HTTPException(status_code=503, detail="AI-tjänsten är inte tillgänglig. Kontrollera att Ollama körs på rätt adress.")
-        except httpx.HTTPStatusError as e:
-            if e.response.status_code == 404:
-                raise HTTPException(status_code=503, detail=f"AI-modellen '{OLLAMA_MODEL}' hittades inte. Kör: ollama pull {OLLAMA_MODEL}")
-            raise HTTPException(status_code=503, detail=f"AI-tjänstfel: {e.response.status_code}")
-        except httpx.TimeoutException:
-            raise HTTPException(status_code=503, detail="AI-tjänsten svarar inte. Försök igen om en stund.")
-        except Exception as e:
-            logger.error(f"Ollama query error: {e}", exc_info=True)
-            raise HTTPException(status_code=503, detail="AI-tjänsten är inte tillgänglig just nu.")
+
+    on_token = stream.token if stream else None
+    if key is None:
+        return await generate(on_token)
+    return await chat_flights.run(key, generate, on_token)
+
+
+def context_confidence(context: list) -> int:
+    """Confidence score based on ACTUAL knowledge base matches
+
+    ANTI-HALLUCINATION: Only high confidence when we have real KB matches
+    100% = multiple exact matches in knowledge base
+    90% = single match in knowledge base
+    0% = no knowledge base match (fallback used)
+    """
+    if len(context) >= 2:
+        return 100  # Multiple KB matches - very confident
+    elif len(context) == 1:
+        return 90   # Single KB match - confident
+    return 0    # No KB match - fallback message used, no confidence
 
 
 def detect_language(text: str) -> str:
@@ -1982,18 +2051,54 @@ def detect_conversational_type(text: str) -> tuple:
     return (None, False)
 
 
+# Static prompt prefixes per (company, widget, language, widget type), with the
+# settings and widget objects they were built from: a reloaded config snapshot
+# is a new object, so changed settings rebuild the prefix
+prompt_prefixes: Dict[tuple, tuple] = {}
+PROMPT_PREFIX_CACHE_SIZE = 4096
+
+
 def build_prompt(question: str, context: List[KnowledgeItem], settings: CompanySettings = None, language: str = None, category: str = None, has_knowledge_match: bool = False, widget_type: str = "external", widget = None) -> str:
     """Bygg prompt med kontext - använder specificerat eller detekterat språk
 
     ANTI-HALLUCINATION: This prompt is designed to prevent the AI from inventing information.
     The AI should ONLY answer based on the provided knowledge base items.
 
+    The prompt is the static prefix of the widget (persona, contact info and
+    rules, byte-identical for every question) followed by the facts and the
+    question, so Ollama can reuse its prompt cache for the prefix.
+
     widget_type: "external" (customers/tenants) or "internal" (employees)
     widget: Optional Widget object with contact info that overrides company settings
     """
     # Use provided language or detect from question
     lang = language if language in ["sv", "en", "ar"] else detect_language(question)
 
+    key = (settings.company_id if settings else None, widget.id if widget else None, lang, widget_type)
+    cached = prompt_prefixes.get(key)
+    if cached and cached[0] is settings and cached[1] is widget:
+        prefix = cached[2]
+    else:
+        prefix = build_prompt_prefix(settings, lang, widget_type, widget)
+        if len(prompt_prefixes) >= PROMPT_PREFIX_CACHE_SIZE:
+            prompt_prefixes.clear()
+        prompt_prefixes[key] = (settings, widget, prefix)
+
+    # Build knowledge base context
+    knowledge = ""
+    if context:
+        knowledge = "FACTS (answer based on these):\n"
+        for item in context:
+            knowledge += f"Q: {item.question}\nA: {item.answer}\n\n"
+    else:
+        knowledge = "FACTS: No matching information found.\n"
+
+    return f"""{prefix}{knowledge}
+Question: {question}"""
+
+
+def build_prompt_prefix(settings, lang: str, widget_type: str = "external", widget = None) -> str:
+    """The part of the prompt that only depends on company, widget and language"""
     # Language names for the prompt
     lang_names = {"sv": "Swedish", "en": "English", "ar": "Arabic"}
     target_lang = lang_names.get(lang, "Swedish")
@@ -2028,15 +2133,6 @@ def build_prompt(question: str, context: List[KnowledgeItem], settings: CompanyS
     if company_facts:
         company_info = "Contact info:\n" + "\n".join(f"- {fact}" for fact in company_facts)
 
-    # Build knowledge base context
-    knowledge = ""
-    if context:
-        knowledge = "FACTS (answer based on these):\n"
-        for item in context:
-            knowledge += f"Q: {item.question}\nA: {item.answer}\n\n"
-    else:
-        knowledge = "FACTS: No matching information found.\n"
-
     # Determine effective tone: widget.tone > widget_type default
     # Tones: professional, collegial, casual
     effective_tone = ""
@@ -2056,10 +2152,8 @@ STYLE: Casual and approachable. Like a helpful friend who knows the answers.
 
 {company_info}
 
-{knowledge}
-
 HOW TO RESPOND:
-- Use ONLY the facts above. Don't make stuff up.
+- Use ONLY the facts below. Don't make stuff up.
 - Keep it short: 1-3 sentences max.
 - Be friendly but get straight to the point.
 - Reply in {target_lang}.
@@ -2070,7 +2164,7 @@ DON'T DO THIS:
 - Don't guess with words like "typically" or "usually"
 - Don't over-empathize or be patronizing
 
-Question: {question}"""
+"""
 
     elif effective_tone == "collegial":
         # Collegial tone - helpful coworker, direct
@@ -2080,10 +2174,8 @@ STYLE: Friendly and helpful, like a coworker who knows where to find information
 
 {company_info}
 
-{knowledge}
-
 HOW TO RESPOND:
-- Use ONLY the facts above. Never make up information or policies.
+- Use ONLY the facts below. Never make up information or policies.
 - Answer clearly in 1-3 sentences. Add relevant context only if it actually helps.
 - Get straight to the answer - no preamble or filler phrases.
 - Reply in {target_lang}.
@@ -2094,7 +2186,7 @@ NEVER DO THIS:
 - Don't start with empathy phrases like "Jag förstår att det kan vara..." or "Det låter som..."
 - Don't be overly sympathetic or patronizing
 
-Question: {question}"""
+"""
 
     else:
         # Professional tone (default) - helpful and direct
@@ -2104,10 +2196,8 @@ STYLE: Professional and helpful. Direct answers without unnecessary filler.
 
 {company_info}
 
-{knowledge}
-
 HOW TO RESPOND:
-- Use ONLY the facts above. Never make up information.
+- Use ONLY the facts below. Never make up information.
 - Answer clearly in 1-3 sentences. Include contact info if relevant.
 - Get straight to the point - no preamble.
 - Reply in {target_lang}.
@@ -2118,7 +2208,7 @@ NEVER DO THIS:
 - Don't start with phrases like "Jag förstår att..." or "Tråkigt att höra!"
 - Don't be overly empathetic or patronizing
 
-Question: {question}"""
+"""
 
 
 def anonymize_ip(ip: str) -> str:
@@ -2144,7 +2234,7 @@ def anonymize_user_agent(user_agent: str) -> str:
     return "Other"
 
 
-async def save_conversation_stats(db: Session, conversation: Conversation):
+def save_conversation_stats(db: Session, conversation: Conversation):
     """Spara anonymiserad statistik innan konversation raderas"""
     conv_date = conversation.started_at.date()
 
@@ -2317,13 +2407,100 @@ def set_global_setting(db: Session, key: str, value: str, admin_username: str =
 
 def is_maintenance_mode(db: Session) -> tuple:
     """Check if maintenance mode is enabled, returns (enabled, message)"""
-    enabled = get_global_setting(db, "maintenance_mode", "false") == "true"
-    message = get_global_setting(db, "maintenance_message", "Systemet är tillfälligt stängt för underhåll.")
-    return enabled, message
+    def load():
+        values = dict(db.query(GlobalSettings.key, GlobalSettings.value).filter(
+            GlobalSettings.key.in_(["maintenance_mode", "maintenance_message"])
+        ).all())
+        return (
+            values.get("maintenance_mode", "false") == "true",
+            values.get("maintenance_message", "Systemet är tillfälligt stängt för underhåll.")
+        )
+
+    return config_cache.get("maintenance", "", load)
+
+
+# =============================================================================
+# Hot Config Snapshots (chat path)
+# =============================================================================
+
+def get_widget_snapshot(db: Session, widget_key: str):
+    """Cached read-only Widget by key, or None"""
+    return config_cache.get(
+        "widget", widget_key,
+        lambda: snapshot(db.query(Widget).filter(Widget.widget_key == widget_key).first()),
+        scope_of=lambda widget: widget.company_id
+    )
+
+
+def get_company_snapshot(db: Session, company_id: str):
+    """Cached read-only Company, or None"""
+    return config_cache.get(
+        "company", company_id,
+        lambda: snapshot(db.query(Company).filter(Company.id == company_id).first()),
+        scope=company_id
+    )
+
+
+def get_settings_snapshot(db: Session, company_id: str):
+    """Cached read-only CompanySettings (created if missing)
+
+    Usage counters in the snapshot may be stale; check_usage_limit reads
+    the live row when the company has a limit.
+    """
+    return config_cache.get(
+        "settings", company_id,
+        lambda: snapshot(get_or_create_settings(db, company_id)),
+        scope=company_id
+    )
+
+
+def load_chat_config(db: Session, company_id: Optional[str] = None, widget_key: Optional[str] = None) -> tuple:
+    """(company, widget, settings, (maintenance_enabled, message)) for a chat turn
+
+    Snapshots come from the config cache; on a miss they are loaded here,
+    so chat endpoints call this through run_db(). Missing rows are None.
+    """
+    widget = get_widget_snapshot(db, widget_key) if widget_key else None
+    if company_id is None and widget is not None:
+        company_id = widget.company_id
+    company = get_company_snapshot(db, company_id) if company_id else None
+    settings = get_settings_snapshot(db, company_id) if company else None
+    return company, widget, settings, is_maintenance_mode(db)
+
+
+# Messages, chat logs and counters from the chat path are written in batches
+write_queue = WriteBehindQueue(SessionLocal)
+
+
+def add_chat_messages(company_id: str, conversation_id: int, question: str, answer: str,
+                      sources: Optional[str], had_answer: bool, response_time_ms: int):
+    """Queue the user question and bot answer of a chat turn, and count them in the rollups"""
+    now = datetime.utcnow()
+    write_queue.add_messages([
+        {"conversation_id": conversation_id, "role": "user", "content": question,
+         "sources": None, "had_answer": True, "response_time_ms": None, "created_at": now},
+        {"conversation_id": conversation_id, "role": "bot", "content": answer,
+         "sources": sources, "had_answer": had_answer, "response_time_ms": response_time_ms, "created_at": now},
+    ])
+    write_queue.add_rollup(company_id, now.date(), analytics_rollup.chat_turn(had_answer, response_time_ms))
+
+
+def record_conversation_started(conversation: Conversation):
+    """Count a new conversation in the analytics rollups"""
+    write_queue.add_rollup(
+        conversation.company_id, conversation.started_at.date(),
+        analytics_rollup.conversation_started(conversation.started_at, conversation.language, conversation.category)
+    )
+
 
+def check_usage_limit(db: Session, company_id: str, settings=None) -> tuple:
+    """Check if company has reached usage limit, returns (allowed, message)
+
+    With a settings snapshot, companies without a limit need no query.
+    """
+    if settings is not None and not settings.max_conversations_month:
+        return True, None  # No limit
 
-def check_usage_limit(db: Session, company_id: str) -> tuple:
-    """Check if company has reached usage limit, returns (allowed, message)"""
     settings = db.query(CompanySettings).filter(
         CompanySettings.company_id == company_id
     ).first()
@@ -2358,8 +2535,6 @@ async def root():
 @app.get("/health")
 async def health(db: Session = Depends(get_db)):
     """Health check endpoint with database and Ollama connectivity verification"""
-    import httpx
-
     health_status = {
         "status": "healthy",
         "database": "unknown",
@@ -2376,22 +2551,64 @@ async def health(db: Session = Depends(get_db)):
         health_status["database"] = "disconnected"
         health_status["database_error"] = str(e)
 
-    # Check Ollama connectivity
-    try:
-        async with httpx.AsyncClient(timeout=3.0) as client:
-            response = await client.get(f"{OLLAMA_BASE_URL}/api/tags")
-            if response.status_code == 200:
-                health_status["ollama"] = "connected"
-            else:
-                health_status["ollama"] = "error"
-                health_status["status"] = "degraded"
-    except Exception as e:
-        health_status["ollama"] = "disconnected"
+    # Check Ollama connectivity (every node; probing also brings ejected nodes back)
+    nodes = await ollama_router.probe()
+    online = sum(1 for node in nodes if node["status"] == "online")
+    health_status["ollama_nodes"] = nodes
+    if online == len(nodes):
+        health_status["ollama"] = "connected"
+    else:
+        health_status["ollama"] = "partial" if online else "disconnected"
         health_status["status"] = "degraded"
 
     return health_status
 
 
+@app.get("/metrics")
+def prometheus_metrics(req: Request):
+    """Prometheus metrics (text format) for this worker
+
+    Requires `Authorization: Bearer <METRICS_TOKEN>` when METRICS_TOKEN is set;
+    without a token it is only served outside production.
+    """
+    if metrics.METRICS_TOKEN:
+        supplied = req.headers.get("authorization", "").removeprefix("Bearer ").strip()
+        if not secrets.compare_digest(supplied, metrics.METRICS_TOKEN):
+            raise HTTPException(status_code=401, detail="Ogiltig metrics-token")
+    elif os.getenv("ENVIRONMENT", "development") == "production":
+        raise HTTPException(status_code=404, detail="Not Found")
+    return Response(metrics.registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# Values kept by other components, read when /metrics is scraped
+metrics.registry.gauge("bobot_response_cache_hits_total", "Response cache hits",
+                       lambda: response_cache.stats()["hits"], type="counter")
+metrics.registry.gauge("bobot_response_cache_misses_total", "Response cache misses",
+                       lambda: response_cache.stats()["misses"], type="counter")
+metrics.registry.gauge("bobot_response_cache_entries", "Cached chat responses",
+                       lambda: response_cache.stats()["entries"])
+metrics.registry.gauge("bobot_rate_limit_rejected_requests", "Chat requests rejected by the rate limit (last window)",
+                       lambda: chat_rate_limiter.stats()["rejected_requests"])
+metrics.registry.gauge("bobot_chat_generations_total", "Chat answers generated by Ollama",
+                       lambda: chat_flights.leaders, type="counter")
+metrics.registry.gauge("bobot_chat_coalesced_total", "Chat requests that shared an identical in-flight generation",
+                       lambda: chat_flights.followers, type="counter")
+metrics.registry.gauge("bobot_ollama_queue_depth", "Chat generations waiting for an Ollama slot",
+                       lambda: ollama_scheduler.depth)
+metrics.registry.gauge("bobot_ollama_active_generations", "Chat generations running on Ollama",
+                       lambda: ollama_scheduler.active)
+metrics.registry.gauge("bobot_ollama_queue_wait_p95_seconds", "95th percentile of the wait for an Ollama slot",
+                       lambda: ollama_scheduler.stats()["wait_p95_ms"] / 1000)
+metrics.registry.gauge("bobot_ollama_rejected_total", "Chat generations rejected with 503 by the Ollama queue",
+                       lambda: ollama_scheduler.rejected + ollama_scheduler.timeouts, type="counter")
+metrics.registry.gauge("bobot_ollama_nodes_online", "Ollama nodes taking requests (not ejected)",
+                       lambda: sum(1 for node in ollama_router.nodes if node.healthy))
+metrics.registry.gauge("bobot_jobs_running", "Background jobs running in this process",
+                       lambda: job_engine.stats()["running"])
+metrics.registry.gauge("bobot_write_queue_depth", "Chat writes waiting in the write-behind queue",
+                       lambda: write_queue.depth)
+
+
 # =============================================================================
 # Auth Endpoints - Security Hardened
 # =============================================================================
@@ -2602,8 +2819,55 @@ async def chat(
     db: Session = Depends(get_db)
 ):
     """Chatta med AI - öppen endpoint för widget"""
+    return await run_chat_turn(company_id, request, req, response, db)
+
+
+def streamed_turn_metrics(req: Request):
+    """on_finish for stream_chat_turn: record the turn's chat metrics with its full duration and outcome"""
+    def record(status: int):
+        company_id = getattr(req.state, "company_id", None)
+        if company_id:
+            metrics.record_chat(company_id, status, (time.perf_counter() - req.state.started_at) * 1000)
+    return record
+
+
+@app.post("/chat/{company_id}/stream")
+async def chat_stream(
+    company_id: str,
+    request: ChatRequest,
+    req: Request
+):
+    """Chatta med AI - streamar svaret som Server-Sent Events
+
+    Events: `meta` (sources, confidence), `token` (text), then `done` with the
+    persisted conversation_id and final answer, or `error`.
+    """
+    return await stream_chat_turn(
+        lambda stream, response, db: run_chat_turn(company_id, request, req, response, db, stream),
+        on_finish=streamed_turn_metrics(req)
+    )
+
+
+async def run_chat_turn(
+    company_id: str,
+    request: ChatRequest,
+    req: Request,
+    response: Response,
+    db: Session,
+    stream: Optional[ChatStream] = None
+) -> ChatResponse:
+    """One chat turn for /chat/{company_id} (JSON or streamed)
+
+    Database work runs on the DB thread pool (run_db) so the event loop
+    keeps serving other chats.
+    """
+    company, widget, settings, (maintenance_enabled, maintenance_msg) = await run_db(
+        load_chat_config, db, company_id, request.widget_key, release=db
+    )
+    if company:
+        req.state.company_id = company.id  # Per-company metrics (only for companies that exist)
+
     # Check maintenance mode
-    maintenance_enabled, maintenance_msg = is_maintenance_mode(db)
     if maintenance_enabled:
         raise HTTPException(
             status_code=503,
@@ -2612,7 +2876,7 @@ async def chat(
 
     # Rate limiting - check before any heavy processing
     client_ip = req.client.host if req.client else "unknown"
-    allowed, current_count, reset_time = check_rate_limit(request.session_id, client_ip)
+    allowed, current_count, reset_time = check_rate_limit(request.session_id, client_ip, company_id)
 
     # Add rate limit headers to response
     response.headers["X-RateLimit-Limit"] = str(RATE_LIMIT_MAX_REQUESTS)
@@ -2631,24 +2895,20 @@ async def chat(
             }
         )
 
-    company = db.query(Company).filter(Company.id == company_id).first()
     if not company:
         raise HTTPException(status_code=404, detail="Företag finns inte")
 
     if not company.is_active:
         raise HTTPException(status_code=403, detail="COMPANY_INACTIVE")
 
-    # Check if widget_key is provided and validate widget is active
-    if request.widget_key:
-        widget_check = db.query(Widget).filter(
-            Widget.widget_key == request.widget_key,
-            Widget.company_id == company_id
-        ).first()
-        if widget_check and not widget_check.is_active:
-            raise HTTPException(status_code=403, detail="WIDGET_INACTIVE")
+    # Determine widget for knowledge filtering and personalized responses
+    if widget and widget.company_id != company_id:
+        widget = None
+    if widget and not widget.is_active:
+        raise HTTPException(status_code=403, detail="WIDGET_INACTIVE")
 
     # Check usage limits
-    allowed, limit_msg = check_usage_limit(db, company_id)
+    allowed, limit_msg = await run_db(check_usage_limit, db, company_id, settings, release=db)
     if not allowed:
         raise HTTPException(status_code=429, detail=limit_msg)
 
@@ -2670,19 +2930,7 @@ async def chat(
             confidence=cached.get("confidence", 100)
         )
 
-    # Hämta inställningar
-    settings = get_or_create_settings(db, company_id)
-
-    # Determine widget for knowledge filtering and personalized responses
-    widget_type = "external"  # Default to customer-facing
-    widget = None  # Store widget for knowledge filtering
-    if request.widget_key:
-        widget = db.query(Widget).filter(
-            Widget.widget_key == request.widget_key,
-            Widget.company_id == company_id
-        ).first()
-        if widget:
-            widget_type = widget.widget_type or "external"
+    widget_type = (widget.widget_type or "external") if widget else "external"  # Default to customer-facing
 
     # Hantera session
     session_id = request.session_id or str(uuid.uuid4())
@@ -2691,12 +2939,14 @@ async def chat(
     category = detect_category(request.question)
 
     # Hitta eller skapa konversation
-    conversation = db.query(Conversation).filter(
-        Conversation.session_id == session_id,
-        Conversation.company_id == company_id
-    ).first()
+    def find_or_create_conversation() -> tuple:
+        conversation = db.query(Conversation).filter(
+            Conversation.session_id == session_id,
+            Conversation.company_id == company_id
+        ).first()
+        if conversation:
+            return conversation, False
 
-    if not conversation:
         # Anonymisera användardata
         client_ip = req.client.host if req.client else None
         user_agent = req.headers.get("user-agent", "")
@@ -2716,15 +2966,24 @@ async def chat(
         db.add(conversation)
         db.commit()
         db.refresh(conversation)
+        return conversation, True
 
+    new_category = None
+    conversation, created = await run_db(find_or_create_conversation, release=db)
+
+    if created:
+        record_conversation_started(conversation)
         # Increment monthly usage counter
         if settings.max_conversations_month > 0:
-            settings.current_month_conversations = (settings.current_month_conversations or 0) + 1
-            db.commit()
+            write_queue.increment_usage(company_id)
     else:
         # Update category if new one is more specific
         if category != "allmant" and conversation.category == "allmant":
-            conversation.category = category
+            new_category = category
+            write_queue.add_rollup(
+                company_id, conversation.started_at.date(),
+                analytics_rollup.category_changed(conversation.category, new_category)
+            )
 
         # Check max messages per conversation (100 messages = 50 exchanges)
         MAX_MESSAGES_PER_CONVERSATION = 100
@@ -2734,14 +2993,6 @@ async def chat(
                 detail="Konversationen har nått maxgränsen. Vänligen starta en ny chatt."
             )
 
-    # Spara användarens meddelande
-    user_message = Message(
-        conversation_id=conversation.id,
-        role="user",
-        content=request.question
-    )
-    db.add(user_message)
-
     # Mät svarstid
     start_time = datetime.utcnow()
 
@@ -2772,7 +3023,7 @@ async def chat(
             answer = get_greeting_response(language, settings.company_name)
     else:
         # Hitta kontext i kunskapsbasen (with widget isolation if widget_key was provided)
-        context = find_relevant_context(
+        context = await find_relevant_context(
             request.question, company_id, db,
             widget_id=widget.id if widget else None,
             widget_type=widget_type
@@ -2805,7 +3056,12 @@ async def chat(
         else:
             # We have knowledge base context - let AI formulate response based on FACTS
             prompt = build_prompt(request.question, context, settings, language, category, has_knowledge_match=True, widget_type=widget_type)
-            answer = await query_ollama(prompt)
+            if stream:
+                stream.open(session_id, context, context_confidence(context))
+            answer = await generate_answer(
+                prompt, stream, key=make_cache_key(company_id, request.question, language, request.widget_key),
+                company_id=company_id, tier=company.pricing_tier
+            )
             response_time = int((datetime.utcnow() - start_time).total_seconds() * 1000)
 
             # ANTI-HALLUCINATION: Double-check AI didn't hallucinate despite having context
@@ -2829,40 +3085,24 @@ async def chat(
                 answer = fallback_messages.get(language, fallback_messages["sv"])
                 had_answer = False
 
-    # Spara bot-svaret
+    # Spara användarens meddelande och bot-svaret
     sources = [item.question for item in context]
     sources_detail = [{"question": item.question, "answer": item.answer, "category": item.category} for item in context]
-    bot_message = Message(
-        conversation_id=conversation.id,
-        role="bot",
-        content=answer,
+    add_chat_messages(
+        company_id, conversation.id, request.question, answer,
         sources=json.dumps(sources) if sources else None,
         had_answer=had_answer,
         response_time_ms=response_time
     )
-    db.add(bot_message)
 
     # Uppdatera konversation
-    conversation.message_count += 2
-    conversation.ended_at = datetime.utcnow()
+    write_queue.touch_conversation(conversation.id, messages=2, category=new_category)
 
     # Legacy: Spara även till ChatLog för bakåtkompatibilitet
-    log = ChatLog(company_id=company_id, question=request.question, answer=answer)
-    db.add(log)
-
-    db.commit()
+    write_queue.add_chat_log(company_id, request.question, answer)
 
     # Calculate confidence score based on ACTUAL knowledge base matches
-    # ANTI-HALLUCINATION: Only high confidence when we have real KB matches
-    # 100% = multiple exact matches in knowledge base
-    # 90% = single match in knowledge base
-    # 0% = no knowledge base match (fallback used)
-    if len(context) >= 2:
-        confidence = 100  # Multiple KB matches - very confident
-    elif len(context) == 1:
-        confidence = 90   # Single KB match - confident
-    else:
-        confidence = 0    # No KB match - fallback message used, no confidence
+    confidence = context_confidence(context)
 
     # Cache the response
     cache_data = {
@@ -2905,7 +3145,9 @@ async def chat_feedback(
     # Track if feedback changed (to avoid double counting)
     previous_feedback = conversation.was_helpful
     conversation.was_helpful = helpful
+    started = conversation.started_at.date()
     db.commit()
+    write_queue.add_rollup(company_id, started, analytics_rollup.feedback_changed(previous_feedback, helpful))
 
     # Update daily statistics with feedback
     today = date.today()
@@ -2942,16 +3184,16 @@ async def chat_feedback(
 
 
 @app.get("/widget/{company_id}/config")
-async def get_widget_config(
+def get_widget_config(
     company_id: str,
     db: Session = Depends(get_db)
 ):
     """Hämta widget-konfiguration (publik endpoint för widget)"""
-    company = db.query(Company).filter(Company.id == company_id).first()
+    company = get_company_snapshot(db, company_id)
     if not company or not company.is_active:
         raise HTTPException(status_code=404, detail="Företag finns inte")
 
-    settings = get_or_create_settings(db, company_id)
+    settings = get_settings_snapshot(db, company_id)
 
     # Parse suggested questions JSON
     suggested_questions = []
@@ -2992,20 +3234,20 @@ async def get_widget_config(
 
 
 @app.get("/widget/key/{widget_key}/config")
-async def get_widget_config_by_key(
+def get_widget_config_by_key(
     widget_key: str,
     db: Session = Depends(get_db)
 ):
     """Hämta widget-konfiguration via widget_key (publik endpoint för ny widget-modell)"""
-    widget = db.query(Widget).filter(Widget.widget_key == widget_key).first()
+    widget = get_widget_snapshot(db, widget_key)
     if not widget or not widget.is_active:
         raise HTTPException(status_code=404, detail="Widget finns inte")
 
-    company = db.query(Company).filter(Company.id == widget.company_id).first()
+    company = get_company_snapshot(db, widget.company_id)
     if not company or not company.is_active:
         raise HTTPException(status_code=404, detail="Företag finns inte")
 
-    settings = get_or_create_settings(db, widget.company_id)
+    settings = get_settings_snapshot(db, widget.company_id)
 
     # Parse suggested questions JSON
     suggested_questions = []
@@ -3087,25 +3329,58 @@ async def chat_via_widget_key(
     db: Session = Depends(get_db)
 ):
     """Chatta med AI via widget_key - ny endpoint för multi-widget support"""
-    # Look up widget
-    widget = db.query(Widget).filter(Widget.widget_key == widget_key).first()
+    return await run_widget_chat_turn(widget_key, request, req, response, db)
+
+
+@app.post("/chat/widget/{widget_key}/stream")
+async def chat_via_widget_key_stream(
+    widget_key: str,
+    request: ChatRequest,
+    req: Request
+):
+    """Chatta via widget_key - streamar svaret som Server-Sent Events
+
+    Same events as /chat/{company_id}/stream.
+    """
+    return await stream_chat_turn(
+        lambda stream, response, db: run_widget_chat_turn(widget_key, request, req, response, db, stream),
+        on_finish=streamed_turn_metrics(req)
+    )
+
+
+async def run_widget_chat_turn(
+    widget_key: str,
+    request: ChatRequest,
+    req: Request,
+    response: Response,
+    db: Session,
+    stream: Optional[ChatStream] = None
+) -> ChatResponse:
+    """One chat turn for /chat/widget/{widget_key} (JSON or streamed)
+
+    Database work runs on the DB thread pool (run_db), as in run_chat_turn.
+    """
+    # Look up widget, company and settings
+    company, widget, settings, (maintenance_enabled, maintenance_msg) = await run_db(
+        load_chat_config, db, widget_key=widget_key, release=db
+    )
     if not widget:
         raise HTTPException(status_code=404, detail="Widget finns inte")
 
     if not widget.is_active:
         raise HTTPException(status_code=403, detail="WIDGET_INACTIVE")
 
-    company = db.query(Company).filter(Company.id == widget.company_id).first()
     if not company:
         raise HTTPException(status_code=404, detail="Företag finns inte")
 
+    req.state.company_id = company.id  # Per-company metrics
+
     if not company.is_active:
         raise HTTPException(status_code=403, detail="COMPANY_INACTIVE")
 
     company_id = company.id
 
     # Check maintenance mode
-    maintenance_enabled, maintenance_msg = is_maintenance_mode(db)
     if maintenance_enabled:
         raise HTTPException(
             status_code=503,
@@ -3114,7 +3389,7 @@ async def chat_via_widget_key(
 
     # Rate limiting
     client_ip = req.client.host if req.client else "unknown"
-    allowed, current_count, reset_time = check_rate_limit(request.session_id, client_ip)
+    allowed, current_count, reset_time = check_rate_limit(request.session_id, client_ip, company_id)
 
     response.headers["X-RateLimit-Limit"] = str(RATE_LIMIT_MAX_REQUESTS)
     response.headers["X-RateLimit-Remaining"] = str(max(0, RATE_LIMIT_MAX_REQUESTS - current_count))
@@ -3127,7 +3402,7 @@ async def chat_via_widget_key(
         )
 
     # Check usage limits
-    allowed, limit_msg = check_usage_limit(db, company_id)
+    allowed, limit_msg = await run_db(check_usage_limit, db, company_id, settings, release=db)
     if not allowed:
         raise HTTPException(status_code=429, detail=limit_msg)
 
@@ -3154,17 +3429,16 @@ async def chat_via_widget_key(
     # Auto-detect category
     category = detect_category(request.question)
 
-    # Get company settings (needed for usage tracking and prompts)
-    settings = get_or_create_settings(db, company_id)
-
     # Find or create conversation
-    conversation = db.query(Conversation).filter(
-        Conversation.session_id == session_id,
-        Conversation.company_id == company_id,
-        Conversation.widget_id == widget.id
-    ).first()
+    def find_or_create_conversation() -> tuple:
+        conversation = db.query(Conversation).filter(
+            Conversation.session_id == session_id,
+            Conversation.company_id == company_id,
+            Conversation.widget_id == widget.id
+        ).first()
+        if conversation:
+            return conversation, False
 
-    if not conversation:
         client_ip = req.client.host if req.client else None
         user_agent = req.headers.get("user-agent", "")
         reference_id = generate_reference_id()
@@ -3182,20 +3456,15 @@ async def chat_via_widget_key(
         db.add(conversation)
         db.commit()
         db.refresh(conversation)
+        return conversation, True
 
-        # Increment monthly usage counter for new conversations
-        if settings.max_conversations_month > 0:
-            settings.current_month_conversations = (settings.current_month_conversations or 0) + 1
-            db.commit()
+    conversation, created = await run_db(find_or_create_conversation, release=db)
 
-    # Save user message
-    user_message = Message(
-        conversation_id=conversation.id,
-        role="user",
-        content=request.question
-    )
-    db.add(user_message)
-    conversation.message_count += 1
+    # Increment monthly usage counter for new conversations
+    if created:
+        record_conversation_started(conversation)
+        if settings.max_conversations_month > 0:
+            write_queue.increment_usage(company_id)
 
     # Check if this is a conversational message (greeting, thanks, human request, etc.)
     conv_type, is_conversational = detect_conversational_type(request.question)
@@ -3224,16 +3493,22 @@ async def chat_via_widget_key(
     else:
         # Find relevant context from widget-specific knowledge base
         start_time = time.time()
-        relevant_items = find_relevant_context(request.question, company_id, db, widget_id=widget.id, widget_type=widget.widget_type)
-
-        # Build prompt and get AI response (pass widget for contact info override)
-        prompt = build_prompt(request.question, relevant_items, settings=settings, language=language, widget_type=widget.widget_type, widget=widget)
-        answer = await query_ollama(prompt)
-        response_time = int((time.time() - start_time) * 1000)
+        relevant_items = await find_relevant_context(request.question, company_id, db, widget_id=widget.id, widget_type=widget.widget_type)
 
         # Check if we had a real answer (based on whether we found relevant context)
         had_answer = len(relevant_items) > 0
 
+        if had_answer:
+            # Build prompt and get AI response (pass widget for contact info override)
+            prompt = build_prompt(request.question, relevant_items, settings=settings, language=language, widget_type=widget.widget_type, widget=widget)
+            if stream:
+                stream.open(session_id, relevant_items[:3], 100)
+            answer = await generate_answer(
+                prompt, stream, key=make_cache_key(company_id, request.question, language, widget_key),
+                company_id=company_id, tier=company.pricing_tier
+            )
+        response_time = int((time.time() - start_time) * 1000)
+
         if not had_answer:
             # Build dynamic fallback message with widget contact info
             # Widget contact info takes priority over company settings
@@ -3255,22 +3530,17 @@ async def chat_via_widget_key(
             }
             answer = fallback_messages.get(language, fallback_messages["sv"])
 
-    # Save bot message
+    # Save user message and bot message
     # sources_detail includes full knowledge base entries for user reference
     sources = [item.question for item in relevant_items[:3]]
     sources_detail = [{"question": item.question, "answer": item.answer, "category": item.category} for item in relevant_items[:3]]
-    bot_message = Message(
-        conversation_id=conversation.id,
-        role="bot",
-        content=answer,
+    add_chat_messages(
+        company_id, conversation.id, request.question, answer,
         sources=json.dumps(sources),
         had_answer=had_answer,
         response_time_ms=response_time
     )
-    db.add(bot_message)
-    conversation.message_count += 1
-
-    db.commit()
+    write_queue.touch_conversation(conversation.id, messages=2)
 
     # Cache the response (include widget_key to prevent cross-widget cache contamination)
     set_cached_response(company_id, request.question, {
@@ -3522,6 +3792,7 @@ async def update_widget(
 
     db.commit()
     db.refresh(widget)
+    config_cache.invalidate_company(current["company_id"])
 
     # Log activity
     log_company_activity(
@@ -3597,12 +3868,16 @@ async def delete_widget(
         )
 
     widget_name = widget.name
+    widget_key = widget.widget_key
 
     # Delete associated knowledge items
     db.query(KnowledgeItem).filter(KnowledgeItem.widget_id == widget_id).delete()
 
     db.delete(widget)
     db.commit()
+    knowledge_index.invalidate(current["company_id"])
+    response_cache.invalidate(current["company_id"], [widget_key, None])
+    config_cache.invalidate_company(current["company_id"])
 
     # Log activity
     log_company_activity(
@@ -3801,6 +4076,7 @@ async def update_settings(
 
     db.commit()
     db.refresh(settings)
+    config_cache.invalidate_company(current["company_id"])
 
     # Log activity with specific changes
     if changes:
@@ -4030,7 +4306,7 @@ async def delete_conversation(
 
     reference_id = conversation.reference_id or f"#{conversation.id}"
     # Spara statistik innan radering
-    await save_conversation_stats(db, conversation)
+    save_conversation_stats(db, conversation)
 
     # Radera (meddelanden tas bort via cascade)
     db.delete(conversation)
@@ -4047,21 +4323,10 @@ async def delete_conversation(
 
 @app.delete("/conversations")
 async def delete_all_conversations(
-    current: dict = Depends(get_current_company),
-    db: Session = Depends(get_db)
+    current: dict = Depends(get_current_company)
 ):
     """Radera alla konversationer (GDPR) - statistik sparas"""
-    conversations = db.query(Conversation).filter(
-        Conversation.company_id == current["company_id"]
-    ).all()
-
-    count = len(conversations)
-
-    for conv in conversations:
-        await save_conversation_stats(db, conv)
-        db.delete(conv)
-
-    db.commit()
+    count = await retention_cleanup.delete_conversations(current["company_id"])
 
     return {"message": f"{count} konversationer raderade. Anonymiserad statistik sparad."}
 
@@ -4133,11 +4398,15 @@ async def add_knowledge(
         widget_id=item.widget_id,
         question=item.question,
         answer=item.answer,
-        category=item.category or ""
+        category=item.category or "",
+        minhash=question_signature(item.question)
     )
     db.add(new_item)
     db.commit()
     db.refresh(new_item)
+    knowledge_index.add_items([IndexedItem.from_model(new_item)])
+    invalidate_response_cache(db, current["company_id"], [new_item.widget_id])
+    embedding_worker.schedule(current["company_id"])
 
     # Log activity
     log_company_activity(
@@ -4183,11 +4452,21 @@ async def update_knowledge(
             raise HTTPException(status_code=400, detail="Widget finns inte eller tillhör inte ditt företag")
         widget_name = widget.name
 
+    old_widget_id = db_item.widget_id
+    if db_item.question != item.question or db_item.answer != item.answer:
+        # Re-embedded in the background
+        db_item.embedding = None
+        db_item.embedding_model = None
+        db_item.minhash = question_signature(item.question)
     db_item.question = item.question
     db_item.answer = item.answer
     db_item.category = item.category or ""
     db_item.widget_id = item.widget_id
+    indexed_item = IndexedItem.from_model(db_item)
     db.commit()
+    knowledge_index.add_items([indexed_item])
+    invalidate_response_cache(db, current["company_id"], [old_widget_id, item.widget_id])
+    embedding_worker.schedule(current["company_id"])
 
     # Log activity
     log_company_activity(
@@ -4222,8 +4501,11 @@ async def delete_knowledge(
         raise HTTPException(status_code=404, detail="Finns inte")
 
     question_preview = db_item.question[:50]
+    widget_id = db_item.widget_id
     db.delete(db_item)
     db.commit()
+    knowledge_index.remove_items(current["company_id"], [item_id])
+    invalidate_response_cache(db, current["company_id"], [widget_id])
 
     # Log activity
     log_company_activity(
@@ -4238,6 +4520,9 @@ class SimilarQuestionRequest(BaseModel):
     question: str
 
 
+SIMILAR_QUESTION_THRESHOLD = 0.3
+
+
 class SimilarQuestionResponse(BaseModel):
     id: int
     question: str
@@ -4245,54 +4530,26 @@ class SimilarQuestionResponse(BaseModel):
     similarity: float
 
 
-def calculate_similarity(str1: str, str2: str) -> float:
-    """Calculate simple word-based similarity between two strings"""
-    # Normalize strings
-    s1 = str1.lower().strip()
-    s2 = str2.lower().strip()
-
-    # Exact match
-    if s1 == s2:
-        return 1.0
-
-    # Word-based Jaccard similarity
-    words1 = set(s1.split())
-    words2 = set(s2.split())
-
-    if not words1 or not words2:
-        return 0.0
-
-    intersection = words1 & words2
-    union = words1 | words2
-
-    return len(intersection) / len(union) if union else 0.0
-
-
 @app.post("/knowledge/check-similar", response_model=List[SimilarQuestionResponse])
 async def check_similar_questions(
     request: SimilarQuestionRequest,
     current: dict = Depends(get_current_company),
     db: Session = Depends(get_db)
 ):
-    """Check for similar questions in the knowledge base"""
-    items = db.query(KnowledgeItem).filter(
-        KnowledgeItem.company_id == current["company_id"]
-    ).all()
+    """Check for similar questions in the knowledge base
 
-    similar = []
-    for item in items:
-        sim = calculate_similarity(request.question, item.question)
-        if sim > 0.3:  # Threshold for similarity
-            similar.append(SimilarQuestionResponse(
-                id=item.id,
-                question=item.question,
-                answer=item.answer[:100] + "..." if len(item.answer) > 100 else item.answer,
-                similarity=round(sim * 100, 1)
-            ))
-
-    # Sort by similarity descending
-    similar.sort(key=lambda x: x.similarity, reverse=True)
-    return similar[:5]  # Return top 5 similar
+    Word overlap (Jaccard) of at least 30%, looked up in the knowledge
+    index's MinHash/LSH buckets instead of scanning every item.
+    """
+    matches = knowledge_index.similar_questions(
+        db, current["company_id"], request.question, SIMILAR_QUESTION_THRESHOLD, limit=5
+    )
+    return [SimilarQuestionResponse(
+        id=item.id,
+        question=item.question,
+        answer=item.answer[:100] + "..." if len(item.answer) > 100 else item.answer,
+        similarity=round(sim * 100, 1)
+    ) for sim, item in matches]
 
 
 # =============================================================================
@@ -4376,6 +4633,8 @@ async def update_category(
     existing.name = category.name
     db.commit()
     db.refresh(existing)
+    knowledge_index.invalidate(current["company_id"])
+    response_cache.invalidate(current["company_id"])
 
     return CategoryResponse(id=existing.id, name=existing.name)
 
@@ -4403,15 +4662,25 @@ async def delete_category(
 
     db.delete(existing)
     db.commit()
+    knowledge_index.invalidate(current["company_id"])
+    response_cache.invalidate(current["company_id"])
 
     return {"message": "Kategorin borttagen"}
 
 
+class DuplicateQuestion(BaseModel):
+    question: str
+    duplicate_of: str  # The existing (or earlier imported) question it resembles
+    duplicate_of_id: Optional[int] = None  # None if the match was earlier in the same import
+    similarity: float
+
+
 class UploadResponse(BaseModel):
     success: bool
     imported: int  # Changed from items_added to match frontend expectations
     message: str
     items: List[KnowledgeItemResponse] = []
+    duplicates: List[DuplicateQuestion] = []  # Skipped near-duplicates
 
 
 class URLImportRequest(BaseModel):
@@ -4446,82 +4715,32 @@ def validate_and_truncate_import_items(items: List[dict]) -> List[dict]:
 
 
 async def parse_excel_file(content: bytes) -> List[dict]:
-    """Parse Excel file and extract Q&A pairs"""
-    import io
+    """Parse Excel file and extract Q&A pairs (streamed, in the parser pool)"""
     try:
-        import openpyxl
+        return await parse_in_pool(excel_items, content)
     except ImportError:
         raise HTTPException(
             status_code=500,
             detail="Excel-stöd saknas. Kontakta administratör för att installera openpyxl."
         )
-
-    items = []
-    try:
-        workbook = openpyxl.load_workbook(io.BytesIO(content))
-        sheet = workbook.active
-
-        # Try to find headers
-        headers = []
-        for col in range(1, sheet.max_column + 1):
-            val = sheet.cell(row=1, column=col).value
-            headers.append(str(val).lower() if val else "")
-
-        # Map columns to Q&A
-        q_col = None
-        a_col = None
-        cat_col = None
-
-        for i, h in enumerate(headers):
-            if any(x in h for x in ['fråga', 'question', 'q']):
-                q_col = i + 1
-            elif any(x in h for x in ['svar', 'answer', 'a']):
-                a_col = i + 1
-            elif any(x in h for x in ['kategori', 'category', 'cat']):
-                cat_col = i + 1
-
-        # If no headers found, assume first two columns
-        if q_col is None:
-            q_col = 1
-        if a_col is None:
-            a_col = 2
-
-        # Read rows
-        for row in range(2, sheet.max_row + 1):
-            q = sheet.cell(row=row, column=q_col).value
-            a = sheet.cell(row=row, column=a_col).value
-            cat = sheet.cell(row=row, column=cat_col).value if cat_col else None
-
-            if q and a:
-                items.append({
-                    "question": str(q).strip(),
-                    "answer": str(a).strip(),
-                    "category": str(cat).strip() if cat else None
-                })
+    except ParseError:
+        raise
     except Exception as e:
         logger.error(f"Excel parse error: {e}", exc_info=True)
-
-    return items
+        return []
 
 
 async def parse_word_file(content: bytes) -> str:
-    """Parse Word file and extract text"""
-    import io
+    """Parse Word file and extract text (in the parser pool)"""
     try:
-        from docx import Document
+        return await parse_in_pool(word_text, content)
     except ImportError:
         raise HTTPException(
             status_code=500,
             detail="Word-stöd saknas. Kontakta administratör för att installera python-docx."
         )
-
-    try:
-        doc = Document(io.BytesIO(content))
-        text = []
-        for para in doc.paragraphs:
-            if para.text.strip():
-                text.append(para.text.strip())
-        return "\n\n".join(text)
+    except ParseError:
+        raise
     except Exception as e:
         logger.error(f"Word parse error: {e}", exc_info=True)
         return ""
@@ -4541,25 +4760,16 @@ async def parse_text_file(content: bytes) -> str:
 async def parse_pdf_file(content: bytes) -> str:
     """Parse PDF file and extract text
 
-    Supports multi-page PDFs. Extracts text from all pages.
+    Supports multi-page PDFs. Extracts text from all pages, in parallel
+    page ranges in the parser pool for large documents.
     """
-    import io
     try:
-        from pypdf import PdfReader
+        return await parse_pdf_pages(content)
     except ImportError:
         logger.error("pypdf not installed - PDF import disabled")
         return ""
-
-    try:
-        reader = PdfReader(io.BytesIO(content))
-        text_parts = []
-
-        for page_num, page in enumerate(reader.pages):
-            page_text = page.extract_text()
-            if page_text and page_text.strip():
-                text_parts.append(page_text.strip())
-
-        return "\n\n".join(text_parts)
+    except ParseError:
+        raise
     except Exception as e:
         logger.error(f"PDF parse error: {e}", exc_info=True)
         return ""
@@ -4570,50 +4780,49 @@ async def fetch_url_content(url: str) -> str:
     MAX_URL_CONTENT_SIZE = 1024 * 1024  # 1MB max for URL imports
 
     try:
-        async with httpx.AsyncClient(timeout=30.0, follow_redirects=True) as client:
-            response = await client.get(url, headers={
-                'User-Agent': 'Mozilla/5.0 (compatible; BobotBot/1.0)'
-            })
-            response.raise_for_status()
-
-            # Check content size to prevent memory issues
-            content_length = response.headers.get('content-length')
-            if content_length and int(content_length) > MAX_URL_CONTENT_SIZE:
-                return ""  # Too large, return empty
-
-            html = response.text
-            if len(html) > MAX_URL_CONTENT_SIZE:
-                html = html[:MAX_URL_CONTENT_SIZE]  # Truncate to limit
-
-            # Simple HTML to text conversion
-            import re
-            # Remove script and style elements
-            html = re.sub(r'<script[^>]*>.*?</script>', '', html, flags=re.DOTALL | re.IGNORECASE)
-            html = re.sub(r'<style[^>]*>.*?</style>', '', html, flags=re.DOTALL | re.IGNORECASE)
-            html = re.sub(r'<nav[^>]*>.*?</nav>', '', html, flags=re.DOTALL | re.IGNORECASE)
-            html = re.sub(r'<footer[^>]*>.*?</footer>', '', html, flags=re.DOTALL | re.IGNORECASE)
-            html = re.sub(r'<header[^>]*>.*?</header>', '', html, flags=re.DOTALL | re.IGNORECASE)
-
-            # Convert common HTML elements
-            html = re.sub(r'<br\s*/?>', '\n', html)
-            html = re.sub(r'<p[^>]*>', '\n\n', html)
-            html = re.sub(r'</p>', '', html)
-            html = re.sub(r'<h[1-6][^>]*>', '\n\n## ', html)
-            html = re.sub(r'</h[1-6]>', '\n', html)
-            html = re.sub(r'<li[^>]*>', '\n- ', html)
-
-            # Remove remaining HTML tags
-            text = re.sub(r'<[^>]+>', '', html)
-
-            # Decode HTML entities
-            import html as html_module
-            text = html_module.unescape(text)
-
-            # Clean up whitespace
-            text = re.sub(r'\n\s*\n\s*\n', '\n\n', text)
-            text = text.strip()
-
-            return text
+        response = await get_http_client().get(url, headers={
+            'User-Agent': 'Mozilla/5.0 (compatible; BobotBot/1.0)'
+        }, timeout=FETCH_TIMEOUT, follow_redirects=True)
+        response.raise_for_status()
+
+        # Check content size to prevent memory issues
+        content_length = response.headers.get('content-length')
+        if content_length and int(content_length) > MAX_URL_CONTENT_SIZE:
+            return ""  # Too large, return empty
+
+        html = response.text
+        if len(html) > MAX_URL_CONTENT_SIZE:
+            html = html[:MAX_URL_CONTENT_SIZE]  # Truncate to limit
+
+        # Simple HTML to text conversion
+        import re
+        # Remove script and style elements
+        html = re.sub(r'<script[^>]*>.*?</script>', '', html, flags=re.DOTALL | re.IGNORECASE)
+        html = re.sub(r'<style[^>]*>.*?</style>', '', html, flags=re.DOTALL | re.IGNORECASE)
+        html = re.sub(r'<nav[^>]*>.*?</nav>', '', html, flags=re.DOTALL | re.IGNORECASE)
+        html = re.sub(r'<footer[^>]*>.*?</footer>', '', html, flags=re.DOTALL | re.IGNORECASE)
+        html = re.sub(r'<header[^>]*>.*?</header>', '', html, flags=re.DOTALL | re.IGNORECASE)
+
+        # Convert common HTML elements
+        html = re.sub(r'<br\s*/?>', '\n', html)
+        html = re.sub(r'<p[^>]*>', '\n\n', html)
+        html = re.sub(r'</p>', '', html)
+        html = re.sub(r'<h[1-6][^>]*>', '\n\n## ', html)
+        html = re.sub(r'</h[1-6]>', '\n', html)
+        html = re.sub(r'<li[^>]*>', '\n- ', html)
+
+        # Remove remaining HTML tags
+        text = re.sub(r'<[^>]+>', '', html)
+
+        # Decode HTML entities
+        import html as html_module
+        text = html_module.unescape(text)
+
+        # Clean up whitespace
+        text = re.sub(r'\n\s*\n\s*\n', '\n\n', text)
+        text = text.strip()
+
+        return text
     except Exception as e:
         logger.error(f"URL fetch error for: {e}", exc_info=True)
         return ""
@@ -4624,9 +4833,17 @@ class AIExtractionError(Exception):
     pass
 
 
-async def ai_extract_qa_pairs(text: str, company_name: str = "") -> List[dict]:
+async def ai_extract_qa_pairs(text: str, company_name: str = "", on_progress=None,
+                              company_id: str = "-", tier: Optional[str] = None) -> List[dict]:
     """Use AI to extract Q&A pairs from unstructured text
 
+    Long texts are split into overlapping chunks that are extracted
+    concurrently (EXTRACT_CONCURRENCY at a time, each in a background slot
+    of the Ollama scheduler), and the results merged without
+    near-duplicates. Chunk results are cached by content hash, so an edited
+    document only re-extracts the chunks that changed.
+    on_progress(done, total) is awaited after each chunk.
+
     Raises:
         AIExtractionError: If Ollama is not available or AI extraction fails
     """
@@ -4634,12 +4851,56 @@ async def ai_extract_qa_pairs(text: str, company_name: str = "") -> List[dict]:
         logger.info("[AI Extract] Text too short, skipping")
         return []
 
-    logger.info(f"[AI Extract] Starting extraction, text length: {len(text)}")
+    chunks = chunk_text(text)
+    if len(chunks) > EXTRACT_MAX_CHUNKS:
+        logger.warning(f"[AI Extract] {len(chunks)} chunks, only the first {EXTRACT_MAX_CHUNKS} are extracted")
+        chunks = chunks[:EXTRACT_MAX_CHUNKS]
+    logger.info(f"[AI Extract] Starting extraction, text length: {len(text)}, {len(chunks)} chunks")
+
+    semaphore = asyncio.Semaphore(EXTRACT_CONCURRENCY)
+    done = 0
+
+    async def extract(part: int, chunk: str) -> List[dict]:
+        nonlocal done
+        key = chunk_key(OLLAMA_MODEL, chunk)
+        items = extraction_cache.get(key)
+        if items is None:
+            async with semaphore:
+                items = await ai_extract_chunk(chunk, part, len(chunks), company_id, tier)
+            if items is None:
+                items = []  # Unparseable answer: not cached, so a retry asks again
+            else:
+                extraction_cache.put(key, items)
+        done += 1
+        if on_progress:
+            await on_progress(done, len(chunks))
+        return items
+
+    tasks = [asyncio.create_task(extract(part, chunk)) for part, chunk in enumerate(chunks, 1)]
+    try:
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+    items = merge_pairs(results)
+    logger.info(f"[AI Extract] Merged {sum(len(r) for r in results)} Q&A pairs into {len(items)}")
+    return items
+
+
+async def ai_extract_chunk(chunk: str, part: int, total: int, company_id: str = "-",
+                           tier: Optional[str] = None) -> Optional[List[dict]]:
+    """Extract Q&A pairs from one chunk; None if the answer held no valid JSON array
 
+    The generation queues with chat in the Ollama scheduler, as a
+    lower-weight background slot of the company.
+    """
+    document = "Document text:" if total == 1 else f"Document text (part {part} of {total}):"
     prompt = f"""Analyze this document and extract question-answer pairs that would be useful for a customer service chatbot for a property management company.
 
-Document text:
-{text[:4000]}
+{document}
+{chunk}
 
 Extract relevant information as Q&A pairs. For each piece of information, create a natural question a tenant might ask, and provide the answer.
 
@@ -4655,26 +4916,32 @@ Example format:
 ]"""
 
     try:
-        logger.info(f"[AI Extract] Sending request to Ollama at {OLLAMA_BASE_URL}")
-        async with httpx.AsyncClient(timeout=180.0) as client:  # 3 min timeout for large pages
-            response = await client.post(
-                f"{OLLAMA_BASE_URL}/api/generate",
-                json={"model": OLLAMA_MODEL, "prompt": prompt, "stream": False}
-            )
-            response.raise_for_status()
-            result = response.json().get("response", "")
-            logger.info(f"[AI Extract] Got response, length: {len(result)}")
-
-            # Try to parse JSON from response
-            import re
-            json_match = re.search(r'\[[\s\S]*\]', result)
-            if json_match:
-                items = json.loads(json_match.group())
-                valid_items = [item for item in items if item.get("question") and item.get("answer")]
-                logger.info(f"[AI Extract] Parsed {len(valid_items)} Q&A pairs")
-                return valid_items
-            logger.warning("[AI Extract] No JSON array found in response")
-            return []
+        logger.info(f"[AI Extract] Sending part {part}/{total} to Ollama ({len(ollama_router.nodes)} nodes)")
+        async with ollama_scheduler.slot(company_id, tier, background=True):
+            with query_counter.waiting("ollama"):
+                response = await ollama_router.post(
+                    "/api/generate",
+                    {"model": OLLAMA_MODEL, "prompt": prompt, "stream": False},
+                    timeout=EXTRACT_TIMEOUT  # 3 min timeout for large pages
+                )
+        response.raise_for_status()
+        result = response.json().get("response", "")
+        logger.info(f"[AI Extract] Got response for part {part}/{total}, length: {len(result)}")
+
+        # Try to parse JSON from response
+        import re
+        json_match = re.search(r'\[[\s\S]*\]', result)
+        if json_match:
+            items = json.loads(json_match.group())
+            valid_items = [
+                item for item in items
+                if isinstance(item, dict) and isinstance(item.get("question"), str) and item.get("question")
+                and isinstance(item.get("answer"), str) and item.get("answer")
+            ]
+            logger.info(f"[AI Extract] Parsed {len(valid_items)} Q&A pairs from part {part}/{total}")
+            return valid_items
+        logger.warning(f"[AI Extract] No JSON array found in response for part {part}/{total}")
+        return None
     except httpx.ConnectError:
         logger.error("AI extraction failed: Cannot connect to Ollama")
         raise AIExtractionError("AI-tjänsten är inte tillgänglig. Kontrollera att Ollama körs.")
@@ -4688,14 +4955,28 @@ Example format:
         logger.error("AI extraction failed: Timeout")
         raise AIExtractionError("AI-tjänsten svarar inte. Försök igen om en stund.")
     except json.JSONDecodeError:
-        logger.warning("AI extraction returned invalid JSON, returning empty list")
-        return []
+        logger.warning(f"AI extraction returned invalid JSON for part {part}/{total}")
+        return None
     except Exception as e:
         logger.error(f"AI extraction error: {e}", exc_info=True)
         raise AIExtractionError("AI-tjänsten är inte tillgänglig just nu.")
 
 
-@app.post("/knowledge/upload", response_model=UploadResponse)
+KNOWLEDGE_FILE_TYPES = ('.xlsx', '.xls', '.docx', '.pdf', '.txt', '.csv')
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024  # 10MB
+
+
+class JobSubmitted(BaseModel):
+    job_id: str
+    status: str
+    status_url: str
+
+
+def job_submitted(job_id: str) -> JobSubmitted:
+    return JobSubmitted(job_id=job_id, status="queued", status_url=f"/jobs/{job_id}")
+
+
+@app.post("/knowledge/upload", response_model=JobSubmitted, status_code=202)
 async def upload_knowledge_file(
     file: UploadFile = File(...),
     widget_id: Optional[int] = Form(None),
@@ -4710,124 +4991,41 @@ async def upload_knowledge_file(
     - PDF (.pdf): AI extracts Q&A from PDF text
     - Text (.txt): AI extracts Q&A from plain text
     - CSV (.csv): Q&A pairs in comma/semicolon separated format
+
+    The file is parsed and imported in a background job; the response is the
+    job id to poll with GET /jobs/{job_id}.
     """
     if not file.filename:
         raise HTTPException(status_code=400, detail="Ingen fil vald")
 
     filename = file.filename.lower()
-    content = await file.read()
-
-    if len(content) > 10 * 1024 * 1024:  # 10MB limit
-        raise HTTPException(status_code=400, detail="Filen är för stor (max 10MB)")
-
-    items_to_add = []
-
-    # Parse based on file type
-    try:
-        if filename.endswith('.xlsx') or filename.endswith('.xls'):
-            items_to_add = await parse_excel_file(content)
-        elif filename.endswith('.docx'):
-            text = await parse_word_file(content)
-            if text:
-                # Use AI to extract Q&A from unstructured text
-                settings = get_or_create_settings(db, current["company_id"])
-                items_to_add = await ai_extract_qa_pairs(text, settings.company_name)
-        elif filename.endswith('.pdf'):
-            text = await parse_pdf_file(content)
-            if text:
-                # Use AI to extract Q&A from PDF text
-                settings = get_or_create_settings(db, current["company_id"])
-                items_to_add = await ai_extract_qa_pairs(text, settings.company_name)
-        elif filename.endswith('.txt') or filename.endswith('.csv'):
-            text = await parse_text_file(content)
-            if text:
-                # Check if it looks like CSV
-                if ',' in text or ';' in text:
-                    # Simple CSV parsing
-                    lines = text.strip().split('\n')
-                    for line in lines[1:]:  # Skip header
-                        parts = line.split(',') if ',' in line else line.split(';')
-                        if len(parts) >= 2:
-                            items_to_add.append({
-                                "question": parts[0].strip().strip('"'),
-                                "answer": parts[1].strip().strip('"'),
-                                "category": parts[2].strip().strip('"') if len(parts) > 2 else None
-                            })
-                else:
-                    # Use AI to extract Q&A
-                    settings = get_or_create_settings(db, current["company_id"])
-                    items_to_add = await ai_extract_qa_pairs(text, settings.company_name)
-        else:
-            raise HTTPException(
-                status_code=400,
-                detail="Filformat stöds inte. Använd .xlsx, .docx, .pdf, .txt eller .csv"
-            )
-    except AIExtractionError as e:
-        raise HTTPException(status_code=503, detail=str(e))
-
-    if not items_to_add:
-        return UploadResponse(
-            success=False,
-            imported=0,
-            message="Kunde inte hitta några frågor/svar i filen. Kontrollera formatet."
-        )
-
-    # Validate and truncate items for security
-    items_to_add = validate_and_truncate_import_items(items_to_add)
-
-    if not items_to_add:
-        return UploadResponse(
-            success=False,
-            imported=0,
-            message="Inga giltiga frågor/svar hittades efter validering."
-        )
-
-    # Auto-categorize items without category
-    for item in items_to_add:
-        if not item.get("category"):
-            item["category"] = detect_category(item["question"] + " " + item["answer"])
-
-    # Add to database
-    added_items = []
-    for item in items_to_add:
-        new_item = KnowledgeItem(
-            company_id=current["company_id"],
-            question=item["question"],
-            answer=item["answer"],
-            category=item.get("category", "allmant"),
-            widget_id=widget_id  # Assign to specific widget
+    if not filename.endswith(KNOWLEDGE_FILE_TYPES):
+        raise HTTPException(
+            status_code=400,
+            detail="Filformat stöds inte. Använd .xlsx, .docx, .pdf, .txt eller .csv"
         )
-        db.add(new_item)
-        db.flush()
-        added_items.append(KnowledgeItemResponse(
-            id=new_item.id,
-            question=new_item.question,
-            answer=new_item.answer,
-            category=new_item.category or "",
-            widget_id=new_item.widget_id
-        ))
 
-    db.commit()
+    content = await file.read()
+    if len(content) > MAX_UPLOAD_SIZE:
+        raise HTTPException(status_code=400, detail="Filen är för stor (max 10MB)")
 
-    return UploadResponse(
-        success=True,
-        imported=len(added_items),
-        message=f"{len(added_items)} frågor/svar har lagts till i kunskapsbasen",
-        items=added_items
+    job_id = await run_db(
+        job_engine.submit, db, "knowledge_upload", current["company_id"],
+        {"filename": filename, "widget_id": widget_id}, content, release=db
     )
+    job_engine.wake()
+    return job_submitted(job_id)
 
 
-@app.post("/knowledge/import-url", response_model=UploadResponse)
+@app.post("/knowledge/import-url", response_model=JobSubmitted, status_code=202)
 async def import_knowledge_from_url(
     request: URLImportRequest,
     current: dict = Depends(get_current_company),
     db: Session = Depends(get_db)
 ):
-    """Import knowledge base items from a URL"""
+    """Import knowledge base items from a URL (as a background job, see GET /jobs/{job_id})"""
     import re
 
-    logger.info(f"[URL Import] Starting import from: {request.url}")
-
     # Validate URL
     url = request.url.strip()
     if not url.startswith(('http://', 'https://')):
@@ -4836,78 +5034,211 @@ async def import_knowledge_from_url(
     if not re.match(r'https?://[^\s/$.?#].[^\s]*', url):
         raise HTTPException(status_code=400, detail="Ogiltig URL")
 
-    # Fetch content
-    logger.info(f"[URL Import] Fetching content from: {url}")
+    job_id = await run_db(
+        job_engine.submit, db, "knowledge_import_url", current["company_id"],
+        {"url": url, "widget_id": request.widget_id}, release=db
+    )
+    job_engine.wake()
+    logger.info(f"[URL Import] Queued import from: {url} (job {job_id})")
+    return job_submitted(job_id)
+
+
+# =============================================================================
+# Knowledge Import Jobs
+# =============================================================================
+
+@job_engine.handler("knowledge_upload")
+async def knowledge_upload_job(job: JobContext) -> dict:
+    """Parse an uploaded file, extract Q&A pairs (with AI for free text) and import them"""
+    await job.update(5, "Läser filen...")
+    try:
+        items = await parse_knowledge_file(job, job.params["filename"], job.payload)
+    except HTTPException as e:
+        raise JobFailed(e.detail)
+    except ParseError as e:
+        raise JobFailed(str(e))
+
+    if not items:
+        raise JobFailed("Kunde inte hitta några frågor/svar i filen. Kontrollera formatet.")
+    return await import_knowledge_items(job, items, "{count} frågor/svar har lagts till i kunskapsbasen")
+
+
+@job_engine.handler("knowledge_import_url")
+async def knowledge_import_url_job(job: JobContext) -> dict:
+    """Fetch a page, extract Q&A pairs with AI and import them"""
+    url = job.params["url"]
+    await job.update(5, "Hämtar sidan...")
     text = await fetch_url_content(url)
-    logger.info(f"[URL Import] Fetched {len(text) if text else 0} characters")
+    logger.info(f"[URL Import] Fetched {len(text) if text else 0} characters from {url}")
 
     if not text or len(text) < 50:
-        return UploadResponse(
-            success=False,
-            imported=0,
-            message="Kunde inte hämta innehåll från URL:en. Kontrollera att sidan är tillgänglig."
-        )
+        raise JobFailed("Kunde inte hämta innehåll från URL:en. Kontrollera att sidan är tillgänglig.")
+
+    items = await extract_knowledge_with_ai(job, text)
+    if not items:
+        raise JobFailed("Kunde inte hitta några frågor/svar på sidan. Försök med en annan sida.")
+    return await import_knowledge_items(job, items, "{count} frågor/svar har importerats från " + url)
+
+
+async def parse_knowledge_file(job: JobContext, filename: str, content: bytes) -> List[dict]:
+    """Q&A pairs from a file: read from columns (Excel, CSV) or extracted by AI"""
+    if filename.endswith('.xlsx') or filename.endswith('.xls'):
+        return await parse_excel_file(content)
+    if filename.endswith('.docx'):
+        text = await parse_word_file(content)
+    elif filename.endswith('.pdf'):
+        text = await parse_pdf_file(content)
+    else:
+        text = await parse_text_file(content)
+        # Check if it looks like CSV
+        if text and (',' in text or ';' in text):
+            return parse_csv_text(text)
+
+    if not text:
+        return []
+    return await extract_knowledge_with_ai(job, text)
+
+
+def parse_csv_text(text: str) -> List[dict]:
+    """Simple CSV parsing: question, answer[, category] per line after a header"""
+    items = []
+    lines = text.strip().split('\n')
+    for line in lines[1:]:  # Skip header
+        parts = line.split(',') if ',' in line else line.split(';')
+        if len(parts) >= 2:
+            items.append({
+                "question": parts[0].strip().strip('"'),
+                "answer": parts[1].strip().strip('"'),
+                "category": parts[2].strip().strip('"') if len(parts) > 2 else None
+            })
+    return items
+
+
+def load_company_name_and_tier(company_id: str) -> Tuple[str, Optional[str]]:
+    db = SessionLocal()
+    try:
+        company = get_company_snapshot(db, company_id)
+        return get_settings_snapshot(db, company_id).company_name, company.pricing_tier if company else None
+    finally:
+        db.close()
+
+
+async def extract_knowledge_with_ai(job: JobContext, text: str) -> List[dict]:
+    """Use AI to extract Q&A from unstructured text"""
+    await job.update(20, "Analyserar texten med AI (kan ta några minuter)...")
+    company_name, tier = await run_db(load_company_name_and_tier, job.company_id)
+
+    async def progress(done: int, total: int):
+        await job.update(20 + 65 * done // total, f"Analyserar texten med AI (del {done} av {total})...")
 
-    # Use AI to extract Q&A pairs
-    logger.info("[URL Import] Starting AI extraction...")
     try:
-        settings = get_or_create_settings(db, current["company_id"])
-        items_to_add = await ai_extract_qa_pairs(text, settings.company_name)
-        logger.info(f"[URL Import] AI extraction returned {len(items_to_add)} items")
+        return await ai_extract_qa_pairs(text, company_name, on_progress=progress, company_id=job.company_id, tier=tier)
     except AIExtractionError as e:
-        logger.error(f"[URL Import] AI extraction failed: {e}")
-        raise HTTPException(status_code=503, detail=str(e))
-
-    if not items_to_add:
-        return UploadResponse(
-            success=False,
-            imported=0,
-            message="Kunde inte hitta några frågor/svar på sidan. Försök med en annan sida."
-        )
+        raise JobFailed(str(e))
 
-    # Validate and truncate items for security
-    items_to_add = validate_and_truncate_import_items(items_to_add)
 
-    if not items_to_add:
-        return UploadResponse(
-            success=False,
-            imported=0,
-            message="Inga giltiga frågor/svar hittades efter validering."
-        )
+async def import_knowledge_items(job: JobContext, items: List[dict], message: str) -> dict:
+    """Validate, categorize and insert extracted items; returns the job's result (an UploadResponse)"""
+    # Validate and truncate items for security
+    items = validate_and_truncate_import_items(items)
+    if not items:
+        raise JobFailed("Inga giltiga frågor/svar hittades efter validering.")
 
     # Auto-categorize items without category
-    for item in items_to_add:
+    for item in items:
         if not item.get("category"):
             item["category"] = detect_category(item["question"] + " " + item["answer"])
 
-    # Add to database
-    added_items = []
-    for item in items_to_add:
-        new_item = KnowledgeItem(
-            company_id=current["company_id"],
-            question=item["question"],
-            answer=item["answer"],
-            category=item.get("category", "allmant"),
-            widget_id=request.widget_id  # Assign to specific widget
-        )
-        db.add(new_item)
-        db.flush()
-        added_items.append(KnowledgeItemResponse(
-            id=new_item.id,
-            question=new_item.question,
-            answer=new_item.answer,
-            category=new_item.category or "",
-            widget_id=new_item.widget_id
-        ))
+    await job.update(90, f"Sparar {len(items)} frågor/svar...", {"found": len(items)})
+    result, indexed_items = await run_db(add_knowledge_items, job, items, message)
+    knowledge_index.add_items(indexed_items)
+    embedding_worker.schedule(job.company_id)
+    return result
 
-    db.commit()
 
-    return UploadResponse(
-        success=True,
-        imported=len(added_items),
-        message=f"{len(added_items)} frågor/svar har importerats från {url}",
-        items=added_items
-    )
+def add_knowledge_items(job: JobContext, items: List[dict], message: str) -> tuple:
+    """Insert items in one statement, skipping near-duplicates; returns (job result, indexed items)
+
+    The job is marked succeeded in the same transaction as the insert, so
+    a restart after the commit does not import the items a second time.
+    """
+    db = SessionLocal()
+    try:
+        indexed_items, duplicates = bulk_insert_knowledge(db, job.company_id, job.params.get("widget_id"), items)
+        added_items = [KnowledgeItemResponse(
+            id=i.id,
+            question=i.question,
+            answer=i.answer,
+            category=i.category,
+            widget_id=i.widget_id
+        ) for i in indexed_items]
+
+        message = message.format(count=len(added_items))
+        if duplicates:
+            message += f" ({len(duplicates)} som liknar befintliga frågor hoppades över)"
+        result = UploadResponse(
+            success=True,
+            imported=len(added_items),
+            message=message,
+            items=added_items,
+            duplicates=duplicates
+        ).model_dump(mode="json")
+
+        job.complete(db, result)
+        db.commit()
+        invalidate_response_cache(db, job.company_id, {i.widget_id for i in indexed_items})
+        return result, indexed_items
+    finally:
+        db.close()
+
+
+# =============================================================================
+# Background Job Endpoints
+# =============================================================================
+
+def get_company_job(db: Session, job_id: str, company_id: str) -> BackgroundJob:
+    job = db.query(BackgroundJob).filter(
+        BackgroundJob.id == job_id,
+        BackgroundJob.company_id == company_id
+    ).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Jobbet finns inte")
+    return job
+
+
+@app.get("/jobs")
+def list_jobs(
+    limit: int = Query(20, ge=1, le=100),
+    current: dict = Depends(get_current_company),
+    db: Session = Depends(get_db)
+):
+    """The company's latest background jobs, newest first"""
+    jobs = db.query(BackgroundJob).filter(
+        BackgroundJob.company_id == current["company_id"]
+    ).order_by(BackgroundJob.created_at.desc()).limit(limit).all()
+    return [job_response(job) for job in jobs]
+
+
+@app.get("/jobs/{job_id}")
+def get_job(
+    job_id: str,
+    current: dict = Depends(get_current_company),
+    db: Session = Depends(get_db)
+):
+    """Status, progress, (partial) result and error of a background job"""
+    return job_response(get_company_job(db, job_id, current["company_id"]))
+
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(
+    job_id: str,
+    current: dict = Depends(get_current_company),
+    db: Session = Depends(get_db)
+):
+    """Cancel a queued or running job (items already saved are kept)"""
+    await run_db(get_company_job, db, job_id, current["company_id"], release=db)
+    status = await job_engine.cancel(job_id)
+    return {"job_id": job_id, "status": status}
 
 
 class BulkDeleteRequest(BaseModel):
@@ -4921,19 +5252,11 @@ async def delete_knowledge_bulk(
     db: Session = Depends(get_db)
 ):
     """Delete multiple knowledge items at once (using POST for better compatibility)"""
-    deleted_count = 0
-
-    for item_id in request.item_ids:
-        db_item = db.query(KnowledgeItem).filter(
-            KnowledgeItem.id == item_id,
-            KnowledgeItem.company_id == current["company_id"]
-        ).first()
-
-        if db_item:
-            db.delete(db_item)
-            deleted_count += 1
-
+    deleted = bulk_delete_knowledge(db, current["company_id"], request.item_ids)
     db.commit()
+    knowledge_index.remove_items(current["company_id"], [item_id for item_id, _ in deleted])
+    invalidate_response_cache(db, current["company_id"], {widget_id for _, widget_id in deleted})
+    deleted_count = len(deleted)
 
     return {"message": f"{deleted_count} poster har tagits bort", "deleted_count": deleted_count}
 
@@ -5052,8 +5375,6 @@ async def apply_template(
         raise HTTPException(status_code=404, detail=f"Template '{template_id}' not found")
 
     company_id = current["company_id"]
-    items_added = 0
-    items_skipped = 0
 
     # Optionally clear existing knowledge (for this widget specifically)
     if request.replace_existing:
@@ -5064,19 +5385,11 @@ async def apply_template(
             delete_query = delete_query.filter(KnowledgeItem.widget_id == request.widget_id)
         delete_query.delete()
         db.commit()
-
-    # Get existing questions to avoid duplicates (for this widget specifically)
-    existing_questions = set()
-    if not request.replace_existing:
-        query = db.query(KnowledgeItem.question).filter(
-            KnowledgeItem.company_id == company_id
-        )
-        if request.widget_id:
-            query = query.filter(KnowledgeItem.widget_id == request.widget_id)
-        existing = query.all()
-        existing_questions = {q[0].lower().strip() for q in existing}
+        knowledge_index.invalidate(company_id)
+        invalidate_response_cache(db, company_id, [request.widget_id])
 
     # Import template items
+    new_items = []
     for item in template.get("items", []):
         category = item.get("category", "")
 
@@ -5090,24 +5403,18 @@ async def apply_template(
         if not question or not answer:
             continue
 
-        # Skip duplicates
-        if question.lower() in existing_questions:
-            items_skipped += 1
-            continue
-
-        # Create knowledge item
-        db_item = KnowledgeItem(
-            company_id=company_id,
-            question=question,
-            answer=answer,
-            category=category,
-            widget_id=request.widget_id  # Associate with specific widget
-        )
-        db.add(db_item)
-        existing_questions.add(question.lower())
-        items_added += 1
+        new_items.append({"question": question, "answer": answer, "category": category})
 
+    # One INSERT, skipping near-duplicates (of existing questions for this widget, or within the template)
+    indexed_items, duplicates = bulk_insert_knowledge(
+        db, company_id, request.widget_id, new_items, skip_existing=not request.replace_existing
+    )
+    items_added = len(indexed_items)
+    items_skipped = len(duplicates)
     db.commit()
+    knowledge_index.add_items(indexed_items)
+    invalidate_response_cache(db, company_id, {i.widget_id for i in indexed_items})
+    embedding_worker.schedule(company_id)
 
     # Log activity
     log_company_activity(
@@ -5173,7 +5480,7 @@ async def preview_template(
 # =============================================================================
 
 @app.get("/stats", response_model=StatsResponse)
-async def get_stats(
+def get_stats(
     current: dict = Depends(get_current_company),
     db: Session = Depends(get_db)
 ):
@@ -5186,56 +5493,19 @@ async def get_stats(
     # Knowledge items count
     knowledge = db.query(KnowledgeItem).filter(KnowledgeItem.company_id == company_id).count()
 
-    # Get all daily statistics for this company
-    all_stats = db.query(DailyStatistics).filter(
-        DailyStatistics.company_id == company_id
-    ).all()
-
-    # Total conversations from historical data
-    total = sum(s.total_conversations for s in all_stats)
-
-    # Add active conversations not yet in daily stats
-    active_convs = db.query(Conversation).filter(
-        Conversation.company_id == company_id
-    ).all()
-    total += len(active_convs)
+    # Conversations from the analytics rollups (incl. conversations deleted by GDPR cleanup)
+    total = analytics_rollup.totals(db, company_id).get(analytics_rollup.CONVERSATIONS, 0)
+    per_day = analytics_rollup.daily(db, company_id, month_ago, [analytics_rollup.CONVERSATIONS])
 
-    # Today's stats from DailyStatistics
-    today_stats = db.query(DailyStatistics).filter(
-        DailyStatistics.company_id == company_id,
-        DailyStatistics.date == today
-    ).first()
-    today_count = today_stats.total_conversations if today_stats else 0
-    # Add today's active conversations
-    today_convs = [c for c in active_convs if c.started_at.date() == today]
-    today_count += len(today_convs)
-
-    # This week's stats
-    week_stats = db.query(DailyStatistics).filter(
-        DailyStatistics.company_id == company_id,
-        DailyStatistics.date >= week_ago
-    ).all()
-    week_count = sum(s.total_conversations for s in week_stats)
-    # Add this week's active conversations
-    week_convs = [c for c in active_convs if c.started_at.date() >= week_ago]
-    week_count += len(week_convs)
-
-    # This month's stats
-    month_stats = db.query(DailyStatistics).filter(
-        DailyStatistics.company_id == company_id,
-        DailyStatistics.date >= month_ago
-    ).all()
-    month_count = sum(s.total_conversations for s in month_stats)
-    # Add this month's active conversations
-    month_convs = [c for c in active_convs if c.started_at.date() >= month_ago]
-    month_count += len(month_convs)
+    def conversations_since(start: date) -> int:
+        return sum(values.get(analytics_rollup.CONVERSATIONS, 0) for day, values in per_day.items() if day >= start)
 
     return StatsResponse(
         total_questions=total,
         knowledge_items=knowledge,
-        questions_today=today_count,
-        questions_this_week=week_count,
-        questions_this_month=month_count
+        questions_today=conversations_since(today),
+        questions_this_week=conversations_since(week_ago),
+        questions_this_month=conversations_since(month_ago)
     )
 
 
@@ -5271,253 +5541,115 @@ async def get_my_usage(
         }
 
     # Conversation usage
-    conv_limit = settings.max_conversations_month or 0
-    conv_current = settings.current_month_conversations or 0
-    conv_percent = (conv_current / conv_limit * 100) if conv_limit > 0 else 0
-
-    # Knowledge usage
-    knowledge_limit = settings.max_knowledge_items or 0
-    knowledge_percent = (knowledge_count / knowledge_limit * 100) if knowledge_limit > 0 else 0
-
-    return {
-        "conversations": {
-            "current": conv_current,
-            "limit": conv_limit,
-            "percent": min(100, round(conv_percent, 1)),
-            "has_limit": conv_limit > 0
-        },
-        "knowledge": {
-            "current": knowledge_count,
-            "limit": knowledge_limit,
-            "percent": min(100, round(knowledge_percent, 1)),
-            "has_limit": knowledge_limit > 0
-        }
-    }
-
-
-@app.get("/analytics", response_model=AnalyticsResponse)
-async def get_analytics(
-    current: dict = Depends(get_current_company),
-    db: Session = Depends(get_db)
-):
-    """Hämta detaljerad GDPR-säker statistik (anonymiserad)"""
-    company_id = current["company_id"]
-    today = date.today()
-    week_ago = today - timedelta(days=7)
-    month_ago = today - timedelta(days=30)
-
-    # Totals från DailyStatistics (historisk data)
-    stats = db.query(DailyStatistics).filter(
-        DailyStatistics.company_id == company_id
-    ).all()
-
-    total_conversations = sum(s.total_conversations for s in stats)
-    total_messages = sum(s.total_messages for s in stats)
-    total_answered = sum(s.questions_answered for s in stats)
-    total_unanswered = sum(s.questions_unanswered for s in stats)
-
-    # Lägg till aktiva konversationer (ej ännu i statistik)
-    active_convs = db.query(Conversation).filter(
-        Conversation.company_id == company_id
-    ).all()
-    total_conversations += len(active_convs)
-    total_messages += sum(c.message_count for c in active_convs)
-
-    # Initialize new stats collectors
-    language_stats = {}
-    category_stats = {}
-    hourly_stats = {str(h): 0 for h in range(24)}
-    feedback_stats = {"helpful": 0, "not_helpful": 0, "no_feedback": 0}
-    unanswered_questions = []
-
-    # Räkna answered/unanswered för aktiva + collect new stats
-    for conv in active_convs:
-        # Language stats
-        lang = conv.language or "sv"
-        language_stats[lang] = language_stats.get(lang, 0) + 1
-
-        # Category stats
-        cat = conv.category or "allmant"
-        category_stats[cat] = category_stats.get(cat, 0) + 1
-
-        # Hourly stats
-        hour = str(conv.started_at.hour)
-        hourly_stats[hour] = hourly_stats.get(hour, 0) + 1
-
-        # Feedback stats
-        if conv.was_helpful is True:
-            feedback_stats["helpful"] += 1
-        elif conv.was_helpful is False:
-            feedback_stats["not_helpful"] += 1
-        else:
-            feedback_stats["no_feedback"] += 1
-
-        msgs = db.query(Message).filter(
-            Message.conversation_id == conv.id,
-            Message.role == "bot"
-        ).all()
-        for msg in msgs:
-            if msg.had_answer:
-                total_answered += 1
-            else:
-                total_unanswered += 1
-                # Collect unanswered question
-                user_msg = db.query(Message).filter(
-                    Message.conversation_id == conv.id,
-                    Message.role == "user"
-                ).order_by(Message.created_at.desc()).first()
-                if user_msg and user_msg.content not in unanswered_questions:
-                    unanswered_questions.append(user_msg.content[:100])
-
-    # Today
-    today_stats = db.query(DailyStatistics).filter(
-        DailyStatistics.company_id == company_id,
-        DailyStatistics.date == today
-    ).first()
-
-    conversations_today = today_stats.total_conversations if today_stats else 0
-    messages_today = today_stats.total_messages if today_stats else 0
-
-    # Helper to get actual message count for a conversation
-    def get_message_count(conv):
-        count = conv.message_count or 0
-        if count == 0:
-            count = db.query(Message).filter(Message.conversation_id == conv.id).count()
-        return count
-
-    # Lägg till dagens aktiva konversationer
-    today_convs = [c for c in active_convs if c.started_at.date() == today]
-    conversations_today += len(today_convs)
-    messages_today += sum(get_message_count(c) for c in today_convs)
-
-    # This week
-    week_stats = db.query(DailyStatistics).filter(
-        DailyStatistics.company_id == company_id,
-        DailyStatistics.date >= week_ago
-    ).all()
-
-    conversations_week = sum(s.total_conversations for s in week_stats)
-    messages_week = sum(s.total_messages for s in week_stats)
-
-    # Lägg till veckans aktiva
-    week_convs = [c for c in active_convs if c.started_at.date() >= week_ago]
-    conversations_week += len(week_convs)
-    messages_week += sum(get_message_count(c) for c in week_convs)
-
-    # Performance
-    all_response_times = []
-    for conv in active_convs:
-        msgs = db.query(Message).filter(
-            Message.conversation_id == conv.id,
-            Message.response_time_ms.isnot(None)
-        ).all()
-        all_response_times.extend([m.response_time_ms for m in msgs])
-
-    avg_response_time = sum(all_response_times) / len(all_response_times) if all_response_times else 0
-
-    # Inkludera historisk data
-    historical_avg = [s.avg_response_time_ms for s in stats if s.avg_response_time_ms]
-    if historical_avg:
-        avg_response_time = (avg_response_time + sum(historical_avg)) / (1 + len(historical_avg))
-
-    answer_rate = (total_answered / (total_answered + total_unanswered) * 100) if (total_answered + total_unanswered) > 0 else 100
-
-    # Daily breakdown (senaste 30 dagarna)
-    # Initialize all 30 days with zeros first
-    daily_stats_dict = {}
-    for i in range(30):
-        d = (today - timedelta(days=29-i)).isoformat()
-        daily_stats_dict[d] = {
-            "date": d,
-            "conversations": 0,
-            "messages": 0,
-            "answered": 0,
-            "unanswered": 0
-        }
+    conv_limit = settings.max_conversations_month or 0
+    conv_current = settings.current_month_conversations or 0
+    conv_percent = (conv_current / conv_limit * 100) if conv_limit > 0 else 0
 
-    # Count messages and conversations by day directly from tables
-    month_start = today - timedelta(days=29)
-    month_start_dt = datetime.combine(month_start, datetime.min.time())
+    # Knowledge usage
+    knowledge_limit = settings.max_knowledge_items or 0
+    knowledge_percent = (knowledge_count / knowledge_limit * 100) if knowledge_limit > 0 else 0
 
+    return {
+        "conversations": {
+            "current": conv_current,
+            "limit": conv_limit,
+            "percent": min(100, round(conv_percent, 1)),
+            "has_limit": conv_limit > 0
+        },
+        "knowledge": {
+            "current": knowledge_count,
+            "limit": knowledge_limit,
+            "percent": min(100, round(knowledge_percent, 1)),
+            "has_limit": knowledge_limit > 0
+        }
+    }
 
-    # Get all conversations for this company in the last 30 days
-    conversations = db.query(Conversation).filter(
-        Conversation.company_id == company_id,
-        Conversation.started_at >= month_start_dt
-    ).all()
 
+@app.get("/analytics", response_model=AnalyticsResponse)
+def get_analytics(
+    current: dict = Depends(get_current_company),
+    db: Session = Depends(get_db)
+):
+    """Hämta detaljerad GDPR-säker statistik (anonymiserad)
 
-    # Count conversations per day
-    for conv in conversations:
-        d = conv.started_at.date().isoformat()
-        if d in daily_stats_dict:
-            daily_stats_dict[d]["conversations"] += 1
+    Read from the analytics rollups: one row per day and metric, including
+    conversations already deleted by the GDPR cleanup.
+    """
+    company_id = current["company_id"]
+    today = date.today()
+    week_ago = today - timedelta(days=7)
+    month_start = today - timedelta(days=29)
 
-    # Get all messages for these conversations
-    if conversations:
-        conv_ids = [c.id for c in conversations]
-        messages = db.query(Message).filter(
-            Message.conversation_id.in_(conv_ids)
-        ).all()
+    totals = analytics_rollup.totals(db, company_id)
+    per_day = analytics_rollup.daily(db, company_id, month_start)
 
+    total_conversations = totals.get(analytics_rollup.CONVERSATIONS, 0)
+    total_answered = totals.get(analytics_rollup.ANSWERED, 0)
+    total_unanswered = totals.get(analytics_rollup.UNANSWERED, 0)
 
-        # Count messages per day
-        for msg in messages:
-            if msg.created_at:
-                d = msg.created_at.date().isoformat()
-                if d in daily_stats_dict:
-                    daily_stats_dict[d]["messages"] += 1
+    def since(start: date, metric: str) -> int:
+        return sum(values.get(metric, 0) for day, values in per_day.items() if day >= start)
 
-    # Convert to sorted list (always 30 days)
-    daily_stats_list = [daily_stats_dict[d] for d in sorted(daily_stats_dict.keys())]
+    # Daily breakdown (senaste 30 dagarna, alltid 30 dagar)
+    daily_stats_list = []
+    for i in range(30):
+        d = today - timedelta(days=29 - i)
+        values = per_day.get(d, {})
+        daily_stats_list.append({
+            "date": d.isoformat(),
+            "conversations": values.get(analytics_rollup.CONVERSATIONS, 0),
+            "messages": values.get(analytics_rollup.MESSAGES, 0),
+            "answered": values.get(analytics_rollup.ANSWERED, 0),
+            "unanswered": values.get(analytics_rollup.UNANSWERED, 0)
+        })
 
-    # Merge historical stats
-    for s in stats:
-        # Category counts from history
-        if s.category_counts:
-            try:
-                cats = json.loads(s.category_counts)
-                for cat, count in cats.items():
-                    category_stats[cat] = category_stats.get(cat, 0) + count
-            except (json.JSONDecodeError, TypeError, ValueError):
-                pass
+    hourly_stats = {str(h): 0 for h in range(24)}
+    hourly_stats.update(analytics_rollup.breakdown(totals, "hour"))
+
+    helpful = totals.get(analytics_rollup.HELPFUL, 0)
+    not_helpful = totals.get(analytics_rollup.NOT_HELPFUL, 0)
+    feedback_stats = {
+        "helpful": helpful,
+        "not_helpful": not_helpful,
+        "no_feedback": max(0, total_conversations - helpful - not_helpful)
+    }
 
-        # Language counts from history
-        if hasattr(s, 'language_counts') and s.language_counts:
-            try:
-                langs = json.loads(s.language_counts)
-                for lang, count in langs.items():
-                    language_stats[lang] = language_stats.get(lang, 0) + count
-            except (json.JSONDecodeError, TypeError, ValueError):
-                pass
+    answer_rate = (total_answered / (total_answered + total_unanswered) * 100) if (total_answered + total_unanswered) > 0 else 100
 
-        # Hourly counts from history
-        if hasattr(s, 'hourly_counts') and s.hourly_counts:
-            try:
-                hours = json.loads(s.hourly_counts)
-                for hour, count in hours.items():
-                    hourly_stats[hour] = hourly_stats.get(hour, 0) + count
-            except (json.JSONDecodeError, TypeError, ValueError):
-                pass
+    # Senaste obesvarade frågor: användarens fråga före varje obesvarat svar
+    answer = aliased(Message)
+    question = select(Message.content).where(
+        Message.conversation_id == answer.conversation_id,
+        Message.role == "user",
+        Message.id < answer.id
+    ).order_by(Message.id.desc()).limit(1).correlate(answer).scalar_subquery()
+    unanswered_rows = db.query(question).select_from(answer).join(
+        Conversation, Conversation.id == answer.conversation_id
+    ).filter(
+        Conversation.company_id == company_id,
+        answer.role == "bot",
+        answer.had_answer == False
+    ).order_by(answer.id.desc()).limit(50)
 
-        # Feedback from history
-        feedback_stats["helpful"] += s.helpful_count or 0
-        feedback_stats["not_helpful"] += s.not_helpful_count or 0
+    unanswered_questions = []
+    for (content,) in unanswered_rows:
+        if content and content[:100] not in unanswered_questions:
+            unanswered_questions.append(content[:100])
 
     return AnalyticsResponse(
         total_conversations=total_conversations,
-        total_messages=total_messages,
+        total_messages=totals.get(analytics_rollup.MESSAGES, 0),
         total_answered=total_answered,
         total_unanswered=total_unanswered,
-        conversations_today=conversations_today,
-        messages_today=messages_today,
-        conversations_week=conversations_week,
-        messages_week=messages_week,
-        avg_response_time_ms=avg_response_time,
+        conversations_today=since(today, analytics_rollup.CONVERSATIONS),
+        messages_today=since(today, analytics_rollup.MESSAGES),
+        conversations_week=since(week_ago, analytics_rollup.CONVERSATIONS),
+        messages_week=since(week_ago, analytics_rollup.MESSAGES),
+        avg_response_time_ms=analytics_rollup.average_response_ms(totals),
         answer_rate=answer_rate,
         daily_stats=daily_stats_list,
-        category_stats=category_stats,
-        language_stats=language_stats,
+        category_stats=analytics_rollup.breakdown(totals, "category"),
+        language_stats=analytics_rollup.breakdown(totals, "language"),
         feedback_stats=feedback_stats,
         hourly_stats=hourly_stats,
         top_unanswered=unanswered_questions[:10]  # Top 10 unanswered
@@ -5528,155 +5660,106 @@ async def get_analytics(
 # Export Endpoints
 # =============================================================================
 
+CONVERSATION_EXPORT_COLUMNS = [
+    ("reference_id", "Reference ID"), ("started_at", "Started At"), ("messages", "Messages"),
+    ("category", "Category"), ("language", "Language"), ("was_helpful", "Was Helpful"),
+    ("first_message", "First Message"),
+]
+STATISTICS_EXPORT_COLUMNS = [
+    ("date", "Date"), ("conversations", "Conversations"), ("messages", "Messages"),
+    ("answered", "Answered"), ("unanswered", "Unanswered"),
+    ("avg_response_time_ms", "Avg Response Time (ms)"), ("helpful", "Helpful"), ("not_helpful", "Not Helpful"),
+]
+KNOWLEDGE_EXPORT_COLUMNS = [
+    ("question", "Question"), ("answer", "Answer"), ("category", "Category"), ("created_at", "Created At"),
+]
+
+
+def conversation_export_rows(db: Session, conversations: list) -> List[dict]:
+    """One export page of conversations, with first user messages in one grouped query"""
+    first_ids = db.query(func.min(Message.id)).filter(
+        Message.conversation_id.in_([c.id for c in conversations]),
+        Message.role == "user"
+    ).group_by(Message.conversation_id)
+    first_messages = dict(
+        db.query(Message.conversation_id, Message.content).filter(Message.id.in_(first_ids))
+    )
+    return [{
+        "reference_id": conv.reference_id or f"BOB-{conv.id:04d}",
+        "started_at": conv.started_at.isoformat(),
+        "messages": conv.message_count,
+        "category": conv.category or "allmant",
+        "language": conv.language or "sv",
+        "was_helpful": "Yes" if conv.was_helpful else ("No" if conv.was_helpful is False else "N/A"),
+        "first_message": (first_messages.get(conv.id) or "")[:100]
+    } for conv in conversations]
+
+
 @app.get("/export/conversations")
-async def export_conversations(
+def export_conversations(
     current: dict = Depends(get_current_company),
-    db: Session = Depends(get_db),
     format: str = "csv"
 ):
-    """Export conversations as CSV"""
-    from fastapi.responses import StreamingResponse
-    import io
-    import csv
-
+    """Export conversations as CSV, JSON or NDJSON (newest first, streamed)"""
     company_id = current["company_id"]
-
-    conversations = db.query(Conversation).filter(
-        Conversation.company_id == company_id
-    ).order_by(Conversation.started_at.desc()).all()
-
-    output = io.StringIO()
-    writer = csv.writer(output)
-
-    # Header
-    writer.writerow([
-        "Reference ID", "Started At", "Messages", "Category", "Language",
-        "Was Helpful", "First Message"
-    ])
-
-    for conv in conversations:
-        first_msg = db.query(Message).filter(
-            Message.conversation_id == conv.id,
-            Message.role == "user"
-        ).order_by(Message.created_at.asc()).first()
-
-        writer.writerow([
-            conv.reference_id or f"BOB-{conv.id:04d}",
-            conv.started_at.isoformat(),
-            conv.message_count,
-            conv.category or "allmant",
-            conv.language or "sv",
-            "Yes" if conv.was_helpful else ("No" if conv.was_helpful is False else "N/A"),
-            first_msg.content[:100] if first_msg else ""
-        ])
-
-    output.seek(0)
-    return StreamingResponse(
-        iter([output.getvalue()]),
-        media_type="text/csv",
-        headers={"Content-Disposition": "attachment; filename=conversations.csv"}
+    pages = keyset_pages(
+        SessionLocal,
+        lambda db: db.query(
+            Conversation.id, Conversation.reference_id, Conversation.started_at, Conversation.message_count,
+            Conversation.category, Conversation.language, Conversation.was_helpful
+        ).filter(Conversation.company_id == company_id),
+        [Conversation.id], descending=True, transform=conversation_export_rows
     )
+    return export_response(pages, format, CONVERSATION_EXPORT_COLUMNS, "conversations")
 
 
 @app.get("/export/statistics")
-async def export_statistics(
+def export_statistics(
     current: dict = Depends(get_current_company),
-    db: Session = Depends(get_db)
+    format: str = "csv"
 ):
-    """Export daily statistics as CSV"""
-    from fastapi.responses import StreamingResponse
-    import io
-    import csv
-
+    """Export daily statistics as CSV, JSON or NDJSON (newest first, streamed)"""
     company_id = current["company_id"]
-
-    stats = db.query(DailyStatistics).filter(
-        DailyStatistics.company_id == company_id
-    ).order_by(DailyStatistics.date.desc()).all()
-
-    output = io.StringIO()
-    writer = csv.writer(output)
-
-    # Header
-    writer.writerow([
-        "Date", "Conversations", "Messages", "Answered", "Unanswered",
-        "Avg Response Time (ms)", "Helpful", "Not Helpful"
-    ])
-
-    for s in stats:
-        writer.writerow([
-            s.date.isoformat(),
-            s.total_conversations,
-            s.total_messages,
-            s.questions_answered,
-            s.questions_unanswered,
-            round(s.avg_response_time_ms or 0, 2),
-            s.helpful_count or 0,
-            s.not_helpful_count or 0
-        ])
-
-    output.seek(0)
-    return StreamingResponse(
-        iter([output.getvalue()]),
-        media_type="text/csv",
-        headers={"Content-Disposition": "attachment; filename=statistics.csv"}
+    pages = keyset_pages(
+        SessionLocal,
+        lambda db: db.query(DailyStatistics).filter(DailyStatistics.company_id == company_id),
+        [DailyStatistics.date, DailyStatistics.id], descending=True,
+        transform=lambda db, stats: [{
+            "date": s.date.isoformat(),
+            "conversations": s.total_conversations,
+            "messages": s.total_messages,
+            "answered": s.questions_answered,
+            "unanswered": s.questions_unanswered,
+            "avg_response_time_ms": round(s.avg_response_time_ms or 0, 2),
+            "helpful": s.helpful_count or 0,
+            "not_helpful": s.not_helpful_count or 0
+        } for s in stats]
     )
+    return export_response(pages, format, STATISTICS_EXPORT_COLUMNS, "statistics")
 
 
 @app.get("/export/knowledge")
-async def export_knowledge(
+def export_knowledge(
     format: str = "csv",
-    current: dict = Depends(get_current_company),
-    db: Session = Depends(get_db)
+    current: dict = Depends(get_current_company)
 ):
-    """Export knowledge base as CSV or JSON"""
-    from fastapi.responses import StreamingResponse
-    import io
-    import csv
-
+    """Export knowledge base as CSV, JSON or NDJSON (streamed)"""
     company_id = current["company_id"]
-
-    items = db.query(KnowledgeItem).filter(
-        KnowledgeItem.company_id == company_id
-    ).all()
-
-    if format.lower() == "json":
-        # Export as JSON
-        data = [{
+    pages = keyset_pages(
+        SessionLocal,
+        lambda db: db.query(
+            KnowledgeItem.id, KnowledgeItem.question, KnowledgeItem.answer,
+            KnowledgeItem.category, KnowledgeItem.created_at
+        ).filter(KnowledgeItem.company_id == company_id),
+        [KnowledgeItem.id],
+        transform=lambda db, items: [{
             "question": item.question,
             "answer": item.answer,
             "category": item.category or "",
             "created_at": item.created_at.isoformat()
         } for item in items]
-
-        output = json.dumps(data, ensure_ascii=False, indent=2)
-        return StreamingResponse(
-            iter([output]),
-            media_type="application/json",
-            headers={"Content-Disposition": "attachment; filename=knowledge_base.json"}
-        )
-    else:
-        # Export as CSV (default)
-        output = io.StringIO()
-        writer = csv.writer(output)
-
-        # Header
-        writer.writerow(["Question", "Answer", "Category", "Created At"])
-
-        for item in items:
-            writer.writerow([
-                item.question,
-                item.answer,
-                item.category or "",
-                item.created_at.isoformat()
-            ])
-
-        output.seek(0)
-        return StreamingResponse(
-            iter([output.getvalue()]),
-            media_type="text/csv",
-            headers={"Content-Disposition": "attachment; filename=knowledge_base.csv"}
-        )
+    )
+    return export_response(pages, format, KNOWLEDGE_EXPORT_COLUMNS, "knowledge_base")
 
 
 # =============================================================================
@@ -5710,6 +5793,7 @@ async def record_consent(
         Conversation.company_id == company_id
     ).first()
 
+    created = False
     if conversation:
         conversation.consent_given = request.consent_given
         conversation.consent_timestamp = datetime.utcnow() if request.consent_given else None
@@ -5725,6 +5809,7 @@ async def record_consent(
             consent_timestamp=datetime.utcnow() if request.consent_given else None
         )
         db.add(conversation)
+        created = True
 
     # Log the consent action
     audit_log = GDPRAuditLog(
@@ -5737,6 +5822,8 @@ async def record_consent(
     )
     db.add(audit_log)
     db.commit()
+    if created:
+        record_conversation_started(conversation)
 
     return {"message": "Samtycke registrerat", "consent_given": request.consent_given}
 
@@ -5835,7 +5922,7 @@ async def delete_my_data(
         return {"message": "Ingen data att radera för denna session"}
 
     # Save anonymized stats before deletion (for aggregate statistics)
-    await save_conversation_stats(db, conversation)
+    save_conversation_stats(db, conversation)
 
     # Log the deletion request
     audit_log = GDPRAuditLog(
@@ -5891,33 +5978,68 @@ async def get_audit_log(
 # Super Admin Endpoints
 # =============================================================================
 
+def company_counts(model, *filters):
+    """Subquery of (company_id, n): rows of model per company, one GROUP BY"""
+    return select(model.company_id, func.count(model.id).label("n")).where(*filters).group_by(
+        model.company_id
+    ).subquery()
+
+
 @app.get("/admin/companies", response_model=List[CompanyResponse])
-async def list_companies(
+def list_companies(
+    response: Response,
     admin: dict = Depends(get_super_admin),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Max items to return (default all)"),
+    offset: int = Query(0, ge=0, description="Number of items to skip"),
+    sort: str = Query("created_at", description="created_at, chat_count, knowledge_count or name"),
+    order: str = Query("asc", description="asc or desc")
 ):
-    """Lista alla företag"""
-    companies = db.query(Company).all()
-
-    result = []
-    for c in companies:
-        knowledge_count = db.query(KnowledgeItem).filter(KnowledgeItem.company_id == c.id).count()
-        # Use Conversation table for accurate chat count (ChatLog is legacy)
-        chat_count = db.query(Conversation).filter(Conversation.company_id == c.id).count()
-        widget_count = db.query(Widget).filter(Widget.company_id == c.id).count()
-        settings = db.query(CompanySettings).filter(CompanySettings.company_id == c.id).first()
+    """Lista alla företag (antal i en fråga, totalen i X-Total-Count)"""
+    knowledge = company_counts(KnowledgeItem)
+    # Use Conversation table for accurate chat count (ChatLog is legacy)
+    chats = company_counts(Conversation)
+    widgets = company_counts(Widget)
+    knowledge_count = func.coalesce(knowledge.c.n, 0)
+    chat_count = func.coalesce(chats.c.n, 0)
+    widget_count = func.coalesce(widgets.c.n, 0)
+
+    sorts = {
+        "created_at": Company.created_at,
+        "chat_count": chat_count,
+        "knowledge_count": knowledge_count,
+        "name": Company.name,
+    }
+    if sort not in sorts or order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="Ogiltig sortering")
+    sort_column = sorts[sort].desc() if order == "desc" else sorts[sort].asc()
+
+    query = db.query(
+        Company, knowledge_count, chat_count, widget_count,
+        CompanySettings.max_conversations_month, CompanySettings.current_month_conversations,
+        CompanySettings.max_knowledge_items
+    ).outerjoin(knowledge, knowledge.c.company_id == Company.id).outerjoin(
+        chats, chats.c.company_id == Company.id
+    ).outerjoin(widgets, widgets.c.company_id == Company.id).outerjoin(
+        CompanySettings, CompanySettings.company_id == Company.id
+    ).order_by(sort_column, Company.id).offset(offset)
+    if limit is not None:
+        query = query.limit(limit)
+
+    response.headers["X-Total-Count"] = str(db.query(func.count(Company.id)).scalar())
 
-        result.append(CompanyResponse(
+    return [
+        CompanyResponse(
             id=c.id,
             name=c.name,
             is_active=c.is_active,
             created_at=c.created_at,
-            knowledge_count=knowledge_count,
-            chat_count=chat_count,
-            widget_count=widget_count,
-            max_conversations_month=settings.max_conversations_month if settings else 0,
-            current_month_conversations=settings.current_month_conversations if settings else 0,
-            max_knowledge_items=settings.max_knowledge_items if settings else 0,
+            knowledge_count=knowledge_n,
+            chat_count=chat_n,
+            widget_count=widget_n,
+            max_conversations_month=max_conversations or 0,
+            current_month_conversations=current_conversations or 0,
+            max_knowledge_items=max_knowledge or 0,
             pricing_tier=c.pricing_tier or "starter",
             startup_fee_paid=c.startup_fee_paid or False,
             contract_start_date=c.contract_start_date,
@@ -5925,9 +6047,9 @@ async def list_companies(
             discount_percent=c.discount_percent or 0.0,
             discount_end_date=c.discount_end_date,
             discount_note=c.discount_note or ""
-        ))
-
-    return result
+        )
+        for c, knowledge_n, chat_n, widget_n, max_conversations, current_conversations, max_knowledge in query
+    ]
 
 
 @app.post("/admin/companies", response_model=CompanyResponse)
@@ -5998,6 +6120,9 @@ async def delete_company(
     company_name = company.name
     db.delete(company)
     db.commit()
+    knowledge_index.invalidate(company_id)
+    response_cache.invalidate(company_id)
+    config_cache.invalidate_company(company_id)
 
     # Log admin action
     log_admin_action(
@@ -6022,6 +6147,7 @@ async def toggle_company(
 
     company.is_active = not company.is_active
     db.commit()
+    config_cache.invalidate_company(company_id)
 
     # Log admin action
     status = "aktiverat" if company.is_active else "inaktiverat"
@@ -6076,6 +6202,7 @@ async def toggle_widget(
 
     widget.is_active = not widget.is_active
     db.commit()
+    config_cache.invalidate_company(widget.company_id)
 
     # Log admin action
     status = "aktiverad" if widget.is_active else "inaktiverad"
@@ -6103,6 +6230,7 @@ async def admin_delete_widget(
     company_id = widget.company_id
     db.delete(widget)
     db.commit()
+    config_cache.invalidate_company(company_id)
 
     # Log admin action
     log_admin_action(
@@ -6125,17 +6253,10 @@ async def system_health(
 ):
     """Hämta systemhälsa för admin dashboard"""
     import os
-    import httpx
 
-    # Check Ollama status
-    ollama_status = "offline"
-    try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            response = await client.get(f"{OLLAMA_BASE_URL}/api/tags")
-            if response.status_code == 200:
-                ollama_status = "online"
-    except (httpx.RequestError, httpx.TimeoutException, Exception):
-        ollama_status = "offline"
+    # Check Ollama status (online if any node answers)
+    ollama_nodes = await ollama_router.probe()
+    ollama_status = "online" if any(node["status"] == "online" for node in ollama_nodes) else "offline"
 
     # Get database size
     db_path = "./bobot.db"
@@ -6158,6 +6279,8 @@ async def system_health(
     return {
         "ollama_status": ollama_status,
         "ollama_model": OLLAMA_MODEL,
+        "ollama_nodes": ollama_nodes,
+        "ollama_queue": ollama_scheduler.stats(),
         "database_size": db_size,
         "total_companies": total_companies,
         "total_conversations": total_conversations,
@@ -6177,7 +6300,7 @@ async def manual_gdpr_cleanup(
     db: Session = Depends(get_db)
 ):
     """Kör GDPR-cleanup manuellt (för testing)"""
-    await cleanup_old_conversations()
+    summary = await retention_cleanup.run()
 
     # Log admin action
     log_admin_action(
@@ -6186,7 +6309,15 @@ async def manual_gdpr_cleanup(
         ip_address=req.client.host if req else None
     )
 
-    return {"message": "GDPR cleanup genomförd"}
+    return {"message": "GDPR cleanup genomförd", **summary}
+
+
+@app.get("/admin/gdpr-cleanup")
+async def get_gdpr_cleanup_stats(
+    admin: dict = Depends(get_super_admin)
+):
+    """Get GDPR cleanup progress and statistics (batches, deleted rows, last run duration)"""
+    return retention_cleanup.stats()
 
 
 # =============================================================================
@@ -6275,14 +6406,19 @@ async def impersonate_company(
 # Export Company Data
 # =============================================================================
 
+COMPANY_EXPORT_KNOWLEDGE_COLUMNS = [
+    ("id", "ID"), ("question", "Question"), ("answer", "Answer"), ("category", "Category"), ("created_at", "Created At"),
+]
+
+
 @app.get("/admin/export/{company_id}")
-async def export_company_data(
+def export_company_data(
     company_id: str,
     admin: dict = Depends(get_super_admin),
     req: Request = None,
     db: Session = Depends(get_db)
 ):
-    """Export all data for a company (for support/GDPR requests)"""
+    """Export all data for a company (for support/GDPR requests), streamed as one JSON object"""
     company = db.query(Company).filter(Company.id == company_id).first()
     if not company:
         raise HTTPException(status_code=404, detail="Företag finns inte")
@@ -6291,14 +6427,6 @@ async def export_company_data(
         CompanySettings.company_id == company_id
     ).first()
 
-    knowledge = db.query(KnowledgeItem).filter(
-        KnowledgeItem.company_id == company_id
-    ).all()
-
-    conversations = db.query(Conversation).filter(
-        Conversation.company_id == company_id
-    ).all()
-
     # Log admin action
     log_admin_action(
         db, admin["username"], "export_data",
@@ -6307,7 +6435,7 @@ async def export_company_data(
         ip_address=req.client.host if req else None
     )
 
-    return {
+    head = {
         "company": {
             "id": company.id,
             "name": company.name,
@@ -6315,28 +6443,46 @@ async def export_company_data(
             "is_active": company.is_active
         },
         "settings": {
-            "company_name": settings.company_name if settings else "",
-            "contact_email": settings.contact_email if settings else "",
-            "contact_phone": settings.contact_phone if settings else "",
-            "welcome_message": settings.welcome_message if settings else "",
-            "primary_color": settings.primary_color if settings else "",
-            "data_retention_days": settings.data_retention_days if settings else 30,
-            "max_conversations_month": settings.max_conversations_month if settings else 0,
-            "current_month_conversations": settings.current_month_conversations if settings else 0
+            "company_name": settings.company_name,
+            "contact_email": settings.contact_email,
+            "contact_phone": settings.contact_phone,
+            "welcome_message": settings.welcome_message,
+            "primary_color": settings.primary_color,
+            "data_retention_days": settings.data_retention_days,
+            "max_conversations_month": settings.max_conversations_month,
+            "current_month_conversations": settings.current_month_conversations
         } if settings else None,
-        "knowledge_items": [
-            {
-                "id": k.id,
-                "question": k.question,
-                "answer": k.answer,
-                "category": k.category,
-                "created_at": k.created_at.isoformat()
-            }
-            for k in knowledge
-        ],
-        "conversations_count": len(conversations),
-        "total_messages": sum(c.message_count or 0 for c in conversations)
     }
+    knowledge = keyset_pages(
+        SessionLocal,
+        lambda session: session.query(
+            KnowledgeItem.id, KnowledgeItem.question, KnowledgeItem.answer,
+            KnowledgeItem.category, KnowledgeItem.created_at
+        ).filter(KnowledgeItem.company_id == company_id),
+        [KnowledgeItem.id],
+        transform=lambda session, items: [{
+            "id": k.id,
+            "question": k.question,
+            "answer": k.answer,
+            "category": k.category,
+            "created_at": k.created_at.isoformat()
+        } for k in items]
+    )
+
+    def conversation_totals() -> dict:
+        session = SessionLocal()
+        try:
+            count, messages = session.query(
+                func.count(Conversation.id), func.coalesce(func.sum(Conversation.message_count), 0)
+            ).filter(Conversation.company_id == company_id).one()
+        finally:
+            session.close()
+        return {"conversations_count": count, "total_messages": int(messages)}
+
+    return StreamingResponse(
+        encode_document(head, "knowledge_items", knowledge, COMPANY_EXPORT_KNOWLEDGE_COLUMNS, conversation_totals),
+        media_type="application/json"
+    )
 
 
 # =============================================================================
@@ -6364,6 +6510,7 @@ async def update_usage_limit(
     settings.max_conversations_month = max(0, update.max_conversations_month)
     settings.max_knowledge_items = max(0, update.max_knowledge_items)
     db.commit()
+    config_cache.invalidate_company(company_id)
 
     # Log admin action
     log_admin_action(
@@ -6469,6 +6616,7 @@ async def update_company_pricing(
         company.billing_email = update.billing_email
 
     db.commit()
+    config_cache.invalidate_company(company_id)  # The chat path reads pricing_tier from the snapshot
 
     # Also update or create the subscription to match the pricing tier
     tier_info = PRICING_TIERS.get(update.pricing_tier)
@@ -7267,6 +7415,7 @@ async def update_maintenance_mode(
 
     if update.message:
         set_global_setting(db, "maintenance_message", update.message, admin["username"])
+    config_cache.invalidate_global()
 
     # Log admin action
     log_admin_action(
@@ -7441,6 +7590,7 @@ async def create_or_update_subscription(
         settings.max_knowledge_items = features.get("max_knowledge", 0)
 
     db.commit()
+    config_cache.invalidate_company(company_id)
     return {"message": f"Prenumeration uppdaterad till {subscription.plan_name}"}
 
 
@@ -7849,7 +7999,7 @@ async def get_activity_stream(
 # =============================================================================
 
 @app.get("/admin/ai-insights")
-async def get_ai_insights(
+def get_ai_insights(
     admin: dict = Depends(get_super_admin),
     db: Session = Depends(get_db)
 ):
@@ -7858,26 +8008,26 @@ async def get_ai_insights(
     today = date.today()
     week_ago = today - timedelta(days=7)
 
-    # Get all companies with their stats
-    companies = db.query(Company).filter(Company.is_active == True).all()
-
-    for company in companies:
-        settings = db.query(CompanySettings).filter(
-            CompanySettings.company_id == company.id
-        ).first()
-        company_name = settings.company_name if settings and settings.company_name else company.name
-
-        # Get recent stats
-        recent_stats = db.query(DailyStatistics).filter(
-            DailyStatistics.company_id == company.id,
-            DailyStatistics.date >= week_ago
-        ).all()
-
-        if not recent_stats:
-            continue
-
-        total_answered = sum(s.questions_answered for s in recent_stats)
-        total_unanswered = sum(s.questions_unanswered for s in recent_stats)
+    # Stats of all active companies, aggregated per company in one statement
+    recent = and_(DailyStatistics.company_id == Company.id, DailyStatistics.date >= week_ago)
+    latest_date = select(func.max(DailyStatistics.date)).where(recent).correlate(Company).scalar_subquery()
+    latest_conversations = select(DailyStatistics.total_conversations).where(
+        DailyStatistics.company_id == Company.id, DailyStatistics.date == latest_date
+    ).correlate(Company).limit(1).scalar_subquery()
+    companies = db.query(
+        Company.id, func.coalesce(func.nullif(CompanySettings.company_name, ""), Company.name),
+        func.count(DailyStatistics.id),
+        func.sum(DailyStatistics.questions_answered), func.sum(DailyStatistics.questions_unanswered),
+        func.avg(DailyStatistics.total_conversations), latest_conversations,
+        func.sum(DailyStatistics.helpful_count), func.sum(DailyStatistics.not_helpful_count)
+    ).join(DailyStatistics, recent).outerjoin(
+        CompanySettings, CompanySettings.company_id == Company.id
+    ).filter(Company.is_active == True).group_by(Company.id, Company.name, CompanySettings.company_name)
+
+    for (company_id, company_name, days, total_answered, total_unanswered, avg_conv, latest_conv,
+         helpful, not_helpful) in companies:
+        total_answered = total_answered or 0
+        total_unanswered = total_unanswered or 0
         total_questions = total_answered + total_unanswered
 
         if total_questions > 0:
@@ -7888,7 +8038,7 @@ async def get_ai_insights(
                 insights.append({
                     "type": "warning",
                     "severity": "high" if unanswered_rate > 50 else "medium",
-                    "company_id": company.id,
+                    "company_id": company_id,
                     "company_name": company_name,
                     "title": f"Hög andel obesvarade frågor",
                     "description": f"{unanswered_rate:.0f}% av frågorna kunde inte besvaras senaste veckan. Kunskapsbasen behöver utökas.",
@@ -7897,16 +8047,13 @@ async def get_ai_insights(
                 })
 
         # Check for traffic spikes
-        if len(recent_stats) >= 2:
-            daily_conversations = [s.total_conversations for s in recent_stats]
-            avg_conv = sum(daily_conversations) / len(daily_conversations)
-            latest_conv = daily_conversations[-1] if daily_conversations else 0
-
+        if days >= 2:
+            latest_conv = latest_conv or 0
             if latest_conv > avg_conv * 2 and latest_conv >= 10:
                 insights.append({
                     "type": "info",
                     "severity": "low",
-                    "company_id": company.id,
+                    "company_id": company_id,
                     "company_name": company_name,
                     "title": f"Trafiktopp upptäckt",
                     "description": f"{latest_conv} konversationer idag, {latest_conv/avg_conv:.1f}x normalt.",
@@ -7915,8 +8062,8 @@ async def get_ai_insights(
                 })
 
         # Check for low feedback
-        helpful = sum(s.helpful_count for s in recent_stats)
-        not_helpful = sum(s.not_helpful_count for s in recent_stats)
+        helpful = helpful or 0
+        not_helpful = not_helpful or 0
         total_feedback = helpful + not_helpful
 
         if total_feedback >= 5:
@@ -7925,7 +8072,7 @@ async def get_ai_insights(
                 insights.append({
                     "type": "warning",
                     "severity": "medium",
-                    "company_id": company.id,
+                    "company_id": company_id,
                     "company_name": company_name,
                     "title": f"Låg nöjdhet",
                     "description": f"Endast {satisfaction:.0f}% positiv feedback. Granska svaren.",
@@ -7939,12 +8086,12 @@ async def get_ai_insights(
 
     # Get trending topics across all companies
     all_categories = {}
-    all_stats = db.query(DailyStatistics).filter(
+    all_stats = db.query(DailyStatistics.category_counts).filter(
         DailyStatistics.date >= week_ago
-    ).all()
+    )
 
-    for s in all_stats:
-        cats = json.loads(s.category_counts) if s.category_counts else {}
+    for (category_counts,) in all_stats:
+        cats = json.loads(category_counts) if category_counts else {}
         for cat, count in cats.items():
             all_categories[cat] = all_categories.get(cat, 0) + count
 
@@ -8354,63 +8501,59 @@ async def get_usage_trends(
 
 
 @app.get("/admin/analytics/companies")
-async def get_company_analytics_comparison(
+def get_company_analytics_comparison(
     limit: int = Query(10, ge=1, le=100, description="Max companies to return"),
+    offset: int = Query(0, ge=0, description="Number of items to skip"),
     admin: dict = Depends(get_super_admin),
     db: Session = Depends(get_db)
 ):
-    """Get analytics comparison across companies"""
+    """Get analytics comparison across companies (one statement, busiest first)"""
     cutoff_date = date.today() - timedelta(days=30)
     cutoff_datetime = datetime.combine(cutoff_date, datetime.min.time())
 
-    # Get all companies first
-    all_companies = db.query(Company).filter(Company.is_active == True).all()
-
-    company_data = []
-    for company in all_companies:
-        # Count from DailyStatistics (historical/aggregated data)
-        daily_stats = db.query(
-            func.sum(DailyStatistics.total_conversations).label('conversations'),
-            func.sum(DailyStatistics.total_messages).label('messages'),
-            func.avg(DailyStatistics.avg_response_time_ms).label('avg_response_time')
-        ).filter(
-            DailyStatistics.company_id == company.id,
-            DailyStatistics.date >= cutoff_date
-        ).first()
-
-        daily_convs = daily_stats.conversations or 0 if daily_stats else 0
-        daily_msgs = daily_stats.messages or 0 if daily_stats else 0
-        avg_resp = daily_stats.avg_response_time or 0 if daily_stats else 0
-
-        # Also count directly from Conversation table (active/recent conversations)
-        conv_count = db.query(Conversation).filter(
-            Conversation.company_id == company.id,
-            Conversation.started_at >= cutoff_datetime
-        ).count()
-
-        msg_count = db.query(Message).join(Conversation).filter(
-            Conversation.company_id == company.id,
-            Conversation.started_at >= cutoff_datetime
-        ).count()
-
-        # Use the higher of the two counts (avoid double-counting by taking max)
-        total_conversations = max(daily_convs, conv_count)
-        total_messages = max(daily_msgs, msg_count)
-
-        if total_conversations > 0 or total_messages > 0:
-            company_data.append({
-                "company_id": company.id,
-                "company_name": company.name,
-                "conversations": total_conversations,
-                "messages": total_messages,
-                "avg_response_time": round(avg_resp, 2)
-            })
-
-    # Sort by conversations descending and limit
-    company_data.sort(key=lambda x: x["conversations"], reverse=True)
-    result = company_data[:limit]
-
-    return {"companies": result}
+    # DailyStatistics (historical/aggregated data) per company
+    daily = select(
+        DailyStatistics.company_id,
+        func.sum(DailyStatistics.total_conversations).label("conversations"),
+        func.sum(DailyStatistics.total_messages).label("messages"),
+        func.avg(DailyStatistics.avg_response_time_ms).label("avg_response_time")
+    ).where(DailyStatistics.date >= cutoff_date).group_by(DailyStatistics.company_id).subquery()
+    # Also count directly from Conversation table (active/recent conversations)
+    conversations = company_counts(Conversation, Conversation.started_at >= cutoff_datetime)
+    messages = select(
+        Conversation.company_id, func.count(Message.id).label("n")
+    ).join(Message, Message.conversation_id == Conversation.id).where(
+        Conversation.started_at >= cutoff_datetime
+    ).group_by(Conversation.company_id).subquery()
+
+    # Use the higher of the two counts (avoid double-counting by taking max)
+    def higher(a, b):
+        a, b = func.coalesce(a, 0), func.coalesce(b, 0)
+        return case((a > b, a), else_=b)
+
+    total_conversations = higher(daily.c.conversations, conversations.c.n).label("conversations")
+    total_messages = higher(daily.c.messages, messages.c.n).label("messages")
+
+    rows = db.query(
+        Company.id, Company.name, total_conversations, total_messages,
+        func.coalesce(daily.c.avg_response_time, 0)
+    ).outerjoin(daily, daily.c.company_id == Company.id).outerjoin(
+        conversations, conversations.c.company_id == Company.id
+    ).outerjoin(messages, messages.c.company_id == Company.id).filter(
+        Company.is_active == True,
+        (total_conversations > 0) | (total_messages > 0)
+    ).order_by(total_conversations.desc(), Company.id).offset(offset).limit(limit)
+
+    return {"companies": [
+        {
+            "company_id": company_id,
+            "company_name": name,
+            "conversations": int(conversation_n),
+            "messages": int(message_n),
+            "avg_response_time": round(avg_resp, 2)
+        }
+        for company_id, name, conversation_n, message_n, avg_resp in rows
+    ]}
 
 
 # =============================================================================
@@ -8475,42 +8618,8 @@ async def get_audit_action_types(
 # Widget Performance Endpoints
 # =============================================================================
 
-@app.get("/admin/performance/{company_id}")
-async def get_widget_performance(
-    company_id: str,
-    hours: int = 24,
-    admin: dict = Depends(get_super_admin),
-    db: Session = Depends(get_db)
-):
-    """Get widget performance stats for a company"""
-    cutoff = datetime.utcnow() - timedelta(hours=hours)
-
-    perf = db.query(WidgetPerformance).filter(
-        WidgetPerformance.company_id == company_id,
-        WidgetPerformance.hour >= cutoff
-    ).order_by(WidgetPerformance.hour).all()
-
-    # Also get current rate limit stats
-    from main import rate_limit_store
-    rate_limited_count = sum(1 for k in rate_limit_store.keys() if company_id in k)
-
-    return {
-        "hourly_stats": [{
-            "hour": p.hour.isoformat(),
-            "total_requests": p.total_requests,
-            "successful_requests": p.successful_requests,
-            "failed_requests": p.failed_requests,
-            "rate_limited_requests": p.rate_limited_requests,
-            "avg_response_time": p.avg_response_time,
-            "p95_response_time": p.p95_response_time,
-            "error_counts": json.loads(p.error_counts) if p.error_counts else {}
-        } for p in perf],
-        "current_rate_limit_sessions": rate_limited_count
-    }
-
-
 @app.get("/admin/performance/overview")
-async def get_performance_overview(
+def get_performance_overview(
     hours: int = 24,
     admin: dict = Depends(get_super_admin),
     db: Session = Depends(get_db)
@@ -8518,41 +8627,43 @@ async def get_performance_overview(
     """Get overall widget performance across all companies"""
     cutoff = datetime.utcnow() - timedelta(hours=hours)
 
-    # First try WidgetPerformance table (if populated)
+    # WidgetPerformance rows, written every hour from the chat metrics
     stats = db.query(
         func.sum(WidgetPerformance.total_requests).label('total'),
         func.sum(WidgetPerformance.successful_requests).label('successful'),
         func.sum(WidgetPerformance.failed_requests).label('failed'),
         func.sum(WidgetPerformance.rate_limited_requests).label('rate_limited'),
-        func.avg(WidgetPerformance.avg_response_time).label('avg_response')
+        # Weighted by the answered and failed requests of each hour
+        func.sum(WidgetPerformance.avg_response_time * (
+            WidgetPerformance.successful_requests + WidgetPerformance.failed_requests
+        )).label('response_sum'),
+        func.max(WidgetPerformance.p95_response_time).label('p95')
     ).filter(WidgetPerformance.hour >= cutoff).first()
 
     total_requests = stats.total or 0
     successful_requests = stats.successful or 0
     failed_requests = stats.failed or 0
     rate_limited = stats.rate_limited or 0
-    avg_response = stats.avg_response or 0
+    timed_requests = successful_requests + failed_requests
+    avg_response = (stats.response_sum or 0) / timed_requests if timed_requests else 0
+    p95_response = stats.p95 or 0
 
-    # If no WidgetPerformance data, calculate from Message/Conversation tables
+    # Before the first hourly flush: bot messages and DailyStatistics
     if total_requests == 0:
-        # Count messages in the time period
-        messages = db.query(Message).filter(
+        total_requests, successful_requests = db.query(
+            func.count(Message.id), func.coalesce(func.sum(case((Message.had_answer == True, 1), else_=0)), 0)
+        ).filter(
             Message.created_at >= cutoff,
             Message.role == "bot"
-        ).all()
-
-        total_requests = len(messages)
-        successful_requests = sum(1 for m in messages if m.had_answer)
-        failed_requests = sum(1 for m in messages if not m.had_answer)
+        ).one()
+        failed_requests = total_requests - successful_requests
 
         # Calculate average response time from DailyStatistics
         today = date.today()
-        daily_stats = db.query(DailyStatistics).filter(
-            DailyStatistics.date >= today - timedelta(days=1)
-        ).all()
-
-        response_times = [s.avg_response_time_ms for s in daily_stats if s.avg_response_time_ms]
-        avg_response = sum(response_times) / len(response_times) if response_times else 0
+        avg_response = db.query(func.avg(DailyStatistics.avg_response_time_ms)).filter(
+            DailyStatistics.date >= today - timedelta(days=1),
+            DailyStatistics.avg_response_time_ms > 0
+        ).scalar() or 0
 
     return {
         "total_requests": total_requests,
@@ -8560,10 +8671,45 @@ async def get_performance_overview(
         "failed_requests": failed_requests,
         "rate_limited_requests": rate_limited,
         "avg_response_time": round(avg_response, 2),
+        "p95_response_time": p95_response,
         "success_rate": round(successful_requests / max(total_requests, 1) * 100, 1)
     }
 
 
+@app.get("/admin/performance/{company_id}")
+async def get_widget_performance(
+    company_id: str,
+    hours: int = 24,
+    admin: dict = Depends(get_super_admin),
+    db: Session = Depends(get_db)
+):
+    """Get widget performance stats for a company"""
+    cutoff = datetime.utcnow() - timedelta(hours=hours)
+
+    perf = db.query(WidgetPerformance).filter(
+        WidgetPerformance.company_id == company_id,
+        WidgetPerformance.hour >= cutoff
+    ).order_by(WidgetPerformance.hour).all()
+
+    # Also get current rate limit stats
+    rate_limit_stats = chat_rate_limiter.stats(label=company_id)
+
+    return {
+        "hourly_stats": [{
+            "hour": p.hour.isoformat(),
+            "total_requests": p.total_requests,
+            "successful_requests": p.successful_requests,
+            "failed_requests": p.failed_requests,
+            "rate_limited_requests": p.rate_limited_requests,
+            "avg_response_time": p.avg_response_time,
+            "p95_response_time": p.p95_response_time,
+            "error_counts": json.loads(p.error_counts) if p.error_counts else {}
+        } for p in perf],
+        "current_rate_limit_sessions": rate_limit_stats["limited_keys"],
+        "current_rate_limited_requests": rate_limit_stats["rejected_requests"]
+    }
+
+
 # =============================================================================
 # Rate Limiting Display
 # =============================================================================
@@ -8573,27 +8719,50 @@ async def get_rate_limit_stats(
     admin: dict = Depends(get_super_admin)
 ):
     """Get current rate limiting statistics"""
-    now = datetime.utcnow().timestamp()
-
-    # Clean old entries and count active sessions
-    active_sessions = 0
-    rate_limited_sessions = 0
-
-    for key, timestamps in list(rate_limit_store.items()):
-        recent = [ts for ts in timestamps if now - ts < RATE_LIMIT_WINDOW]
-        if recent:
-            active_sessions += 1
-            if len(recent) >= RATE_LIMIT_MAX_REQUESTS:
-                rate_limited_sessions += 1
+    # Sliding-window estimates over the last window, kept up to date by the limiter
+    stats = chat_rate_limiter.stats()
 
     return {
-        "active_sessions": active_sessions,
-        "rate_limited_sessions": rate_limited_sessions,
+        "active_sessions": stats["active_keys"],
+        "rate_limited_sessions": stats["limited_keys"],
+        "rejected_requests": stats["rejected_requests"],
         "rate_limit_window_seconds": RATE_LIMIT_WINDOW,
         "rate_limit_max_requests": RATE_LIMIT_MAX_REQUESTS
     }
 
 
+# =============================================================================
+# Response Cache Display
+# =============================================================================
+
+@app.get("/admin/response-cache")
+async def get_response_cache_stats(
+    admin: dict = Depends(get_super_admin)
+):
+    """Get chat response cache statistics (size, hit rate, evictions) and coalesced generations"""
+    return {**response_cache.stats(), "single_flight": chat_flights.stats()}
+
+
+@app.delete("/admin/response-cache")
+async def clear_response_cache(
+    admin: dict = Depends(get_super_admin),
+    db: Session = Depends(get_db)
+):
+    """Empty the chat response cache"""
+    require_admin_rate_limit(admin)
+    response_cache.clear()
+    log_admin_action(db, admin["username"], "clear_response_cache", description="Tömde svarscachen")
+    return {"message": "Svarscachen tömd"}
+
+
+@app.get("/admin/write-behind")
+async def get_write_behind_stats(
+    admin: dict = Depends(get_super_admin)
+):
+    """Get write-behind queue statistics (queue depth, batches, dropped writes)"""
+    return write_queue.stats()
+
+
 # =============================================================================
 # Bulk Operations Endpoints
 # =============================================================================
@@ -8625,6 +8794,8 @@ async def bulk_set_limits(
             updated += 1
 
     db.commit()
+    for company_id in update.company_ids:
+        config_cache.invalidate_company(company_id)
 
     log_admin_action(
         db, admin["username"], "bulk_set_limits",
@@ -8636,35 +8807,59 @@ async def bulk_set_limits(
     return {"message": f"Uppdaterade gränser för {updated} företag"}
 
 
-@app.get("/admin/bulk/export-companies")
-async def export_companies_csv(
-    admin: dict = Depends(get_super_admin),
-    db: Session = Depends(get_db)
-):
-    """Export all companies as CSV"""
-    from fastapi.responses import StreamingResponse
-    import io
+COMPANY_EXPORT_COLUMNS = [
+    ("id", "id"), ("name", "name"), ("is_active", "is_active"), ("created_at", "created_at"),
+    ("knowledge_count", "knowledge_count"), ("chat_count", "chat_count"),
+    ("max_conversations", "max_conversations"), ("current_conversations", "current_conversations"),
+    ("max_knowledge", "max_knowledge"),
+]
 
-    companies = db.query(Company).all()
-    output = io.StringIO()
-    output.write("id,name,is_active,created_at,knowledge_count,chat_count,max_conversations,current_conversations,max_knowledge\n")
 
+def company_export_rows(db: Session, companies: list) -> List[dict]:
+    """One export page of companies: settings and counts in three queries per page"""
+    ids = [c.id for c in companies]
+    settings = {
+        s.company_id: s for s in db.query(
+            CompanySettings.company_id, CompanySettings.max_conversations_month,
+            CompanySettings.current_month_conversations, CompanySettings.max_knowledge_items
+        ).filter(CompanySettings.company_id.in_(ids))
+    }
+    knowledge_counts = dict(db.query(KnowledgeItem.company_id, func.count(KnowledgeItem.id)).filter(
+        KnowledgeItem.company_id.in_(ids)
+    ).group_by(KnowledgeItem.company_id))
+    chat_counts = dict(db.query(Conversation.company_id, func.count(Conversation.id)).filter(
+        Conversation.company_id.in_(ids)
+    ).group_by(Conversation.company_id))
+
+    rows = []
     for c in companies:
-        settings = db.query(CompanySettings).filter(CompanySettings.company_id == c.id).first()
-        knowledge_count = db.query(KnowledgeItem).filter(KnowledgeItem.company_id == c.id).count()
-        chat_count = db.query(Conversation).filter(Conversation.company_id == c.id).count()
+        s = settings.get(c.id)
+        rows.append({
+            "id": c.id,
+            "name": c.name,
+            "is_active": c.is_active,
+            "created_at": c.created_at.isoformat(),
+            "knowledge_count": knowledge_counts.get(c.id, 0),
+            "chat_count": chat_counts.get(c.id, 0),
+            "max_conversations": s.max_conversations_month if s else 0,
+            "current_conversations": s.current_month_conversations if s else 0,
+            "max_knowledge": s.max_knowledge_items if s else 0
+        })
+    return rows
 
-        output.write(f"{c.id},{c.name},{c.is_active},{c.created_at.isoformat()},{knowledge_count},{chat_count},")
-        output.write(f"{settings.max_conversations_month if settings else 0},")
-        output.write(f"{settings.current_month_conversations if settings else 0},")
-        output.write(f"{settings.max_knowledge_items if settings else 0}\n")
 
-    output.seek(0)
-    return StreamingResponse(
-        io.BytesIO(output.getvalue().encode()),
-        media_type="text/csv",
-        headers={"Content-Disposition": f"attachment; filename=companies_{date.today().isoformat()}.csv"}
+@app.get("/admin/bulk/export-companies")
+def export_companies_csv(
+    admin: dict = Depends(get_super_admin),
+    format: str = "csv"
+):
+    """Export all companies as CSV, JSON or NDJSON (streamed)"""
+    pages = keyset_pages(
+        SessionLocal,
+        lambda db: db.query(Company.id, Company.name, Company.is_active, Company.created_at),
+        [Company.id], transform=company_export_rows
     )
+    return export_response(pages, format, COMPANY_EXPORT_COLUMNS, f"companies_{date.today().isoformat()}")
 
 
 class BulkImportCompany(BaseModel):
@@ -0,0 +1,368 @@
+"""
+Bobot Metrics
+In-process Prometheus metrics and hourly widget performance rows
+
+    GET /metrics    -> text exposition format (no Prometheus client library needed)
+
+RequestIDMiddleware records every request (latency, status, SQL count and
+time per route template); chat requests are also recorded per company
+(latency, success / failed / rate limited) and aggregated per hour in
+memory. An hourly task writes the finished hours to WidgetPerformance
+(avg, min, max and p95 response time, error counts), so the admin
+performance views show real values.
+
+Metrics live in the process: with several uvicorn workers each serves its
+own /metrics (scrape them per worker), and their hourly rows for the same
+company and hour are merged on flush (p95 then becomes the highest of
+the workers' p95s).
+"""
+
+import json
+import math
+import os
+import threading
+from array import array
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy.orm import Session
+
+from database import WidgetPerformance
+
+
+# =============================================================================
+# Configuration
+# =============================================================================
+
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")  # Bearer token for /metrics (required in production)
+METRICS_MAX_COMPANIES = int(os.getenv("METRICS_MAX_COMPANIES", "500"))  # Company labels; the rest are "other"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+# =============================================================================
+# Registry
+# =============================================================================
+
+class Counter:
+    """Monotonic count per label combination"""
+
+    type = "counter"
+
+    def __init__(self, registry: "Registry", name: str, help: str, labels: Sequence[str] = ()):
+        self._lock = registry.lock
+        self.name, self.help, self.labelnames = name, help, tuple(labels)
+        self._values: Dict[LabelValues, float] = defaultdict(float)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] += amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(str(labels[name]) for name in self.labelnames), 0)
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+                for key, value in sorted(self._values.items())]
+
+
+class Histogram:
+    """Cumulative buckets, sum and count per label combination"""
+
+    type = "histogram"
+
+    def __init__(self, registry: "Registry", name: str, help: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self._lock = registry.lock
+        self.name, self.help, self.labelnames = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = defaultdict(float)
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self._sums[key] += value
+
+    def count(self, **labels) -> int:
+        return sum(self._counts.get(tuple(str(labels[name]) for name in self.labelnames), ()))
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, counts in sorted(self._counts.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(round(self._sums[key], 6))}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Value read from a callback at scrape time (cache sizes, limiter state, ...)"""
+
+    def __init__(self, name: str, help: str, read: Callable[[], float], type: str = "gauge"):
+        self.name, self.help, self.read, self.type = name, help, read, type
+
+    def render(self) -> List[str]:
+        return [f"{self.name} {_number(self.read())}"]
+
+
+class Registry:
+    """Named metrics rendered together in the Prometheus text format"""
+
+    def __init__(self):
+        self.lock = threading.Lock()  # Requests are recorded from the event loop and DB threads
+        self._metrics: Dict[str, object] = {}
+
+    def _add(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(self, name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(self, name, help, labels, buckets))
+
+    def gauge(self, name: str, help: str, read: Callable[[], float], type: str = "gauge") -> Gauge:
+        """A value read when scraped; type="counter" for totals kept elsewhere"""
+        return self._add(Gauge(name, help, read, type))
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            if isinstance(metric, Gauge):
+                lines.extend(metric.render())
+            else:
+                with self.lock:
+                    lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    "bobot_http_requests_total", "HTTP requests by route template and status", ("method", "route", "status"))
+http_duration = registry.histogram(
+    "bobot_http_request_duration_seconds", "HTTP request latency by route template", ("route",))
+db_queries = registry.counter(
+    "bobot_db_queries_total", "SQL statements executed by route template", ("route",))
+db_duration = registry.histogram(
+    "bobot_db_duration_seconds", "Time spent in SQL per request by route template", ("route",))
+external_duration = registry.histogram(
+    "bobot_external_request_duration_seconds", "Latency of calls to other services (Ollama)", ("service",))
+chat_requests = registry.counter(
+    "bobot_chat_requests_total", "Chat requests by company and outcome (success, failed, rate_limited)",
+    ("company", "outcome"))
+chat_duration = registry.histogram(
+    "bobot_chat_duration_seconds", "Chat request latency by company", ("company",))
+
+
+# =============================================================================
+# Recording
+# =============================================================================
+
+_companies: set = set()
+
+
+def company_label(company_id: str) -> str:
+    """The company id, or "other" once METRICS_MAX_COMPANIES companies have a label"""
+    if company_id in _companies:
+        return company_id
+    with registry.lock:
+        if len(_companies) < METRICS_MAX_COMPANIES:
+            _companies.add(company_id)
+            return company_id
+    return "other"
+
+
+def outcome(status: int) -> str:
+    if status == 429:
+        return "rate_limited"
+    return "success" if status < 400 else "failed"
+
+
+def error_kind(status: int) -> Optional[str]:
+    """Key in WidgetPerformance.error_counts for a failed chat request"""
+    if status < 400 or status == 429:
+        return None
+    if status == 503:
+        return "ollama_error"
+    if status == 504:
+        return "timeout"
+    if status >= 500:
+        return "server_error"
+    return f"http_{status}"
+
+
+def record_request(method: str, route: str, status: int, duration_ms: float, queries: int, db_ms: float,
+                   company_id: Optional[str] = None):
+    """Called by RequestIDMiddleware once per request"""
+    http_requests.inc(method=method, route=route, status=status)
+    http_duration.observe(duration_ms / 1000, route=route)
+    db_queries.inc(queries, route=route)
+    db_duration.observe(db_ms / 1000, route=route)
+    if company_id:
+        record_chat(company_id, status, duration_ms)
+
+
+def record_chat(company_id: str, status: int, duration_ms: float):
+    """One chat turn; streamed turns are recorded when their stream ends"""
+    label = company_label(company_id)
+    chat_requests.inc(company=label, outcome=outcome(status))
+    chat_duration.observe(duration_ms / 1000, company=label)
+    performance.record(company_id, duration_ms, status)
+
+
+def record_external(service: str, duration_ms: float):
+    external_duration.observe(duration_ms / 1000, service=service)
+
+
+# =============================================================================
+# Hourly Widget Performance
+# =============================================================================
+
+class _Hour:
+    __slots__ = ("total", "successful", "failed", "rate_limited", "durations", "errors")
+
+    def __init__(self):
+        self.total = self.successful = self.failed = self.rate_limited = 0
+        self.durations = array("I")  # ms of every answered or failed request
+        self.errors: Dict[str, int] = defaultdict(int)
+
+
+def percentile(sorted_values: Sequence[int], fraction: float) -> int:
+    if not sorted_values:
+        return 0
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+class HourlyPerformance:
+    """Chat requests per company and hour, until flushed to WidgetPerformance"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hours: Dict[Tuple[str, datetime], _Hour] = {}
+
+    def record(self, company_id: str, duration_ms: float, status: int, at: Optional[datetime] = None):
+        hour = (at or datetime.utcnow()).replace(minute=0, second=0, microsecond=0)
+        with self._lock:
+            stats = self._hours.get((company_id, hour))
+            if stats is None:
+                stats = self._hours[(company_id, hour)] = _Hour()
+            stats.total += 1
+            kind = outcome(status)
+            if kind == "rate_limited":
+                stats.rate_limited += 1  # Rejected up front; not a response time
+                return
+            if kind == "success":
+                stats.successful += 1
+            else:
+                stats.failed += 1
+                stats.errors[error_kind(status)] += 1
+            stats.durations.append(max(0, int(duration_ms)))
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._hours)
+
+    def flush(self, db: Session, before: Optional[datetime] = None) -> int:
+        """Write the hours that started before `before` (default: all) and forget them
+
+        Rows that already exist for a company and hour (another worker, an
+        earlier shutdown) are merged. Returns the number of hours written.
+        """
+        with self._lock:
+            keys = [key for key in self._hours if before is None or key[1] < before]
+            hours = {key: self._hours.pop(key) for key in keys}
+        if not hours:
+            return 0
+        try:
+            existing = {
+                (row.company_id, row.hour): row for row in db.query(WidgetPerformance).filter(
+                    WidgetPerformance.company_id.in_({company_id for company_id, _ in hours}),
+                    WidgetPerformance.hour.in_({hour for _, hour in hours})
+                )
+            }
+            for (company_id, hour), stats in hours.items():
+                self._write(db, existing.get((company_id, hour)), company_id, hour, stats)
+            db.commit()
+        except Exception:
+            db.rollback()
+            with self._lock:  # Keep them for the next flush
+                for key, stats in hours.items():
+                    self._hours.setdefault(key, stats)
+            raise
+        return len(hours)
+
+    @staticmethod
+    def _write(db: Session, row: Optional[WidgetPerformance], company_id: str, hour: datetime, stats: _Hour):
+        durations = sorted(stats.durations)
+        timed = len(durations)
+        if row is None:
+            row = WidgetPerformance(company_id=company_id, hour=hour, total_requests=0, successful_requests=0,
+                                    failed_requests=0, rate_limited_requests=0, avg_response_time=0,
+                                    min_response_time=0, max_response_time=0, p95_response_time=0)
+            db.add(row)
+        previous_timed = (row.successful_requests or 0) + (row.failed_requests or 0)
+
+        if timed:
+            row.avg_response_time = (
+                (row.avg_response_time or 0) * previous_timed + sum(durations)
+            ) / (previous_timed + timed)
+            row.min_response_time = min(row.min_response_time, durations[0]) if previous_timed else durations[0]
+            row.max_response_time = max(row.max_response_time or 0, durations[-1])
+            row.p95_response_time = max(row.p95_response_time or 0, percentile(durations, 0.95))
+        row.total_requests = (row.total_requests or 0) + stats.total
+        row.successful_requests = (row.successful_requests or 0) + stats.successful
+        row.failed_requests = (row.failed_requests or 0) + stats.failed
+        row.rate_limited_requests = (row.rate_limited_requests or 0) + stats.rate_limited
+
+        errors = json.loads(row.error_counts or "{}")
+        for kind, count in stats.errors.items():
+            errors[kind] = errors.get(kind, 0) + count
+        row.error_counts = json.dumps(errors)
+
+
+performance = HourlyPerformance()
+
+
+def next_hour(now: Optional[datetime] = None) -> datetime:
+    now = now or datetime.utcnow()
+    return now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
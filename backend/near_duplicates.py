@@ -0,0 +1,176 @@
+"""
+Bobot Near-Duplicate Detection
+MinHash signatures and LSH banding for finding similar knowledge questions
+
+Similarity is the Jaccard overlap of two questions' word sets. A MinHash
+signature (MINHASH_PERMUTATIONS minimum hashes) estimates it, and LSH
+groups signatures into LSH_BANDS bands: questions that agree on any whole
+band share a bucket. Lookups then only compare against the items in the
+query's buckets instead of every item of the company. With 32 bands of 2
+rows, a pair with similarity 0.3 becomes a candidate 95% of the time and a
+pair at 0.5 or more practically always. Candidates are scored by their
+exact Jaccard similarity.
+
+Signatures are stored in KnowledgeItem.minhash, so loading a company's
+index does not rehash every question.
+"""
+
+import logging
+import os
+import re
+import zlib
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from sqlalchemy import update
+
+from database import KnowledgeItem
+
+logger = logging.getLogger("bobot")
+
+
+# =============================================================================
+# Configuration
+# =============================================================================
+
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 32  # 2 rows per band
+NEAR_DUPLICATE_SIMILARITY = float(os.getenv("NEAR_DUPLICATE_SIMILARITY", "0.75"))  # Import dedup threshold
+
+_PRIME = (1 << 31) - 1  # a * crc32 + b stays below 2**63
+_rng = np.random.default_rng(20240101)  # Fixed seed: stored signatures must stay comparable
+_A = _rng.integers(1, _PRIME, MINHASH_PERMUTATIONS, dtype=np.uint64)[:, None]
+_B = _rng.integers(0, _PRIME, MINHASH_PERMUTATIONS, dtype=np.uint64)[:, None]
+
+_WORD_RE = re.compile(r"\w+")
+
+
+# =============================================================================
+# Signatures
+# =============================================================================
+
+def question_words(question: str) -> FrozenSet[str]:
+    """Lower-cased words of a question, punctuation removed"""
+    return frozenset(_WORD_RE.findall(question.lower()))
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    union = len(a | b)
+    return len(a & b) / union if union else 0.0
+
+
+def minhash(words: Iterable[str]) -> Optional[np.ndarray]:
+    """MinHash signature (uint32) of a word set; None for an empty set"""
+    hashes = np.fromiter((zlib.crc32(word.encode()) for word in words), dtype=np.uint64)
+    if not len(hashes):
+        return None
+    return ((_A * hashes + _B) % _PRIME).min(axis=1).astype(np.uint32)
+
+
+def encode_signature(signature: Optional[np.ndarray]) -> Optional[bytes]:
+    return None if signature is None else signature.astype("<u4").tobytes()
+
+
+def decode_signature(data: Optional[bytes]) -> Optional[np.ndarray]:
+    if not data or len(data) != MINHASH_PERMUTATIONS * 4:
+        return None  # Missing, or made with another MINHASH_PERMUTATIONS
+    return np.frombuffer(data, dtype="<u4").astype(np.uint32)
+
+
+def question_signature(question: str) -> Optional[bytes]:
+    """The stored form of a question's signature (KnowledgeItem.minhash)"""
+    return encode_signature(minhash(question_words(question)))
+
+
+# =============================================================================
+# LSH Index
+# =============================================================================
+
+class LSHIndex:
+    """Item ids bucketed by the bands of their question's MinHash signature"""
+
+    def __init__(self, bands: int = LSH_BANDS):
+        self.bands = bands
+        self.buckets: Dict[Tuple[int, bytes], Set[int]] = {}
+        self.entries: Dict[int, Tuple[FrozenSet[str], List[Tuple[int, bytes]]]] = {}  # id -> (words, keys)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _keys(self, signature: np.ndarray) -> List[Tuple[int, bytes]]:
+        return [(band, rows.tobytes()) for band, rows in enumerate(np.split(signature, self.bands))]
+
+    def add(self, item_id: int, words: FrozenSet[str], signature: Optional[np.ndarray] = None):
+        self.remove(item_id)
+        if signature is None:
+            signature = minhash(words)
+        keys = self._keys(signature) if signature is not None else []
+        for key in keys:
+            self.buckets.setdefault(key, set()).add(item_id)
+        self.entries[item_id] = (words, keys)
+
+    def remove(self, item_id: int):
+        entry = self.entries.pop(item_id, None)
+        if entry is None:
+            return
+        for key in entry[1]:
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                bucket.discard(item_id)
+                if not bucket:
+                    del self.buckets[key]
+
+    def candidates(self, signature: Optional[np.ndarray]) -> Set[int]:
+        if signature is None:
+            return set()
+        found = set()
+        for key in self._keys(signature):
+            found |= self.buckets.get(key, set())
+        return found
+
+    def similar(self, words: FrozenSet[str], min_similarity: float,
+                signature: Optional[np.ndarray] = None) -> List[Tuple[float, int]]:
+        """(similarity, item id) of candidates at or above min_similarity, most similar first"""
+        if signature is None:
+            signature = minhash(words)
+        scored = []
+        for item_id in self.candidates(signature):
+            similarity = jaccard(words, self.entries[item_id][0])
+            if similarity >= min_similarity:
+                scored.append((similarity, item_id))
+        scored.sort(key=lambda x: (-x[0], x[1]))
+        return scored
+
+
+# =============================================================================
+# Backfill
+# =============================================================================
+
+def backfill_signatures(session_factory, batch_size: int = 500) -> int:
+    """Store signatures for knowledge items that have none (rows from before the column existed)"""
+    filled = 0
+    last_id = 0
+    db = session_factory()
+    try:
+        while True:
+            # Paged by id: questions without words get no signature and must not be selected again
+            rows = db.query(KnowledgeItem.id, KnowledgeItem.question).filter(
+                KnowledgeItem.minhash.is_(None),
+                KnowledgeItem.id > last_id
+            ).order_by(KnowledgeItem.id).limit(batch_size).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            updates = [{"id": row.id, "minhash": question_signature(row.question)} for row in rows]
+            updates = [row for row in updates if row["minhash"] is not None]
+            if updates:
+                db.execute(update(KnowledgeItem), updates)  # One executemany UPDATE per batch
+                db.commit()
+                filled += len(updates)
+            if len(rows) < batch_size:
+                break
+    finally:
+        db.close()
+    if filled:
+        logger.info(f"[Near-duplicates] Stored MinHash signatures for {filled} knowledge items")
+    return filled
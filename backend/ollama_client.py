@@ -0,0 +1,72 @@
+"""
+Bobot Ollama Client
+Shared, pooled HTTP client for Ollama traffic (and outbound URL imports)
+"""
+
+import os
+from typing import Optional
+
+import httpx
+
+
+# =============================================================================
+# Configuration
+# =============================================================================
+
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "qwen2.5:7b-instruct")
+
+# Per-use timeouts (seconds)
+OLLAMA_CHAT_TIMEOUT = float(os.getenv("OLLAMA_CHAT_TIMEOUT", "60"))
+OLLAMA_EXTRACT_TIMEOUT = float(os.getenv("OLLAMA_EXTRACT_TIMEOUT", "180"))  # 3 min for large pages
+OLLAMA_HEALTH_TIMEOUT = float(os.getenv("OLLAMA_HEALTH_TIMEOUT", "3"))
+URL_FETCH_TIMEOUT = float(os.getenv("URL_FETCH_TIMEOUT", "30"))
+
+# Connection pool
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+
+CHAT_TIMEOUT = httpx.Timeout(OLLAMA_CHAT_TIMEOUT)
+EXTRACT_TIMEOUT = httpx.Timeout(OLLAMA_EXTRACT_TIMEOUT)
+HEALTH_TIMEOUT = httpx.Timeout(OLLAMA_HEALTH_TIMEOUT)
+FETCH_TIMEOUT = httpx.Timeout(URL_FETCH_TIMEOUT)
+
+
+# =============================================================================
+# Client Lifecycle
+# =============================================================================
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """Create a pooled AsyncClient with the configured limits"""
+    return httpx.AsyncClient(
+        timeout=CHAT_TIMEOUT,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the process-wide client
+
+    The client is normally opened in the app lifespan. It is created on first
+    use as well, so scripts and tests that never run the lifespan still work.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = create_http_client()
+    return _client
+
+
+async def close_http_client():
+    """Close the process-wide client (called on shutdown)"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
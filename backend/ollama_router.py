@@ -0,0 +1,245 @@
+"""
+Bobot Ollama Router
+Spreads Ollama calls over several nodes (GPU boxes) with passive health checks
+
+    async with ollama_router.node(OLLAMA_MODEL) as node:
+        response = await client.post(f"{node.url}/api/generate", ...)
+
+Nodes come from OLLAMA_NODES (comma-separated base URLs), or the single
+OLLAMA_BASE_URL. Each call goes to the healthy node with the fewest
+outstanding requests that serves the model (learned from /api/tags; a node
+whose models are unknown is assumed to serve every model, and if no node
+lists the model any healthy node is used so Ollama can answer 404).
+
+A node that refuses the connection (or does not accept it in time) is
+ejected; one that accepts requests but answers none of the last
+OLLAMA_EJECT_TIMEOUTS in time is ejected as hung, while a single slow
+generation is not held against it. The last healthy node is only ejected
+if it also fails an immediate /api/tags probe. Ejected nodes are re-probed
+every OLLAMA_PROBE_INTERVAL seconds (by the background probe, or by a call
+that finds no healthy node) and return as soon as they answer. State is
+per process.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Collection, Iterable, List, Optional, Set
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+# =============================================================================
+# Configuration
+# =============================================================================
+
+OLLAMA_NODES = [url.strip().rstrip("/") for url in os.getenv("OLLAMA_NODES", "").split(",") if url.strip()]
+OLLAMA_PROBE_INTERVAL = float(os.getenv("OLLAMA_PROBE_INTERVAL", "10"))  # Seconds between probes of ejected nodes
+OLLAMA_EJECT_TIMEOUTS = int(os.getenv("OLLAMA_EJECT_TIMEOUTS", "3"))  # Consecutive read timeouts that eject a node
+
+
+class NoHealthyNode(httpx.ConnectError):
+    """Every Ollama node is ejected (handled like a refused connection)"""
+
+
+def is_node_failure(e: BaseException) -> bool:
+    """Errors that say the node is down: the connection was refused or not accepted in time"""
+    return isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout)) and not isinstance(e, NoHealthyNode)
+
+
+def is_slow_response(e: BaseException) -> bool:
+    """Timeouts after the node took the request: a slow generation, or a hung node if they repeat"""
+    return isinstance(e, httpx.TimeoutException) and not isinstance(e, (httpx.ConnectTimeout, httpx.PoolTimeout))
+
+
+def model_names(tags: dict) -> Set[str]:
+    """Model names from an /api/tags response, with and without the ":latest" tag"""
+    names = set()
+    for model in tags.get("models", []):
+        name = model.get("name") or model.get("model")
+        if name:
+            names.add(name)
+            names.add(name.removesuffix(":latest"))
+    return names
+
+
+# =============================================================================
+# Nodes
+# =============================================================================
+
+class OllamaNode:
+    __slots__ = ("url", "healthy", "models", "outstanding", "requests", "failures", "timeouts",
+                 "last_error", "ejected_at", "last_probe", "last_pick")
+
+    def __init__(self, url: str):
+        self.url = url
+        self.healthy = True
+        self.models: Optional[Set[str]] = None  # None until probed
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.timeouts = 0  # Consecutive read timeouts
+        self.last_error: Optional[str] = None
+        self.ejected_at: Optional[float] = None
+        self.last_probe = 0.0
+        self.last_pick = 0
+
+    def serves(self, model: str) -> bool:
+        return self.models is None or model in self.models
+
+    def status(self) -> dict:
+        return {
+            "url": self.url,
+            "status": "online" if self.healthy else "ejected",
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "models": sorted(self.models) if self.models is not None else None,
+            "last_error": self.last_error,
+        }
+
+
+class OllamaRouter:
+    """Least-outstanding-requests balancing over the healthy nodes"""
+
+    def __init__(self, urls: Callable[[], Iterable[str]], get_client: Callable[[], httpx.AsyncClient],
+                 probe_timeout: Optional[httpx.Timeout] = None, probe_interval: float = OLLAMA_PROBE_INTERVAL,
+                 eject_timeouts: int = OLLAMA_EJECT_TIMEOUTS, clock=time.monotonic):
+        self._urls = urls
+        self._get_client = get_client
+        self.probe_timeout = probe_timeout
+        self.probe_interval = probe_interval
+        self.eject_timeouts = eject_timeouts
+        self._clock = clock
+        self._nodes: List[OllamaNode] = []
+        self._picks = 0
+
+    @property
+    def nodes(self) -> List[OllamaNode]:
+        """Current nodes; state is kept for URLs that stay configured"""
+        urls = [url.rstrip("/") for url in self._urls()]
+        if urls != [node.url for node in self._nodes]:
+            known = {node.url: node for node in self._nodes}
+            self._nodes = [known.get(url) or OllamaNode(url) for url in urls]
+        return self._nodes
+
+    def candidates(self, model: str, exclude: Collection[str] = ()) -> List[OllamaNode]:
+        healthy = [node for node in self.nodes if node.healthy and node.url not in exclude]
+        return [node for node in healthy if node.serves(model)] or healthy
+
+    # -------------------------------------------------------------------------
+    # Routing
+    # -------------------------------------------------------------------------
+
+    @asynccontextmanager
+    async def node(self, model: str, exclude: Collection[str] = ()) -> AsyncIterator[OllamaNode]:
+        """Least busy healthy node serving model (raises NoHealthyNode)
+
+        A connect error in the block, or eject_timeouts read timeouts in a
+        row, ejects the node (see fail()).
+        """
+        candidates = self.candidates(model, exclude)
+        if not candidates:
+            await self.probe(ejected_only=True, due_only=True)
+            candidates = self.candidates(model, exclude)
+        if not candidates:
+            raise NoHealthyNode("Ingen Ollama-nod är tillgänglig")
+
+        node = min(candidates, key=lambda n: (n.outstanding, n.last_pick))
+        self._picks += 1
+        node.last_pick = self._picks
+        node.outstanding += 1
+        node.requests += 1
+        try:
+            yield node
+        except BaseException as e:
+            if is_node_failure(e):
+                await self.fail(node, e)
+            elif is_slow_response(e):
+                node.timeouts += 1
+                if node.timeouts >= self.eject_timeouts:
+                    await self.fail(node, e)
+            raise
+        else:
+            node.timeouts = 0
+        finally:
+            node.outstanding -= 1
+
+    async def post(self, path: str, payload: dict, timeout: Optional[httpx.Timeout] = None) -> httpx.Response:
+        """POST to the least busy node serving payload["model"]
+
+        A node that refuses the connection never saw the request, so the
+        call moves on to the next healthy node; timeouts are not retried.
+        """
+        tried: List[str] = []
+        while True:
+            try:
+                async with self.node(payload["model"], exclude=tried) as node:
+                    return await self._get_client().post(f"{node.url}{path}", json=payload, timeout=timeout)
+            except NoHealthyNode:
+                raise
+            except httpx.ConnectError:
+                tried.append(node.url)
+                if not self.candidates(payload["model"], tried):
+                    raise
+
+    async def fail(self, node: OllamaNode, error: BaseException):
+        """Eject a failing node; the last healthy one only if it does not answer a probe either"""
+        if node.healthy and not any(other.healthy for other in self.nodes if other is not node):
+            await self._probe(node, error)
+        else:
+            self.eject(node, error)
+
+    def eject(self, node: OllamaNode, error: BaseException):
+        node.failures += 1
+        node.last_error = f"{type(error).__name__}: {error}"[:200]
+        node.timeouts = 0
+        if node.healthy:
+            node.healthy = False
+            node.ejected_at = node.last_probe = self._clock()
+            logger.warning(f"[Ollama router] {node.url} ejected ({node.last_error})")
+
+    # -------------------------------------------------------------------------
+    # Probes
+    # -------------------------------------------------------------------------
+
+    async def probe(self, ejected_only: bool = False, due_only: bool = False) -> List[dict]:
+        """Probe nodes via /api/tags (all, or only ejected ones); returns every node's status"""
+        now = self._clock()
+        nodes = [node for node in self.nodes
+                 if not (ejected_only and node.healthy)
+                 and not (due_only and now - node.last_probe < self.probe_interval)]
+        await asyncio.gather(*[self._probe(node) for node in nodes])
+        return self.status()
+
+    async def _probe(self, node: OllamaNode, error: Optional[BaseException] = None):
+        """Refresh a node's models; if it does not answer, eject it (for error, if given)"""
+        node.last_probe = self._clock()
+        try:
+            response = await self._get_client().get(f"{node.url}/api/tags", timeout=self.probe_timeout)
+            response.raise_for_status()
+            node.models = model_names(response.json())
+        except Exception as e:
+            self.eject(node, error or e)
+            return
+        node.timeouts = 0
+        if not node.healthy:
+            node.healthy = True
+            node.ejected_at = None
+            logger.info(f"[Ollama router] {node.url} back online")
+
+    async def run_probes(self):
+        """Re-probe ejected nodes every probe_interval seconds (background task)"""
+        while True:
+            await asyncio.sleep(self.probe_interval)
+            try:
+                await self.probe(ejected_only=True)
+            except Exception as e:
+                logger.error(f"[Ollama router] Probe failed: {e}")
+
+    def status(self) -> List[dict]:
+        return [node.status() for node in self.nodes]
@@ -0,0 +1,231 @@
+"""
+Bobot Ollama Scheduler
+Concurrency limit and weighted fair queuing per company in front of Ollama
+
+    async with ollama_scheduler.slot(company_id, tier=company.pricing_tier):
+        answer = await query_ollama(prompt)
+
+A local model slows down for everyone when it generates too many answers
+at once, so at most OLLAMA_CONCURRENCY generations run together. Waiting
+requests are served in weighted fair order (virtual finish time per
+company, as in WFQ): a company with many queued questions does not starve
+the others, and a company's share of the model follows its pricing tier
+weight.
+
+When the queue is full, or the predicted wait (queue position x average
+generation time / concurrency) exceeds OLLAMA_MAX_QUEUE_WAIT, requests
+are rejected at once with SchedulerBusy (503 with Retry-After), well
+before they would have hit the Ollama timeout. The limit is per process.
+
+Knowledge imports take background slots: they queue in a lane of their
+own per company (so a company's chats do not wait behind its import) at
+OLLAMA_BACKGROUND_WEIGHT of the tier weight, wait as long as it takes
+instead of being rejected, and are left out of the queue length and
+generation-time average that decide whether a chat is admitted.
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+
+# =============================================================================
+# Configuration
+# =============================================================================
+
+OLLAMA_CONCURRENCY = int(os.getenv("OLLAMA_CONCURRENCY", "2"))  # Generations running at once
+OLLAMA_MAX_QUEUE = int(os.getenv("OLLAMA_MAX_QUEUE", "50"))  # Waiting requests before 503
+OLLAMA_MAX_QUEUE_WAIT = float(os.getenv("OLLAMA_MAX_QUEUE_WAIT", "30"))  # Seconds a request may wait
+
+
+def parse_weights(raw: str) -> Dict[str, float]:
+    """{"starter": 1.0, ...} from "starter:1,professional:2" """
+    weights = {}
+    for part in raw.split(","):
+        tier, _, weight = part.partition(":")
+        if tier.strip() and weight.strip():
+            weights[tier.strip()] = float(weight)
+    return weights
+
+
+# Share of the model per pricing tier (relative)
+OLLAMA_BACKGROUND_WEIGHT = float(os.getenv("OLLAMA_BACKGROUND_WEIGHT", "0.5"))  # Of the tier weight, for imports
+BACKGROUND_LANE = "/import"  # Queue key suffix of a company's background slots
+TIER_WEIGHTS = parse_weights(os.getenv("OLLAMA_TIER_WEIGHTS", "starter:1,professional:2,business:3,enterprise:4"))
+
+
+class SchedulerBusy(Exception):
+    """Too many queued generations; retry after retry_after seconds"""
+
+    def __init__(self, retry_after: int, reason: str):
+        super().__init__(reason)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+# =============================================================================
+# Scheduler
+# =============================================================================
+
+class OllamaScheduler:
+    """Limits concurrent generations and queues the rest fairly per company"""
+
+    def __init__(self, concurrency: int = OLLAMA_CONCURRENCY, max_queue: int = OLLAMA_MAX_QUEUE,
+                 max_wait: float = OLLAMA_MAX_QUEUE_WAIT, weights: Optional[Dict[str, float]] = None,
+                 clock=time.monotonic):
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.weights = TIER_WEIGHTS if weights is None else weights
+        self._clock = clock
+
+        self.active = 0
+        # (virtual finish, order, future, company_id); cancelled waiters are skipped when popped
+        self._queue: List[Tuple[float, int, asyncio.Future, str]] = []
+        self._order = itertools.count()
+        self._virtual_time = 0.0
+        self._last_finish: Dict[str, float] = {}
+        self._queued: Dict[str, int] = defaultdict(int)
+
+        # Metrics
+        self.generation_s = 5.0  # Moving average of a generation, for the predicted wait
+        self.started = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self._waits: Deque[float] = deque(maxlen=1000)
+
+    def weight(self, tier: Optional[str]) -> float:
+        return self.weights.get(tier or "starter", 1.0) or 1.0
+
+    @property
+    def depth(self) -> int:
+        return sum(self._queued.values())
+
+    @property
+    def chat_depth(self) -> int:
+        """Queued chat generations (background slots do not count towards chat admission)"""
+        return sum(count for lane, count in self._queued.items() if not lane.endswith(BACKGROUND_LANE))
+
+    def predicted_wait(self, position: Optional[int] = None) -> float:
+        """Seconds until a chat request queued at position (default: last) would start"""
+        position = self.chat_depth + 1 if position is None else position
+        return position * self.generation_s / self.concurrency
+
+    # -------------------------------------------------------------------------
+    # Slots
+    # -------------------------------------------------------------------------
+
+    @asynccontextmanager
+    async def slot(self, company_id: str, tier: Optional[str] = None, background: bool = False) -> AsyncIterator[None]:
+        """Run the block as one generation (raises SchedulerBusy when overloaded, unless background)"""
+        if background:
+            await self.acquire(company_id + BACKGROUND_LANE, self.weight(tier) * OLLAMA_BACKGROUND_WEIGHT, background=True)
+        else:
+            await self.acquire(company_id, self.weight(tier))
+        started = self._clock()
+        try:
+            yield
+        finally:
+            # Average over recent chat generations (including failed ones, they held the model too)
+            if not background:
+                self.generation_s += 0.1 * ((self._clock() - started) - self.generation_s)
+            self.release()
+
+    async def acquire(self, company_id: str, weight: float = 1.0, background: bool = False):
+        if self.active < self.concurrency and not self.depth:
+            self.active += 1
+            self._started(0.0)
+            return
+
+        if not background:
+            if self.chat_depth >= self.max_queue:
+                self._reject("queue_full")
+            if self.predicted_wait() > self.max_wait:
+                self._reject("wait_too_long")
+
+        # Virtual finish time: after the company's previous request, one unit of model time / weight
+        start = max(self._virtual_time, self._last_finish.get(company_id, 0.0))
+        finish = start + 1.0 / weight
+        self._last_finish[company_id] = finish
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (finish, next(self._order), future, company_id))
+        self._queued[company_id] += 1
+        queued_at = self._clock()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=None if background else self.max_wait)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                self.release()  # Got the slot just as we gave up: pass it on
+            else:
+                future.cancel()
+                self._dequeued(company_id)
+            if isinstance(e, asyncio.TimeoutError):
+                self.timeouts += 1
+                self._reject("wait_timeout", count=False)
+            raise
+        self._started(self._clock() - queued_at)
+
+    def release(self):
+        self.active -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        while self.active < self.concurrency and self._queue:
+            finish, _, future, company_id = heapq.heappop(self._queue)
+            if future.done():
+                continue  # Cancelled or timed out while waiting
+            self._dequeued(company_id)
+            self._virtual_time = finish
+            self.active += 1
+            future.set_result(True)
+        if not self._queue:
+            # Idle: forget old finish times so a new backlog starts fair
+            self._last_finish.clear()
+
+    def _dequeued(self, company_id: str):
+        self._queued[company_id] -= 1
+        if self._queued[company_id] <= 0:
+            del self._queued[company_id]
+
+    def _started(self, waited: float):
+        self.started += 1
+        self._waits.append(waited)
+
+    def _reject(self, reason: str, count: bool = True):
+        if count:
+            self.rejected += 1
+        retry_after = min(60, max(1, math.ceil(self.predicted_wait(self.chat_depth) or self.generation_s)))
+        raise SchedulerBusy(retry_after, reason)
+
+    # -------------------------------------------------------------------------
+    # Stats
+    # -------------------------------------------------------------------------
+
+    def stats(self) -> dict:
+        waits = sorted(self._waits)
+        return {
+            "concurrency": self.concurrency,
+            "active": self.active,
+            "queue_depth": self.depth,
+            "queue_by_company": dict(self._queued),
+            "max_queue": self.max_queue,
+            "max_wait_seconds": self.max_wait,
+            "avg_generation_seconds": round(self.generation_s, 2),
+            "predicted_wait_seconds": round(self.predicted_wait(), 2),
+            "started": self.started,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "wait_avg_ms": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+            "wait_p95_ms": round(waits[max(0, math.ceil(0.95 * len(waits)) - 1)] * 1000, 1) if waits else 0.0,
+            "wait_max_ms": round(waits[-1] * 1000, 1) if waits else 0.0,
+        }
+
+
+ollama_scheduler = OllamaScheduler()
@@ -0,0 +1,215 @@
+"""
+Bobot Ollama Stub
+Minimal in-process Ollama-compatible HTTP server for benchmarks, tests and
+offline development (no GPU or model download needed).
+
+Usage:
+    python ollama_stub.py --port 11434 --delay 0.5
+"""
+
+import argparse
+import asyncio
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+
+class OllamaStub:
+    """Speaks enough of the Ollama HTTP API for Bobot
+
+    Supports GET /api/tags, POST /api/generate (streaming and not) and
+    POST /api/embed (deterministic hashing embeddings) over HTTP/1.1 keep-alive. `delay` simulates model time per request, and
+    `token_delay` the time between streamed tokens.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, model: str = "stub",
+                 response_text: str = "Hyran betalas senast den sista vardagen i månaden.",
+                 delay: float = 0.0, token_delay: float = 0.0):
+        self.host = host
+        self.port = port
+        self.model = model
+        self.response_text = response_text
+        self.delay = delay
+        self.token_delay = token_delay
+        self.connections = 0  # TCP connections accepted
+        self.requests = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    # -------------------------------------------------------------------------
+    # HTTP handling
+    # -------------------------------------------------------------------------
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length", "0"))
+                body = await reader.readexactly(length) if length else b""
+                self.requests += 1
+
+                await self.handle(method, path, json.loads(body) if body else {}, writer)
+
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle(self, method: str, path: str, payload: dict, writer: asyncio.StreamWriter):
+        """Dispatch one request; override in subclasses to add behaviour"""
+        if method == "GET" and path == "/api/tags":
+            await self.send_json(writer, {"models": [{"name": self.model}]})
+        elif method == "POST" and path == "/api/generate":
+            await self.generate(payload, writer)
+        elif method == "POST" and path == "/api/embed":
+            await self.embed(payload, writer)
+        else:
+            await self.send_json(writer, {"error": "not found"}, status=404)
+
+    async def generate(self, payload: dict, writer: asyncio.StreamWriter):
+        started = time.perf_counter()
+        if self.delay:
+            await asyncio.sleep(self.delay)
+
+        if payload.get("stream", True):
+            await self.send_stream_start(writer)
+            for token in self.tokens(self.response_text):
+                if self.token_delay:
+                    await asyncio.sleep(self.token_delay)
+                await self.send_chunk(writer, {"model": self.model, "response": token, "done": False})
+            await self.send_chunk(writer, self.final_chunk(payload, started))
+            await self.send_stream_end(writer)
+        else:
+            result = self.final_chunk(payload, started)
+            result["response"] = self.response_text
+            await self.send_json(writer, result)
+
+    async def embed(self, payload: dict, writer: asyncio.StreamWriter):
+        from embeddings import HashingEmbedder
+
+        texts = payload.get("input", [])
+        if isinstance(texts, str):
+            texts = [texts]
+        embedder = HashingEmbedder()
+        await self.send_json(writer, {
+            "model": payload.get("model", self.model),
+            "embeddings": [embedder.embed_one(text).tolist() for text in texts],
+        })
+
+    def final_chunk(self, payload: dict, started: float) -> dict:
+        return {
+            "model": self.model,
+            "response": "",
+            "done": True,
+            "prompt_eval_count": len(payload.get("prompt", "")) // 4,
+            "eval_count": len(self.tokens(self.response_text)),
+            "total_duration": int((time.perf_counter() - started) * 1e9),
+        }
+
+    @staticmethod
+    def tokens(text: str) -> list:
+        """Split text into word-sized tokens that join back to the original"""
+        words = text.split(" ")
+        return [w if i == 0 else " " + w for i, w in enumerate(words)]
+
+    # -------------------------------------------------------------------------
+    # Response writers
+    # -------------------------------------------------------------------------
+
+    @staticmethod
+    async def send_json(writer: asyncio.StreamWriter, data: dict, status: int = 200):
+        body = json.dumps(data).encode()
+        writer.write(
+            f"HTTP/1.1 {status} OK\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+
+    @staticmethod
+    async def send_stream_start(writer: asyncio.StreamWriter):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nTransfer-Encoding: chunked\r\n\r\n")
+        await writer.drain()
+
+    @staticmethod
+    async def send_chunk(writer: asyncio.StreamWriter, data: dict):
+        line = json.dumps(data).encode() + b"\n"
+        writer.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+        await writer.drain()
+
+    @staticmethod
+    async def send_stream_end(writer: asyncio.StreamWriter):
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+
+@contextmanager
+def running_stub(**kwargs):
+    """Run an OllamaStub on its own event loop thread (for sync test clients)"""
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    stub = OllamaStub(**kwargs)
+    asyncio.run_coroutine_threadsafe(stub.start(), loop).result()
+    try:
+        yield stub
+    finally:
+        asyncio.run_coroutine_threadsafe(stub.stop(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
+async def _serve(args):
+    stub = OllamaStub(host=args.host, port=args.port, delay=args.delay, token_delay=args.token_delay)
+    await stub.start()
+    print(f"[Ollama Stub] Listening on {stub.base_url}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ollama-compatible stub server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds before each response")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Seconds between streamed tokens")
+    try:
+        asyncio.run(_serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
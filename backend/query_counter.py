@@ -0,0 +1,131 @@
+"""
+Bobot Query Counter
+Counts and times SQL statements per request (or any block of code)
+
+    with count_queries() as counter:
+        ...
+    print(counter.count, counter.db_ms, counter.slowest)
+
+    with waiting("ollama"):        # time spent awaiting another service
+        response = await client.post(...)
+
+Counters nest: a statement (or wait) is counted by every active counter in
+the current context. RequestIDMiddleware wraps each request in one, logs
+a structured line with the counts and timings and returns them in the
+Server-Timing header (and, outside production, the count in X-DB-Queries).
+
+With SLOW_QUERY_MS set, every statement slower than that is logged as a
+warning with the request id of the counter it ran under.
+"""
+
+import heapq
+import logging
+import os
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))  # 0 = slow-query log off
+SLOWEST_KEPT = 3  # Slowest statements kept per counter
+STATEMENT_CHARS = 200  # Statements are cut to this length in logs
+
+
+class QueryCounter:
+    """Number and time of statements executed while active (and the SQL, if kept)"""
+
+    def __init__(self, keep_statements: bool = False, request_id: Optional[str] = None):
+        self.count = 0
+        self.db_ms = 0.0
+        self.waits: Dict[str, float] = defaultdict(float)  # ms per service
+        self.request_id = request_id
+        self.statements: List[str] = []
+        self._slowest: List[Tuple[float, int, str]] = []  # min-heap of (ms, order, statement)
+        self._keep_statements = keep_statements
+
+    def record(self, statement: str, duration_ms: float = 0.0):
+        self.count += 1
+        self.db_ms += duration_ms
+        if self._keep_statements:
+            self.statements.append(statement)
+        entry = (duration_ms, self.count, statement)
+        if len(self._slowest) < SLOWEST_KEPT:
+            heapq.heappush(self._slowest, entry)
+        elif duration_ms > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, entry)
+
+    def wait(self, service: str, duration_ms: float):
+        self.waits[service] += duration_ms
+
+    @property
+    def slowest(self) -> List[Tuple[float, str]]:
+        """(ms, statement) of the slowest statements, slowest first"""
+        return [(round(ms, 2), statement[:STATEMENT_CHARS])
+                for ms, _, statement in sorted(self._slowest, reverse=True)]
+
+    def server_timing(self, total_ms: Optional[float] = None) -> str:
+        """Value of a Server-Timing header: db, one entry per service, and total"""
+        entries = [f'db;dur={self.db_ms:.1f};desc="{self.count} queries"']
+        entries += [f"{service};dur={ms:.1f}" for service, ms in sorted(self.waits.items())]
+        if total_ms is not None:
+            entries.append(f"total;dur={total_ms:.1f}")
+        return ", ".join(entries)
+
+
+_active: ContextVar[Tuple[QueryCounter, ...]] = ContextVar("active_query_counters", default=())
+
+
+@contextmanager
+def count_queries(keep_statements: bool = False, request_id: Optional[str] = None) -> Iterator[QueryCounter]:
+    counter = QueryCounter(keep_statements, request_id)
+    token = _active.set(_active.get() + (counter,))
+    try:
+        yield counter
+    finally:
+        _active.reset(token)
+
+
+@contextmanager
+def waiting(service: str) -> Iterator[None]:
+    """Add the time spent in the block to the active counters' waits for service
+
+    Every wait is also observed in the service's latency histogram (/metrics).
+    """
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        duration_ms = (perf_counter() - started) * 1000
+        metrics.record_external(service, duration_ms)
+        for counter in _active.get():
+            counter.wait(service, duration_ms)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_started"] = perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop("query_started", None)
+    duration_ms = (perf_counter() - started) * 1000 if started is not None else 0.0
+    counters = _active.get()
+    for counter in counters:
+        counter.record(statement, duration_ms)
+    if SLOW_QUERY_MS and duration_ms >= SLOW_QUERY_MS:
+        request_id = next((c.request_id for c in counters if c.request_id), None)
+        logger.warning(f"[Slow query] [{request_id or '-'}] {duration_ms:.1f}ms: {statement[:STATEMENT_CHARS]}")
+
+
+def install(engine: Engine):
+    """Count and time statements executed on this engine"""
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
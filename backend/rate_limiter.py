@@ -0,0 +1,167 @@
+"""
+Bobot Rate Limiter
+Sliding window counter rate limiting on top of the state backend
+"""
+
+import math
+import time
+from typing import NamedTuple, Optional
+
+from state_backend import StateBackend, state_backend
+
+
+class RateDecision(NamedTuple):
+    allowed: bool
+    count: int  # Requests in the last window (estimated), including this one if allowed
+    remaining: int
+    reset: int  # Seconds until the next request is allowed (blocked) or the window rolls over
+
+
+class SlidingWindowLimiter:
+    """Sliding window counter limiter with constant memory per key
+
+    Time is split into fixed windows. Each key stores the start of the
+    current window, the counts of the previous and current window, and the
+    window it was last rejected in. The number of requests in the last
+    `window` seconds is estimated as
+
+        previous * (share of the previous window still inside) + current
+
+    Keys expire two windows after their last update (the backend drops them
+    incrementally), so there is never a global clear.
+
+    The limiter also keeps aggregate counters (active keys, rate-limited
+    keys, rejected requests; optionally per label such as company_id) with
+    the same sliding-window estimate, so dashboards read a few values
+    instead of scanning every key.
+    """
+
+    def __init__(self, namespace: str, limit: int, window: int,
+                 backend: StateBackend = state_backend, clock=time.time):
+        self.namespace = namespace
+        self.stats_namespace = f"{namespace}:stats"
+        self.limit = limit
+        self.window = window
+        self._backend = backend
+        self._clock = clock
+
+    # -------------------------------------------------------------------------
+    # Window arithmetic
+    # -------------------------------------------------------------------------
+
+    def _roll(self, state: Optional[list], now: float) -> list:
+        """Move a [window_start, previous, current, limited_window] state to now's window"""
+        window_start = now - now % self.window
+        if state is None:
+            return [window_start, 0, 0, None]
+        start, previous, current, limited = state
+        if start == window_start:
+            return list(state)
+        if start == window_start - self.window:
+            return [window_start, current, 0, limited]
+        return [window_start, 0, 0, limited]
+
+    def _estimate(self, state: list, now: float) -> float:
+        window_start, previous, current, _ = state
+        return previous * (1 - (now - window_start) / self.window) + current
+
+    def _retry_after(self, state: list, now: float) -> int:
+        """Whole seconds until the estimate is below the limit (strictly)"""
+        window_start, previous, current, _ = state
+        if current < self.limit and previous:
+            # Still in this window, once enough of the previous window has slid out
+            at = window_start + (1 - (self.limit - current) / previous) * self.window
+        else:
+            # In the next window, where the current count becomes the previous one
+            at = window_start + self.window + max(0.0, 1 - self.limit / current) * self.window
+        return max(1, math.floor(at - now) + 1)
+
+    # -------------------------------------------------------------------------
+    # Limiting
+    # -------------------------------------------------------------------------
+
+    def hit(self, key: str, label: Optional[str] = None) -> RateDecision:
+        """Count a request for key if it is under the limit"""
+        now = self._clock()
+
+        def apply(state):
+            state = self._roll(state, now)
+            estimate = self._estimate(state, now)
+            if estimate >= self.limit:
+                first_rejection = state[3] != state[0]
+                state[3] = state[0]
+                decision = RateDecision(False, math.floor(estimate), 0, self._retry_after(state, now))
+                return state, (decision, False, first_rejection)
+
+            first_request = state[2] == 0
+            state[2] += 1
+            count = math.floor(estimate) + 1
+            decision = RateDecision(True, count, max(0, self.limit - count),
+                                    math.ceil(state[0] + self.window - now))
+            return state, (decision, first_request, False)
+
+        decision, first_request, first_rejection = self._backend.update(
+            self.namespace, key, apply, ttl=2 * self.window
+        )
+
+        if first_request:
+            self._count("active", now)
+        if not decision.allowed:
+            self._count("rejected", now, label)
+            if first_rejection:
+                self._count("limited", now, label)
+        return decision
+
+    def peek(self, key: str) -> RateDecision:
+        """Check key against the limit without counting a request"""
+        now = self._clock()
+        state = self._roll(self._backend.get(self.namespace, key), now)
+        estimate = self._estimate(state, now)
+        if estimate >= self.limit:
+            return RateDecision(False, math.floor(estimate), 0, self._retry_after(state, now))
+        count = math.floor(estimate)
+        return RateDecision(True, count, self.limit - count, math.ceil(state[0] + self.window - now))
+
+    def add(self, key: str):
+        """Count an event for key regardless of the limit (e.g. a failed login)"""
+        now = self._clock()
+
+        def apply(state):
+            state = self._roll(state, now)
+            state[2] += 1
+            return state, None
+
+        self._backend.update(self.namespace, key, apply, ttl=2 * self.window)
+
+    def reset(self, key: str):
+        self._backend.delete(self.namespace, key)
+
+    # -------------------------------------------------------------------------
+    # Aggregate counters
+    # -------------------------------------------------------------------------
+
+    def _count(self, name: str, now: float, label: Optional[str] = None):
+        def apply(state):
+            state = self._roll(state, now)
+            state[2] += 1
+            return state, None
+
+        self._backend.update(self.stats_namespace, name, apply, ttl=2 * self.window)
+        if label:
+            self._backend.update(self.stats_namespace, f"{name}:{label}", apply, ttl=2 * self.window)
+
+    def _read(self, name: str, now: float) -> int:
+        state = self._roll(self._backend.get(self.stats_namespace, name), now)
+        return round(self._estimate(state, now))
+
+    def stats(self, label: Optional[str] = None) -> dict:
+        """Estimated counts over the last window (per label if given)"""
+        now = self._clock()
+        suffix = f":{label}" if label else ""
+        stats = {
+            "limited_keys": self._read(f"limited{suffix}", now),
+            "rejected_requests": self._read(f"rejected{suffix}", now),
+        }
+        if not label:
+            stats["active_keys"] = self._read("active", now)
+        return stats
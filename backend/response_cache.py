@@ -0,0 +1,373 @@
+"""
+Bobot Response Cache
+Bounded LRU cache for chat answers, with per-entry TTL and tenant invalidation
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Set
+
+from state_backend import SQLiteConnections, StateBackend, state_backend
+
+
+# =============================================================================
+# Configuration
+# =============================================================================
+
+CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "300"))  # 5 minutes
+CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))  # 16 MB
+CACHE_FLUSH_INTERVAL = float(os.getenv("RESPONSE_CACHE_FLUSH_INTERVAL", "5"))  # Seconds (shared backend)
+
+DEFAULT_WIDGET = "default"  # Cache key part for answers not bound to a widget key
+
+
+def make_cache_key(company_id: str, question: str, language: str = "sv", widget_key: str = None) -> str:
+    """Cache key for a chat answer
+
+    Includes widget_key to prevent cross-widget cache contamination.
+    """
+    return f"{company_id}:{widget_key or DEFAULT_WIDGET}:{language}:{question.lower().strip()}"
+
+
+def estimate_size(key: str, value) -> int:
+    """Approximate memory cost of an entry in bytes (UTF-8 key + JSON value)"""
+    return len(key.encode()) + len(json.dumps(value, ensure_ascii=False, default=str).encode())
+
+
+# =============================================================================
+# Cache
+# =============================================================================
+
+class _Entry:
+    __slots__ = ("value", "expires_at", "size", "company_id", "widget_part")
+
+    def __init__(self, value, expires_at: float, size: int, company_id: str, widget_part: str):
+        self.value = value
+        self.expires_at = expires_at
+        self.size = size
+        self.company_id = company_id
+        self.widget_part = widget_part
+
+
+class ResponseCache:
+    """LRU cache bounded by total entry size in bytes
+
+    Reads move an entry to the most-recently-used end, and inserts evict
+    from the least-recently-used end until the cache fits in max_bytes, so
+    both are O(1). Expired entries are dropped when read, and from the LRU
+    end on every insert. Entries are also indexed per tenant (company and
+    widget key) so knowledge edits can drop exactly the affected answers.
+    """
+
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES, ttl: int = CACHE_TTL, clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._clock = clock
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._tenants: Dict[str, Dict[str, Set[str]]] = {}  # company_id -> widget part -> keys
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0  # Dropped to stay under max_bytes
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires_at <= self._clock():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def set(self, key: str, value, company_id: str, widget_key: str = None, ttl: Optional[int] = None):
+        size = estimate_size(key, value)
+        with self._lock:
+            self._remove(key)
+            if size > self.max_bytes:
+                return  # Would evict everything else and still not fit
+
+            now = self._clock()
+            widget_part = widget_key or DEFAULT_WIDGET
+            self._entries[key] = _Entry(value, now + (self.ttl if ttl is None else ttl), size, company_id, widget_part)
+            self._bytes += size
+            self._tenants.setdefault(company_id, {}).setdefault(widget_part, set()).add(key)
+
+            # Drop expired entries at the LRU end, then evict until we fit
+            while self._entries:
+                oldest_key, oldest = next(iter(self._entries.items()))
+                if oldest.expires_at <= now:
+                    self._remove(oldest_key)
+                    self.expirations += 1
+                elif self._bytes > self.max_bytes:
+                    self._remove(oldest_key)
+                    self.evictions += 1
+                else:
+                    break
+
+    def invalidate(self, company_id: str, widget_keys: Optional[Iterable[Optional[str]]] = None) -> int:
+        """Drop a company's entries, or only those of the given widget keys
+
+        None in widget_keys stands for answers cached without a widget key.
+        Returns the number of entries removed.
+        """
+        with self._lock:
+            widgets = self._tenants.get(company_id)
+            if not widgets:
+                return 0
+            if widget_keys is None:
+                parts = list(widgets.keys())
+            else:
+                parts = [key or DEFAULT_WIDGET for key in widget_keys]
+
+            removed = 0
+            for part in parts:
+                for key in list(widgets.get(part, ())):
+                    self._remove(key)
+                    removed += 1
+            self.invalidations += removed
+            return removed
+
+    def flush(self):
+        """Nothing is buffered in process (see SharedResponseCache.flush)"""
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tenants.clear()
+            self._bytes = 0
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry.size
+        widgets = self._tenants[entry.company_id]
+        keys = widgets[entry.widget_part]
+        keys.discard(key)
+        if not keys:
+            del widgets[entry.widget_part]
+            if not widgets:
+                del self._tenants[entry.company_id]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: str):
+        return key in self._entries
+
+    def stats(self) -> dict:
+        """Counters and size, for the super admin dashboard"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "companies": len(self._tenants),
+                "size_bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups * 100, 1) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+class SharedResponseCache:
+    """ResponseCache kept in the shared state SQLite file (STATE_BACKEND=sqlite)
+
+    Same interface and eviction rules as ResponseCache, but every uvicorn
+    worker reads and fills the same entries, and the counters are totals
+    for all workers. LRU order is tracked with an indexed last_used column,
+    so get and evict are O(log n) instead of O(1).
+
+    get() only reads (WAL readers never wait for the writer): hit/miss
+    counts and last_used updates are buffered in the worker and written by
+    flush(), which set() and stats() call and the app runs every
+    CACHE_FLUSH_INTERVAL seconds. Expired entries are removed by set().
+    """
+
+    COUNTERS = ("size_bytes", "hits", "misses", "evictions", "expirations", "invalidations")
+
+    def __init__(self, connections: SQLiteConnections, max_bytes: int = CACHE_MAX_BYTES,
+                 ttl: int = CACHE_TTL, clock=time.time):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._connections = connections
+        self._clock = clock
+        self._pending_lock = threading.Lock()
+        self._pending_counts = {"hits": 0, "misses": 0}
+        self._pending_used: Dict[str, float] = {}  # key -> last_used
+        with connections.transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    key TEXT PRIMARY KEY,
+                    company_id TEXT NOT NULL,
+                    widget_part TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_response_cache_last_used ON response_cache (last_used)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_response_cache_expires_at ON response_cache (expires_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_response_cache_tenant ON response_cache (company_id, widget_part)")
+            conn.execute("CREATE TABLE IF NOT EXISTS response_cache_stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.executemany("INSERT OR IGNORE INTO response_cache_stats (name, value) VALUES (?, 0)",
+                             [(name,) for name in self.COUNTERS])
+
+    @staticmethod
+    def _count(conn, name: str, delta: int = 1):
+        conn.execute("UPDATE response_cache_stats SET value = value + ? WHERE name = ?", (delta, name))
+
+    def _remove_rows(self, conn, rows, counter: Optional[str]) -> int:
+        """Delete (key, size) rows and keep size_bytes (and counter) current"""
+        if not rows:
+            return 0
+        conn.executemany("DELETE FROM response_cache WHERE key = ?", [(key,) for key, _ in rows])
+        self._count(conn, "size_bytes", -sum(size for _, size in rows))
+        if counter:
+            self._count(conn, counter, len(rows))
+        return len(rows)
+
+    def get(self, key: str):
+        row = self._connections.get().execute(
+            "SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)
+        ).fetchone()
+        now = self._clock()
+        with self._pending_lock:
+            if row is None or row[1] <= now:
+                self._pending_counts["misses"] += 1
+                return None
+            self._pending_counts["hits"] += 1
+            self._pending_used[key] = now
+        return json.loads(row[0])
+
+    def _write_pending(self, conn):
+        with self._pending_lock:
+            counts, self._pending_counts = self._pending_counts, {"hits": 0, "misses": 0}
+            used, self._pending_used = self._pending_used, {}
+        for name, delta in counts.items():
+            if delta:
+                self._count(conn, name, delta)
+        if used:
+            conn.executemany("UPDATE response_cache SET last_used = MAX(last_used, ?) WHERE key = ?",
+                             [(last_used, key) for key, last_used in used.items()])
+
+    def flush(self):
+        """Write the buffered hit/miss counts and last_used times"""
+        with self._pending_lock:
+            if not self._pending_used and not any(self._pending_counts.values()):
+                return
+        with self._connections.transaction() as conn:
+            self._write_pending(conn)
+
+    def set(self, key: str, value, company_id: str, widget_key: str = None, ttl: Optional[int] = None):
+        size = estimate_size(key, value)
+        with self._connections.transaction() as conn:
+            self._write_pending(conn)  # LRU order is current before evicting
+            self._remove_rows(conn, conn.execute(
+                "SELECT key, size FROM response_cache WHERE key = ?", (key,)
+            ).fetchall(), None)
+            if size > self.max_bytes:
+                return  # Would evict everything else and still not fit
+
+            now = self._clock()
+            conn.execute(
+                "INSERT INTO response_cache (key, company_id, widget_part, value, size, expires_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, company_id, widget_key or DEFAULT_WIDGET, json.dumps(value, ensure_ascii=False, default=str),
+                 size, now + (self.ttl if ttl is None else ttl), now)
+            )
+            self._count(conn, "size_bytes", size)
+
+            # Drop expired entries, then evict least recently used until we fit
+            self._remove_rows(conn, conn.execute(
+                "SELECT key, size FROM response_cache WHERE expires_at <= ? LIMIT 100", (now,)
+            ).fetchall(), "expirations")
+            total = conn.execute("SELECT value FROM response_cache_stats WHERE name = 'size_bytes'").fetchone()[0]
+            while total > self.max_bytes:
+                oldest = conn.execute("SELECT key, size FROM response_cache ORDER BY last_used LIMIT 1").fetchone()
+                self._remove_rows(conn, [oldest], "evictions")
+                total -= oldest[1]
+
+    def invalidate(self, company_id: str, widget_keys: Optional[Iterable[Optional[str]]] = None) -> int:
+        """Drop a company's entries, or only those of the given widget keys
+
+        None in widget_keys stands for answers cached without a widget key.
+        Returns the number of entries removed.
+        """
+        with self._connections.transaction() as conn:
+            if widget_keys is None:
+                rows = conn.execute(
+                    "SELECT key, size FROM response_cache WHERE company_id = ?", (company_id,)
+                ).fetchall()
+            else:
+                parts = sorted({key or DEFAULT_WIDGET for key in widget_keys})
+                rows = conn.execute(
+                    f"SELECT key, size FROM response_cache WHERE company_id = ? "
+                    f"AND widget_part IN ({', '.join('?' * len(parts))})",
+                    (company_id, *parts)
+                ).fetchall()
+            return self._remove_rows(conn, rows, "invalidations")
+
+    def clear(self):
+        with self._connections.transaction() as conn:
+            conn.execute("DELETE FROM response_cache")
+            conn.execute("UPDATE response_cache_stats SET value = 0 WHERE name = 'size_bytes'")
+
+    def __len__(self):
+        return self._connections.get().execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+
+    def __contains__(self, key: str):
+        return self._connections.get().execute(
+            "SELECT 1 FROM response_cache WHERE key = ?", (key,)
+        ).fetchone() is not None
+
+    def stats(self) -> dict:
+        """Counters and size (for all workers), for the super admin dashboard"""
+        self.flush()
+        conn = self._connections.get()
+        counters = dict(conn.execute("SELECT name, value FROM response_cache_stats").fetchall())
+        entries, companies = conn.execute(
+            "SELECT COUNT(*), COUNT(DISTINCT company_id) FROM response_cache"
+        ).fetchone()
+        lookups = counters["hits"] + counters["misses"]
+        return {
+            "entries": entries,
+            "companies": companies,
+            "size_bytes": counters["size_bytes"],
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl,
+            "hits": counters["hits"],
+            "misses": counters["misses"],
+            "hit_rate": round(counters["hits"] / lookups * 100, 1) if lookups else 0.0,
+            "evictions": counters["evictions"],
+            "expirations": counters["expirations"],
+            "invalidations": counters["invalidations"],
+        }
+
+
+def create_response_cache(backend: StateBackend = state_backend):
+    """Response cache for the configured state backend"""
+    if backend.shared:
+        return SharedResponseCache(backend.connections)
+    return ResponseCache()
+
+
+response_cache = create_response_cache()
@@ -0,0 +1,281 @@
+"""
+Bobot Retention Cleanup
+Set-based GDPR deletion of expired conversations in bounded batches
+
+Every hour, conversations older than the company's data_retention_days
+are deleted. Before deletion their anonymous statistics are merged into
+DailyStatistics, as save_conversation_stats() does for one conversation:
+
+    1. pick up to GDPR_CLEANUP_BATCH expired conversation ids
+    2. two GROUP BY queries give the per-day deltas (conversations,
+       categories, languages, hours, feedback / answered, unanswered,
+       response times)
+    3. one read and one write per affected DailyStatistics day
+    4. bulk DELETE of the batch's messages and conversations
+
+Each batch is one transaction on the DB thread pool, so the event loop
+(and other requests) get a turn between batches, and a failure leaves
+at most one batch to redo on the next run.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, case, delete, extract, func
+from sqlalchemy.orm import Session
+
+from database import Company, CompanySettings, Conversation, DailyStatistics, Message
+from db_executor import run_db
+
+logger = logging.getLogger(__name__)
+
+
+# =============================================================================
+# Configuration
+# =============================================================================
+
+GDPR_CLEANUP_BATCH = int(os.getenv("GDPR_CLEANUP_BATCH", "1000"))  # Conversations per transaction
+DEFAULT_RETENTION_DAYS = 30
+
+
+class DayDeltas:
+    """Statistics of the deleted conversations that started on one day"""
+
+    __slots__ = ("conversations", "messages", "answered", "unanswered", "helpful", "not_helpful",
+                 "response_ms_sum", "response_count", "categories", "languages", "hours")
+
+    def __init__(self):
+        self.conversations = self.messages = self.answered = self.unanswered = 0
+        self.helpful = self.not_helpful = self.response_ms_sum = self.response_count = 0
+        self.categories: Dict[str, int] = defaultdict(int)
+        self.languages: Dict[str, int] = defaultdict(int)
+        self.hours: Dict[str, int] = defaultdict(int)
+
+
+def _merge_json(raw: Optional[str], deltas: Dict[str, int]) -> str:
+    try:
+        counts = json.loads(raw or "{}")
+    except (json.JSONDecodeError, TypeError, ValueError):
+        counts = {}
+    for key, value in deltas.items():
+        counts[key] = counts.get(key, 0) + value
+    return json.dumps(counts)
+
+
+class RetentionCleanup:
+    """Deletes expired conversations batch by batch
+
+        await cleanup.run()                          # all companies, by retention
+        await cleanup.delete_conversations("acme")   # all of one company (DELETE /conversations)
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], batch_size: int = GDPR_CLEANUP_BATCH):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self._lock = asyncio.Lock()  # One run at a time (scheduler and manual trigger)
+        # Metrics
+        self.runs = 0
+        self.batches = 0
+        self.errors = 0
+        self.deleted_conversations = 0
+        self.deleted_messages = 0
+        self.progress: Optional[dict] = None  # Company being cleaned right now
+        self.last_run: Optional[dict] = None
+
+    # -------------------------------------------------------------------------
+    # Scheduling
+    # -------------------------------------------------------------------------
+
+    async def run(self) -> dict:
+        """Delete expired conversations of all companies, returns a run summary"""
+        async with self._lock:
+            started_at = datetime.utcnow()
+            started = time.perf_counter()
+            deleted = {"conversations": 0, "messages": 0, "companies": 0}
+            try:
+                for company_id, cutoff in await run_db(self.expiry_cutoffs):
+                    conversations, messages = await self._delete_all(company_id, cutoff)
+                    if conversations:
+                        deleted["conversations"] += conversations
+                        deleted["messages"] += messages
+                        deleted["companies"] += 1
+                        print(f"[GDPR Cleanup] Raderade {conversations} gamla konversationer för {company_id}")
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"[GDPR Cleanup Error] {e}")
+            finally:
+                self.progress = None
+            self.runs += 1
+            self.last_run = {
+                "started_at": started_at.isoformat(),
+                "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+                **deleted,
+            }
+            return self.last_run
+
+    async def delete_conversations(self, company_id: str, cutoff: Optional[datetime] = None) -> int:
+        """Delete one company's conversations (started before cutoff), returns how many"""
+        async with self._lock:
+            try:
+                conversations, _ = await self._delete_all(company_id, cutoff)
+            finally:
+                self.progress = None
+            return conversations
+
+    async def _delete_all(self, company_id: str, cutoff: Optional[datetime]) -> Tuple[int, int]:
+        conversations = messages = 0
+        self.progress = {"company_id": company_id, "deleted_conversations": 0, "batches": 0}
+        while True:
+            batch_conversations, batch_messages = await run_db(self.delete_batch, company_id, cutoff)
+            conversations += batch_conversations
+            messages += batch_messages
+            self.progress["deleted_conversations"] = conversations
+            self.progress["batches"] += 1
+            if batch_conversations < self.batch_size:
+                return conversations, messages
+            await asyncio.sleep(0)  # Let queued requests run between batches
+
+    def expiry_cutoffs(self) -> List[Tuple[str, datetime]]:
+        """(company_id, cutoff) for every company, in one query"""
+        db = self.session_factory()
+        try:
+            rows = db.query(Company.id, CompanySettings.data_retention_days).outerjoin(
+                CompanySettings, CompanySettings.company_id == Company.id
+            ).all()
+        finally:
+            db.close()
+        now = datetime.utcnow()
+        return [(company_id, now - timedelta(days=days or DEFAULT_RETENTION_DAYS)) for company_id, days in rows]
+
+    # -------------------------------------------------------------------------
+    # One batch
+    # -------------------------------------------------------------------------
+
+    def delete_batch(self, company_id: str, cutoff: Optional[datetime]) -> Tuple[int, int]:
+        """Save statistics for and delete up to batch_size conversations (one transaction)
+
+        Returns (conversations, messages) deleted.
+        """
+        db = self.session_factory()
+        try:
+            query = db.query(Conversation.id).filter(Conversation.company_id == company_id)
+            if cutoff is not None:
+                query = query.filter(Conversation.started_at < cutoff)
+            ids = [row[0] for row in query.order_by(Conversation.id).limit(self.batch_size)]
+            if not ids:
+                return 0, 0
+
+            days = self._day_deltas(db, ids)
+            self._merge_into_daily_statistics(db, company_id, days)
+
+            messages = db.execute(delete(Message).where(Message.conversation_id.in_(ids))).rowcount
+            db.execute(delete(Conversation).where(Conversation.id.in_(ids)))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+        self.batches += 1
+        self.deleted_conversations += len(ids)
+        self.deleted_messages += messages
+        return len(ids), messages
+
+    def _day_deltas(self, db: Session, ids: List[int]) -> Dict[date, DayDeltas]:
+        days: Dict[date, DayDeltas] = defaultdict(DayDeltas)
+        day_of = (
+            extract("year", Conversation.started_at),
+            extract("month", Conversation.started_at),
+            extract("day", Conversation.started_at),
+        )
+
+        # Conversations per day, hour, category, language and feedback
+        conversation_rows = db.query(
+            *day_of, extract("hour", Conversation.started_at),
+            Conversation.category, Conversation.language, Conversation.was_helpful,
+            func.count(Conversation.id), func.sum(Conversation.message_count)
+        ).filter(Conversation.id.in_(ids)).group_by(
+            *day_of, extract("hour", Conversation.started_at),
+            Conversation.category, Conversation.language, Conversation.was_helpful
+        )
+        for year, month, day, hour, category, language, was_helpful, count, messages in conversation_rows:
+            deltas = days[date(int(year), int(month), int(day))]
+            deltas.conversations += count
+            deltas.messages += messages or 0
+            deltas.categories[category or "allmant"] += count
+            deltas.languages[language or "sv"] += count
+            deltas.hours[str(int(hour))] += count
+            if was_helpful is True:
+                deltas.helpful += count
+            elif was_helpful is False:
+                deltas.not_helpful += count
+
+        # Bot answers per day (a missing had_answer counts as unanswered, as before)
+        is_bot = Message.role == "bot"
+        has_time = Message.response_time_ms > 0
+        message_rows = db.query(
+            *day_of,
+            func.sum(case((is_bot, 1), else_=0)),
+            func.sum(case((and_(is_bot, Message.had_answer == True), 1), else_=0)),
+            func.sum(case((has_time, Message.response_time_ms), else_=0)),
+            func.sum(case((has_time, 1), else_=0))
+        ).join(Conversation, Conversation.id == Message.conversation_id).filter(
+            Message.conversation_id.in_(ids)
+        ).group_by(*day_of)
+        for year, month, day, bot_messages, answered, response_ms_sum, response_count in message_rows:
+            deltas = days[date(int(year), int(month), int(day))]
+            deltas.answered += answered or 0
+            deltas.unanswered += (bot_messages or 0) - (answered or 0)
+            deltas.response_ms_sum += response_ms_sum or 0
+            deltas.response_count += response_count or 0
+        return days
+
+    def _merge_into_daily_statistics(self, db: Session, company_id: str, days: Dict[date, DayDeltas]):
+        existing = {
+            stat.date: stat for stat in db.query(DailyStatistics).filter(
+                DailyStatistics.company_id == company_id,
+                DailyStatistics.date.in_(list(days))
+            )
+        }
+        for day, deltas in days.items():
+            stat = existing.get(day)
+            if stat is None:
+                stat = DailyStatistics(company_id=company_id, date=day)
+                db.add(stat)
+            previous_questions = (stat.questions_answered or 0) + (stat.questions_unanswered or 0)
+
+            stat.total_conversations = (stat.total_conversations or 0) + deltas.conversations
+            stat.total_messages = (stat.total_messages or 0) + deltas.messages
+            stat.questions_answered = (stat.questions_answered or 0) + deltas.answered
+            stat.questions_unanswered = (stat.questions_unanswered or 0) + deltas.unanswered
+            stat.helpful_count = (stat.helpful_count or 0) + deltas.helpful
+            stat.not_helpful_count = (stat.not_helpful_count or 0) + deltas.not_helpful
+            stat.category_counts = _merge_json(stat.category_counts, deltas.categories)
+            stat.language_counts = _merge_json(stat.language_counts, deltas.languages)
+            stat.hourly_counts = _merge_json(stat.hourly_counts, deltas.hours)
+
+            # Running average weighted like save_conversation_stats()
+            if deltas.response_count:
+                stat.avg_response_time_ms = (
+                    (stat.avg_response_time_ms or 0) * previous_questions + deltas.response_ms_sum
+                ) / (previous_questions + deltas.response_count)
+
+    def stats(self) -> dict:
+        return {
+            "running": self._lock.locked(),
+            "progress": self.progress,
+            "batch_size": self.batch_size,
+            "runs": self.runs,
+            "batches": self.batches,
+            "errors": self.errors,
+            "deleted_conversations": self.deleted_conversations,
+            "deleted_messages": self.deleted_messages,
+            "last_run": self.last_run,
+        }
@@ -0,0 +1,101 @@
+"""
+Bobot Single Flight
+Coalesces identical concurrent chat generations into one Ollama call
+
+    answer = await chat_flights.run(key, generate, on_token)
+
+When many residents ask the same question within seconds (a notice about
+a water shut-off), every request misses the response cache until the
+first answer is done. With the response-cache key as flight key, the
+first request (the leader) generates; identical requests arriving while
+it runs (followers) await the same result instead of queueing on the
+model. Each request still writes its own messages and conversation.
+
+generate(emit) runs as its own task, so a leader whose client disconnects
+does not cancel the followers' answer. Tokens passed to emit() reach every
+waiting request's on_token, and a follower that joins mid-generation first
+gets the tokens generated so far. Flights are per process.
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+TokenCallback = Callable[[str], None]
+
+
+class _Flight:
+    __slots__ = ("task", "tokens", "listeners", "followers")
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.tokens: List[str] = []
+        self.listeners: List[TokenCallback] = []
+        self.followers = 0
+
+
+class SingleFlight:
+    """One running generation per key; identical concurrent calls share its result"""
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        # Metrics
+        self.leaders = 0      # Generations actually run
+        self.followers = 0    # Calls that shared a running generation (LLM calls saved)
+        self.errors = 0
+
+    async def run(self, key: str, generate: Callable[[TokenCallback], Awaitable[str]],
+                  on_token: Optional[TokenCallback] = None) -> str:
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = _Flight()
+            self.leaders += 1
+            flight.task = asyncio.create_task(self._generate(key, flight, generate))
+            # Retrieved even if every waiting request was cancelled
+            flight.task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        else:
+            flight.followers += 1
+            self.followers += 1
+            if on_token:
+                for token in flight.tokens:  # Catch up on what was streamed before joining
+                    on_token(token)
+        if on_token:
+            flight.listeners.append(on_token)
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            if on_token in flight.listeners:
+                flight.listeners.remove(on_token)
+
+    async def _generate(self, key: str, flight: _Flight, generate: Callable[[TokenCallback], Awaitable[str]]) -> str:
+        def emit(token: str):
+            flight.tokens.append(token)
+            for listener in list(flight.listeners):
+                listener(token)
+
+        try:
+            return await generate(emit)
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            # Requests arriving after this point start a new flight (or hit the response cache)
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            if flight.followers:
+                logger.info(f"[Single flight] {flight.followers} identical requests shared one generation")
+
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    def stats(self) -> dict:
+        calls = self.leaders + self.followers
+        return {
+            "in_flight": len(self._flights),
+            "generations": self.leaders,
+            "coalesced_requests": self.followers,
+            "saved_rate": round(self.followers / calls * 100, 1) if calls else 0.0,
+            "errors": self.errors,
+        }
@@ -0,0 +1,304 @@
+"""
+Bobot State Backend
+Storage for rate limits, login attempts and cache bookkeeping
+
+The "memory" backend keeps state in this process (a single uvicorn worker).
+The "sqlite" backend keeps it in a shared SQLite file (WAL mode), so all
+workers on the host see the same limits and cache:
+
+    STATE_BACKEND=sqlite STATE_SQLITE_PATH=/var/lib/bobot/state.db \\
+        uvicorn main:app --workers 4
+"""
+
+import json
+import os
+from abc import ABC, abstractmethod
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+# =============================================================================
+# Configuration
+# =============================================================================
+
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")  # memory | sqlite
+STATE_SQLITE_PATH = os.getenv("STATE_SQLITE_PATH", "./bobot_state.db")
+STATE_SQLITE_TIMEOUT = float(os.getenv("STATE_SQLITE_TIMEOUT", "5"))  # Seconds to wait for the write lock
+
+# The SQLite backend deletes up to PURGE_BATCH expired rows every PURGE_EVERY writes
+PURGE_EVERY = 200
+PURGE_BATCH = 500
+
+# The memory backend checks up to this many of the oldest keys on every write
+MEMORY_PURGE_BATCH = 8
+
+# fn(current value or None) -> (new value or None to delete, result)
+UpdateFn = Callable[[Any], Tuple[Any, Any]]
+
+
+class StateBackend(ABC):
+    """Key/value store with optional per-key TTL, grouped in namespaces
+
+    Values must be JSON-serializable. update() is the only read-modify-write
+    primitive and is atomic, also across processes for shared backends.
+    """
+
+    shared = False  # True if the state is visible to other worker processes
+
+    @abstractmethod
+    def get(self, namespace: str, key: str, default=None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def update(self, namespace: str, key: str, fn: UpdateFn, ttl: Optional[float] = None):
+        """Atomically replace a value with fn(value) and return fn's result
+
+        ttl (seconds) sets the new expiry; None keeps the entry until deleted.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, namespace: str, key: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    def items(self, namespace: str) -> List[Tuple[str, Any]]:
+        """All live (key, value) pairs of a namespace"""
+        raise NotImplementedError
+
+    def count(self, namespace: str) -> int:
+        return len(self.items(namespace))
+
+    @abstractmethod
+    def clear(self, namespace: str):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+# =============================================================================
+# In-process Backend
+# =============================================================================
+
+class MemoryBackend(StateBackend):
+    """Dicts in this process
+
+    Each namespace is kept in write order. Every write also drops up to
+    MEMORY_PURGE_BATCH expired keys from the oldest end, so keys that are
+    never touched again are still expired a few at a time, without a full
+    scan. This assumes one TTL per namespace, which is how callers use it.
+    """
+
+    def __init__(self, clock=time.time):
+        self._data: Dict[str, "OrderedDict[str, Tuple[Any, Optional[float]]]"] = {}
+        self._lock = threading.Lock()
+        self._clock = clock
+
+    def _live(self, namespace: str, key: str):
+        entries = self._data.get(namespace)
+        if not entries or key not in entries:
+            return None
+        value, expires_at = entries[key]
+        if expires_at is not None and expires_at <= self._clock():
+            del entries[key]
+            return None
+        return value
+
+    def get(self, namespace: str, key: str, default=None):
+        with self._lock:
+            value = self._live(namespace, key)
+        return default if value is None else value
+
+    def update(self, namespace: str, key: str, fn: UpdateFn, ttl: Optional[float] = None):
+        with self._lock:
+            new_value, result = fn(self._live(namespace, key))
+            entries = self._data.setdefault(namespace, OrderedDict())
+            now = self._clock()
+            entries.pop(key, None)
+            if new_value is not None:
+                entries[key] = (new_value, now + ttl if ttl is not None else None)
+
+            # Incremental expiry from the oldest end
+            for _ in range(MEMORY_PURGE_BATCH):
+                if not entries:
+                    break
+                oldest_key, (_, expires_at) = next(iter(entries.items()))
+                if expires_at is None or expires_at > now:
+                    break
+                del entries[oldest_key]
+            return result
+
+    def delete(self, namespace: str, key: str):
+        with self._lock:
+            self._data.get(namespace, {}).pop(key, None)
+
+    def items(self, namespace: str) -> List[Tuple[str, Any]]:
+        with self._lock:
+            now = self._clock()
+            return [
+                (key, value) for key, (value, expires_at) in self._data.get(namespace, {}).items()
+                if expires_at is None or expires_at > now
+            ]
+
+    def count(self, namespace: str) -> int:
+        """Keys in the namespace, including expired keys not purged yet"""
+        with self._lock:
+            return len(self._data.get(namespace, ()))
+
+    def clear(self, namespace: str):
+        with self._lock:
+            self._data.pop(namespace, None)
+
+
+# =============================================================================
+# Shared SQLite Backend
+# =============================================================================
+
+class SQLiteConnections:
+    """One SQLite connection per thread to a shared state file
+
+    WAL mode lets readers run next to the single writer; writers wait up to
+    STATE_SQLITE_TIMEOUT seconds for each other.
+    """
+
+    def __init__(self, path: str = STATE_SQLITE_PATH, timeout: float = STATE_SQLITE_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._all: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def get(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit mode: transactions are opened explicitly with BEGIN IMMEDIATE
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._all.append(conn)
+        return conn
+
+    def transaction(self):
+        return _Transaction(self.get())
+
+    def close(self):
+        with self._lock:
+            for conn in self._all:
+                conn.close()
+            self._all.clear()
+        self._local = threading.local()
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT (ROLLBACK on error)"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+class SQLiteBackend(StateBackend):
+    """State in a SQLite file shared by all worker processes on the host"""
+
+    shared = True
+
+    def __init__(self, path: str = STATE_SQLITE_PATH, clock=time.time):
+        self._connections = SQLiteConnections(path)
+        self._clock = clock
+        with self._connections.transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS state (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL,
+                    PRIMARY KEY (namespace, key)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_state_expires_at ON state (expires_at)")
+        self._writes = 0
+
+    @property
+    def connections(self) -> SQLiteConnections:
+        return self._connections
+
+    def get(self, namespace: str, key: str, default=None):
+        row = self._connections.get().execute(
+            "SELECT value FROM state WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, key, self._clock())
+        ).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def update(self, namespace: str, key: str, fn: UpdateFn, ttl: Optional[float] = None):
+        with self._connections.transaction() as conn:
+            now = self._clock()
+            row = conn.execute(
+                "SELECT value FROM state WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (namespace, key, now)
+            ).fetchone()
+            new_value, result = fn(None if row is None else json.loads(row[0]))
+            if new_value is None:
+                conn.execute("DELETE FROM state WHERE namespace = ? AND key = ?", (namespace, key))
+            else:
+                conn.execute(
+                    "INSERT OR REPLACE INTO state (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                    (namespace, key, json.dumps(new_value), now + ttl if ttl is not None else None)
+                )
+
+            # Expired rows are otherwise only replaced when their key is used again
+            self._writes += 1
+            if self._writes % PURGE_EVERY == 0:
+                conn.execute(
+                    "DELETE FROM state WHERE rowid IN "
+                    "(SELECT rowid FROM state WHERE expires_at <= ? LIMIT ?)",
+                    (now, PURGE_BATCH)
+                )
+            return result
+
+    def delete(self, namespace: str, key: str):
+        with self._connections.transaction() as conn:
+            conn.execute("DELETE FROM state WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def items(self, namespace: str) -> List[Tuple[str, Any]]:
+        rows = self._connections.get().execute(
+            "SELECT key, value FROM state WHERE namespace = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, self._clock())
+        ).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def count(self, namespace: str) -> int:
+        return self._connections.get().execute(
+            "SELECT COUNT(*) FROM state WHERE namespace = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, self._clock())
+        ).fetchone()[0]
+
+    def clear(self, namespace: str):
+        with self._connections.transaction() as conn:
+            conn.execute("DELETE FROM state WHERE namespace = ?", (namespace,))
+
+    def close(self):
+        self._connections.close()
+
+
+def create_state_backend(kind: str = STATE_BACKEND, path: str = STATE_SQLITE_PATH) -> StateBackend:
+    if kind == "sqlite":
+        return SQLiteBackend(path)
+    if kind == "memory":
+        return MemoryBackend()
+    raise ValueError(f"Unknown STATE_BACKEND: {kind}")
+
+
+state_backend = create_state_backend()
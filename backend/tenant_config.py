@@ -0,0 +1,167 @@
+"""
+Bobot Tenant Config Cache
+Short-lived snapshots of per-tenant configuration for the chat path
+
+Every chat request needs the widget, the company, the company settings and
+the global maintenance flag. They change rarely, so they are read through
+this cache as immutable snapshots and reloaded after CONFIG_CACHE_TTL
+seconds or when an endpoint that edits them calls invalidate_company() or
+invalidate_global().
+
+Invalidation is per process. With a shared state backend (several
+workers) each invalidation also bumps a version there, and other workers
+drop their copy on the next lookup, as the knowledge index does.
+"""
+
+import os
+import threading
+import time
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from sqlalchemy import inspect as sa_inspect
+
+from state_backend import StateBackend, state_backend
+
+
+# =============================================================================
+# Configuration
+# =============================================================================
+
+CONFIG_CACHE_TTL = float(os.getenv("CONFIG_CACHE_TTL", "30"))  # Seconds
+
+VERSION_NAMESPACE = "config_version"
+GLOBAL_SCOPE = "_global"  # Version key for settings shared by all tenants
+
+
+# =============================================================================
+# Snapshots
+# =============================================================================
+
+class Snapshot:
+    """Read-only copy of a model row's column values
+
+    Supports the attribute reads the chat code does on Widget, Company and
+    CompanySettings rows, but is detached from any session: it never
+    triggers a query and cannot be modified or saved.
+    """
+
+    __slots__ = ("_values",)
+
+    def __init__(self, values: Dict[str, Any]):
+        object.__setattr__(self, "_values", MappingProxyType(dict(values)))
+
+    def __getattr__(self, name: str):
+        try:
+            return self._values[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __setattr__(self, name: str, value):
+        raise AttributeError("Snapshot is read-only")
+
+    def __repr__(self):
+        return f"Snapshot({dict(self._values)!r})"
+
+
+def snapshot(row) -> Optional[Snapshot]:
+    """Snapshot of a model instance's columns (None stays None)"""
+    if row is None:
+        return None
+    return Snapshot({attr.key: getattr(row, attr.key) for attr in sa_inspect(row).mapper.column_attrs})
+
+
+# =============================================================================
+# Cache
+# =============================================================================
+
+class TenantConfigCache:
+    """Read-through cache of config snapshots keyed by (kind, key)
+
+    Each entry remembers the company it belongs to (GLOBAL_SCOPE for
+    settings shared by all tenants) so invalidate_company() can drop the company, its settings
+    and all of its widgets at once. Lookups that find nothing are not
+    cached.
+    """
+
+    def __init__(self, ttl: float = CONFIG_CACHE_TTL, versions: Optional[StateBackend] = None,
+                 clock=time.monotonic):
+        self.ttl = ttl
+        self._versions = versions
+        self._clock = clock
+        # (kind, key) -> (value, scope, expires_at, shared version)
+        self._entries: Dict[Tuple[str, str], Tuple[Any, str, float, int]] = {}
+        self._lock = threading.Lock()
+        self._generation = 0  # Bumped by every invalidation
+        self.hits = 0
+        self.misses = 0
+
+    def _version(self, scope: str) -> int:
+        return self._versions.get(VERSION_NAMESPACE, scope, 0) if self._versions is not None else 0
+
+    def get(self, kind: str, key: str, load: Callable[[], Any],
+            scope: Optional[str] = None, scope_of: Optional[Callable[[Any], str]] = None):
+        """Cached value for (kind, key), or load() it
+
+        scope is the company_id the value belongs to (GLOBAL_SCOPE if
+        omitted); scope_of derives it from the loaded value instead, for
+        lookups such as widget by key where the company is not known yet.
+        """
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get((kind, key))
+        if entry is not None:
+            value, entry_scope, expires_at, version = entry
+            if expires_at > now and version == self._version(entry_scope):
+                self.hits += 1
+                return value
+
+        self.misses += 1
+        generation = self._generation
+        value = load()
+        if value is None:
+            return None
+        if scope_of is not None:
+            scope = scope_of(value)
+        scope = scope or GLOBAL_SCOPE
+        version = self._version(scope)
+        with self._lock:
+            # Not stored if an invalidation ran while loading (it may be stale)
+            if generation == self._generation:
+                self._entries[(kind, key)] = (value, scope, now + self.ttl, version)
+        return value
+
+    def invalidate_company(self, company_id: str) -> int:
+        """Drop everything cached for a company; returns the number of entries removed"""
+        return self._invalidate(company_id)
+
+    def invalidate_global(self) -> int:
+        """Drop settings shared by all tenants (e.g. maintenance mode)"""
+        return self._invalidate(GLOBAL_SCOPE)
+
+    def _invalidate(self, scope: str) -> int:
+        if self._versions is not None:
+            self._versions.update(VERSION_NAMESPACE, scope, lambda version: ((version or 0) + 1, None))
+        with self._lock:
+            self._generation += 1
+            keys = [key for key, entry in self._entries.items() if entry[1] == scope]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total * 100, 1) if total else 0,
+        }
+
+
+config_cache = TenantConfigCache(versions=state_backend if state_backend.shared else None)
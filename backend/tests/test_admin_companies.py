@@ -0,0 +1,123 @@
+"""
+Tests for the super admin company lists (aggregated counts, pagination, sorting)
+"""
+
+import os
+import sys
+from datetime import date, datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Set test environment before importing app
+os.environ["ENVIRONMENT"] = "test"
+os.environ["DATABASE_URL"] = "sqlite:///./test_bobot.db"
+
+from main import app
+from auth import create_token
+from database import (
+    Base, engine, SessionLocal, Company, CompanySettings, Conversation, DailyStatistics, KnowledgeItem, Message,
+    Widget
+)
+from tenant_config import config_cache
+
+ENDPOINTS = ("/admin/companies", "/admin/analytics/companies", "/admin/ai-insights")
+
+
+@pytest.fixture
+def client():
+    Base.metadata.create_all(bind=engine)
+    config_cache.clear()
+    with TestClient(app) as c:
+        yield c
+    Base.metadata.drop_all(bind=engine)
+
+
+def admin_headers():
+    return {"Authorization": f"Bearer {create_token({'sub': 'admin', 'type': 'super_admin'})}"}
+
+
+def add_tenants(first, count):
+    """Tenants t<first>.. with i knowledge items, 2 * i conversations, one widget and a week of stats"""
+    db = SessionLocal()
+    try:
+        for i in range(first, first + count):
+            company_id = f"t{i:03d}"
+            db.add(Company(id=company_id, name=f"Tenant {i}", password_hash="x",
+                           created_at=datetime(2024, 1, 1) + timedelta(days=i)))
+            db.add(CompanySettings(company_id=company_id, company_name=f"Bolag {i}", max_knowledge_items=10 * i))
+            db.add(Widget(company_id=company_id, widget_key=f"{company_id}-key", name="Widget"))
+            for k in range(i):
+                db.add(KnowledgeItem(company_id=company_id, question=f"Fråga {k}", answer="Svar"))
+            for c in range(2 * i):
+                conversation = Conversation(company_id=company_id, session_id=f"{company_id}-{c}", message_count=1)
+                db.add(conversation)
+                db.flush()
+                db.add(Message(conversation_id=conversation.id, role="user", content="Hej"))
+            for day in range(3):
+                db.add(DailyStatistics(
+                    company_id=company_id, date=date.today() - timedelta(days=day),
+                    total_conversations=5 + (20 if day == 0 else 0), questions_answered=1, questions_unanswered=9,
+                    helpful_count=1, not_helpful_count=5, category_counts='{"hyra": 2}'
+                ))
+        db.commit()
+    finally:
+        db.close()
+
+
+def tenants(companies):
+    return [c for c in companies if c["id"].startswith("t")]
+
+
+class TestAdminCompanies:
+
+    def test_counts_settings_and_total(self, client):
+        add_tenants(1, 3)
+        response = client.get("/admin/companies", headers=admin_headers())
+        assert response.status_code == 200
+        companies = {c["id"]: c for c in response.json()}
+        assert int(response.headers["X-Total-Count"]) == len(companies)
+        assert companies["t002"]["knowledge_count"] == 2
+        assert companies["t002"]["chat_count"] == 4
+        assert companies["t002"]["widget_count"] == 1
+        assert companies["t002"]["max_knowledge_items"] == 20
+
+    def test_sorting_and_pagination(self, client):
+        add_tenants(1, 5)
+        by_chats = client.get("/admin/companies?sort=chat_count&order=desc", headers=admin_headers()).json()
+        assert [c["id"] for c in tenants(by_chats)] == ["t005", "t004", "t003", "t002", "t001"]
+
+        by_knowledge = client.get("/admin/companies?sort=knowledge_count", headers=admin_headers()).json()
+        assert [c["id"] for c in tenants(by_knowledge)] == ["t001", "t002", "t003", "t004", "t005"]
+
+        # The tenants were created in 2024, before the seeded companies
+        page = client.get("/admin/companies?sort=created_at&limit=2&offset=1", headers=admin_headers())
+        assert [c["id"] for c in page.json()] == ["t002", "t003"]
+        assert int(page.headers["X-Total-Count"]) > 5
+
+        assert client.get("/admin/companies?sort=password_hash", headers=admin_headers()).status_code == 400
+
+    def test_analytics_and_insights(self, client):
+        add_tenants(1, 3)
+        analytics = client.get("/admin/analytics/companies?limit=2", headers=admin_headers()).json()["companies"]
+        assert [c["company_id"] for c in analytics] == ["t001", "t002"]  # DailyStatistics (35) beats 2 and 4
+        assert analytics[0]["conversations"] == 35
+        assert analytics[0]["messages"] == 2
+
+        insights = client.get("/admin/ai-insights", headers=admin_headers()).json()
+        titles = {(i["company_id"], i["title"]) for i in insights["insights"]}
+        assert ("t001", "Hög andel obesvarade frågor") in titles
+        assert ("t001", "Trafiktopp upptäckt") in titles
+        assert ("t001", "Låg nöjdhet") in titles
+        assert next(i for i in insights["insights"] if i["company_id"] == "t001")["company_name"] == "Bolag 1"
+        assert insights["trending_topics"][0]["topic"] == "hyra"
+
+    def test_statement_count_does_not_grow_with_tenants(self, client):
+        add_tenants(1, 2)
+        few = {path: client.get(path, headers=admin_headers()).headers["X-DB-Queries"] for path in ENDPOINTS}
+        add_tenants(3, 10)
+        many = {path: client.get(path, headers=admin_headers()).headers["X-DB-Queries"] for path in ENDPOINTS}
+        assert many == few
@@ -0,0 +1,218 @@
+"""
+Tests for the analytics rollups behind /analytics and /stats
+"""
+
+import os
+import sys
+import uuid
+from datetime import date
+
+import pytest
+from fastapi.testclient import TestClient
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Set test environment before importing app
+os.environ["ENVIRONMENT"] = "test"
+os.environ["DATABASE_URL"] = "sqlite:///./test_bobot.db"
+
+import analytics_rollup
+import main
+from main import app
+from auth import create_token
+from database import (
+    Base, engine, SessionLocal, AnalyticsRollup, Conversation, DailyStatistics, Message
+)
+from ollama_stub import running_stub
+from response_cache import response_cache
+from tenant_config import config_cache
+
+
+@pytest.fixture(scope="module")
+def client():
+    """Test client with an Ollama stub behind it"""
+    Base.metadata.create_all(bind=engine)
+    # Other test modules recreate the database under the process-wide caches
+    config_cache.clear()
+
+    with running_stub() as stub:
+        original_url = main.OLLAMA_BASE_URL
+        main.OLLAMA_BASE_URL = stub.base_url
+        try:
+            with TestClient(app) as c:
+                yield c
+        finally:
+            main.OLLAMA_BASE_URL = original_url
+
+    response_cache.clear()  # Answers from this module's stub must not leak into others
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture
+def chats(client):
+    """A mix of answered, unanswered and conversational turns for demo"""
+    db = SessionLocal()
+    try:
+        db.query(Message).delete()
+        db.query(Conversation).delete()
+        db.query(DailyStatistics).delete()
+        db.query(AnalyticsRollup).delete()
+        db.commit()
+    finally:
+        db.close()
+    response_cache.clear()
+
+    widget_session, company_session = str(uuid.uuid4()), str(uuid.uuid4())
+    turns = [
+        ("/chat/widget/demo-ext-001", widget_session, "Hur betalar jag hyran?"),
+        ("/chat/widget/demo-ext-001", widget_session, "Vad kostar en elefant på månen?"),
+        ("/chat/widget/demo-ext-001", str(uuid.uuid4()), "Hej"),
+        ("/chat/demo", company_session, "Hej"),
+        ("/chat/demo", company_session, "Hur gör jag en felanmälan?"),
+        ("/chat/demo", str(uuid.uuid4()), "What is the meaning of zebras?"),
+    ]
+    for path, session_id, question in turns:
+        response = client.post(path, json={"question": question, "session_id": session_id})
+        assert response.status_code == 200, response.text
+    main.write_queue.flush_all()
+    return client
+
+
+def company_headers(company_id="demo"):
+    return {"Authorization": f"Bearer {create_token({'sub': company_id, 'type': 'company'})}"}
+
+
+def rollup_rows(company_id="demo"):
+    db = SessionLocal()
+    try:
+        return {
+            (r.date, r.metric): r.value
+            for r in db.query(AnalyticsRollup).filter(AnalyticsRollup.company_id == company_id)
+            if r.value
+        }
+    finally:
+        db.close()
+
+
+def scan_tables(company_id="demo"):
+    """What /analytics computed before rollups: every conversation and message"""
+    db = SessionLocal()
+    try:
+        conversations = db.query(Conversation).filter(Conversation.company_id == company_id).all()
+        result = {
+            "total_conversations": len(conversations),
+            "total_messages": sum(c.message_count for c in conversations),
+            "total_answered": 0, "total_unanswered": 0,
+            "conversations_today": len([c for c in conversations if c.started_at.date() == date.today()]),
+            "language_stats": {}, "category_stats": {}, "hourly_stats": {str(h): 0 for h in range(24)},
+        }
+        response_times, unanswered = [], set()
+        for conv in conversations:
+            result["language_stats"][conv.language or "sv"] = result["language_stats"].get(conv.language or "sv", 0) + 1
+            result["category_stats"][conv.category or "allmant"] = result["category_stats"].get(conv.category or "allmant", 0) + 1
+            result["hourly_stats"][str(conv.started_at.hour)] += 1
+            messages = db.query(Message).filter(Message.conversation_id == conv.id).order_by(Message.id).all()
+            for i, msg in enumerate(messages):
+                if msg.response_time_ms is not None:
+                    response_times.append(msg.response_time_ms)
+                if msg.role != "bot":
+                    continue
+                if msg.had_answer:
+                    result["total_answered"] += 1
+                else:
+                    result["total_unanswered"] += 1
+                    unanswered.add(messages[i - 1].content[:100])
+        result["avg_response_time_ms"] = sum(response_times) / len(response_times) if response_times else 0
+        result["top_unanswered"] = unanswered
+        return result
+    finally:
+        db.close()
+
+
+class TestAnalyticsRollup:
+
+    def test_analytics_matches_scanning_the_tables(self, chats):
+        expected = scan_tables()
+        assert expected["total_unanswered"] >= 1  # The scenario covers both outcomes
+
+        analytics = chats.get("/analytics", headers=company_headers()).json()
+        for field in ("total_conversations", "total_messages", "total_answered", "total_unanswered",
+                      "conversations_today", "language_stats", "category_stats", "hourly_stats"):
+            assert analytics[field] == expected[field], field
+        assert analytics["avg_response_time_ms"] == pytest.approx(expected["avg_response_time_ms"])
+        assert set(analytics["top_unanswered"]) == expected["top_unanswered"]
+        assert analytics["messages_today"] == expected["total_messages"]
+        assert analytics["daily_stats"][-1]["conversations"] == expected["total_conversations"]
+        assert analytics["feedback_stats"]["no_feedback"] == expected["total_conversations"]
+
+    def test_backfill_rebuilds_the_incremental_rollups(self, chats):
+        incremental = rollup_rows()
+        assert incremental
+
+        db = SessionLocal()
+        try:
+            analytics_rollup.rebuild(db, "demo")
+        finally:
+            db.close()
+        assert rollup_rows() == incremental
+
+    def test_rollups_survive_gdpr_cleanup(self, chats):
+        before = chats.get("/analytics", headers=company_headers()).json()
+
+        # What cleanup_old_conversations does with each expired conversation
+        db = SessionLocal()
+        try:
+            for conversation in db.query(Conversation).filter(Conversation.company_id == "demo").all():
+                main.save_conversation_stats(db, conversation)
+                db.delete(conversation)
+            db.commit()
+        finally:
+            db.close()
+
+        after = chats.get("/analytics", headers=company_headers()).json()
+        assert after["top_unanswered"] == []  # Question texts are deleted with the conversations
+        after["top_unanswered"] = before["top_unanswered"]
+        assert after == before
+
+        # A backfill from DailyStatistics gives the same counters
+        db = SessionLocal()
+        try:
+            analytics_rollup.rebuild(db, "demo")
+        finally:
+            db.close()
+        rebuilt = chats.get("/analytics", headers=company_headers()).json()
+        for field in ("total_conversations", "total_messages", "total_answered", "total_unanswered",
+                      "language_stats", "category_stats", "hourly_stats"):
+            assert rebuilt[field] == before[field], field
+
+    def test_feedback_change_moves_the_count(self, chats):
+        db = SessionLocal()
+        try:
+            session_id = db.query(Conversation.session_id).filter(Conversation.company_id == "demo").first()[0]
+        finally:
+            db.close()
+
+        chats.post(f"/chat/demo/feedback?session_id={session_id}&helpful=true")
+        chats.post(f"/chat/demo/feedback?session_id={session_id}&helpful=false")
+        main.write_queue.flush_all()
+
+        feedback = chats.get("/analytics", headers=company_headers()).json()["feedback_stats"]
+        assert feedback["helpful"] == 0
+        assert feedback["not_helpful"] == 1
+
+    def test_stats_reads_conversation_counts(self, chats):
+        stats = chats.get("/stats", headers=company_headers()).json()
+        total = scan_tables()["total_conversations"]
+        assert stats["total_questions"] == total
+        assert stats["questions_today"] == total
+        assert stats["questions_this_month"] == total
+
+    def test_analytics_query_count_does_not_grow_with_conversations(self, chats):
+        first = chats.get("/analytics", headers=company_headers())
+        for i in range(3):
+            chats.post("/chat/demo", json={"question": f"Hej nummer {i}", "session_id": str(uuid.uuid4())})
+        main.write_queue.flush_all()
+        second = chats.get("/analytics", headers=company_headers())
+        assert second.json()["total_conversations"] == first.json()["total_conversations"] + 3
+        assert second.headers["X-DB-Queries"] == first.headers["X-DB-Queries"]
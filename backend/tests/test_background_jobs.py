@@ -0,0 +1,277 @@
+"""
+Tests for background jobs (knowledge uploads and URL imports)
+"""
+
+import asyncio
+import json
+import os
+import socket
+import sys
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Set test environment before importing app
+os.environ["ENVIRONMENT"] = "test"
+os.environ["DATABASE_URL"] = "sqlite:///./test_bobot.db"
+
+import main
+from main import app
+from auth import create_token
+from background_jobs import JobContext, JobEngine
+from database import Base, engine, SessionLocal, BackgroundJob, KnowledgeItem
+from db_executor import run_db
+from ollama_stub import running_stub
+from response_cache import response_cache
+from tenant_config import config_cache
+
+EXTRACTED = json.dumps([
+    {"question": "När töms soporna?", "answer": "Soporna töms varje tisdag.", "category": "allmant"},
+    {"question": "Var finns cykelrummet?", "answer": "Cykelrummet ligger i källaren."},
+])
+CSV = "fråga,svar,kategori\nNär betalas hyran?,Senast den sista,hyra\nVar är tvättstugan?,I källaren,tvattstuga\n"
+
+
+@pytest.fixture(scope="module")
+def client():
+    """Test client with an Ollama stub that answers with extracted Q&A pairs"""
+    Base.metadata.create_all(bind=engine)
+    config_cache.clear()
+
+    with running_stub(response_text=EXTRACTED, delay=0.3) as stub:
+        original_url = main.OLLAMA_BASE_URL
+        main.OLLAMA_BASE_URL = stub.base_url
+        try:
+            with TestClient(app) as c:
+                yield c
+        finally:
+            main.OLLAMA_BASE_URL = original_url
+
+    response_cache.clear()
+    Base.metadata.drop_all(bind=engine)
+
+
+def headers(company_id="demo"):
+    return {"Authorization": f"Bearer {create_token({'sub': company_id, 'type': 'company'})}"}
+
+
+def upload(client, filename, content):
+    return client.post("/knowledge/upload", headers=headers(), files={"file": (filename, content.encode())})
+
+
+def wait_for(client, job_id, statuses=("succeeded", "failed", "cancelled"), timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = client.get(f"/jobs/{job_id}", headers=headers()).json()
+        if job["status"] in statuses:
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"Job {job_id} still {job['status']}")
+
+
+def knowledge_questions(company_id="demo"):
+    db = SessionLocal()
+    try:
+        return {item.question for item in db.query(KnowledgeItem).filter(KnowledgeItem.company_id == company_id)}
+    finally:
+        db.close()
+
+
+def dead_url():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{s.getsockname()[1]}"
+
+
+class TestKnowledgeJobs:
+
+    def test_csv_upload_runs_as_job(self, client):
+        response = upload(client, "faq.csv", CSV)
+        assert response.status_code == 202
+        submitted = response.json()
+        assert submitted["status"] == "queued"
+        assert submitted["status_url"] == f"/jobs/{submitted['job_id']}"
+
+        job = wait_for(client, submitted["job_id"])
+        assert job["status"] == "succeeded"
+        assert (job["progress"], job["kind"]) == (100, "knowledge_upload")
+        assert job["result"]["imported"] == 2
+        assert job["result"]["message"] == "2 frågor/svar har lagts till i kunskapsbasen"
+        assert {"När betalas hyran?", "Var är tvättstugan?"} <= knowledge_questions()
+
+        # The uploaded file is not kept
+        db = SessionLocal()
+        try:
+            assert db.get(BackgroundJob, submitted["job_id"]).payload is None
+        finally:
+            db.close()
+
+    def test_text_upload_extracts_with_ai(self, client):
+        job_id = upload(client, "info.txt", "Soporna töms varje tisdag. Cykelrummet ligger i källaren.").json()["job_id"]
+        assert wait_for(client, job_id, statuses=("running",))["stage"]
+        job = wait_for(client, job_id)
+        assert job["status"] == "succeeded"
+        assert [item["question"] for item in job["result"]["items"]] == ["När töms soporna?", "Var finns cykelrummet?"]
+        assert job["result"]["items"][1]["category"]  # Auto-categorized
+
+    def test_failures_are_reported_on_the_job(self, client, monkeypatch):
+        monkeypatch.setattr(main, "OLLAMA_BASE_URL", dead_url())
+        job = wait_for(client, upload(client, "info.txt", "Lång text utan kommatecken om allt i huset").json()["job_id"])
+        assert job["status"] == "failed"
+        assert "AI-tjänsten är inte tillgänglig" in job["error"]
+
+        response = client.post("/knowledge/import-url", headers=headers(), json={"url": dead_url()})
+        assert response.status_code == 202
+        job = wait_for(client, response.json()["job_id"])
+        assert job["status"] == "failed"
+        assert job["error"].startswith("Kunde inte hämta innehåll")
+
+    def test_invalid_input_is_rejected_at_once(self, client):
+        assert upload(client, "bild.png", "x").status_code == 400
+        assert client.post("/knowledge/import-url", headers=headers(), json={"url": "https://"}).status_code == 400
+
+    def test_cancel_running_job(self, client):
+        before = knowledge_questions()
+        job_id = upload(client, "info.txt", "Soporna töms varje tisdag i hela området").json()["job_id"]
+        wait_for(client, job_id, statuses=("running",))
+        assert client.post(f"/jobs/{job_id}/cancel", headers=headers()).json()["job_id"] == job_id
+
+        job = wait_for(client, job_id)
+        assert job["status"] == "cancelled"
+        time.sleep(0.4)  # The extraction would have finished by now
+        assert knowledge_questions() == before
+
+    def test_jobs_are_private_to_the_company(self, client):
+        job_id = upload(client, "faq.csv", CSV).json()["job_id"]
+        assert client.get(f"/jobs/{job_id}", headers=headers("other-company")).status_code == 404
+        assert client.post(f"/jobs/{job_id}/cancel", headers=headers("other-company")).status_code == 404
+        assert job_id in [job["id"] for job in client.get("/jobs", headers=headers()).json()]
+        wait_for(client, job_id)
+
+
+class TestJobEngine:
+
+    def test_interrupted_job_is_resumed(self, client):
+        db = SessionLocal()
+        try:
+            db.add(BackgroundJob(
+                id="interrupted", company_id="demo", kind="knowledge_upload",
+                params=json.dumps({"filename": "faq.csv", "widget_id": None}),
+                payload="fråga,svar\nFinns det hiss?,Ja i alla trapphus\n".encode(),
+                status="running", attempts=1, heartbeat_at=datetime.utcnow() - timedelta(hours=1)
+            ))
+            db.commit()
+        finally:
+            db.close()
+
+        assert main.job_engine.recover() == 1
+        main.job_engine.wake()
+        job = wait_for(client, "interrupted")
+        assert job["status"] == "succeeded"
+        assert "Finns det hiss?" in knowledge_questions()
+
+    async def test_job_completed_with_its_insert_is_not_queued_again(self, client):
+        jobs = JobEngine(SessionLocal)
+        inserted = asyncio.Event()
+
+        async def handler(job):
+            def insert():
+                db = SessionLocal()
+                try:
+                    db.add(KnowledgeItem(company_id="demo", question="Finns det bastu?", answer="Ja, på vinden."))
+                    job.complete(db, {"imported": 1})
+                    db.commit()
+                finally:
+                    db.close()
+            await run_db(insert)
+            inserted.set()
+            await asyncio.sleep(60)  # Shutdown comes before the handler returns
+
+        jobs.handler("bastu")(handler)
+        db = SessionLocal()
+        try:
+            # Already running, so the app's own job engine leaves it alone
+            db.add(BackgroundJob(id="bastu", company_id="demo", kind="bastu", status="running", attempts=1,
+                                 heartbeat_at=datetime.utcnow()))
+            db.commit()
+            context = JobContext(jobs, db.get(BackgroundJob, "bastu"))
+        finally:
+            db.close()
+
+        jobs._tasks = [asyncio.create_task(jobs._run(context))]
+        await asyncio.wait_for(inserted.wait(), 5)
+        await jobs.stop()
+
+        db = SessionLocal()
+        try:
+            job = db.get(BackgroundJob, "bastu")
+            assert (job.status, json.loads(job.result)) == ("succeeded", {"imported": 1})
+        finally:
+            db.close()
+        assert (jobs.stats()["succeeded"], jobs.stats()["requeued"]) == (1, 0)
+
+    async def test_heartbeat_does_not_stop_a_completed_handler(self, client):
+        jobs = JobEngine(SessionLocal, stale_seconds=1)  # Heartbeat every 0.5 s
+        returned = []
+
+        async def handler(job):
+            def insert():
+                db = SessionLocal()
+                try:
+                    job.complete(db, {"imported": 0})
+                    db.commit()
+                finally:
+                    db.close()
+            await run_db(insert)
+            await asyncio.sleep(1)  # Updating the in-memory index, while the heartbeat fires
+            returned.append(job.id)
+
+        jobs.handler("index")(handler)
+        db = SessionLocal()
+        try:
+            db.add(BackgroundJob(id="index", company_id="demo", kind="index", status="running", attempts=1,
+                                 heartbeat_at=datetime.utcnow()))
+            db.commit()
+            context = JobContext(jobs, db.get(BackgroundJob, "index"))
+        finally:
+            db.close()
+
+        await asyncio.wait_for(jobs._run(context), 5)
+        assert returned == ["index"]
+        db = SessionLocal()
+        try:
+            assert db.get(BackgroundJob, "index").status == "succeeded"
+        finally:
+            db.close()
+
+    def test_stale_job_fails_after_max_attempts_and_queued_job_cancels(self, client):
+        jobs = JobEngine(SessionLocal, max_attempts=2)
+        jobs.handler("noop")(lambda job: None)
+        db = SessionLocal()
+        try:
+            db.add(BackgroundJob(id="crashing", kind="noop", status="running", attempts=2, heartbeat_at=None))
+            db.commit()
+            queued = jobs.submit(db, "noop", "demo", payload=b"data")
+        finally:
+            db.close()
+
+        jobs.recover()
+        assert jobs.request_cancel(queued) == "cancelled"
+
+        db = SessionLocal()
+        try:
+            crashing = db.get(BackgroundJob, "crashing")
+            assert (crashing.status, crashing.error) == ("failed", "Jobbet avbröts för många gånger och har stoppats.")
+            assert db.get(BackgroundJob, queued).payload is None
+
+            # Finished jobs are deleted after the retention period
+            crashing.finished_at = datetime.utcnow() - timedelta(days=30)
+            db.commit()
+        finally:
+            db.close()
+        assert jobs.delete_finished(days=7) == 1
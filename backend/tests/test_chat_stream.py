@@ -0,0 +1,108 @@
+"""
+Tests for the streaming (SSE) chat endpoints
+"""
+
+import json
+import os
+import sys
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Set test environment before importing app
+os.environ["ENVIRONMENT"] = "test"
+os.environ["DATABASE_URL"] = "sqlite:///./test_bobot.db"
+
+import main
+from main import app
+from database import Base, engine, SessionLocal, Conversation, Message
+from ollama_stub import running_stub
+
+
+STUB_ANSWER = "Hyran betalas via autogiro eller bankgiro."
+
+
+@pytest.fixture(scope="module")
+def client():
+    """Test client with an Ollama stub behind it"""
+    Base.metadata.create_all(bind=engine)
+
+    with running_stub(response_text=STUB_ANSWER) as stub:
+        original_url = main.OLLAMA_BASE_URL
+        main.OLLAMA_BASE_URL = stub.base_url
+        try:
+            with TestClient(app) as c:
+                yield c
+        finally:
+            main.OLLAMA_BASE_URL = original_url
+
+    Base.metadata.drop_all(bind=engine)
+
+
+def read_events(response):
+    """Parse an SSE body into a list of (event, data) tuples"""
+    events = []
+    for block in response.text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+class TestChatStream:
+    """Tests for /chat/widget/{widget_key}/stream and /chat/{company_id}/stream"""
+
+    def test_widget_stream_tokens_and_persistence(self, client):
+        """Knowledge answers stream meta, tokens and a persisted conversation id"""
+        session_id = str(uuid.uuid4())
+        response = client.post("/chat/widget/demo-ext-001/stream", json={
+            "question": "Hur betalar jag hyran?",
+            "session_id": session_id
+        })
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+
+        events = read_events(response)
+        names = [name for name, _ in events]
+        assert names[0] == "meta"
+        assert names[-1] == "done"
+        assert "token" in names
+
+        meta = events[0][1]
+        assert meta["sources"]
+        assert meta["confidence"] == 100
+
+        tokens = "".join(data["text"] for name, data in events if name == "token")
+        done = events[-1][1]
+        assert tokens == STUB_ANSWER
+        assert done["answer"] == STUB_ANSWER
+        assert done["conversation_id"].startswith("BOB-")
+
+        main.write_queue.flush_all()  # Messages are written behind the response
+        db = SessionLocal()
+        try:
+            conversation = db.query(Conversation).filter(Conversation.session_id == session_id).first()
+            assert conversation.reference_id == done["conversation_id"]
+            roles = [m.role for m in db.query(Message).filter(Message.conversation_id == conversation.id)]
+            assert sorted(roles) == ["bot", "user"]
+        finally:
+            db.close()
+
+    def test_company_stream_greeting_without_llm(self, client):
+        """Conversational answers are sent as a single token"""
+        response = client.post("/chat/demo/stream", json={
+            "question": "Hej",
+            "session_id": str(uuid.uuid4())
+        })
+        assert response.status_code == 200
+        names = [name for name, _ in read_events(response)]
+        assert names == ["meta", "token", "done"]
+
+    def test_errors_before_stream_are_plain_http(self, client):
+        """Validation errors keep their HTTP status instead of an SSE body"""
+        response = client.post("/chat/widget/does-not-exist/stream", json={"question": "Hej"})
+        assert response.status_code == 404
+        assert response.json()["detail"] == "Widget finns inte"
@@ -0,0 +1,67 @@
+"""
+Tests for running synchronous DB work off the event loop
+"""
+
+import asyncio
+import os
+import sys
+import threading
+
+import pytest
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ["ENVIRONMENT"] = "test"
+os.environ["DATABASE_URL"] = "sqlite:///./test_bobot.db"
+
+from sqlalchemy import text
+
+from database import Base, engine, SessionLocal
+from db_executor import run_db
+import query_counter
+from query_counter import count_queries
+
+
+@pytest.fixture
+def db():
+    Base.metadata.create_all(bind=engine)
+    query_counter.install(engine)
+    session = SessionLocal()
+    yield session
+    session.close()
+
+
+class TestRunDb:
+
+    async def test_runs_in_a_db_thread(self):
+        name = await run_db(lambda: threading.current_thread().name)
+        assert name.startswith("bobot-db")
+
+    async def test_query_counter_sees_queries_from_the_thread(self, db):
+        with count_queries() as counter:
+            await run_db(lambda: db.execute(text("SELECT 1")).scalar())
+        assert counter.count == 1
+
+    async def test_release_returns_the_connection(self, db):
+        def select_one():
+            value = db.execute(text("SELECT 1")).scalar()
+            assert db.in_transaction()
+            return value
+
+        assert await run_db(select_one, release=db) == 1
+        assert not db.in_transaction()
+
+    async def test_event_loop_keeps_running_during_db_work(self):
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.005)
+
+        task = asyncio.create_task(ticker())
+        await run_db(lambda: threading.Event().wait(0.1))
+        task.cancel()
+        assert ticks >= 5
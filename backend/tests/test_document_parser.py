@@ -0,0 +1,143 @@
+"""
+Tests for document parsing in the worker process pool
+"""
+
+import asyncio
+import io
+import os
+import sys
+import time
+
+import pytest
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Set test environment before importing app
+os.environ["ENVIRONMENT"] = "test"
+os.environ["DATABASE_URL"] = "sqlite:///./test_bobot.db"
+
+import document_parser
+from document_parser import ParseError, parse_in_pool, parse_pdf_pages
+from main import parse_excel_file, parse_pdf_file, parse_word_file
+
+
+def make_pdf(pages: int) -> bytes:
+    """A PDF with the text "Sida n" on page n"""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for n in range(1, pages + 1):
+        stream = f"BT /F1 12 Tf 72 720 Td (Sida {n}) Tj ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {pages} >>"
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n{body}\nendobj\n".encode())
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    return out.getvalue()
+
+
+def make_xlsx(rows) -> bytes:
+    import openpyxl
+    workbook = openpyxl.Workbook()
+    for row in rows:
+        workbook.active.append(row)
+    out = io.BytesIO()
+    workbook.save(out)
+    return out.getvalue()
+
+
+def make_docx(paragraphs) -> bytes:
+    from docx import Document
+    doc = Document()
+    for text in paragraphs:
+        doc.add_paragraph(text)
+    out = io.BytesIO()
+    doc.save(out)
+    return out.getvalue()
+
+
+@pytest.fixture(scope="module", autouse=True)
+def pool():
+    yield
+    document_parser.close_parse_pool()
+
+
+class TestParsers:
+
+    async def test_excel_is_read_by_header(self):
+        items = await parse_excel_file(make_xlsx([
+            ["Kategori", "Fråga", "Svar"],
+            ["hyra", "När betalas hyran?", "Senast den sista"],
+            [None, "Var är tvättstugan?", "I källaren"],
+            ["hyra", "Fråga utan svar", None],
+        ]))
+        assert items == [
+            {"question": "När betalas hyran?", "answer": "Senast den sista", "category": "hyra"},
+            {"question": "Var är tvättstugan?", "answer": "I källaren", "category": None},
+        ]
+
+    async def test_word_paragraphs(self):
+        text = await parse_word_file(make_docx(["Soporna töms på tisdagar.", "", "Cykelrummet är i källaren."]))
+        assert text == "Soporna töms på tisdagar.\n\nCykelrummet är i källaren."
+
+    async def test_large_pdf_pages_parse_in_parallel_ranges(self):
+        text = await parse_pdf_pages(make_pdf(25), pages_per_task=10)
+        assert text.split("\n\n") == [f"Sida {n}" for n in range(1, 26)]
+        assert await parse_pdf_file(make_pdf(2)) == "Sida 1\n\nSida 2"
+
+    async def test_broken_files_parse_to_nothing(self):
+        assert await parse_pdf_file(b"inte en pdf") == ""
+        assert await parse_excel_file(b"inte ett kalkylark") == []
+        assert await parse_word_file(b"inte ett dokument") == ""
+
+
+class TestLimits:
+
+    async def test_timeout_kills_the_worker_and_pool_recovers(self):
+        started = time.perf_counter()
+        with pytest.raises(ParseError):
+            await parse_in_pool(time.sleep, 30, timeout=1)
+        assert time.perf_counter() - started < 5
+        assert await parse_pdf_file(make_pdf(1)) == "Sida 1"
+
+    async def test_time_limit_starts_when_a_worker_is_free(self, monkeypatch):
+        monkeypatch.setattr(document_parser, "PARSE_WORKERS", 1)
+        monkeypatch.setattr(document_parser, "_slots", None)
+        document_parser.close_parse_pool()
+        try:
+            # The second task waits ~2s for the only worker, then runs within its own 2s limit
+            await asyncio.gather(parse_in_pool(time.sleep, 1.5, timeout=5), parse_in_pool(time.sleep, 1, timeout=2))
+        finally:
+            document_parser.close_parse_pool()
+
+    async def test_timeout_does_not_fail_other_running_tasks(self):
+        stuck, running = await asyncio.gather(
+            parse_in_pool(time.sleep, 30, timeout=1),
+            parse_in_pool(time.sleep, 3, timeout=10),
+            return_exceptions=True,
+        )
+        assert isinstance(stuck, ParseError)
+        assert running is None
+        assert document_parser._retired == set()  # The stuck worker's pool was killed after the other task
+        assert await parse_pdf_file(make_pdf(1)) == "Sida 1"
+
+    async def test_memory_limit(self, monkeypatch):
+        monkeypatch.setattr(document_parser, "PARSE_MEMORY_MB", 512)
+        document_parser.close_parse_pool()
+        try:
+            with pytest.raises(ParseError):
+                await parse_in_pool(bytearray, 1024 * 1024 * 1024)
+        finally:
+            document_parser.close_parse_pool()
@@ -0,0 +1,149 @@
+"""
+Tests for embeddings and hybrid (keyword + semantic) retrieval
+"""
+
+import os
+import sys
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Base, KnowledgeItem
+from embeddings import EmbeddingWorker, HashingEmbedder, OllamaEmbedder, normalize_rows
+from knowledge_index import KnowledgeIndex, IndexedItem, decode_vector
+from ollama_client import close_http_client
+from ollama_stub import OllamaStub
+
+
+def unit(*values):
+    return normalize_rows(np.array([values], dtype=np.float32))[0]
+
+
+class TestHashingEmbedder:
+
+    async def test_deterministic_and_normalized(self):
+        embedder = HashingEmbedder(dim=64)
+        vectors = await embedder.embed(["Hur betalar jag hyran?", "Hur betalar jag hyran?"])
+        assert vectors.dtype == np.float32
+        assert vectors.shape == (2, 64)
+        assert np.allclose(vectors[0], vectors[1])
+        assert abs(float(np.linalg.norm(vectors[0])) - 1) < 1e-5
+
+    async def test_compound_words_are_close(self):
+        embedder = HashingEmbedder()
+        a, b, c = await embedder.embed(["sista betalningsdag", "när ska hyran betalas", "tvättstugan öppettider"])
+        assert float(a @ b) > float(a @ c)
+
+    async def test_ollama_embedder_against_stub(self):
+        async with OllamaStub() as stub:
+            vectors = await OllamaEmbedder(base_url=stub.base_url).embed(["hyra", "parkering"])
+        await close_http_client()
+        assert vectors.shape == (2, 384)
+        assert np.allclose(vectors[0], (await HashingEmbedder().embed(["hyra"]))[0])
+
+
+class TestHybridSearch:
+
+    def build(self):
+        index = KnowledgeIndex()
+        index.build_company("acme", [
+            IndexedItem(1, "acme", None, "Sista betalningsdag", "Den sista vardagen i månaden.", "hyra", unit(1, 0, 0)),
+            IndexedItem(2, "acme", None, "Var kan jag parkera?", "På gården.", "parkering", unit(0, 1, 0)),
+            IndexedItem(3, "acme", 7, "Hur bokar jag tvättstugan?", "I appen.", "tvatt", unit(0, 0, 1)),
+        ])
+        return index
+
+    def test_paraphrase_without_shared_words(self):
+        index = self.build()
+        question = "When is the rent due?"
+        assert index.search(None, "acme", question) == []
+
+        result = index.search(None, "acme", question, query_vector=unit(0.95, 0.1, 0),
+                              semantic_weight=6, min_similarity=0.75)
+        assert [i.id for i in result] == [1]
+
+    def test_weak_similarity_is_ignored(self):
+        index = self.build()
+        result = index.search(None, "acme", "When is the rent due?", query_vector=unit(1, 1, 0),
+                              semantic_weight=6, min_similarity=0.75)
+        assert result == []
+
+    def test_widget_isolation_applies_to_vectors(self):
+        index = self.build()
+        query = unit(0, 0, 1)
+        assert index.search(None, "acme", "laundry", widget_id=8, query_vector=query,
+                            semantic_weight=6, min_similarity=0.75) == []
+        assert [i.id for i in index.search(None, "acme", "laundry", widget_id=7, query_vector=query,
+                                           semantic_weight=6, min_similarity=0.75)] == [3]
+
+    def test_edit_keeps_vector_only_if_text_unchanged(self):
+        index = self.build()
+        index.add_items([IndexedItem(2, "acme", None, "Var kan jag parkera?", "På gården.", "bil")])
+        index.add_items([IndexedItem(1, "acme", None, "Betalning", "Ändrat svar.", "hyra")])
+        assert index.stats()["vectors"] == 2
+
+
+class TestEmbeddingWorker:
+
+    async def test_embeds_missing_items_in_background(self, tmp_path):
+        engine = create_engine(f"sqlite:///{tmp_path / 'bobot.db'}")
+        Base.metadata.create_all(bind=engine)
+        session_factory = sessionmaker(bind=engine)
+
+        db = session_factory()
+        db.add_all([
+            KnowledgeItem(company_id="acme", question=f"Fråga {i}", answer=f"Svar om hyra {i}")
+            for i in range(5)
+        ])
+        db.commit()
+
+        embedder = HashingEmbedder()
+        index = KnowledgeIndex()
+        index.enable_vectors(embedder.model_id)
+        index.search(db, "acme", "hyra")  # Load the company before embeddings exist
+        assert index.stats()["vectors"] == 0
+
+        worker = EmbeddingWorker(embedder, session_factory, index, batch_size=2)
+        worker.start(worker.pending_companies(db))
+        await worker.wait_idle()
+        await worker.stop()
+
+        assert worker.embedded == 5
+        assert index.stats()["vectors"] == 5
+        item = db.query(KnowledgeItem).first()
+        db.refresh(item)
+        assert item.embedding_model == embedder.model_id
+        assert np.allclose(decode_vector(item.embedding), (await embedder.embed(["Fråga 0\nSvar om hyra 0"]))[0])
+        assert worker.pending_companies(db) == []
+
+        db.close()
+        engine.dispose()
+
+    async def test_items_edited_while_embedding_are_skipped(self, tmp_path):
+        engine = create_engine(f"sqlite:///{tmp_path / 'bobot.db'}")
+        Base.metadata.create_all(bind=engine)
+        session_factory = sessionmaker(bind=engine)
+
+        db = session_factory()
+        db.add_all([KnowledgeItem(company_id="acme", question=f"Fråga {i}", answer="Svar") for i in range(3)])
+        db.commit()
+
+        class EditingEmbedder(HashingEmbedder):
+            async def embed(self, texts):
+                db.query(KnowledgeItem).filter(KnowledgeItem.question == "Fråga 1").update({"answer": "Nytt svar"})
+                db.commit()
+                return await super().embed(texts)
+
+        worker = EmbeddingWorker(EditingEmbedder(), session_factory, KnowledgeIndex())
+        await worker.embed_company("acme")
+
+        assert worker.embedded == 2
+        rows = db.query(KnowledgeItem.question, KnowledgeItem.embedding).order_by(KnowledgeItem.id).all()
+        assert [row.embedding is not None for row in rows] == [True, False, True]
+
+        db.close()
+        engine.dispose()
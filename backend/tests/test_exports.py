@@ -0,0 +1,151 @@
+"""
+Tests for the streaming exports (keyset pagination, csv / json / ndjson)
+"""
+
+import csv
+import io
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Set test environment before importing app
+os.environ["ENVIRONMENT"] = "test"
+os.environ["DATABASE_URL"] = "sqlite:///./test_bobot.db"
+
+import exports
+import main
+from main import app
+from auth import create_token
+from database import Base, engine, SessionLocal, Conversation, KnowledgeItem, Message
+from tenant_config import config_cache
+
+CONVERSATIONS = 7
+PAGE_SIZE = 3  # Several pages, the last one short
+
+
+@pytest.fixture(scope="module")
+def client():
+    Base.metadata.create_all(bind=engine)
+    config_cache.clear()
+    with TestClient(app) as c:
+        yield c
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture
+def data(client, monkeypatch):
+    """Conversations with messages and knowledge items for demo, small export pages"""
+    monkeypatch.setattr(exports, "EXPORT_PAGE_SIZE", PAGE_SIZE)
+    db = SessionLocal()
+    try:
+        db.query(Message).delete()
+        db.query(Conversation).delete()
+        db.query(KnowledgeItem).filter(KnowledgeItem.company_id == "demo").delete()
+        start = datetime.utcnow() - timedelta(hours=CONVERSATIONS)
+        for i in range(CONVERSATIONS):
+            conversation = Conversation(
+                company_id="demo", session_id=f"export-{i}", reference_id=f"REF-{i}",
+                started_at=start + timedelta(hours=i), message_count=3,
+                was_helpful=[True, False, None][i % 3]
+            )
+            db.add(conversation)
+            db.flush()
+            db.add(Message(conversation_id=conversation.id, role="user", content=f"Första frågan, {i}"))
+            db.add(Message(conversation_id=conversation.id, role="bot", content="Svar"))
+            db.add(Message(conversation_id=conversation.id, role="user", content="Andra frågan"))
+        for i in range(5):
+            db.add(KnowledgeItem(company_id="demo", question=f"Fråga {i}, med komma", answer=f"Svar {i}"))
+        db.commit()
+    finally:
+        db.close()
+    return client
+
+
+def company_headers(company_id="demo"):
+    return {"Authorization": f"Bearer {create_token({'sub': company_id, 'type': 'company'})}"}
+
+
+def admin_headers():
+    return {"Authorization": f"Bearer {create_token({'sub': 'admin', 'type': 'super_admin'})}"}
+
+
+class TestExports:
+
+    def test_conversations_csv_newest_first_with_first_messages(self, data):
+        response = data.get("/export/conversations", headers=company_headers())
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/csv")
+        assert "conversations.csv" in response.headers["content-disposition"]
+
+        rows = list(csv.reader(io.StringIO(response.text)))
+        assert rows[0] == ["Reference ID", "Started At", "Messages", "Category", "Language", "Was Helpful",
+                           "First Message"]
+        body = rows[1:]
+        assert [row[0] for row in body] == [f"REF-{i}" for i in reversed(range(CONVERSATIONS))]
+        assert [row[6] for row in body] == [f"Första frågan, {i}" for i in reversed(range(CONVERSATIONS))]
+        assert body[-1][5] == "Yes" and body[-2][5] == "No" and body[-3][5] == "N/A"
+
+    def test_conversations_json_and_ndjson_match(self, data):
+        as_json = data.get("/export/conversations?format=json", headers=company_headers()).json()
+        ndjson = data.get("/export/conversations?format=ndjson", headers=company_headers())
+        assert ndjson.headers["content-type"].startswith("application/x-ndjson")
+        assert [json.loads(line) for line in ndjson.text.splitlines()] == as_json
+        assert len(as_json) == CONVERSATIONS
+        assert as_json[0]["messages"] == 3
+
+    def test_unknown_format(self, data):
+        response = data.get("/export/conversations?format=xml", headers=company_headers())
+        assert response.status_code == 400
+
+    def test_knowledge_every_page_once(self, data):
+        items = data.get("/export/knowledge?format=json", headers=company_headers()).json()
+        assert [item["question"] for item in items] == [f"Fråga {i}, med komma" for i in range(5)]
+
+    def test_admin_company_export_is_one_json_object(self, data):
+        response = data.get("/admin/export/demo", headers=admin_headers())
+        assert response.status_code == 200
+        document = response.json()
+        assert document["company"]["id"] == "demo"
+        assert len(document["knowledge_items"]) == 5
+        assert document["conversations_count"] == CONVERSATIONS
+        assert document["total_messages"] == 3 * CONVERSATIONS
+
+        assert data.get("/admin/export/missing", headers=admin_headers()).status_code == 404
+
+    def test_companies_export(self, data):
+        rows = list(csv.DictReader(io.StringIO(
+            data.get("/admin/bulk/export-companies", headers=admin_headers()).text
+        )))
+        demo = next(row for row in rows if row["id"] == "demo")
+        assert demo["chat_count"] == str(CONVERSATIONS)
+        assert demo["knowledge_count"] == "5"
+
+    def test_query_count_grows_with_pages_not_rows(self, data):
+        """Two queries per conversation page, however many rows a page holds"""
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(engine, "before_cursor_execute", count)
+        try:
+            pages = list(exports.keyset_pages(
+                SessionLocal,
+                lambda db: db.query(
+                    Conversation.id, Conversation.reference_id, Conversation.started_at, Conversation.message_count,
+                    Conversation.category, Conversation.language, Conversation.was_helpful
+                ).filter(Conversation.company_id == "demo"),
+                [Conversation.id], descending=True, transform=main.conversation_export_rows
+            ))
+        finally:
+            event.remove(engine, "before_cursor_execute", count)
+        assert [len(page) for page in pages] == [3, 3, 1]
+        assert len([s for s in statements if s.lstrip().upper().startswith("SELECT")]) == 2 * len(pages)
@@ -0,0 +1,170 @@
+"""
+Tests for bulk knowledge inserts and deletes
+"""
+
+import os
+import sys
+from contextlib import contextmanager
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Set test environment before importing app
+os.environ["ENVIRONMENT"] = "test"
+os.environ["DATABASE_URL"] = "sqlite:///./test_bobot.db"
+
+from main import app, knowledge_index
+from auth import create_token
+from database import Base, engine, SessionLocal, KnowledgeItem, Company, Widget
+from knowledge_bulk import bulk_insert_knowledge, bulk_delete_knowledge
+from response_cache import response_cache
+from tenant_config import config_cache
+
+
+@pytest.fixture(scope="module")
+def client():
+    Base.metadata.create_all(bind=engine)
+    config_cache.clear()
+    with TestClient(app) as c:
+        yield c
+    response_cache.clear()
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture
+def db(client):
+    session = SessionLocal()
+    for company_id in ("bulk-a", "bulk-b"):
+        if not session.get(Company, company_id):
+            session.add(Company(id=company_id, name=company_id, password_hash="x"))
+    session.commit()
+    yield session
+    session.query(KnowledgeItem).filter(KnowledgeItem.company_id.in_(["bulk-a", "bulk-b"])).delete()
+    session.query(Widget).filter(Widget.company_id == "bulk-a").delete()
+    session.commit()
+    session.close()
+    knowledge_index.invalidate("bulk-a")
+    knowledge_index.invalidate("bulk-b")
+
+
+@contextmanager
+def statements(prefix: str):
+    """Count executed SQL statements starting with prefix"""
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(prefix):
+            executed.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield executed
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+
+def items(count: int, start: int = 0):
+    return [{"question": f"Fråga nummer {n}?", "answer": f"Svar {n}", "category": "allmant"}
+            for n in range(start, start + count)]
+
+
+def headers(company_id: str):
+    return {"Authorization": f"Bearer {create_token({'sub': company_id, 'type': 'company'})}"}
+
+
+class TestBulkInsert:
+
+    def test_insert_is_one_statement_and_returns_ids_in_order(self, db):
+        with statements("INSERT") as inserts:
+            inserted, duplicates = bulk_insert_knowledge(db, "bulk-a", None, items(300))
+        db.commit()
+
+        assert len(inserts) == 1
+        assert duplicates == []
+        assert [item.question for item in inserted] == [f"Fråga nummer {n}?" for n in range(300)]
+        rows = {row.id: row.question for row in db.query(KnowledgeItem).filter(KnowledgeItem.company_id == "bulk-a")}
+        assert {item.id: item.question for item in inserted} == rows
+        assert db.get(KnowledgeItem, inserted[0].id).created_at is not None
+
+    def test_duplicates_are_skipped_without_per_item_queries(self, db):
+        inserted, _ = bulk_insert_knowledge(db, "bulk-a", None, items(5))
+        db.commit()
+        knowledge_index.add_items(inserted)
+
+        batch = items(10) + [{"question": "  FRÅGA NUMMER 7? ", "answer": "Igen"}]
+        with statements("SELECT") as selects:
+            inserted, duplicates = bulk_insert_knowledge(db, "bulk-a", None, batch)
+        assert len(selects) <= 1  # At most the index's version check
+        assert (len(inserted), len(duplicates)) == (5, 6)
+        assert inserted[0].question == "Fråga nummer 5?"
+        assert duplicates[-1] == {"question": "  FRÅGA NUMMER 7? ", "duplicate_of": "Fråga nummer 7?",
+                                  "duplicate_of_id": None, "similarity": 1.0}
+
+        # Other companies' questions are not duplicates
+        inserted, duplicates = bulk_insert_knowledge(db, "bulk-b", None, items(3))
+        assert (len(inserted), len(duplicates)) == (3, 0)
+
+    def test_widget_scope(self, db):
+        widget = Widget(company_id="bulk-a", name="Intern", widget_key="bulk-widget-key")
+        db.add(widget)
+        shared, _ = bulk_insert_knowledge(db, "bulk-a", None, items(2))
+        db.commit()
+        knowledge_index.add_items(shared)
+
+        inserted, duplicates = bulk_insert_knowledge(db, "bulk-a", widget.id, items(2))
+        assert (len(inserted), len(duplicates)) == (2, 0)
+        assert {item.widget_id for item in inserted} == {widget.id}
+
+    def test_empty_batch(self, db):
+        with statements("INSERT") as inserts:
+            assert bulk_insert_knowledge(db, "bulk-a", None, []) == ([], [])
+        assert inserts == []
+
+
+class TestBulkDelete:
+
+    def test_delete_is_one_statement_per_batch(self, db):
+        ours, _ = bulk_insert_knowledge(db, "bulk-a", None, items(700))
+        theirs, _ = bulk_insert_knowledge(db, "bulk-b", None, items(3))
+        db.commit()
+
+        ids = [item.id for item in ours] + [item.id for item in theirs] + [999999]
+        with statements("DELETE") as deletes:
+            deleted = bulk_delete_knowledge(db, "bulk-a", ids)
+        db.commit()
+
+        assert len(deletes) == 2  # 500 ids per IN (...)
+        assert sorted(item_id for item_id, _ in deleted) == sorted(item.id for item in ours)
+        assert db.query(KnowledgeItem).filter(KnowledgeItem.company_id == "bulk-a").count() == 0
+        assert db.query(KnowledgeItem).filter(KnowledgeItem.company_id == "bulk-b").count() == 3
+
+    def test_endpoint_updates_the_index(self, client, db):
+        inserted, _ = bulk_insert_knowledge(db, "bulk-a", None, [
+            {"question": "Hur bokar jag tvättstugan?", "answer": "Boka tvättstugan i appen."},
+            {"question": "När töms soporna?", "answer": "Soporna töms på tisdagar."},
+        ])
+        db.commit()
+        knowledge_index.add_items(inserted)
+        assert knowledge_index.search(db, "bulk-a", "boka tvättstugan")
+
+        response = client.post("/knowledge/bulk-delete", headers=headers("bulk-a"),
+                               json={"item_ids": [inserted[0].id, inserted[0].id]})
+        assert response.json()["deleted_count"] == 1
+        assert not knowledge_index.search(db, "bulk-a", "boka tvättstugan")
+        assert knowledge_index.search(db, "bulk-a", "när töms soporna")
+
+
+class TestTemplateApply:
+
+    def test_template_is_inserted_once_and_reapply_skips_everything(self, client, db):
+        with statements("INSERT") as inserts:
+            first = client.post("/templates/fastighetsbolag_sv/apply", headers=headers("bulk-a"), json={}).json()
+        assert first["items_added"] > 50
+        assert len([s for s in inserts if "knowledge_items" in s]) == 1
+
+        again = client.post("/templates/fastighetsbolag_sv/apply", headers=headers("bulk-a"), json={}).json()
+        assert (again["items_added"], again["items_skipped"]) == (0, first["items_added"] + first["items_skipped"])
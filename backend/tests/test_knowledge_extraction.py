@@ -0,0 +1,164 @@
+"""
+Tests for chunked AI extraction of long documents
+"""
+
+import asyncio
+import json
+import os
+import re
+import sys
+
+import pytest
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Set test environment before importing app
+os.environ["ENVIRONMENT"] = "test"
+os.environ["DATABASE_URL"] = "sqlite:///./test_bobot.db"
+
+import main
+from knowledge_extraction import chunk_text, merge_pairs, extraction_cache
+from ollama_client import close_http_client
+from ollama_scheduler import OllamaScheduler
+from ollama_stub import OllamaStub
+
+
+def section(n: int) -> str:
+    return f"Avsnitt {n}. " + " ".join(f"Regel {n}.{i} gäller alla hyresgäster i huset." for i in range(6))
+
+
+def handbook(sections: int = 40) -> str:
+    return "\n\n".join(section(n) for n in range(sections))
+
+
+class ExtractingStub(OllamaStub):
+    """Answers with one Q&A pair per section in the prompt and records concurrency"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.prompts = []
+
+    async def generate(self, payload, writer):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        prompt = payload["prompt"]
+        self.prompts.append(prompt)
+        pairs = [{"question": f"Vad gäller enligt avsnitt {n}?", "answer": f"Reglerna i avsnitt {n}."}
+                 for n in dict.fromkeys(re.findall(r"Avsnitt (\d+)\.", prompt))]
+        await self.send_json(writer, {"model": self.model, "response": json.dumps(pairs, ensure_ascii=False),
+                                      "done": True})
+
+
+@pytest.fixture
+async def stub(monkeypatch):
+    extraction_cache.clear()
+
+    async def start(delay=0.05):
+        server = ExtractingStub(delay=delay)
+        await server.start()
+        monkeypatch.setattr(main, "OLLAMA_BASE_URL", server.base_url)
+        return server
+
+    yield start
+    await close_http_client()  # The pooled client is bound to this test's event loop
+
+
+class TestChunking:
+
+    def test_chunks_cover_the_document_within_size(self):
+        text = handbook()
+        chunks = chunk_text(text, size=1000, overlap=300)
+        assert len(chunks) > 5
+        assert all(len(chunk) <= 1000 for chunk in chunks)
+        for n in range(40):
+            assert any(section(n) in chunk for chunk in chunks)
+
+    def test_consecutive_chunks_overlap_by_whole_paragraphs(self):
+        chunks = chunk_text(handbook(), size=1000, overlap=300)
+        for previous, chunk in zip(chunks, chunks[1:]):
+            first = chunk.split("\n\n")[0]
+            assert previous.endswith(first)
+
+    def test_edit_only_changes_nearby_chunks(self):
+        text = handbook(80)
+        edited = text.replace(section(40), section(40) + " Tillägg: grillning är förbjuden.")
+        before, after = chunk_text(text, size=1000), chunk_text(edited, size=1000)
+        changed = set(after) - set(before)
+        assert 1 <= len(changed) <= 3
+        assert len(after) - len(changed) >= len(before) - 3
+
+    def test_long_paragraph_is_split_at_sentences(self):
+        text = " ".join(f"Mening nummer {n} om tvättstugan." for n in range(200))
+        chunks = chunk_text(text, size=500, overlap=0)
+        assert all(len(chunk) <= 500 for chunk in chunks)
+        assert all(chunk.endswith("tvättstugan.") for chunk in chunks)
+        assert " ".join(chunks) == text
+
+    def test_short_text_is_one_chunk(self):
+        assert chunk_text("Hyran betalas den sista.") == ["Hyran betalas den sista."]
+        assert chunk_text("") == []
+
+    def test_merge_drops_near_duplicates_keeping_the_longer_answer(self):
+        merged = merge_pairs([
+            [{"question": "När ska hyran betalas?", "answer": "Den sista."}],
+            [{"question": "När ska hyran betalas", "answer": "Senast den sista varje månad."},
+             {"question": "Var är tvättstugan?", "answer": "I källaren."}],
+        ])
+        assert [(item["question"], item["answer"]) for item in merged] == [
+            ("När ska hyran betalas", "Senast den sista varje månad."),
+            ("Var är tvättstugan?", "I källaren."),
+        ]
+
+
+class TestChunkedExtraction:
+
+    async def test_whole_document_is_extracted_concurrently(self, stub, monkeypatch):
+        monkeypatch.setattr(main, "EXTRACT_CONCURRENCY", 4)
+        monkeypatch.setattr(main, "ollama_scheduler", OllamaScheduler(concurrency=3))
+        server = await stub(delay=0.1)
+        text = handbook()
+        chunks = len(chunk_text(text))
+        progress = []
+
+        async def on_progress(done, total):
+            progress.append((done, total))
+
+        try:
+            items = await main.ai_extract_qa_pairs(text, "Bostads AB", on_progress=on_progress)
+        finally:
+            await server.stop()
+
+        assert chunks > 1 and server.requests == chunks
+        assert server.max_in_flight == 3  # Capped by the Ollama scheduler, not EXTRACT_CONCURRENCY
+        # Every section is covered once, despite overlapping chunks
+        assert [item["question"] for item in items] == [f"Vad gäller enligt avsnitt {n}?" for n in range(40)]
+        assert progress[-1] == (chunks, chunks)
+        assert any("(part 1 of" in prompt for prompt in server.prompts)
+
+    async def test_edited_document_only_extracts_changed_chunks(self, stub):
+        server = await stub(delay=0)
+        text = handbook(80)
+        try:
+            await main.ai_extract_qa_pairs(text)
+            first = server.requests
+            items = await main.ai_extract_qa_pairs(text.replace(section(40), section(40) + " Nytt stycke."))
+        finally:
+            await server.stop()
+
+        assert 1 <= server.requests - first <= 3
+        assert len(items) == 80
+        assert extraction_cache.stats()["hits"] >= first - 3
+
+    async def test_failing_chunk_fails_the_extraction(self, stub):
+        server = await stub()
+        await server.stop()
+        with pytest.raises(main.AIExtractionError):
+            await main.ai_extract_qa_pairs(handbook())
+        assert extraction_cache.stats()["entries"] == 0
@@ -0,0 +1,185 @@
+"""
+Tests for the in-memory knowledge index
+"""
+
+import random
+import os
+import sys
+import threading
+from types import SimpleNamespace
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from knowledge_index import KnowledgeIndex, IndexedItem, scan_score_items
+
+
+WORDS = [
+    "hyra", "hyran", "betala", "betalning", "felanmälan", "felanmäler", "anmäler",
+    "tvättstuga", "tvättstugan", "boka", "bokning", "parkering", "parkeringsplats",
+    "kontrakt", "uppsägning", "nyckel", "nycklar", "lägenhet", "lägenheten", "el",
+    "vatten", "värme", "rent", "payment", "laundry", "parking", "key", "contract",
+    "när", "hur", "var", "jag", "min", "the", "is", "due", "sista", "dag", "månad",
+]
+CATEGORIES = ["hyra", "felanmalan", "tvattstuga", "parkering", "kontrakt", "", None]
+
+
+def make_items(count, seed=1, company_id="acme", widget_ids=(None, 1, 2)):
+    rng = random.Random(seed)
+    items = []
+    for item_id in range(1, count + 1):
+        question = " ".join(rng.choices(WORDS, k=rng.randint(3, 8))) + "?"
+        answer = ", ".join(rng.choices(WORDS, k=rng.randint(5, 20))) + "."
+        items.append(IndexedItem(item_id, company_id, rng.choice(widget_ids), question, answer, rng.choice(CATEGORIES)))
+    return items
+
+
+def make_questions(count, seed=2):
+    rng = random.Random(seed)
+    return [" ".join(rng.choices(WORDS, k=rng.randint(1, 6))) for _ in range(count)]
+
+
+def build_index(items, company_id="acme"):
+    index = KnowledgeIndex()
+    index.build_company(company_id, items)
+    return index
+
+
+def visible(items, widget_id):
+    if widget_id:
+        return [i for i in items if i.widget_id in (widget_id, None)]
+    return items
+
+
+class TestKnowledgeIndexEquivalence:
+    """The index must return exactly what the full table scan returns"""
+
+    def test_matches_scan_for_random_questions(self):
+        items = make_items(300)
+        index = build_index(items)
+
+        for question in make_questions(200):
+            for widget_id in (None, 1, 2):
+                expected = scan_score_items(question, visible(items, widget_id))
+                actual = index.search(None, "acme", question, widget_id=widget_id)
+                assert [i.id for i in actual] == [i.id for i in expected], question
+
+    def test_matches_scan_with_other_limits(self):
+        items = make_items(150, seed=7)
+        index = build_index(items)
+
+        for question in make_questions(50, seed=8):
+            expected = scan_score_items(question, items, top_k=10, min_score=1)
+            actual = index.search(None, "acme", question, top_k=10, min_score=1)
+            assert [i.id for i in actual] == [i.id for i in expected]
+
+    def test_compound_word_partial_match(self):
+        """Swedish compound words should match via substrings and shared roots"""
+        items = [
+            IndexedItem(1, "acme", None, "Hur gör jag en felanmälan?", "Ring oss.", "felanmalan"),
+            IndexedItem(2, "acme", None, "Var är tvättstugan?", "I källaren.", "tvattstuga"),
+        ]
+        index = build_index(items)
+
+        result = index.search(None, "acme", "Jag vill anmäla fel")
+        assert [i.id for i in result] == [i.id for i in scan_score_items("Jag vill anmäla fel", items)]
+
+        result = index.search(None, "acme", "Hur gör jag felanmälan i tvättstuga")
+        assert [i.id for i in result] == [1, 2]
+
+    def test_stopwords_only_returns_nothing(self):
+        index = build_index(make_items(20))
+        assert index.search(None, "acme", "hur kan jag") == []
+
+
+class TestKnowledgeIndexUpdates:
+    """Incremental updates must leave the index equal to a fresh build"""
+
+    def test_add_update_remove(self):
+        items = make_items(100, seed=3)
+        index = build_index(items[:50])
+
+        # Add the rest, then edit some and delete some
+        index.add_items(items[50:])
+        edited = IndexedItem(10, "acme", 2, "Parkering och nycklar", "Kontakta expeditionen.", "parkering")
+        index.add_items([edited])
+        index.remove_items("acme", [1, 2, 3, 99])
+
+        current = [edited if i.id == 10 else i for i in items if i.id not in (1, 2, 3, 99)]
+        fresh = build_index(current)
+
+        for question in make_questions(100, seed=4):
+            for widget_id in (None, 1, 2):
+                assert [i.id for i in index.search(None, "acme", question, widget_id=widget_id)] == \
+                    [i.id for i in fresh.search(None, "acme", question, widget_id=widget_id)]
+
+    def test_unloaded_company_is_not_populated_by_updates(self):
+        index = KnowledgeIndex()
+        index.add_items(make_items(5, company_id="other"))
+        assert index.stats()["companies"] == 0
+
+    def test_invalidate_drops_company(self):
+        index = build_index(make_items(10))
+        index.invalidate("acme")
+        assert index.stats()["companies"] == 0
+
+
+class BlockingSession:
+    """Stands in for a Session: query(...).filter(...).all() returns rows, optionally after a gate opens"""
+
+    def __init__(self, items, gate=None):
+        self.rows = [SimpleNamespace(id=i.id, widget_id=i.widget_id, question=i.question, answer=i.answer,
+                                     category=i.category, minhash=None) for i in items]
+        self.gate = gate
+        self.querying = threading.Event()
+
+    def query(self, *columns):
+        return self
+
+    def filter(self, *criteria):
+        return self
+
+    def all(self):
+        self.querying.set()
+        if self.gate is not None:
+            assert self.gate.wait(5)
+        return self.rows
+
+
+class TestKnowledgeIndexLoading:
+    """Loading a company from the database must not block other companies"""
+
+    def test_other_companies_search_while_one_loads(self):
+        index = build_index(make_items(20))
+        gate = threading.Event()
+        slow = BlockingSession(make_items(20, company_id="slow"), gate)
+        loader = threading.Thread(target=index.search, args=(slow, "slow", "boka tvättstuga"))
+        loader.start()
+        try:
+            assert slow.querying.wait(5)
+            # The load is waiting on the database; acme is still served and updated
+            done = threading.Event()
+            threading.Thread(target=lambda: (index.search(None, "acme", "boka tvättstuga"),
+                                             index.remove_items("acme", [1]), done.set())).start()
+            assert done.wait(5)
+        finally:
+            gate.set()
+            loader.join(5)
+        assert index.stats()["companies"] == 2
+
+    def test_load_overlapping_a_change_is_not_kept(self):
+        index = KnowledgeIndex()
+        gate = threading.Event()
+        items = make_items(10)
+        stale = BlockingSession(items, gate)
+        loader = threading.Thread(target=index.search, args=(stale, "acme", "boka"))
+        loader.start()
+        assert stale.querying.wait(5)
+        # Deleted (and committed) after the loader read its rows
+        index.remove_items("acme", [1])
+        gate.set()
+        loader.join(5)
+        assert index.stats()["companies"] == 0
+
+        index.search(BlockingSession(items[1:]), "acme", "boka")
+        assert index.stats()["items"] == 9
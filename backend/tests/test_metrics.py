@@ -0,0 +1,209 @@
+"""
+Tests for the Prometheus /metrics endpoint and hourly WidgetPerformance rows
+"""
+
+import json
+import os
+import sys
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Set test environment before importing app
+os.environ["ENVIRONMENT"] = "test"
+os.environ["DATABASE_URL"] = "sqlite:///./test_bobot.db"
+
+import main
+import metrics
+from main import app
+from auth import create_token
+from database import Base, engine, SessionLocal, WidgetPerformance
+from metrics import HourlyPerformance, Registry, percentile
+from ollama_stub import running_stub
+from response_cache import response_cache
+from tenant_config import config_cache
+
+HOUR = datetime(2025, 3, 1, 14)
+
+
+@pytest.fixture(scope="module")
+def stub():
+    with running_stub() as stub:
+        yield stub
+
+
+@pytest.fixture(scope="module")
+def client(stub):
+    """Test client with an Ollama stub behind it"""
+    Base.metadata.create_all(bind=engine)
+    config_cache.clear()
+
+    original_url = main.OLLAMA_BASE_URL
+    main.OLLAMA_BASE_URL = stub.base_url
+    try:
+        with TestClient(app) as c:
+            yield c
+    finally:
+        main.OLLAMA_BASE_URL = original_url
+
+    response_cache.clear()
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture
+def performance(client, monkeypatch):
+    """A fresh hourly aggregate and an empty WidgetPerformance table"""
+    monkeypatch.setattr(metrics, "performance", HourlyPerformance())
+    db = SessionLocal()
+    try:
+        db.query(WidgetPerformance).delete()
+        db.commit()
+    finally:
+        db.close()
+    return metrics.performance
+
+
+def admin_headers():
+    return {"Authorization": f"Bearer {create_token({'sub': 'admin', 'type': 'super_admin'})}"}
+
+
+def widget_rows():
+    db = SessionLocal()
+    try:
+        return {(row.company_id, row.hour): row for row in db.query(WidgetPerformance)}
+    finally:
+        db.close()
+
+
+def flush(performance, before=None):
+    db = SessionLocal()
+    try:
+        return performance.flush(db, before)
+    finally:
+        db.close()
+
+
+class TestRegistry:
+
+    def test_text_format(self):
+        registry = Registry()
+        requests = registry.counter("test_requests_total", "Requests", ("route", "status"))
+        latency = registry.histogram("test_latency_seconds", "Latency", ("route",), buckets=(0.1, 1.0))
+        registry.gauge("test_depth", "Depth", lambda: 7)
+
+        requests.inc(route='/chat/"x"', status=200)
+        requests.inc(2, route='/chat/"x"', status=200)
+        latency.observe(0.05, route="/a")
+        latency.observe(0.5, route="/a")
+        latency.observe(3, route="/a")
+
+        lines = registry.render().splitlines()
+        assert "# TYPE test_requests_total counter" in lines
+        assert 'test_requests_total{route="/chat/\\"x\\"",status="200"} 3' in lines
+        assert 'test_latency_seconds_bucket{route="/a",le="0.1"} 1' in lines
+        assert 'test_latency_seconds_bucket{route="/a",le="1"} 2' in lines
+        assert 'test_latency_seconds_bucket{route="/a",le="+Inf"} 3' in lines
+        assert 'test_latency_seconds_sum{route="/a"} 3.55' in lines
+        assert 'test_latency_seconds_count{route="/a"} 3' in lines
+        assert "test_depth 7" in lines
+
+    def test_company_labels_are_capped(self, monkeypatch):
+        monkeypatch.setattr(metrics, "_companies", set())
+        monkeypatch.setattr(metrics, "METRICS_MAX_COMPANIES", 2)
+        assert [metrics.company_label(c) for c in ("a", "b", "c", "a")] == ["a", "b", "other", "a"]
+
+
+class TestHourlyPerformance:
+
+    def test_flush_writes_finished_hours(self, performance):
+        for ms in range(1, 101):
+            performance.record("demo", ms, 200, at=HOUR)
+        performance.record("demo", 5000, 503, at=HOUR)
+        performance.record("demo", 2, 429, at=HOUR)
+        performance.record("demo", 10, 200, at=HOUR + timedelta(hours=1))
+
+        assert flush(performance, before=HOUR + timedelta(hours=1)) == 1
+        assert performance.pending() == 1
+
+        row = widget_rows()[("demo", HOUR)]
+        assert (row.total_requests, row.successful_requests, row.failed_requests, row.rate_limited_requests) == \
+            (102, 100, 1, 1)
+        assert (row.min_response_time, row.max_response_time) == (1, 5000)
+        assert row.p95_response_time == 96
+        assert row.avg_response_time == pytest.approx((5050 + 5000) / 101)
+        assert json.loads(row.error_counts) == {"ollama_error": 1}
+
+    def test_flush_merges_into_existing_rows(self, performance):
+        performance.record("demo", 100, 200, at=HOUR)
+        flush(performance)
+        performance.record("demo", 300, 200, at=HOUR)
+        performance.record("demo", 50, 404, at=HOUR)
+        flush(performance)
+
+        row = widget_rows()[("demo", HOUR)]
+        assert (row.total_requests, row.successful_requests, row.failed_requests) == (3, 2, 1)
+        assert row.avg_response_time == pytest.approx(150)
+        assert (row.min_response_time, row.max_response_time, row.p95_response_time) == (50, 300, 300)
+        assert json.loads(row.error_counts) == {"http_404": 1}
+
+    def test_percentile(self):
+        assert percentile([], 0.95) == 0
+        assert percentile([7], 0.95) == 7
+        assert percentile(list(range(1, 21)), 0.95) == 19
+
+
+class TestMetricsEndpoint:
+
+    def test_chat_requests_show_up_per_route_and_company(self, client, performance):
+        before = metrics.chat_requests.value(company="demo", outcome="success")
+        response = client.post("/chat/demo", json={
+            "question": f"Vad kostar parkering {uuid.uuid4()}?", "session_id": str(uuid.uuid4())
+        })
+        assert response.status_code == 200
+        client.post("/chat/no-such-company", json={"question": "Hej", "session_id": str(uuid.uuid4())})
+
+        text = client.get("/metrics").text
+        assert metrics.chat_requests.value(company="demo", outcome="success") == before + 1
+        assert 'bobot_http_requests_total{method="POST",route="/chat/{company_id}",status="200"}' in text
+        assert 'company="no-such-company"' not in text
+        assert 'bobot_external_request_duration_seconds_count{service="ollama"}' in text
+        assert "bobot_response_cache_hits_total" in text
+        assert performance.pending() == 1
+
+    def test_streamed_turns_are_timed_to_the_end_of_the_stream(self, client, stub, performance, monkeypatch):
+        monkeypatch.setattr(stub, "token_delay", 0.05)
+        before = metrics.chat_requests.value(company="demo", outcome="success")
+        response = client.post("/chat/demo/stream", json={
+            "question": f"Vad kostar parkering {uuid.uuid4()}?", "session_id": str(uuid.uuid4())
+        })
+        assert "event: done" in response.text
+
+        assert metrics.chat_requests.value(company="demo", outcome="success") == before + 1
+        (hour,) = performance._hours.values()
+        assert hour.successful == 1
+        assert hour.durations[0] >= response.text.count("event: token") * 50 * 0.9  # Generation included
+
+    def test_admin_overview_reads_flushed_hours(self, client, performance):
+        for ms in (100, 200, 300):
+            performance.record("demo", ms, 200)
+        performance.record("demo", 0, 429)
+        assert main.flush_widget_performance() == 1
+
+        overview = client.get("/admin/performance/overview", headers=admin_headers()).json()
+        assert overview["total_requests"] == 4
+        assert overview["rate_limited_requests"] == 1
+        assert overview["avg_response_time"] == 200
+        assert overview["p95_response_time"] == 300
+
+        company = client.get("/admin/performance/demo", headers=admin_headers()).json()
+        assert company["hourly_stats"][0]["p95_response_time"] == 300
+
+    def test_token(self, client, monkeypatch):
+        monkeypatch.setattr(metrics, "METRICS_TOKEN", "s3cret")
+        assert client.get("/metrics").status_code == 401
+        assert client.get("/metrics", headers={"Authorization": "Bearer s3cret"}).status_code == 200
@@ -0,0 +1,162 @@
+"""
+Tests for MinHash/LSH near-duplicate detection
+"""
+
+import os
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Set test environment before importing app
+os.environ["ENVIRONMENT"] = "test"
+os.environ["DATABASE_URL"] = "sqlite:///./test_bobot.db"
+
+from main import app, knowledge_index
+from auth import create_token
+from database import Base, engine, SessionLocal, KnowledgeItem, Company
+from knowledge_bulk import bulk_insert_knowledge
+from near_duplicates import (
+    LSHIndex, backfill_signatures, decode_signature, jaccard, minhash, question_signature, question_words
+)
+from response_cache import response_cache
+from tenant_config import config_cache
+
+COMPANY = "near-dup"
+HEADERS = {"Authorization": f"Bearer {create_token({'sub': COMPANY, 'type': 'company'})}"}
+
+
+@pytest.fixture(scope="module")
+def client():
+    Base.metadata.create_all(bind=engine)
+    config_cache.clear()
+    with TestClient(app) as c:
+        yield c
+    response_cache.clear()
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture
+def db(client):
+    session = SessionLocal()
+    if not session.get(Company, COMPANY):
+        session.add(Company(id=COMPANY, name=COMPANY, password_hash="x"))
+    session.commit()
+    yield session
+    session.query(KnowledgeItem).filter(KnowledgeItem.company_id == COMPANY).delete()
+    session.commit()
+    session.close()
+    knowledge_index.invalidate(COMPANY)
+
+
+class TestSignatures:
+
+    def test_words_ignore_case_and_punctuation(self):
+        assert question_words("När betalas HYRAN?") == {"när", "betalas", "hyran"}
+        assert minhash(question_words("?!")) is None
+
+    def test_signature_roundtrip(self):
+        signature = minhash(question_words("När betalas hyran?"))
+        assert (decode_signature(question_signature("när betalas hyran")) == signature).all()
+        assert decode_signature(b"\x00" * 8) is None  # Another signature length
+
+    def test_lsh_finds_paraphrase_among_many(self):
+        index = LSHIndex()
+        for n in range(2000):
+            index.add(n, question_words(f"ord{n} ord{n + 1} ord{n + 2} ord{n + 3} ord{n + 4}"))
+        target = question_words("När ska hyran för lägenheten betalas varje månad?")
+        index.add(5000, target)
+
+        query = question_words("När ska hyran för lägenheten betalas?")
+        assert len(index.candidates(minhash(query))) < 100
+        assert index.similar(query, 0.5) == [(jaccard(query, target), 5000)]
+
+        index.remove(5000)
+        assert index.similar(query, 0.5) == []
+
+
+class TestCheckSimilar:
+
+    def test_endpoint_returns_paraphrases(self, client, db):
+        client.post("/knowledge", headers=HEADERS,
+                    json={"question": "När ska hyran betalas?", "answer": "Senast den sista vardagen."})
+        client.post("/knowledge", headers=HEADERS,
+                    json={"question": "Var ligger tvättstugan?", "answer": "I källaren."})
+
+        response = client.post("/knowledge/check-similar", headers=HEADERS,
+                               json={"question": "när ska hyran betalas varje månad"})
+        similar = response.json()
+        assert [s["question"] for s in similar] == ["När ska hyran betalas?"]
+        assert similar[0]["similarity"] == 66.7
+
+    def test_updated_question_is_matched_on_its_new_words(self, client, db):
+        item = client.post("/knowledge", headers=HEADERS,
+                           json={"question": "Var ligger tvättstugan?", "answer": "I källaren."}).json()
+        client.put(f"/knowledge/{item['id']}", headers=HEADERS,
+                   json={"question": "Hur bokar jag bastun?", "answer": "I appen."})
+
+        def check(question):
+            return client.post("/knowledge/check-similar", headers=HEADERS, json={"question": question}).json()
+
+        assert check("Var ligger tvättstugan") == []
+        assert [s["id"] for s in check("hur bokar jag bastun")] == [item["id"]]
+
+
+class TestImportDedup:
+
+    def test_paraphrase_of_existing_question_is_skipped(self, db):
+        inserted, _ = bulk_insert_knowledge(db, COMPANY, None, [
+            {"question": "Hur gör jag en felanmälan i lägenheten?", "answer": "Via appen."},
+        ])
+        db.commit()
+        knowledge_index.add_items(inserted)
+
+        inserted, duplicates = bulk_insert_knowledge(db, COMPANY, None, [
+            {"question": "Hur gör jag en felanmälan i lägenheten", "answer": "Ring oss."},
+            {"question": "hur gör jag felanmälan i lägenheten?", "answer": "Ring oss."},
+            {"question": "Var hittar jag tvättstugan?", "answer": "I källaren."},
+        ])
+        assert [item.question for item in inserted] == ["Var hittar jag tvättstugan?"]
+        assert [(d["duplicate_of"], d["similarity"]) for d in duplicates] == [
+            ("Hur gör jag en felanmälan i lägenheten?", 1.0),
+            ("Hur gör jag en felanmälan i lägenheten?", 0.86),
+        ]
+
+    def test_threshold_and_skip_existing(self, db):
+        inserted, _ = bulk_insert_knowledge(db, COMPANY, None, [{"question": "När töms soporna?", "answer": "Tisdag."}])
+        db.commit()
+        knowledge_index.add_items(inserted)
+
+        batch = [{"question": "När töms soporna", "answer": "Tisdag."}]
+        assert len(bulk_insert_knowledge(db, COMPANY, None, batch, skip_existing=False)[0]) == 1
+        assert len(bulk_insert_knowledge(db, COMPANY, None, batch, min_similarity=1.01)[0]) == 1
+
+
+class TestStoredSignatures:
+
+    def test_inserts_store_signatures_and_backfill_fills_old_rows(self, client, db):
+        inserted, _ = bulk_insert_knowledge(db, COMPANY, None, [{"question": "Får jag ha husdjur?", "answer": "Ja."}])
+        db.add(KnowledgeItem(company_id=COMPANY, question="Finns det parkering?", answer="Ja."))
+        db.commit()
+
+        stored = db.get(KnowledgeItem, inserted[0].id).minhash
+        assert stored == question_signature("Får jag ha husdjur?")
+        assert db.query(KnowledgeItem).filter(KnowledgeItem.minhash.is_(None)).count() == 1
+
+        assert backfill_signatures(SessionLocal, batch_size=1) == 1
+        db.expire_all()
+        assert db.query(KnowledgeItem).filter(KnowledgeItem.minhash.is_(None)).count() == 0
+        assert backfill_signatures(SessionLocal) == 0
+
+    def test_backfill_gets_past_questions_without_words(self, client, db):
+        db.add_all([KnowledgeItem(company_id=COMPANY, question=question, answer="Ja.")
+                    for question in ("???", "!!!", "Finns det cykelrum?")])
+        db.commit()
+
+        assert backfill_signatures(SessionLocal, batch_size=2) == 1
+        db.expire_all()
+        questions = [row.question for row in db.query(KnowledgeItem.question).filter(KnowledgeItem.minhash.is_(None))]
+        assert sorted(questions) == ["!!!", "???"]
@@ -0,0 +1,41 @@
+"""
+Tests for the shared Ollama HTTP client
+"""
+
+import os
+import sys
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ollama_client import get_http_client, close_http_client, HEALTH_TIMEOUT
+from ollama_stub import OllamaStub
+
+
+class TestSharedClient:
+    """Tests for the process-wide client lifecycle"""
+
+    async def test_client_is_reused(self):
+        """get_http_client should return the same client until closed"""
+        client = get_http_client()
+        assert get_http_client() is client
+
+        await close_http_client()
+        assert get_http_client() is not client
+        await close_http_client()
+
+    async def test_connections_are_kept_alive(self):
+        """Sequential requests should share one pooled TCP connection"""
+        async with OllamaStub() as stub:
+            for _ in range(5):
+                response = await get_http_client().post(
+                    f"{stub.base_url}/api/generate",
+                    json={"model": "stub", "prompt": "hej", "stream": False}
+                )
+                assert response.json()["response"]
+
+            tags = await get_http_client().get(f"{stub.base_url}/api/tags", timeout=HEALTH_TIMEOUT)
+            assert tags.status_code == 200
+            assert stub.requests == 6
+            assert stub.connections == 1
+        await close_http_client()
@@ -0,0 +1,165 @@
+"""
+Tests for routing Ollama calls over several nodes
+"""
+
+import asyncio
+import os
+import socket
+import sys
+import uuid
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Set test environment before importing app
+os.environ["ENVIRONMENT"] = "test"
+os.environ["DATABASE_URL"] = "sqlite:///./test_bobot.db"
+
+import main
+from main import app
+from database import Base, engine
+from ollama_router import NoHealthyNode, OllamaRouter
+from ollama_stub import OllamaStub, running_stub
+from response_cache import response_cache
+from tenant_config import config_cache
+
+
+def dead_url() -> str:
+    """URL of a local port nothing listens on"""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{s.getsockname()[1]}"
+
+
+def generate(model="stub"):
+    return {"model": model, "prompt": "Hej", "stream": False}
+
+
+class GenerateCounter(OllamaStub):
+    """Stub that counts /api/generate calls only (probes are not load)"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.generated = 0
+
+    async def generate(self, payload, writer):
+        self.generated += 1
+        await super().generate(payload, writer)
+
+
+@pytest.fixture
+async def client():
+    async with httpx.AsyncClient() as c:
+        yield c
+
+
+class TestRouting:
+
+    async def test_least_outstanding_requests(self, client):
+        async with GenerateCounter(delay=0.1) as a, GenerateCounter(delay=0.1) as b:
+            router = OllamaRouter(lambda: [a.base_url, b.base_url], lambda: client)
+            responses = await asyncio.gather(*[router.post("/api/generate", generate()) for _ in range(6)])
+
+            assert all(r.status_code == 200 for r in responses)
+            assert (a.generated, b.generated) == (3, 3)
+            assert all(node["outstanding"] == 0 for node in router.status())
+
+    async def test_refused_node_is_ejected_and_call_retried(self, client):
+        async with GenerateCounter() as live:
+            down = dead_url()
+            router = OllamaRouter(lambda: [down, live.base_url], lambda: client)
+
+            for _ in range(3):
+                assert (await router.post("/api/generate", generate())).status_code == 200
+
+            status = {node["url"]: node for node in router.status()}
+            assert status[down]["status"] == "ejected"
+            assert status[down]["failures"] == 1
+            assert "ConnectError" in status[down]["last_error"]
+            assert live.generated == 3
+
+    async def test_repeated_timeouts_eject_without_retry(self, client):
+        async with GenerateCounter(delay=0.5) as slow, GenerateCounter() as fast:
+            router = OllamaRouter(lambda: [slow.base_url, fast.base_url], lambda: client, eject_timeouts=2)
+            # Both calls go to the slow node: the fast one is not tried
+            router.nodes[1].outstanding = 1
+            for expected in (["online", "online"], ["ejected", "online"]):
+                with pytest.raises(httpx.TimeoutException):
+                    await router.post("/api/generate", generate(), timeout=httpx.Timeout(0.1))
+                assert [node["status"] for node in router.status()] == expected
+            assert fast.generated == 0
+
+    async def test_last_node_stays_up_if_it_answers_a_probe(self, client):
+        async with GenerateCounter(delay=0.5) as slow:
+            router = OllamaRouter(lambda: [slow.base_url], lambda: client, eject_timeouts=1, probe_interval=60)
+            with pytest.raises(httpx.ReadTimeout):
+                await router.post("/api/generate", generate(), timeout=httpx.Timeout(0.1))
+            assert router.status()[0]["status"] == "online"
+
+            # Chat keeps working right away, without waiting for the probe interval
+            assert (await router.post("/api/generate", generate())).status_code == 200
+            assert slow.generated == 2
+
+    async def test_probe_brings_node_back(self, client):
+        async with OllamaStub() as stub:
+            router = OllamaRouter(lambda: [stub.base_url], lambda: client, probe_interval=0)
+            router.eject(router.nodes[0], httpx.ConnectError("nere"))
+
+            # A call finding no healthy node probes the ejected ones first
+            assert (await router.post("/api/generate", generate())).status_code == 200
+            assert router.status()[0]["status"] == "online"
+
+    async def test_all_nodes_down(self, client):
+        urls = [dead_url(), dead_url()]
+        router = OllamaRouter(lambda: urls, lambda: client, probe_interval=60)
+        with pytest.raises(httpx.ConnectError):
+            await router.post("/api/generate", generate())
+        with pytest.raises(NoHealthyNode):
+            await router.post("/api/generate", generate())
+
+    async def test_model_aware_routing(self, client):
+        async with GenerateCounter(model="qwen2.5:14b") as qwen, GenerateCounter(model="llama3:latest") as llama:
+            router = OllamaRouter(lambda: [qwen.base_url, llama.base_url], lambda: client)
+            await router.probe()
+
+            for _ in range(2):
+                await router.post("/api/generate", generate("llama3"))
+            await router.post("/api/generate", generate("qwen2.5:14b"))
+            assert (qwen.generated, llama.generated) == (1, 2)
+
+            # No node lists the model: any healthy node (Ollama answers the 404)
+            await router.post("/api/generate", generate("mistral"))
+            assert qwen.generated + llama.generated == 4
+
+
+class TestHealth:
+
+    def test_health_reports_every_node(self, monkeypatch):
+        Base.metadata.create_all(bind=engine)
+        config_cache.clear()
+        response_cache.clear()
+        try:
+            with running_stub() as first, running_stub() as second:
+                down = dead_url()
+                monkeypatch.setattr(main, "OLLAMA_NODES", [first.base_url, down, second.base_url])
+                with TestClient(app) as client:
+                    before = first.requests + second.requests
+                    for _ in range(2):
+                        response = client.post("/chat/demo", json={
+                            "question": f"Hur betalar jag hyran {uuid.uuid4()}?", "session_id": str(uuid.uuid4())
+                        })
+                        assert response.status_code == 200
+                    assert first.requests + second.requests - before == 2
+
+                    health = client.get("/health").json()
+                    assert health["ollama"] == "partial"
+                    assert health["status"] == "degraded"
+                    assert [node["status"] for node in health["ollama_nodes"]] == ["online", "ejected", "online"]
+                    assert "bobot_ollama_nodes_online 2" in client.get("/metrics").text
+        finally:
+            response_cache.clear()
+            Base.metadata.drop_all(bind=engine)
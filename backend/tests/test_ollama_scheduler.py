@@ -0,0 +1,190 @@
+"""
+Tests for the Ollama scheduler (concurrency limit, fair queuing, 503 backpressure)
+"""
+
+import asyncio
+import os
+import sys
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi.testclient import TestClient
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Set test environment before importing app
+os.environ["ENVIRONMENT"] = "test"
+os.environ["DATABASE_URL"] = "sqlite:///./test_bobot.db"
+
+import main
+from main import app
+from auth import create_token
+from database import Base, engine
+from ollama_scheduler import OllamaScheduler, SchedulerBusy, parse_weights
+from ollama_stub import running_stub
+from response_cache import response_cache
+from tenant_config import config_cache
+
+
+def fast_scheduler(**kwargs):
+    """Scheduler whose generations are expected to take 10ms"""
+    scheduler = OllamaScheduler(**kwargs)
+    scheduler.generation_s = 0.01
+    return scheduler
+
+
+async def hold(scheduler, company_id, tier=None, order=None, seconds=0.01):
+    async with scheduler.slot(company_id, tier):
+        if order is not None:
+            order.append(company_id)
+        await asyncio.sleep(seconds)
+
+
+async def queue_behind_busy_slot(scheduler, requests):
+    """Run requests [(company_id, tier)] queued behind one running generation; order served"""
+    order = []
+    blocker = asyncio.create_task(hold(scheduler, "blocker", seconds=0.05))
+    await asyncio.sleep(0)
+    tasks = []
+    for company_id, tier in requests:
+        tasks.append(asyncio.create_task(hold(scheduler, company_id, tier, order)))
+        await asyncio.sleep(0)
+    await asyncio.gather(blocker, *tasks)
+    return order
+
+
+class TestScheduler:
+
+    async def test_limits_concurrent_generations(self):
+        scheduler = fast_scheduler(concurrency=2, max_queue=10, max_wait=5)
+        running, peak = 0, 0
+
+        async def generate():
+            nonlocal running, peak
+            async with scheduler.slot("demo"):
+                running += 1
+                peak = max(peak, running)
+                await asyncio.sleep(0.02)
+                running -= 1
+
+        await asyncio.gather(*[generate() for _ in range(6)])
+        assert peak == 2
+        assert scheduler.stats()["started"] == 6
+        assert scheduler.active == scheduler.depth == 0
+
+    async def test_busy_company_does_not_starve_others(self):
+        scheduler = fast_scheduler(concurrency=1, max_queue=10, max_wait=5)
+        order = await queue_behind_busy_slot(scheduler, [("a", None)] * 5 + [("b", None)])
+        assert order[:2] == ["a", "b"]
+
+    async def test_share_follows_tier_weight(self):
+        scheduler = fast_scheduler(concurrency=1, max_queue=10, max_wait=5,
+                                   weights={"starter": 1, "business": 3})
+        order = await queue_behind_busy_slot(scheduler, [("small", "starter")] * 4 + [("big", "business")] * 4)
+        assert order == ["big", "big", "small", "big", "big", "small", "small", "small"]
+
+    async def test_full_queue_rejects_with_retry_after(self):
+        scheduler = fast_scheduler(concurrency=1, max_queue=1, max_wait=5)
+        blocker = asyncio.create_task(hold(scheduler, "a", seconds=0.05))
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(hold(scheduler, "a"))
+        await asyncio.sleep(0)
+
+        with pytest.raises(SchedulerBusy) as busy:
+            await scheduler.acquire("b")
+        assert busy.value.reason == "queue_full"
+        assert busy.value.retry_after >= 1
+
+        await asyncio.gather(blocker, waiting)
+        assert scheduler.stats()["rejected"] == 1
+
+    async def test_predicted_wait_rejects_before_timeout(self):
+        scheduler = OllamaScheduler(concurrency=1, max_queue=10, max_wait=20)
+        scheduler.generation_s = 15  # Two queued requests would wait ~30s
+        blocker = asyncio.create_task(hold(scheduler, "a", seconds=0.05))
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(hold(scheduler, "a"))
+        await asyncio.sleep(0)
+
+        with pytest.raises(SchedulerBusy) as busy:
+            await scheduler.acquire("b")
+        assert busy.value.reason == "wait_too_long"
+        assert busy.value.retry_after == 15
+        await asyncio.gather(blocker, waiting)
+
+    async def test_cancelled_waiter_leaves_queue(self):
+        scheduler = fast_scheduler(concurrency=1, max_queue=10, max_wait=5)
+        blocker = asyncio.create_task(hold(scheduler, "a", seconds=0.05))
+        await asyncio.sleep(0)
+        gone = asyncio.create_task(hold(scheduler, "b"))
+        await asyncio.sleep(0)
+        assert scheduler.depth == 1
+
+        gone.cancel()
+        await asyncio.sleep(0.01)
+        assert scheduler.depth == 0
+        await blocker
+        await hold(scheduler, "c")
+        assert scheduler.active == 0
+
+    async def test_background_slots_wait_in_their_own_lane(self):
+        scheduler = fast_scheduler(concurrency=1, max_queue=1, max_wait=1)
+        order = []
+
+        async def background(name, seconds=0.01):
+            async with scheduler.slot("a", background=True):
+                order.append(name)
+                await asyncio.sleep(seconds)
+
+        blocker = asyncio.create_task(background("import-1", seconds=0.05))
+        await asyncio.sleep(0)
+        imports = [asyncio.create_task(background(f"import-{n}")) for n in (2, 3)]
+        await asyncio.sleep(0)
+        assert scheduler.stats()["queue_by_company"] == {"a/import": 2}  # Over max_queue, not rejected
+
+        # The company's own chat is not queued behind its import
+        await asyncio.sleep(0.03)
+        chat = asyncio.create_task(hold(scheduler, "a", order=order))
+        await asyncio.gather(blocker, *imports, chat)
+        assert order.index("a") == 1
+        assert scheduler.generation_s == pytest.approx(0.01, abs=0.01)  # Chat generations only
+        assert scheduler.stats()["rejected"] == 0
+
+    def test_parse_weights(self):
+        assert parse_weights("starter:1, enterprise:4,broken") == {"starter": 1.0, "enterprise": 4.0}
+
+
+class TestChatBackpressure:
+
+    def test_overloaded_queue_answers_503_with_retry_after(self, monkeypatch):
+        Base.metadata.create_all(bind=engine)
+        config_cache.clear()
+        response_cache.clear()
+        monkeypatch.setattr(main, "ollama_scheduler", OllamaScheduler(concurrency=1, max_queue=0, max_wait=5))
+        try:
+            with running_stub(delay=0.5) as stub:
+                monkeypatch.setattr(main, "OLLAMA_BASE_URL", stub.base_url)
+                with TestClient(app) as client:
+                    def ask(n):
+                        return client.post("/chat/demo", json={
+                            "question": f"Hur betalar jag hyran {n}?", "session_id": str(uuid.uuid4())
+                        })
+
+                    with ThreadPoolExecutor(max_workers=2) as pool:
+                        responses = list(pool.map(ask, range(2)))
+                    main.write_queue.flush_all()
+
+                    assert sorted(r.status_code for r in responses) == [200, 503]
+                    rejected = next(r for r in responses if r.status_code == 503)
+                    assert int(rejected.headers["Retry-After"]) >= 1
+                    assert stub.requests == 1
+
+                    admin = {"Authorization": f"Bearer {create_token({'sub': 'admin', 'type': 'super_admin'})}"}
+                    queue = client.get("/admin/system-health", headers=admin).json()["ollama_queue"]
+                    assert (queue["started"], queue["rejected"], queue["queue_depth"]) == (1, 1, 0)
+                    assert "bobot_ollama_queue_depth 0" in client.get("/metrics").text
+        finally:
+            response_cache.clear()
+            Base.metadata.drop_all(bind=engine)
@@ -0,0 +1,82 @@
+"""
+Tests for the cache-friendly prompt layout (static prefix first, facts and question last)
+"""
+
+import os
+import sys
+from types import SimpleNamespace
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Set test environment before importing app
+os.environ["ENVIRONMENT"] = "test"
+os.environ["DATABASE_URL"] = "sqlite:///./test_bobot.db"
+
+import main
+from main import build_prompt
+from tenant_config import Snapshot
+
+
+def settings(**values):
+    return Snapshot({
+        "company_id": "demo", "company_name": "Bostads AB", "contact_email": "info@bostad.se",
+        "contact_phone": "08-123 45 67", "data_controller_name": None, "data_controller_email": None,
+        "privacy_policy_url": None, **values,
+    })
+
+
+def widget(**values):
+    return Snapshot({"id": 7, "display_name": None, "contact_email": None, "contact_phone": None,
+                     "tone": None, **values})
+
+
+def fact(question, answer):
+    return SimpleNamespace(question=question, answer=answer)
+
+
+def shared_prefix(a: str, b: str) -> str:
+    return os.path.commonprefix([a, b])
+
+
+class TestPromptPrefix:
+
+    def setup_method(self):
+        main.prompt_prefixes.clear()
+
+    def test_variable_parts_come_after_an_identical_prefix(self):
+        company = settings()
+        first = build_prompt("När betalas hyran?", [fact("När betalas hyran?", "Den sista.")], company, "sv")
+        second = build_prompt("Var är tvättstugan?", [fact("Tvättstuga?", "I källaren.")], company, "sv")
+
+        prefix = shared_prefix(first, second)
+        assert prefix.endswith("FACTS (answer based on these):\nQ: ")
+        assert "Reply in Swedish" in prefix
+        assert "info@bostad.se" in prefix
+        assert first.endswith("Question: När betalas hyran?")
+        assert first.index("NEVER DO THIS") < first.index("Den sista.")
+
+    def test_prefix_is_cached_per_company_widget_and_language(self):
+        company, support = settings(), widget(tone="casual")
+        build_prompt("Hej", [], company, "sv", widget=support)
+        cached = main.prompt_prefixes[("demo", 7, "sv", "external")]
+        build_prompt("Hej igen", [], company, "sv", widget=support)
+        assert main.prompt_prefixes[("demo", 7, "sv", "external")][2] is cached[2]
+
+        english = build_prompt("Hello", [], company, "en", widget=support)
+        assert "Reply in English" in english
+        assert "relaxed, friendly way" in english
+        assert len(main.prompt_prefixes) == 2
+
+    def test_reloaded_settings_rebuild_the_prefix(self):
+        build_prompt("Hej", [], settings(), "sv")
+        changed = build_prompt("Hej", [], settings(contact_email="ny@bostad.se"), "sv")
+        assert "ny@bostad.se" in changed
+        assert "info@bostad.se" not in changed
+
+    def test_widget_contact_info_overrides_company(self):
+        prompt = build_prompt("Hej", [], settings(), "sv", widget_type="internal",
+                              widget=widget(display_name="HR-boten", contact_email="hr@bostad.se"))
+        assert prompt.startswith("You are a helpful assistant for HR-boten")
+        assert "hr@bostad.se" in prompt
+        assert "FACTS: No matching information found." in prompt
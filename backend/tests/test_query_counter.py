@@ -0,0 +1,139 @@
+"""
+Tests for the per-request SQL and Ollama timings
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sys
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Set test environment before importing app
+os.environ["ENVIRONMENT"] = "test"
+os.environ["DATABASE_URL"] = "sqlite:///./test_bobot.db"
+
+from sqlalchemy import text
+
+import main
+import query_counter
+from main import app
+from auth import create_token
+from database import Base, engine, SessionLocal
+from ollama_stub import running_stub
+from query_counter import count_queries, waiting
+from response_cache import response_cache
+from tenant_config import config_cache
+
+
+@pytest.fixture
+def db():
+    Base.metadata.create_all(bind=engine)
+    query_counter.install(engine)
+    session = SessionLocal()
+    yield session
+    session.close()
+
+
+@pytest.fixture(scope="module")
+def client():
+    """Test client with an Ollama stub behind it"""
+    Base.metadata.create_all(bind=engine)
+    config_cache.clear()
+
+    with running_stub() as stub:
+        original_url = main.OLLAMA_BASE_URL
+        main.OLLAMA_BASE_URL = stub.base_url
+        try:
+            with TestClient(app) as c:
+                yield c
+        finally:
+            main.OLLAMA_BASE_URL = original_url
+
+    response_cache.clear()
+    Base.metadata.drop_all(bind=engine)
+
+
+def server_timing(response):
+    """{"db": {"dur": "1.2", "desc": "..."}, ...} from the Server-Timing header"""
+    metrics = {}
+    for metric in response.headers["Server-Timing"].split(", "):
+        name, *params = metric.split(";")
+        metrics[name] = dict(param.split("=", 1) for param in params)
+    return metrics
+
+
+class TestQueryCounter:
+
+    def test_counts_and_times_statements(self, db):
+        with count_queries() as outer:
+            db.execute(text("SELECT 1")).scalar()
+            with count_queries() as inner:
+                db.execute(text("WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 20000) "
+                                "SELECT count(*) FROM n")).scalar()
+        assert (outer.count, inner.count) == (2, 1)
+        assert outer.db_ms >= inner.db_ms > 0
+        slowest_ms, slowest_statement = outer.slowest[0]
+        assert "RECURSIVE" in slowest_statement
+        assert len(outer.slowest) == 2
+
+    def test_keeps_only_the_slowest(self, db):
+        with count_queries() as counter:
+            for _ in range(query_counter.SLOWEST_KEPT + 5):
+                db.execute(text("SELECT 1")).scalar()
+        assert counter.count == query_counter.SLOWEST_KEPT + 5
+        assert len(counter.slowest) == query_counter.SLOWEST_KEPT
+        assert [ms for ms, _ in counter.slowest] == sorted((ms for ms, _ in counter.slowest), reverse=True)
+
+    async def test_waiting_adds_to_active_counters(self):
+        with count_queries() as counter:
+            with waiting("ollama"):
+                await asyncio.sleep(0.02)
+        with waiting("ollama"):  # No counter active: nothing to record
+            pass
+        assert counter.waits["ollama"] >= 20
+        assert counter.server_timing(30).startswith('db;dur=0.0;desc="0 queries", ollama;dur=')
+        assert counter.server_timing(30).endswith("total;dur=30.0")
+
+    def test_slow_query_log(self, db, monkeypatch, caplog):
+        monkeypatch.setattr(query_counter, "SLOW_QUERY_MS", 0.000001)
+        with caplog.at_level(logging.WARNING, logger="query_counter"):
+            with count_queries(request_id="abc123"):
+                db.execute(text("SELECT 42")).scalar()
+        assert any("[abc123]" in r.message and "SELECT 42" in r.message for r in caplog.records)
+
+        monkeypatch.setattr(query_counter, "SLOW_QUERY_MS", 0)
+        caplog.clear()
+        db.execute(text("SELECT 43")).scalar()
+        assert not caplog.records
+
+
+class TestRequestTimings:
+
+    def test_headers_and_structured_log(self, client, caplog):
+        headers = {"Authorization": f"Bearer {create_token({'sub': 'demo', 'type': 'company'})}"}
+        with caplog.at_level(logging.INFO, logger="bobot.requests"):
+            response = client.get("/analytics", headers=headers)
+        assert response.status_code == 200
+
+        timing = server_timing(response)
+        assert timing["db"]["desc"] == f'"{response.headers["X-DB-Queries"]} queries"'
+        assert float(timing["total"]["dur"]) >= float(timing["db"]["dur"])
+
+        line = json.loads(next(r.message for r in caplog.records if r.name == "bobot.requests"))
+        assert line["path"] == "/analytics"
+        assert line["db_queries"] == int(response.headers["X-DB-Queries"])
+        assert line["slowest_queries"]
+
+    def test_chat_reports_time_awaiting_ollama(self, client):
+        response = client.post("/chat/demo", json={
+            "question": f"Vad gäller för parkering {uuid.uuid4()}?", "session_id": str(uuid.uuid4())
+        })
+        assert response.status_code == 200
+        assert float(server_timing(response)["ollama"]["dur"]) > 0
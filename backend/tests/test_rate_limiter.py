@@ -0,0 +1,104 @@
+"""
+Tests for the sliding window counter rate limiter
+"""
+
+import os
+import sys
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rate_limiter import SlidingWindowLimiter
+from state_backend import MemoryBackend, MEMORY_PURGE_BATCH
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 6000.0  # Start of a 60 second window
+
+    def __call__(self):
+        return self.now
+
+
+def make_limiter(limit=15, window=60):
+    clock = FakeClock()
+    backend = MemoryBackend(clock=clock)
+    return SlidingWindowLimiter("chat", limit, window, backend=backend, clock=clock), backend, clock
+
+
+class TestSlidingWindowLimiter:
+
+    def test_blocks_at_limit(self):
+        limiter, _, _ = make_limiter(limit=3)
+        decisions = [limiter.hit("s1:ip") for _ in range(4)]
+        assert [d.allowed for d in decisions] == [True, True, True, False]
+        assert [d.count for d in decisions[:3]] == [1, 2, 3]
+        assert decisions[2].remaining == 0
+        assert decisions[3].reset == 61  # The whole current window must slide out
+
+        # Other keys are unaffected
+        assert limiter.hit("s2:ip").allowed
+
+    def test_previous_window_slides_out(self):
+        limiter, _, clock = make_limiter(limit=10)
+        for _ in range(10):
+            limiter.hit("k")
+        clock.now += 60  # Next window: estimate is 10 * 60/60
+        assert not limiter.hit("k").allowed
+
+        clock.now += 1  # 10 * 59/60 < 10
+        assert limiter.hit("k").allowed
+        blocked = limiter.hit("k")  # 10 * 59/60 + 1 >= 10
+        assert not blocked.allowed
+        assert blocked.reset == 6  # 10 * 54/60 + 1 is still 10, so one second more
+
+        clock.now += 6
+        assert limiter.hit("k").allowed
+        clock.now += 120
+        assert limiter.hit("k").count == 1
+
+    def test_state_is_constant_size(self):
+        limiter, backend, _ = make_limiter(limit=1000)
+        for _ in range(500):
+            limiter.hit("k")
+        assert len(backend.get("chat", "k")) == 4
+
+    def test_idle_keys_expire_incrementally(self):
+        limiter, backend, clock = make_limiter()
+        for i in range(100):
+            limiter.hit(f"bot-{i}")
+        clock.now += 121  # Two windows later every key has expired
+
+        limiter.hit("new")
+        assert backend.count("chat") == 100 + 1 - MEMORY_PURGE_BATCH
+        for i in range(20):
+            limiter.hit(f"new-{i}")
+        assert backend.count("chat") == 21
+
+    def test_stats_without_scanning(self):
+        limiter, _, clock = make_limiter(limit=2)
+        for _ in range(4):
+            limiter.hit("a", label="acme")
+        limiter.hit("b", label="other")
+
+        stats = limiter.stats()
+        assert stats == {"limited_keys": 1, "rejected_requests": 2, "active_keys": 2}
+        assert limiter.stats(label="acme") == {"limited_keys": 1, "rejected_requests": 2}
+        assert limiter.stats(label="other") == {"limited_keys": 0, "rejected_requests": 0}
+
+        clock.now += 120
+        assert limiter.stats()["active_keys"] == 0
+
+    def test_failed_login_lockout(self):
+        limiter, _, clock = make_limiter(limit=5, window=900)
+        for _ in range(4):
+            limiter.add("admin:1.2.3.4")
+        assert limiter.peek("admin:1.2.3.4").remaining == 1
+
+        limiter.add("admin:1.2.3.4")
+        locked = limiter.peek("admin:1.2.3.4")
+        assert not locked.allowed
+        assert 0 < locked.reset <= 900
+
+        limiter.reset("admin:1.2.3.4")
+        assert limiter.peek("admin:1.2.3.4").allowed
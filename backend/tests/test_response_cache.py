@@ -0,0 +1,144 @@
+"""
+Tests for the bounded chat response cache
+"""
+
+import os
+import sys
+import time
+
+import pytest
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from response_cache import ResponseCache, SharedResponseCache, make_cache_key, estimate_size
+from state_backend import SQLiteConnections
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def answer(text="Hyran betalas via autogiro."):
+    return {"answer": text, "sources": [], "had_answer": True, "confidence": 100}
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_cache(request, tmp_path):
+    """Factory for both cache implementations"""
+    connections = []
+
+    def make(**kwargs):
+        if request.param == "memory":
+            return ResponseCache(**kwargs)
+        conn = SQLiteConnections(str(tmp_path / f"state{len(connections)}.db"))
+        connections.append(conn)
+        return SharedResponseCache(conn, **kwargs)
+
+    yield make
+    for conn in connections:
+        conn.close()
+
+
+class TestResponseCache:
+    """LRU order, byte limit, TTL and tenant invalidation"""
+
+    def test_hit_and_miss_counters(self, make_cache):
+        cache = make_cache()
+        key = make_cache_key("acme", "Hur betalar jag hyran?")
+        assert cache.get(key) is None
+        cache.set(key, answer(), "acme")
+        assert cache.get(key) == answer()
+
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["size_bytes"] == estimate_size(key, answer())
+
+    def test_evicts_least_recently_used_by_bytes(self, make_cache):
+        entry_size = estimate_size("acme:default:sv:q0", answer())
+        clock = FakeClock()
+        cache = make_cache(max_bytes=entry_size * 3, clock=clock)
+        for i in range(3):
+            clock.now += 1
+            cache.set(f"acme:default:sv:q{i}", answer(), "acme")
+
+        clock.now += 1
+        cache.get("acme:default:sv:q0")  # q1 is now least recently used
+        cache.set("acme:default:sv:q3", answer(), "acme")
+
+        assert "acme:default:sv:q1" not in cache
+        assert "acme:default:sv:q0" in cache
+        assert cache.stats()["evictions"] == 1
+        assert cache.stats()["size_bytes"] <= cache.max_bytes
+
+    def test_oversized_entry_is_not_cached(self, make_cache):
+        cache = make_cache(max_bytes=100)
+        cache.set("acme:default:sv:q", answer("x" * 500), "acme")
+        assert len(cache) == 0
+
+    def test_entries_expire(self, make_cache):
+        clock = FakeClock()
+        cache = make_cache(ttl=300, clock=clock)
+        cache.set("acme:default:sv:a", answer(), "acme")
+        cache.set("acme:default:sv:b", answer(), "acme", ttl=10)
+
+        clock.now += 60
+        assert cache.get("acme:default:sv:b") is None
+        assert cache.get("acme:default:sv:a") == answer()
+
+        clock.now += 300
+        cache.set("acme:default:sv:c", answer(), "acme")  # Purges expired LRU entries
+        assert "acme:default:sv:a" not in cache
+        assert cache.stats()["expirations"] == 2
+
+    def test_invalidate_company_and_widget(self, make_cache):
+        cache = make_cache()
+        for company_id in ("acme", "other"):
+            for widget_key in (None, "w1", "w2"):
+                cache.set(make_cache_key(company_id, "q", "sv", widget_key), answer(), company_id, widget_key)
+
+        # A widget edit drops that widget's answers and the widget-less ones
+        assert cache.invalidate("acme", ["w1", None]) == 2
+        assert make_cache_key("acme", "q", "sv", "w2") in cache
+        assert make_cache_key("acme", "q", "sv", "w1") not in cache
+
+        assert cache.invalidate("acme") == 1
+        assert len(cache) == 3
+        assert cache.stats()["companies"] == 1
+
+    def test_shared_cache_is_seen_by_other_workers(self, tmp_path):
+        path = str(tmp_path / "state.db")
+        worker_a = SharedResponseCache(SQLiteConnections(path))
+        worker_b = SharedResponseCache(SQLiteConnections(path))
+
+        key = make_cache_key("acme", "Hur betalar jag hyran?")
+        worker_a.set(key, answer(), "acme")
+        assert worker_b.get(key) == answer()
+
+        worker_b.invalidate("acme")
+        assert worker_a.get(key) is None
+        worker_b.flush()  # Lookups are counted in the worker until flushed
+        assert worker_a.stats()["hits"] == 1
+        assert worker_a.stats()["invalidations"] == 1
+
+    def test_shared_cache_reads_do_not_wait_for_writers(self, tmp_path):
+        path = str(tmp_path / "state.db")
+        cache = SharedResponseCache(SQLiteConnections(path, timeout=5))
+        key = make_cache_key("acme", "Hur betalar jag hyran?")
+        cache.set(key, answer(), "acme")
+
+        writer = SQLiteConnections(path)
+        with writer.transaction():  # Another worker holds the write lock
+            started = time.perf_counter()
+            assert cache.get(key) == answer()
+            assert cache.get("acme:default:sv:saknas") is None
+            assert time.perf_counter() - started < 1
+        writer.close()
+
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"]) == (1, 1)
@@ -0,0 +1,147 @@
+"""
+Tests for the batched GDPR retention cleanup
+"""
+
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ["ENVIRONMENT"] = "test"
+os.environ["DATABASE_URL"] = "sqlite:///./test_bobot.db"
+
+import main
+from database import (
+    Base, engine, SessionLocal, Company, CompanySettings, Conversation, DailyStatistics, Message
+)
+from retention_cleanup import RetentionCleanup
+
+
+NOW = datetime.utcnow()
+
+
+@pytest.fixture
+def companies():
+    """Two companies with identical conversations, 7 days retention"""
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        for company_id in ("old-way", "batched"):
+            db.add(Company(id=company_id, name=company_id, password_hash="x"))
+            db.add(CompanySettings(company_id=company_id, data_retention_days=7))
+            add_conversations(db, company_id)
+        db.commit()
+        yield
+    finally:
+        db.close()
+        Base.metadata.drop_all(bind=engine)
+
+
+def add_conversations(db, company_id):
+    """Expired conversations over two days (mixed answers and feedback) and one recent"""
+    specs = [
+        # (days ago, hour, category, language, was_helpful, [(had_answer, response_time_ms)])
+        (10, 9, "hyra", "sv", True, [(True, 800), (False, 300)]),
+        (10, 9, "hyra", "en", None, [(True, 1200)]),
+        (10, 14, "allmant", "sv", False, [(None, 0)]),
+        (12, 22, "felanmalan", None, None, [(True, 500), (True, 700), (False, 900)]),
+        (12, 8, None, "ar", True, []),
+        (1, 10, "hyra", "sv", None, [(True, 400)]),
+    ]
+    for days_ago, hour, category, language, was_helpful, answers in specs:
+        started_at = (NOW - timedelta(days=days_ago)).replace(hour=hour, minute=0)
+        conversation = Conversation(
+            company_id=company_id, session_id=f"{company_id}-{days_ago}-{hour}", started_at=started_at,
+            category=category, language=language, was_helpful=was_helpful, message_count=2 * len(answers)
+        )
+        db.add(conversation)
+        db.flush()
+        for had_answer, response_time_ms in answers:
+            db.add(Message(conversation_id=conversation.id, role="user", content="Fråga", created_at=started_at))
+            db.add(Message(conversation_id=conversation.id, role="bot", content="Svar", had_answer=had_answer,
+                           response_time_ms=response_time_ms, created_at=started_at))
+
+
+def daily_statistics(company_id):
+    db = SessionLocal()
+    try:
+        return {
+            s.date: {
+                "conversations": s.total_conversations, "messages": s.total_messages,
+                "answered": s.questions_answered, "unanswered": s.questions_unanswered,
+                "helpful": s.helpful_count, "not_helpful": s.not_helpful_count,
+                "avg_response_time_ms": round(s.avg_response_time_ms or 0, 3),
+                "categories": json.loads(s.category_counts), "languages": json.loads(s.language_counts),
+                "hours": json.loads(s.hourly_counts),
+            }
+            for s in db.query(DailyStatistics).filter(DailyStatistics.company_id == company_id)
+        }
+    finally:
+        db.close()
+
+
+def remaining(company_id):
+    db = SessionLocal()
+    try:
+        conversations = db.query(Conversation).filter(Conversation.company_id == company_id).count()
+        messages = db.query(Message).join(Conversation).filter(Conversation.company_id == company_id).count()
+        return conversations, messages
+    finally:
+        db.close()
+
+
+def delete_one_by_one(company_id, cutoff):
+    """The previous cleanup: save_conversation_stats() and a cascade delete per conversation"""
+    db = SessionLocal()
+    try:
+        for conversation in db.query(Conversation).filter(
+            Conversation.company_id == company_id, Conversation.started_at < cutoff
+        ).order_by(Conversation.id).all():
+            main.save_conversation_stats(db, conversation)
+            db.delete(conversation)
+            db.flush()  # The session does not autoflush; the next call must see this day's row
+        db.commit()
+    finally:
+        db.close()
+
+
+class TestRetentionCleanup:
+
+    async def test_same_statistics_as_deleting_one_by_one(self, companies):
+        delete_one_by_one("old-way", NOW - timedelta(days=7))
+
+        cleanup = RetentionCleanup(SessionLocal, batch_size=2)
+        summary = await cleanup.run()
+
+        assert daily_statistics("batched") == daily_statistics("old-way")
+        assert len(daily_statistics("batched")) == 2
+        assert remaining("batched") == remaining("old-way") == (1, 2)
+
+        assert summary["conversations"] == 5
+        assert summary["messages"] == 14
+        assert summary["duration_ms"] >= 0
+        stats = cleanup.stats()
+        assert stats["batches"] == 3  # 2 + 2 + 1
+        assert stats["running"] is False
+        assert stats["progress"] is None
+
+    async def test_merges_into_existing_daily_statistics(self, companies):
+        cleanup = RetentionCleanup(SessionLocal, batch_size=1)
+        await cleanup.delete_conversations("batched", NOW - timedelta(days=11))
+        first = daily_statistics("batched")
+        assert sum(day["conversations"] for day in first.values()) == 2
+
+        await cleanup.run()
+        delete_one_by_one("old-way", NOW - timedelta(days=7))
+        assert daily_statistics("batched") == daily_statistics("old-way")
+
+    async def test_delete_all_conversations_of_a_company(self, companies):
+        cleanup = RetentionCleanup(SessionLocal)
+        assert await cleanup.delete_conversations("batched") == 6
+        assert remaining("batched") == (0, 0)
+        assert remaining("old-way") == (6, 16)
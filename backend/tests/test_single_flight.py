@@ -0,0 +1,143 @@
+"""
+Tests for coalescing identical concurrent chat generations
+"""
+
+import asyncio
+import os
+import sys
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi.testclient import TestClient
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Set test environment before importing app
+os.environ["ENVIRONMENT"] = "test"
+os.environ["DATABASE_URL"] = "sqlite:///./test_bobot.db"
+
+import main
+from main import app
+from database import Base, engine, SessionLocal, Conversation, Message
+from ollama_stub import running_stub
+from response_cache import response_cache
+from single_flight import SingleFlight
+from tenant_config import config_cache
+
+
+def slow_generation(answer="Svar", tokens=(), delay=0.05, calls=None):
+    async def generate(emit):
+        if calls is not None:
+            calls.append(1)
+        for token in tokens:
+            await asyncio.sleep(delay)
+            emit(token)
+        await asyncio.sleep(delay)
+        return answer
+    return generate
+
+
+class TestSingleFlight:
+
+    async def test_identical_calls_share_one_generation(self):
+        flights = SingleFlight()
+        calls = []
+        answers = await asyncio.gather(*[
+            flights.run("demo:default:sv:vatten?", slow_generation("Vattnet är avstängt", calls=calls))
+            for _ in range(10)
+        ], flights.run("demo:default:sv:annat?", slow_generation("Annat", calls=calls)))
+
+        assert answers == ["Vattnet är avstängt"] * 10 + ["Annat"]
+        assert len(calls) == 2
+        assert flights.stats()["generations"] == 2
+        assert flights.stats()["coalesced_requests"] == 9
+        assert flights.in_flight() == 0
+
+        # Finished flights are not reused
+        await flights.run("demo:default:sv:vatten?", slow_generation(calls=calls))
+        assert len(calls) == 3
+
+    async def test_followers_get_every_token(self):
+        flights = SingleFlight()
+        leader_tokens, follower_tokens = [], []
+        leader = asyncio.create_task(flights.run(
+            "k", slow_generation("abc", tokens=("a", "b", "c")), leader_tokens.append
+        ))
+        await asyncio.sleep(0.08)  # "a" has been generated
+        follower = await flights.run("k", slow_generation("never"), follower_tokens.append)
+
+        assert await leader == follower == "abc"
+        assert leader_tokens == follower_tokens == ["a", "b", "c"]
+
+    async def test_leader_cancelled_followers_still_answered(self):
+        flights = SingleFlight()
+        leader = asyncio.create_task(flights.run("k", slow_generation("svar", delay=0.05)))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(flights.run("k", slow_generation("never")))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+
+        assert await follower == "svar"
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+
+    async def test_errors_reach_every_caller(self):
+        flights = SingleFlight()
+
+        async def failing(emit):
+            await asyncio.sleep(0.02)
+            raise RuntimeError("Ollama nere")
+
+        results = await asyncio.gather(*[flights.run("k", failing) for _ in range(3)], return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+        assert flights.stats()["errors"] == 1
+        assert flights.in_flight() == 0
+
+
+class TestChatCoalescing:
+
+    def test_concurrent_identical_questions_call_ollama_once(self):
+        Base.metadata.create_all(bind=engine)
+        config_cache.clear()
+        response_cache.clear()
+        try:
+            with running_stub(delay=0.5) as stub:
+                original_url = main.OLLAMA_BASE_URL
+                main.OLLAMA_BASE_URL = stub.base_url
+                try:
+                    with TestClient(app) as client:
+                        generated = main.chat_flights.leaders
+                        before = stub.requests
+
+                        def ask(_):
+                            return client.post("/chat/demo", json={
+                                "question": "Hur betalar jag hyran?", "session_id": str(uuid.uuid4())
+                            })
+
+                        with ThreadPoolExecutor(max_workers=6) as pool:
+                            responses = list(pool.map(ask, range(6)))
+                        main.write_queue.flush_all()
+
+                        assert all(r.status_code == 200 for r in responses)
+                        assert len({r.json()["answer"] for r in responses}) == 1
+                        assert stub.requests - before == 1
+                        assert main.chat_flights.leaders - generated == 1
+
+                        # Every request wrote its own conversation and messages
+                        sessions = {r.json()["session_id"] for r in responses}
+                        db = SessionLocal()
+                        try:
+                            conversations = db.query(Conversation).filter(Conversation.session_id.in_(sessions)).all()
+                            assert len(conversations) == 6
+                            assert db.query(Message).filter(
+                                Message.conversation_id.in_([c.id for c in conversations])
+                            ).count() == 12
+                        finally:
+                            db.close()
+                finally:
+                    main.OLLAMA_BASE_URL = original_url
+        finally:
+            response_cache.clear()
+            Base.metadata.drop_all(bind=engine)
@@ -0,0 +1,149 @@
+"""
+Tests for the in-process and shared state backends
+"""
+
+import multiprocessing
+import os
+import sys
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from state_backend import MemoryBackend, SQLiteBackend, StateBackend
+from database import Base, KnowledgeItem
+from knowledge_index import KnowledgeIndex
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def increment(value):
+    return (value or 0) + 1, (value or 0) + 1
+
+
+def increment_many(path, count):
+    backend = SQLiteBackend(path)
+    for _ in range(count):
+        backend.update("counters", "hits", increment)
+    backend.close()
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_backend(request, tmp_path):
+    backends = []
+
+    def make(**kwargs):
+        if request.param == "memory":
+            backend = MemoryBackend(**kwargs)
+        else:
+            backend = SQLiteBackend(str(tmp_path / "state.db"), **kwargs)
+        backends.append(backend)
+        return backend
+
+    yield make
+    for backend in backends:
+        backend.close()
+
+
+class TestStateBackend:
+    """Both backends must behave the same"""
+
+    def test_update_get_delete(self, make_backend):
+        backend = make_backend()
+        assert backend.get("ns", "a") is None
+        assert backend.update("ns", "a", increment) == 1
+        assert backend.update("ns", "a", increment) == 2
+        assert backend.get("ns", "a") == 2
+        assert backend.get("other", "a", default=0) == 0
+
+        backend.update("ns", "b", lambda v: ([1.5, 2.5], None))
+        assert sorted(backend.items("ns")) == [("a", 2), ("b", [1.5, 2.5])]
+
+        backend.delete("ns", "a")
+        assert backend.count("ns") == 1
+        backend.clear("ns")
+        assert backend.items("ns") == []
+
+    def test_ttl(self, make_backend):
+        clock = FakeClock()
+        backend = make_backend(clock=clock)
+        backend.update("ns", "a", increment, ttl=60)
+        backend.update("ns", "b", increment)
+
+        clock.now += 61
+        assert backend.get("ns", "a") is None
+        assert backend.get("ns", "b") == 1
+        assert backend.count("ns") == 1
+        # An expired value is passed to update() as missing
+        assert backend.update("ns", "a", increment, ttl=60) == 1
+
+    def test_returning_none_deletes(self, make_backend):
+        backend = make_backend()
+        backend.update("ns", "a", increment)
+        backend.update("ns", "a", lambda v: (None, v))
+        assert backend.items("ns") == []
+
+    def test_incomplete_backend_fails_at_construction(self):
+        class NoClear(StateBackend):
+            get = MemoryBackend.get
+            update = MemoryBackend.update
+            delete = MemoryBackend.delete
+            items = MemoryBackend.items
+
+        with pytest.raises(TypeError, match="clear"):
+            NoClear()
+
+
+class TestSharedBackend:
+    """The SQLite backend is shared by worker processes"""
+
+    def test_updates_are_atomic_across_processes(self, tmp_path):
+        path = str(tmp_path / "state.db")
+        SQLiteBackend(path).close()  # Create the schema once
+
+        ctx = multiprocessing.get_context("spawn")
+        workers = [ctx.Process(target=increment_many, args=(path, 50)) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(timeout=60)
+            assert worker.exitcode == 0
+
+        backend = SQLiteBackend(path)
+        assert backend.get("counters", "hits") == 200
+        backend.close()
+
+    def test_knowledge_changes_reach_other_workers(self, tmp_path):
+        engine = create_engine(f"sqlite:///{tmp_path / 'bobot.db'}")
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        db.add(KnowledgeItem(company_id="acme", question="Hur betalar jag hyran?", answer="Via autogiro."))
+        db.commit()
+
+        backend = SQLiteBackend(str(tmp_path / "state.db"))
+        worker_a = KnowledgeIndex(backend)
+        worker_b = KnowledgeIndex(backend)
+        assert len(worker_a.search(db, "acme", "betalar hyran")) == 1
+        assert len(worker_b.search(db, "acme", "betalar hyran")) == 1
+
+        # Worker A deletes the item; worker B must reload instead of serving it
+        item = db.query(KnowledgeItem).first()
+        db.delete(item)
+        db.commit()
+        worker_a.remove_items("acme", [item.id])
+
+        assert worker_a.search(db, "acme", "betalar hyran") == []
+        assert worker_b.search(db, "acme", "betalar hyran") == []
+
+        db.close()
+        backend.close()
+        engine.dispose()
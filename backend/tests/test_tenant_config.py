@@ -0,0 +1,218 @@
+"""
+Tests for the tenant config cache and the request query counter
+"""
+
+import os
+import sys
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Set test environment before importing app
+os.environ["ENVIRONMENT"] = "test"
+os.environ["DATABASE_URL"] = "sqlite:///./test_bobot.db"
+
+import main
+from main import app
+from auth import create_token
+from database import Base, engine, SessionLocal, Company
+from ollama_stub import running_stub
+from query_counter import count_queries
+from response_cache import response_cache
+from state_backend import MemoryBackend
+from tenant_config import TenantConfigCache, config_cache, snapshot
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTenantConfigCache:
+
+    def test_read_through_until_ttl(self):
+        clock = FakeClock()
+        cache = TenantConfigCache(ttl=30, clock=clock)
+        loads = []
+
+        def load():
+            loads.append(1)
+            return ("value", len(loads))
+
+        assert cache.get("company", "acme", load, scope="acme") == ("value", 1)
+        assert cache.get("company", "acme", load, scope="acme") == ("value", 1)
+        clock.now += 31
+        assert cache.get("company", "acme", load, scope="acme") == ("value", 2)
+        assert cache.stats()["hits"] == 1
+
+    def test_missing_rows_are_not_cached(self):
+        cache = TenantConfigCache()
+        assert cache.get("widget", "nope", lambda: None) is None
+        assert cache.get("widget", "nope", lambda: "created") == "created"
+
+    def test_invalidate_company_drops_its_widgets(self):
+        cache = TenantConfigCache()
+        cache.get("widget", "acme-ext", lambda: {"company_id": "acme"}, scope_of=lambda w: w["company_id"])
+        cache.get("settings", "acme", lambda: "acme settings", scope="acme")
+        cache.get("settings", "other", lambda: "other settings", scope="other")
+        cache.get("maintenance", "", lambda: (False, ""))
+
+        assert cache.invalidate_company("acme") == 2
+        assert cache.get("widget", "acme-ext", lambda: "reloaded", scope="acme") == "reloaded"
+        assert cache.get("settings", "other", lambda: "reloaded") == "other settings"
+        assert cache.invalidate_global() == 1
+
+    def test_invalidation_during_load_is_not_cached(self):
+        cache = TenantConfigCache()
+
+        def load():
+            cache.invalidate_company("acme")  # E.g. /settings saved while we read the old row
+            return "old"
+
+        assert cache.get("settings", "acme", load, scope="acme") == "old"
+        assert cache.get("settings", "acme", lambda: "new", scope="acme") == "new"
+
+    def test_shared_versions_invalidate_other_workers(self):
+        versions = MemoryBackend()
+        worker_a = TenantConfigCache(versions=versions)
+        worker_b = TenantConfigCache(versions=versions)
+        worker_a.get("company", "acme", lambda: "active", scope="acme")
+        worker_b.get("company", "acme", lambda: "active", scope="acme")
+
+        worker_a.invalidate_company("acme")
+        assert worker_b.get("company", "acme", lambda: "inactive", scope="acme") == "inactive"
+
+    def test_snapshot_is_read_only(self):
+        snap = snapshot(Company(id="snap", name="Snap AB", password_hash="x"))
+        assert snap.name == "Snap AB"
+        with pytest.raises(AttributeError):
+            snap.name = "Other"
+        with pytest.raises(AttributeError):
+            snap.no_such_column
+        assert snapshot(None) is None
+
+
+# =============================================================================
+# Chat path
+# =============================================================================
+
+@pytest.fixture(scope="module")
+def client():
+    """Test client with an Ollama stub behind it"""
+    Base.metadata.create_all(bind=engine)
+    # Other test modules recreate the database under the process-wide caches
+    config_cache.clear()
+    response_cache.clear()
+
+    with running_stub() as stub:
+        original_url = main.OLLAMA_BASE_URL
+        main.OLLAMA_BASE_URL = stub.base_url
+        try:
+            with TestClient(app) as c:
+                yield c
+        finally:
+            main.OLLAMA_BASE_URL = original_url
+
+    Base.metadata.drop_all(bind=engine)
+
+
+def admin_headers():
+    return {"Authorization": f"Bearer {create_token({'sub': 'admin', 'type': 'super_admin'})}"}
+
+
+def company_headers(company_id="demo"):
+    return {"Authorization": f"Bearer {create_token({'sub': company_id, 'type': 'company'})}"}
+
+
+class TestChatPathConfig:
+
+    def test_widget_chat_turn_query_count(self, client):
+        """A follow-up turn only reads the conversation and writes the messages"""
+        session_id = str(uuid.uuid4())
+        first = client.post("/chat/widget/demo-ext-001", json={
+            "question": "Hur betalar jag hyran?", "session_id": session_id
+        })
+        assert first.status_code == 200
+
+        second = client.post("/chat/widget/demo-ext-001", json={
+            "question": "Kan jag betala hyran med autogiro?", "session_id": session_id
+        })
+        assert second.status_code == 200
+        assert second.json()["conversation_id"] == first.json()["conversation_id"]
+        assert int(second.headers["X-DB-Queries"]) <= 3
+
+    def test_count_queries(self):
+        db = SessionLocal()
+        try:
+            with count_queries(keep_statements=True) as outer:
+                db.query(Company).count()
+                with count_queries() as inner:
+                    db.query(Company).first()
+        finally:
+            db.close()
+        assert inner.count == 1
+        assert outer.count == 2
+        assert outer.statements[0].lstrip().upper().startswith("SELECT")
+
+    def test_company_toggle_invalidates(self, client):
+        question = {"question": "Hej!", "session_id": str(uuid.uuid4())}
+        assert client.post("/chat/widget/demo-ext-001", json=question).status_code == 200
+
+        response = client.put("/admin/companies/demo/toggle", headers=admin_headers())
+        assert response.json()["is_active"] is False
+        try:
+            blocked = client.post("/chat/widget/demo-ext-001", json=question)
+            assert blocked.status_code == 403
+            assert blocked.json()["detail"] == "COMPANY_INACTIVE"
+        finally:
+            client.put("/admin/companies/demo/toggle", headers=admin_headers())
+        assert client.post("/chat/widget/demo-ext-001", json=question).status_code == 200
+
+    def test_maintenance_mode_invalidates(self, client):
+        question = {"question": "Hej!", "session_id": str(uuid.uuid4())}
+        assert client.post("/chat/widget/demo-ext-001", json=question).status_code == 200
+
+        client.put("/admin/maintenance-mode", headers=admin_headers(),
+                   json={"enabled": True, "message": "Uppdatering pågår"})
+        try:
+            blocked = client.post("/chat/widget/demo-ext-001", json=question)
+            assert blocked.status_code == 503
+            assert blocked.json()["detail"] == "Uppdatering pågår"
+        finally:
+            client.put("/admin/maintenance-mode", headers=admin_headers(), json={"enabled": False})
+        assert client.post("/chat/widget/demo-ext-001", json=question).status_code == 200
+
+    def test_pricing_update_invalidates(self, client):
+        db = SessionLocal()
+        try:
+            original = main.get_company_snapshot(db, "demo").pricing_tier
+            response = client.put("/admin/companies/demo/pricing", headers=admin_headers(),
+                                  json={"pricing_tier": "enterprise"})
+            assert response.status_code == 200
+            try:
+                assert main.get_company_snapshot(db, "demo").pricing_tier == "enterprise"
+            finally:
+                client.put("/admin/companies/demo/pricing", headers=admin_headers(), json={"pricing_tier": original})
+        finally:
+            db.close()
+
+    def test_settings_update_invalidates(self, client):
+        assert client.get("/widget/demo/config").status_code == 200
+
+        response = client.put("/settings", headers=company_headers(), json={"company_name": "Nytt Namn AB"})
+        assert response.status_code == 200
+        assert client.get("/widget/demo/config").json()["company_name"] == "Nytt Namn AB"
+
+    def test_widget_update_invalidates(self, client):
+        widget_id = client.get("/widget/key/demo-ext-001/config").json()["widget_id"]
+
+        response = client.put(f"/widgets/{widget_id}", headers=company_headers(), json={"subtitle": "Svarar direkt"})
+        assert response.status_code == 200
+        assert client.get("/widget/key/demo-ext-001/config").json()["subtitle"] == "Svarar direkt"
@@ -0,0 +1,126 @@
+"""
+Tests for the write-behind queue of chat messages and counters
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ["ENVIRONMENT"] = "test"
+os.environ["DATABASE_URL"] = "sqlite:///./test_bobot.db"
+
+from database import (
+    Base, engine, SessionLocal, Company, CompanySettings, Conversation, Message, ChatLog
+)
+from write_behind import WriteBehindQueue
+
+
+@pytest.fixture
+def conversation_id():
+    """A company with settings and one conversation"""
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        db.add(Company(id="wb-test", name="WB AB", password_hash="x"))
+        db.add(CompanySettings(company_id="wb-test", current_month_conversations=0))
+        conversation = Conversation(company_id="wb-test", session_id="s1", reference_id="BOB-WB01", message_count=0)
+        db.add(conversation)
+        db.commit()
+        yield conversation.id
+    finally:
+        db.close()
+        Base.metadata.drop_all(bind=engine)
+
+
+def message(conversation_id, content="Hej", role="user"):
+    return {"conversation_id": conversation_id, "role": role, "content": content,
+            "sources": None, "had_answer": True, "response_time_ms": None}
+
+
+def read_state(conversation_id):
+    db = SessionLocal()
+    try:
+        conversation = db.get(Conversation, conversation_id)
+        settings = db.query(CompanySettings).filter(CompanySettings.company_id == "wb-test").first()
+        return {
+            "messages": [m.content for m in db.query(Message).order_by(Message.id)],
+            "chat_logs": db.query(ChatLog).count(),
+            "message_count": conversation.message_count,
+            "category": conversation.category,
+            "ended_at": conversation.ended_at,
+            "usage": settings.current_month_conversations,
+        }
+    finally:
+        db.close()
+
+
+class TestWriteBehindQueue:
+
+    async def test_batches_writes_into_one_transaction(self, conversation_id):
+        queue = WriteBehindQueue(SessionLocal, interval=0.05)
+        queue.start()
+        try:
+            queue.add_messages([message(conversation_id, "Fråga 1"), message(conversation_id, "Svar 1", "bot")])
+            queue.touch_conversation(conversation_id, messages=2)
+            queue.add_messages([message(conversation_id, "Fråga 2"), message(conversation_id, "Svar 2", "bot")])
+            queue.touch_conversation(conversation_id, messages=2, category="hyra")
+            queue.add_chat_log("wb-test", "Fråga 2", "Svar 2")
+            queue.increment_usage("wb-test")
+            queue.increment_usage("wb-test")
+            assert queue.depth == 9
+
+            # Nothing is written until the batch interval has passed
+            assert read_state(conversation_id)["messages"] == []
+            await asyncio.sleep(0.2)
+        finally:
+            await queue.stop()
+
+        state = read_state(conversation_id)
+        assert state["messages"] == ["Fråga 1", "Svar 1", "Fråga 2", "Svar 2"]
+        assert state["message_count"] == 4
+        assert state["category"] == "hyra"
+        assert state["ended_at"] is not None
+        assert state["chat_logs"] == 1
+        assert state["usage"] == 2
+
+        stats = queue.stats()
+        assert stats["batches"] == 1
+        assert stats["written"] == 9
+        assert stats["max_depth"] == 9
+        assert stats["depth"] == 0
+
+    async def test_stop_flushes_pending_writes(self, conversation_id):
+        queue = WriteBehindQueue(SessionLocal, interval=60)
+        queue.start()
+        queue.add_messages([message(conversation_id)])
+        queue.touch_conversation(conversation_id, messages=1)
+        await asyncio.sleep(0)
+
+        await queue.stop()
+        assert read_state(conversation_id)["messages"] == ["Hej"]
+        assert queue.depth == 0
+
+    async def test_bad_row_is_dropped_without_blocking_the_batch(self, conversation_id):
+        queue = WriteBehindQueue(SessionLocal, interval=0.01)
+        queue.start()
+        try:
+            queue.add_messages([message(conversation_id, "Före")])
+            queue.add_messages([message(conversation_id, None)])  # content is NOT NULL
+            queue.add_messages([message(conversation_id, "Efter")])
+            await asyncio.sleep(0.1)
+        finally:
+            await queue.stop()
+
+        assert read_state(conversation_id)["messages"] == ["Före", "Efter"]
+        assert queue.stats()["dropped"] == 1
+
+    def test_writes_immediately_when_not_started(self, conversation_id):
+        queue = WriteBehindQueue(SessionLocal)
+        queue.touch_conversation(conversation_id, messages=2)
+        assert read_state(conversation_id)["message_count"] == 2
+        assert queue.depth == 0
@@ -0,0 +1,295 @@
+"""
+Bobot Write-Behind Queue
+Batches chat writes (messages, chat logs, counters, rollups) into grouped transactions
+
+The chat path only creates conversations synchronously (their reference_id
+is returned right away). Everything written after the answer is queued
+here and written by a background task every WRITE_BEHIND_INTERVAL_MS, or
+as soon as WRITE_BEHIND_BATCH operations are waiting, in one transaction
+per batch on the DB thread pool. stop() flushes what is left, so a
+normal shutdown loses nothing.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import date, datetime
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from sqlalchemy import bindparam, func, insert, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+import analytics_rollup
+from database import ChatLog, CompanySettings, Conversation, Message
+from db_executor import run_db
+
+logger = logging.getLogger(__name__)
+
+
+# =============================================================================
+# Configuration
+# =============================================================================
+
+WRITE_BEHIND_INTERVAL_MS = float(os.getenv("WRITE_BEHIND_INTERVAL_MS", "5"))
+WRITE_BEHIND_BATCH = int(os.getenv("WRITE_BEHIND_BATCH", "500"))  # Operations per transaction
+RETRY_BACKOFF_MAX = 30.0  # Seconds between attempts while the database is unavailable
+
+# Operation kinds
+MESSAGE = "message"
+CHAT_LOG = "chat_log"
+CONVERSATION = "conversation"
+USAGE = "usage"
+ROLLUP = "rollup"
+
+Operation = Tuple[str, dict]
+
+
+class WriteBehindQueue:
+    """In-process queue of chat writes, flushed in batches
+
+    Operations:
+        add_messages(rows)          INSERT messages
+        add_chat_log(...)           INSERT chat_logs (legacy)
+        touch_conversation(...)     message_count += n, ended_at, category
+        increment_usage(company)    current_month_conversations += 1
+        add_rollup(...)             analytics rollup deltas (analytics_rollup.py)
+
+    A batch is written as one executemany per kind; conversation and usage
+    updates are summed per row first. If the database is unavailable the
+    batch is put back and retried with backoff. Any other error is retried
+    one operation at a time so a single bad row (e.g. a message for a
+    conversation deleted meanwhile) is dropped and logged instead of
+    blocking the queue.
+
+    Without start() (scripts, tests without lifespan) operations are
+    written immediately.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session],
+                 interval: float = WRITE_BEHIND_INTERVAL_MS / 1000, batch_size: int = WRITE_BEHIND_BATCH):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.batch_size = batch_size
+        self._pending: Deque[Operation] = deque()
+        self._flush_lock = threading.Lock()  # One batch in flight at a time
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self._failures = 0
+        # Metrics
+        self.enqueued = 0
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.last_flush_ms = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    # -------------------------------------------------------------------------
+    # Enqueueing
+    # -------------------------------------------------------------------------
+
+    def add_messages(self, rows: List[dict]):
+        self._enqueue([(MESSAGE, row) for row in rows])
+
+    def add_chat_log(self, company_id: str, question: str, answer: str):
+        self._enqueue([(CHAT_LOG, {
+            "company_id": company_id, "question": question, "answer": answer,
+            "created_at": datetime.utcnow()
+        })])
+
+    def touch_conversation(self, conversation_id: int, messages: int, category: Optional[str] = None):
+        """Count new messages on a conversation and mark it as active now"""
+        self._enqueue([(CONVERSATION, {
+            "conversation_id": conversation_id, "messages": messages,
+            "new_ended_at": datetime.utcnow(), "new_category": category
+        })])
+
+    def increment_usage(self, company_id: str):
+        """Count a new conversation towards the company's monthly limit"""
+        self._enqueue([(USAGE, {"company_id": company_id})])
+
+    def add_rollup(self, company_id: str, day: date, deltas: Dict[str, int]):
+        """Add analytics counters for a company and day"""
+        self._enqueue([(ROLLUP, row) for row in analytics_rollup.rows_for(company_id, day, deltas)])
+
+    def _enqueue(self, operations: List[Operation]):
+        self.enqueued += len(operations)
+        if not self.running:
+            self._write_batch(operations)
+            return
+        self._pending.extend(operations)
+        self.max_depth = max(self.max_depth, len(self._pending))
+        # Called from the event loop thread (handlers) or others (threadpool)
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    # -------------------------------------------------------------------------
+    # Background flushing
+    # -------------------------------------------------------------------------
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the background task and write everything still queued"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        attempts = 0
+        while self._pending:
+            if await run_db(self.flush):
+                continue
+            attempts += 1
+            if attempts == 3:
+                logger.error(f"Write-behind: {len(self._pending)} queued writes lost at shutdown")
+                break
+            await asyncio.sleep(0.5 * attempts)
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            # Let a few more writes arrive so they share the transaction
+            if len(self._pending) < self.batch_size:
+                await asyncio.sleep(self.interval)
+            while self._pending:
+                if await run_db(self.flush):
+                    self._failures = 0
+                else:
+                    self._failures += 1
+                    await asyncio.sleep(min(RETRY_BACKOFF_MAX, self.interval * 2 ** self._failures))
+
+    def flush(self) -> bool:
+        """Write one batch (in the calling thread); False if it must be retried"""
+        with self._flush_lock:
+            batch = []
+            while self._pending and len(batch) < self.batch_size:
+                batch.append(self._pending.popleft())
+            if not batch:
+                return True
+            try:
+                self._write_batch(batch)
+            except OperationalError as e:
+                # Database unavailable or locked: keep the batch, in order
+                self._pending.extendleft(reversed(batch))
+                self.errors += 1
+                logger.warning(f"Write-behind flush failed, retrying: {e}")
+                return False
+            return True
+
+    def flush_all(self):
+        """Write everything queued so far, including a batch already in flight"""
+        while True:
+            with self._flush_lock:
+                if not self._pending:
+                    return
+            if not self.flush():
+                raise RuntimeError("Write-behind flush failed")
+
+    def _write_batch(self, batch: List[Operation]):
+        started = time.perf_counter()
+        try:
+            self._write(batch)
+        except OperationalError:
+            raise
+        except Exception as e:
+            logger.warning(f"Write-behind batch failed ({e}), writing operations one by one")
+            self.errors += 1
+            for operation in batch:
+                try:
+                    self._write([operation])
+                except Exception as row_error:
+                    self.dropped += 1
+                    logger.error(f"Write-behind dropped {operation[0]} write: {row_error}")
+        self.batches += 1
+        self.written += len(batch)
+        self.last_flush_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    def _write(self, batch: List[Operation]):
+        messages, chat_logs = [], []
+        conversations: Dict[int, dict] = {}
+        usage: Dict[str, int] = {}
+        rollups = []
+        for kind, row in batch:
+            if kind == MESSAGE:
+                messages.append(row)
+            elif kind == CHAT_LOG:
+                chat_logs.append(row)
+            elif kind == CONVERSATION:
+                merged = conversations.setdefault(row["conversation_id"], {
+                    "conversation_id": row["conversation_id"], "messages": 0, "new_ended_at": None, "new_category": None
+                })
+                merged["messages"] += row["messages"]
+                merged["new_ended_at"] = row["new_ended_at"]
+                merged["new_category"] = row["new_category"] or merged["new_category"]
+            elif kind == USAGE:
+                usage[row["company_id"]] = usage.get(row["company_id"], 0) + 1
+            elif kind == ROLLUP:
+                rollups.append(row)
+
+        db = self.session_factory()
+        try:
+            # Table-level statements: one executemany per kind
+            if messages:
+                db.execute(insert(Message.__table__), messages)
+            if chat_logs:
+                db.execute(insert(ChatLog.__table__), chat_logs)
+            if conversations:
+                table = Conversation.__table__
+                db.execute(
+                    update(table).where(table.c.id == bindparam("conversation_id")).values(
+                        message_count=func.coalesce(table.c.message_count, 0) + bindparam("messages"),
+                        ended_at=bindparam("new_ended_at"),
+                        category=func.coalesce(bindparam("new_category"), table.c.category)
+                    ),
+                    list(conversations.values())
+                )
+            if usage:
+                table = CompanySettings.__table__
+                db.execute(
+                    update(table).where(table.c.company_id == bindparam("settings_company_id")).values(
+                        current_month_conversations=func.coalesce(table.c.current_month_conversations, 0)
+                        + bindparam("conversations")
+                    ),
+                    [{"settings_company_id": company_id, "conversations": count} for company_id, count in usage.items()]
+                )
+            if rollups:
+                analytics_rollup.apply(db, rollups)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "last_flush_ms": self.last_flush_ms,
+        }